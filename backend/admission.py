@@ -0,0 +1,255 @@
+import logging
+import math
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .executor import MAX_CONCURRENT_HOSTS, QUEUE_DEPTH
+from .job_store import PARKED_JOB_STATE, UNFINISHED_JOB_STATES
+from .models import HostJobDB, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+# 受付制御の設定(環境変数で上書き可能)
+# 受け付けて実行待ち・実行中にできるホスト数(既定はキューの深さ + ホスト並列数で、submit が待たされない量)
+ADMISSION_MAX_HOSTS = int(os.getenv("ADMISSION_MAX_HOSTS", str(QUEUE_DEPTH + MAX_CONCURRENT_HOSTS)))
+# 受け付けた作業を消化するまでの推定時間の上限(秒)
+ADMISSION_MAX_BACKLOG_SECONDS = float(os.getenv("ADMISSION_MAX_BACKLOG_SECONDS", "14400"))
+# 上限を超えたリクエストの扱い
+#   park   : 承認済み(実行待ち)として保存し、空きが出たら順に実行する(既定)
+#   reject : 429 と Retry-After を返す
+ADMISSION_OVERLOAD_ACTION = os.getenv("ADMISSION_OVERLOAD_ACTION", "park")
+# 待機させられるホスト数の上限(超えた場合は park でも 429 を返す)
+ADMISSION_MAX_PARKED_HOSTS = int(os.getenv("ADMISSION_MAX_PARKED_HOSTS", "20000"))
+# フリート全体のホスト並列数(ワーカー実行時は全ワーカーの合計を指定する)
+ADMISSION_FLEET_CAPACITY = int(os.getenv("ADMISSION_FLEET_CAPACITY", str(MAX_CONCURRENT_HOSTS)))
+# 待機中のリクエストに空きを割り当てる間隔(秒)
+ADMISSION_CHECK_INTERVAL = float(os.getenv("ADMISSION_CHECK_INTERVAL", "5"))
+ADMISSION_MIN_RETRY_AFTER = 30     # Retry-After の下限(秒)
+ADMISSION_MAX_RETRY_AFTER = 3600   # Retry-After の上限(秒)
+
+ADMIT = "admit"
+PARK = "park"
+REJECT = "reject"
+
+@dataclass
+class Backlog:
+    """受け付けたジョブの量(host_jobs から集計)"""
+    admitted_hosts: int = 0       # 実行待ち・実行中
+    running_hosts: int = 0        # 実行中
+    admitted_seconds: float = 0.0  # 実行待ち・実行中のジョブの推定所要時間の合計(秒)
+    parked_hosts: int = 0
+    parked_requests: int = 0
+    parked_seconds: float = 0.0
+    parked_max_priority: Optional[int] = None
+
+@dataclass
+class AdmissionDecision:
+    """受付の判定結果"""
+    action: str  # ADMIT / PARK / REJECT
+    reason: Optional[str] = None
+    retry_after: int = 0             # 再送までの推奨待ち時間(秒)
+    estimated_wait_seconds: float = 0.0  # 実行開始までの推定待ち時間(秒)
+
+def load_backlog(db: Session) -> Backlog:
+    """受け付けたジョブと待機中のジョブの量を集計する"""
+    rows = db.query(
+        HostJobDB.state,
+        func.count(),
+        func.coalesce(func.sum(HostJobDB.estimated_seconds), 0.0),
+        func.count(func.distinct(HostJobDB.request_id)),
+        func.max(HostJobDB.priority)
+    ).filter(
+        HostJobDB.state.in_(UNFINISHED_JOB_STATES + (PARKED_JOB_STATE,))
+    ).group_by(HostJobDB.state).all()
+
+    backlog = Backlog()
+    for state, hosts, seconds, requests, max_priority in rows:
+        if state == PARKED_JOB_STATE:
+            backlog.parked_hosts = hosts
+            backlog.parked_seconds = float(seconds)
+            backlog.parked_requests = requests
+            backlog.parked_max_priority = max_priority or 0
+        else:
+            backlog.admitted_hosts += hosts
+            backlog.admitted_seconds += float(seconds)
+            if state == TaskStatus.IN_PROGRESS.value:
+                backlog.running_hosts = hosts
+    return backlog
+
+class AdmissionController:
+    """
+    リクエストの受付制御
+
+    受け付けて実行待ち・実行中のホスト数と、それを消化するまでの推定時間
+    (推定所要時間の合計 / フリートのホスト並列数)が上限以内であれば受け付ける。
+    上限を超える場合は、承認済み(実行待ち)として待機させるか 429 で拒否する。
+    待機中のリクエストがある間は、それより優先度の高いリクエストだけが先に受け付けられる。
+
+    集計は host_jobs から行うため、APIサーバーで実行する場合(エグゼキューターのキュー +
+    実行中)とワーカーで実行する場合のどちらでも同じ基準で判定できる。
+    """
+
+    def __init__(
+        self,
+        max_hosts: int = ADMISSION_MAX_HOSTS,
+        max_backlog_seconds: float = ADMISSION_MAX_BACKLOG_SECONDS,
+        overload_action: str = ADMISSION_OVERLOAD_ACTION,
+        max_parked_hosts: int = ADMISSION_MAX_PARKED_HOSTS,
+        fleet_capacity: int = ADMISSION_FLEET_CAPACITY
+    ):
+        if overload_action not in (PARK, REJECT):
+            raise ValueError(f"不正な ADMISSION_OVERLOAD_ACTION です: {overload_action}")
+        self.max_hosts = max_hosts
+        self.max_backlog_seconds = max_backlog_seconds
+        self.overload_action = overload_action
+        self.max_parked_hosts = max_parked_hosts
+        self.fleet_capacity = max(fleet_capacity, 1)
+
+        self.admitted_requests = 0
+        self.parked_requests = 0
+        self.rejected_requests = 0
+        self.released_requests = 0
+
+    def backlog_seconds(self, host_seconds: float) -> float:
+        """推定所要時間の合計を、フリート全体で消化するまでの時間に換算する"""
+        return host_seconds / self.fleet_capacity
+
+    def fits(self, backlog: Backlog, hosts: int, host_seconds: float) -> bool:
+        """
+        受け付けても上限を超えないか
+
+        何も実行していない場合は、上限より大きなリクエストでも受け付ける(永久に待たせない)。
+        """
+        if backlog.admitted_hosts == 0:
+            return True
+        return (
+            backlog.admitted_hosts + hosts <= self.max_hosts
+            and self.backlog_seconds(backlog.admitted_seconds + host_seconds) <= self.max_backlog_seconds
+        )
+
+    def retry_after(self, backlog: Backlog, hosts: int, host_seconds: float) -> int:
+        """待機中の分も含めて上限を下回るまでの推定時間(秒)"""
+        total_hosts = backlog.admitted_hosts + backlog.parked_hosts + hosts
+        total_seconds = backlog.admitted_seconds + backlog.parked_seconds + host_seconds
+        excess_seconds = self.backlog_seconds(total_seconds) - self.max_backlog_seconds
+        excess_hosts = total_hosts - self.max_hosts
+        if excess_hosts > 0 and total_hosts:
+            excess_seconds = max(excess_seconds, self.backlog_seconds(excess_hosts * total_seconds / total_hosts))
+        return int(min(max(math.ceil(excess_seconds), ADMISSION_MIN_RETRY_AFTER), ADMISSION_MAX_RETRY_AFTER))
+
+    def decide(self, backlog: Backlog, hosts: int, host_seconds: float, priority: int = 0) -> AdmissionDecision:
+        """
+        リクエストを受け付けるか判定する
+
+        Args:
+            backlog (Backlog): 現在の受付量
+            hosts (int): リクエストの対象PC数
+            host_seconds (float): リクエストの推定所要時間の合計(秒)
+            priority (int): リクエストの優先度
+
+        Returns:
+            AdmissionDecision: 判定結果
+        """
+        parked_ahead = backlog.parked_hosts > 0 and priority <= (backlog.parked_max_priority or 0)
+        if not parked_ahead and self.fits(backlog, hosts, host_seconds):
+            self.admitted_requests += 1
+            return AdmissionDecision(ADMIT, estimated_wait_seconds=self._wait_seconds(backlog, include_parked=False))
+
+        if parked_ahead:
+            reason = f"実行待ちのリクエストが{backlog.parked_requests}件あります"
+        elif backlog.admitted_hosts + hosts > self.max_hosts:
+            reason = f"実行待ち・実行中のホストが上限に達しています({backlog.admitted_hosts}/{self.max_hosts}台)"
+        else:
+            reason = f"受け付けた作業の推定消化時間が上限({int(self.max_backlog_seconds)}秒)を超えます"
+        retry_after = self.retry_after(backlog, hosts, host_seconds)
+        if self.overload_action == PARK and backlog.parked_hosts + hosts <= self.max_parked_hosts:
+            self.parked_requests += 1
+            return AdmissionDecision(
+                PARK, reason, retry_after, estimated_wait_seconds=self._wait_seconds(backlog, include_parked=True)
+            )
+        self.rejected_requests += 1
+        return AdmissionDecision(REJECT, reason, retry_after)
+
+    def _wait_seconds(self, backlog: Backlog, include_parked: bool) -> float:
+        # 全ての並列枠が埋まっている分だけ待つとみなす
+        queued_seconds = backlog.admitted_seconds + (backlog.parked_seconds if include_parked else 0.0)
+        if backlog.admitted_hosts < self.fleet_capacity and not include_parked:
+            return 0.0
+        return self.backlog_seconds(queued_seconds)
+
+    def release_parked(self, db: Session) -> Dict[str, List[int]]:
+        """
+        空きの範囲で、待機中のリクエストを優先度順・受付順に実行待ちにする
+
+        先頭のリクエストが収まらない場合はそこで止める(後続の小さなリクエストに追い越させない)。
+        状態の切り替えは条件付き UPDATE で行うため、複数のプロセスが同時に実行しても二重に解放しない。
+
+        Returns:
+            Dict[str, List[int]]: 実行待ちにしたリクエストIDとジョブの id
+        """
+        backlog = load_backlog(db)
+        if backlog.parked_hosts == 0:
+            return {}
+        parked = db.query(
+            HostJobDB.request_id,
+            func.count(),
+            func.coalesce(func.sum(HostJobDB.estimated_seconds), 0.0)
+        ).filter(
+            HostJobDB.state == PARKED_JOB_STATE
+        ).group_by(HostJobDB.request_id).order_by(
+            func.max(HostJobDB.priority).desc(),
+            func.min(HostJobDB.id)
+        ).all()
+
+        released: Dict[str, List[int]] = {}
+        for request_id, hosts, host_seconds in parked:
+            if not self.fits(backlog, hosts, host_seconds):
+                break
+            job_ids = list(db.execute(
+                HostJobDB.__table__.update()
+                .where(HostJobDB.request_id == request_id, HostJobDB.state == PARKED_JOB_STATE)
+                .values(state=TaskStatus.PENDING.value, updated_at=datetime.now())
+                .returning(HostJobDB.id)
+            ).scalars().all())
+            if job_ids:
+                released[request_id] = sorted(job_ids)
+                backlog.admitted_hosts += len(job_ids)
+                backlog.admitted_seconds += float(host_seconds)
+        db.commit()
+        self.released_requests += len(released)
+        return released
+
+    def snapshot(self, backlog: Backlog) -> Dict[str, Any]:
+        """フロントエンドに表示する受付状況"""
+        if backlog.parked_hosts == 0 and self.fits(backlog, 1, 0.0):
+            accepting = ADMIT
+        elif self.overload_action == PARK and backlog.parked_hosts < self.max_parked_hosts:
+            accepting = PARK
+        else:
+            accepting = REJECT
+        return {
+            "accepting": accepting,
+            "overload_action": self.overload_action,
+            "admitted_hosts": backlog.admitted_hosts,
+            "running_hosts": backlog.running_hosts,
+            "max_hosts": self.max_hosts,
+            "fleet_capacity": self.fleet_capacity,
+            "backlog_seconds": self.backlog_seconds(backlog.admitted_seconds),
+            "max_backlog_seconds": self.max_backlog_seconds,
+            "parked_requests": backlog.parked_requests,
+            "parked_hosts": backlog.parked_hosts,
+            "max_parked_hosts": self.max_parked_hosts,
+            "estimated_wait_seconds": self._wait_seconds(backlog, include_parked=bool(backlog.parked_hosts)),
+            "admitted_requests": self.admitted_requests,
+            "parked_requests_total": self.parked_requests,
+            "rejected_requests": self.rejected_requests,
+            "released_requests": self.released_requests
+        }
+
+# アプリケーション全体で共有する受付制御
+admission = AdmissionController()
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 同時実行ホスト数の自動調整(AIMD)の設定(環境変数で上書き可能)
+AIMD_ENABLED = os.getenv("FLEET_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+AIMD_MIN_HOSTS = int(os.getenv("FLEET_MIN_CONCURRENT_HOSTS", "5"))
+AIMD_INTERVAL = float(os.getenv("AIMD_INTERVAL", "30"))               # 判定の間隔(秒)
+AIMD_INCREASE_STEP = int(os.getenv("AIMD_INCREASE_STEP", "5"))        # 加算的に増やす台数
+AIMD_DECREASE_FACTOR = float(os.getenv("AIMD_DECREASE_FACTOR", "0.7"))  # 乗算的に減らす割合
+AIMD_FAILURE_THRESHOLD = float(os.getenv("AIMD_FAILURE_THRESHOLD", "0.1"))  # 減らす失敗率
+AIMD_LATENCY_THRESHOLD = float(os.getenv("AIMD_LATENCY_THRESHOLD", "2.0"))  # 減らす遅延(平常時の倍率)
+AIMD_MIN_SAMPLES = int(os.getenv("AIMD_MIN_SAMPLES", "5"))            # 判定に必要な1区間のタスク数
+# 平常時の所要時間が長くなる方向に追従する係数(過負荷の間に基準がずれないよう小さくする)
+AIMD_BASELINE_ALPHA = 0.002
+AIMD_DECISION_HISTORY = 100    # 保持する調整履歴の件数
+
+class HostLimiter:
+    """
+    上限を実行中に変更できるセマフォ
+
+    上限を下げても実行中のホストは中断せず、空いた枠を再び割り当てないことで徐々に減らす。
+    待機者には到着順に枠を割り当てる。
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self):
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 枠の割り当てとキャンセルが重なった場合は返却する
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        self._wake()
+
+    def reclaim(self):
+        """
+        待機を終えたジョブが枠を確保し直す
+
+        上限に達していても待たずに確保する。キュー待ちのワーカーが確保している枠は
+        ジョブを取り出した時点で上限超過として返却されるため、新しいジョブより優先される。
+        """
+        self.in_use += 1
+
+    def set_limit(self, limit: int):
+        self.limit = limit
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_use < self.limit:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_use += 1
+                future.set_result(None)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+@dataclass
+class ConcurrencyDecision:
+    """同時実行ホスト数の調整の記録"""
+    timestamp: datetime
+    action: str          # increase / decrease / hold
+    previous_limit: int
+    limit: int
+    samples: int
+    failure_rate: float
+    latency_ratio: float  # 区間内の所要時間 / 平常時の所要時間(中央値)
+    reason: str
+
+class AimdController:
+    """
+    タスクの所要時間と失敗率から同時実行ホスト数を調整する(AIMD)
+
+    - 一定間隔毎に、その区間に終わったタスクの失敗率と所要時間を集計する
+    - 失敗率または所要時間(タスク毎の平常時の値に対する倍率)が閾値を超えた場合は、
+      ファイルサーバーや WinRM が過負荷とみなし、上限を乗算的に減らす
+    - 問題が無く、上限まで使い切っている(またはキューに待ちがある)場合は加算的に増やす
+    - 上限は管理者が設定した範囲(min_limit 〜 max_limit)に収める
+
+    タスクの結果の記録はイベントループ上で O(1) で行い、集計は判定時にまとめて行う。
+    """
+
+    def __init__(
+        self,
+        min_limit: int = AIMD_MIN_HOSTS,
+        max_limit: int = AIMD_MIN_HOSTS,
+        enabled: bool = AIMD_ENABLED,
+        interval: float = AIMD_INTERVAL,
+        increase_step: int = AIMD_INCREASE_STEP,
+        decrease_factor: float = AIMD_DECREASE_FACTOR,
+        failure_threshold: float = AIMD_FAILURE_THRESHOLD,
+        latency_threshold: float = AIMD_LATENCY_THRESHOLD,
+        min_samples: int = AIMD_MIN_SAMPLES
+    ):
+        self.min_limit = max(min(min_limit, max_limit), 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.enabled = enabled
+        self.interval = interval
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.min_samples = min_samples
+
+        # 自動調整が無効の場合は管理者の上限で固定する。有効な場合は下限から増やしていく
+        self.limiter = HostLimiter(self.min_limit if enabled else self.max_limit)
+        self._baselines: Dict[str, float] = {}
+        self._ratios: List[float] = []
+        self._samples = 0
+        self._failures = 0
+        self.decisions: Deque[ConcurrencyDecision] = deque(maxlen=AIMD_DECISION_HISTORY)
+        self.last_decision: Optional[ConcurrencyDecision] = None
+
+    @property
+    def limit(self) -> int:
+        return self.limiter.limit
+
+    def record(self, task_id: str, latency: float, success: bool):
+        """
+        タスクの実行結果を記録する
+
+        Args:
+            task_id (str): タスクID(平常時の所要時間はタスク毎に持つ)
+            latency (float): スクリプトの実行に要した時間(秒)
+            success (bool): 成功したか(タイムアウトは失敗として記録する)
+        """
+        self._samples += 1
+        if not success:
+            self._failures += 1
+            return
+        baseline = self._baselines.get(task_id)
+        if baseline is None:
+            self._baselines[task_id] = max(latency, 1e-3)
+            return
+        self._ratios.append(latency / baseline)
+        # 速くなった場合はすぐに、遅くなった場合はゆっくりと基準を更新する
+        self._baselines[task_id] = latency if latency < baseline else baseline + AIMD_BASELINE_ALPHA * (latency - baseline)
+
+    def adjust(self, saturated: bool) -> ConcurrencyDecision:
+        """
+        区間の集計から上限を調整する
+
+        Args:
+            saturated (bool): 上限まで使い切っている、またはキューにジョブが待っているか
+
+        Returns:
+            ConcurrencyDecision: 調整の記録
+        """
+        samples, failures = self._samples, self._failures
+        ratios = sorted(self._ratios)
+        self._samples, self._failures, self._ratios = 0, 0, []
+        failure_rate = failures / samples if samples else 0.0
+        latency_ratio = ratios[len(ratios) // 2] if ratios else 1.0
+        previous = self.limit
+
+        if not self.enabled:
+            action, limit, reason = "hold", self.max_limit, "自動調整は無効です"
+        elif samples >= self.min_samples and failure_rate > self.failure_threshold:
+            action, limit = "decrease", int(previous * self.decrease_factor)
+            reason = f"失敗率 {failure_rate:.0%} が閾値 {self.failure_threshold:.0%} を超えました"
+        elif samples >= self.min_samples and latency_ratio > self.latency_threshold:
+            action, limit = "decrease", int(previous * self.decrease_factor)
+            reason = f"所要時間が平常時の {latency_ratio:.1f} 倍(閾値 {self.latency_threshold:.1f} 倍)です"
+        elif saturated:
+            action, limit = "increase", previous + self.increase_step
+            reason = "上限まで実行中で、失敗率・所要時間は正常です"
+        else:
+            action, limit, reason = "hold", previous, "上限に達していないため維持します"
+
+        limit = min(max(limit, self.min_limit), self.max_limit)
+        if limit == previous and action != "hold":
+            action, reason = "hold", f"{reason}(設定範囲 {self.min_limit}〜{self.max_limit} の端のため維持)"
+        self.limiter.set_limit(limit)
+
+        decision = ConcurrencyDecision(
+            timestamp=datetime.now(),
+            action=action,
+            previous_limit=previous,
+            limit=limit,
+            samples=samples,
+            failure_rate=failure_rate,
+            latency_ratio=latency_ratio,
+            reason=reason
+        )
+        self.last_decision = decision
+        message = (
+            f"同時実行ホスト数: {previous} -> {limit} ({action}) {reason} "
+            f"[タスク {samples}件, 失敗率 {failure_rate:.0%}, 所要時間 {latency_ratio:.2f} 倍]"
+        )
+        if action == "hold":
+            logger.debug(message)
+        else:
+            self.decisions.append(decision)
+            logger.info(message)
+        return decision
+
+    def configure(
+        self,
+        min_limit: Optional[int] = None,
+        max_limit: Optional[int] = None,
+        enabled: Optional[bool] = None
+    ):
+        """
+        管理者による設定の変更(現在の上限は新しい範囲に収める)
+
+        Raises:
+            ValueError: 範囲が不正な場合
+        """
+        min_limit = self.min_limit if min_limit is None else min_limit
+        max_limit = self.max_limit if max_limit is None else max_limit
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("同時実行ホスト数の範囲が不正です(1 <= 下限 <= 上限)")
+        self.min_limit, self.max_limit = min_limit, max_limit
+        if enabled is not None:
+            self.enabled = enabled
+        previous = self.limit
+        limit = min(max(previous, min_limit), max_limit) if self.enabled else max_limit
+        self.limiter.set_limit(limit)
+        logger.info(
+            f"同時実行ホスト数の設定を変更: 範囲 {min_limit}〜{max_limit}, "
+            f"自動調整 {'有効' if self.enabled else '無効'}, 上限 {previous} -> {limit}"
+        )
+
+    async def run(self, saturated: Callable[[], bool]):
+        """interval 毎に adjust を呼び出す"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.adjust(saturated())
+            except Exception as e:
+                logger.error(f"同時実行ホスト数の調整に失敗: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """現在の上限と調整履歴を取得"""
+        return {
+            "adaptive": self.enabled,
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "slots_in_use": self.limiter.in_use,  # キュー待ちで枠を確保しているワーカーを含む
+            "waiting_workers": self.limiter.waiting,
+            "last_decision": asdict(self.last_decision) if self.last_decision else None,
+            "decisions": [asdict(decision) for decision in reversed(self.decisions)]
+        }
@@ -0,0 +1,267 @@
+import codecs
+import csv
+import io
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError as PydanticValidationError
+
+from .models import ComputerInfo, LoginType
+
+logger = logging.getLogger(__name__)
+
+# 登録ユーザ情報CSVのレイアウト(1始まりの行番号)
+CSV_HEADER_ROW = 5
+CSV_DATA_START_ROW = 10
+
+# 取り込みの設定(環境変数で上書き可能)
+CSV_IMPORT_BATCH = int(os.getenv("CSV_IMPORT_BATCH", "1000"))
+CSV_MAX_ERRORS = int(os.getenv("CSV_MAX_ERRORS", "1000"))  # エラー報告に含める最大行数
+CSV_READ_CHUNK = 64 * 1024  # 文字コード判定のために先読みするバイト数
+
+# ComputerInfo のフィールドと、CSVで使われるヘッダー名
+FIELD_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "computer_name": ("computer_name", "ホスト名"),
+    "ip_address": ("ip_address", "IPアドレス"),
+    "login_type": ("login_type", "ログイン種別", "ログインタイプ"),
+    "ad_username": ("ad_username", "ADユーザ"),
+    "ad_password": ("ad_password", "ADパスワード"),
+    "local_existing_username": ("local_existing_username", "既存ローカルユーザ", "既存ローカル"),
+    "local_existing_password": ("local_existing_password", "既存ローカルユーザパスワード", "既存ローカルパスワード"),
+    "full_name": ("full_name", "フルネーム"),
+    "local_new_username": ("local_new_username", "新規ローカルユーザー名"),
+    "local_new_password": ("local_new_password", "新規ローカルユーザーパスワード", "新規ローカルパスワード"),
+    "admin_privilege": ("admin_privilege", "Administrator権限", "Administrator権限付与(YesまたはNo)")
+}
+
+LOGIN_TYPE_MAP = {
+    "AD": LoginType.AD,
+    "ActiveDirectory": LoginType.AD,
+    "既存ローカル": LoginType.LOCAL_EXISTING,
+    "LocalExisting": LoginType.LOCAL_EXISTING,
+    "新規ローカル": LoginType.LOCAL_NEW,
+    "LocalNew": LoginType.LOCAL_NEW
+}
+
+@dataclass
+class RowError:
+    """取り込めなかった行"""
+    row: int  # CSV上の行番号(1始まり)
+    message: str
+    computer_name: Optional[str] = None
+
+@dataclass
+class CsvImportReport:
+    """取り込み結果の集計(エラーは先頭 max_errors 件のみ保持する)"""
+    max_errors: int = CSV_MAX_ERRORS
+    total_rows: int = 0
+    valid_rows: int = 0
+    error_count: int = 0
+    errors: List[RowError] = field(default_factory=list)
+
+    def add_error(self, error: RowError):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(error)
+
+    @property
+    def errors_truncated(self) -> bool:
+        return self.error_count > len(self.errors)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_rows": self.total_rows,
+            "valid_rows": self.valid_rows,
+            "error_count": self.error_count,
+            "errors_truncated": self.errors_truncated,
+            "errors": [error.__dict__ for error in self.errors]
+        }
+
+class CsvFormatError(ValueError):
+    """CSV全体のレイアウトが不正で、行単位の取り込みができない"""
+
+def detect_encoding(stream: BinaryIO) -> str:
+    """
+    先頭を読んで文字コードを判定する(UTF-8 として読めなければ Shift_JIS とみなす)
+
+    ストリームの位置は先頭に戻す。
+    """
+    head = stream.read(CSV_READ_CHUNK)
+    stream.seek(0)
+    try:
+        # チャンク境界で切れたマルチバイト文字は不問とする
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp932"
+
+def resolve_columns(header: List[str]) -> Dict[str, int]:
+    """
+    ヘッダー行から ComputerInfo のフィールドと列番号の対応を作る
+
+    Raises:
+        CsvFormatError: 必須の列が無い場合
+    """
+    positions = {name.strip().strip('"'): index for index, name in enumerate(header) if name.strip()}
+    columns = {}
+    for field_name, aliases in FIELD_ALIASES.items():
+        index = next((positions[alias] for alias in aliases if alias in positions), None)
+        if index is not None:
+            columns[field_name] = index
+    if "login_type" not in columns:
+        raise CsvFormatError("ヘッダーに'ログイン種別'、'login_type'、または'ログインタイプ'が見つかりません")
+    if "computer_name" not in columns:
+        raise CsvFormatError("ヘッダーに'ホスト名'または'computer_name'が見つかりません")
+    return columns
+
+def row_to_computer(row: List[str], columns: Dict[str, int]) -> ComputerInfo:
+    """
+    CSVの1行を ComputerInfo に変換
+
+    Raises:
+        ValueError: 値が不正な場合
+    """
+    values = {
+        field_name: row[index].strip() if index < len(row) else ""
+        for field_name, index in columns.items()
+    }
+    login_type_value = values.get("login_type", "")
+    login_type = LOGIN_TYPE_MAP.get(login_type_value)
+    if login_type is None:
+        raise ValueError(f"不正なログインタイプです: {login_type_value}(有効な値: AD, 既存ローカル, 新規ローカル)")
+
+    data: Dict[str, Any] = {k: (v or None) for k, v in values.items()}
+    data["login_type"] = login_type
+    data["full_name"] = values.get("full_name", "")
+    data["admin_privilege"] = values.get("admin_privilege", "").lower() == "yes"
+    return ComputerInfo(**data)
+
+def iter_computer_batches(
+    rows: Iterable[List[str]],
+    report: CsvImportReport,
+    batch_size: int = CSV_IMPORT_BATCH,
+    conflict_checker: Optional[Any] = None
+) -> Iterator[List[ComputerInfo]]:
+    """
+    CSVの行を読み進めながら、検証済みの ComputerInfo を batch_size 件ずつ返す
+
+    5行目をヘッダー、10行目以降をデータとして扱う。不正な行は report に記録して読み飛ばすため、
+    1行の誤りで取り込み全体が失敗することはない。保持するのは1バッチ分の行だけなので、
+    行数が増えてもメモリ使用量は一定となる。
+
+    Args:
+        rows (Iterable[List[str]]): csv.reader などが返す行
+        report (CsvImportReport): 取り込み結果を記録する集計
+        batch_size (int): 1バッチの件数
+        conflict_checker (Optional[Any]): 重複・競合を判定するチェッカー(host_registry.HostConflictChecker)
+
+    Raises:
+        CsvFormatError: ヘッダー行が無い・不正な場合
+    """
+    columns: Optional[Dict[str, int]] = None
+    batch: List[ComputerInfo] = []
+    for line_number, row in enumerate(rows, start=1):
+        if line_number == CSV_HEADER_ROW:
+            columns = resolve_columns(row)
+            logger.debug(f"CSVの列対応: {columns}")
+            continue
+        if line_number < CSV_DATA_START_ROW or not any(cell.strip() for cell in row):
+            continue
+        if columns is None:
+            raise CsvFormatError("ヘッダー行(5行目)が見つかりません")
+
+        report.total_rows += 1
+        try:
+            computer = row_to_computer(row, columns)
+            conflict = conflict_checker.check(computer) if conflict_checker is not None else None
+            if conflict is not None:
+                report.add_error(RowError(line_number, conflict.message, computer.computer_name))
+            else:
+                batch.append(computer)
+                report.valid_rows += 1
+        except PydanticValidationError as e:
+            messages = "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+            report.add_error(RowError(line_number, messages, _cell(row, columns, "computer_name")))
+        except ValueError as e:
+            report.add_error(RowError(line_number, str(e), _cell(row, columns, "computer_name")))
+
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if columns is None:
+        raise CsvFormatError("CSVファイルのデータが不足しています(ヘッダー行がありません)")
+    if batch:
+        yield batch
+
+def _cell(row: List[str], columns: Dict[str, int], field_name: str) -> Optional[str]:
+    index = columns.get(field_name)
+    if index is None or index >= len(row):
+        return None
+    return row[index].strip() or None
+
+def open_csv_rows(stream: BinaryIO, encoding: Optional[str] = None) -> Iterator[List[str]]:
+    """
+    バイナリストリームを文字コード変換しながら csv.reader で1行ずつ読む
+
+    ファイル全体を文字列として読み込まないため、巨大なファイルでもメモリを消費しない。
+    """
+    text = io.TextIOWrapper(stream, encoding=encoding or detect_encoding(stream), newline="")
+    try:
+        yield from csv.reader(text)
+    finally:
+        # 元のストリームは呼び出し元が閉じる
+        text.detach()
+
+def iter_import_json(
+    stream: BinaryIO,
+    encoding: Optional[str] = None,
+    batch_size: int = CSV_IMPORT_BATCH,
+    conflict_checker: Optional[Any] = None
+) -> Iterator[str]:
+    """
+    CSVファイルを取り込み、{"computers": [...], <集計>} のJSONをバッチ毎に少しずつ返す
+
+    取り込めたコンピュータを1つのリストに溜めず、1バッチ分ずつJSONにして返すため、
+    行数が増えてもメモリ使用量は一定となる。ヘッダーの不正は最初の要素を取り出す時点で
+    例外となるため、呼び出し元は応答を返し始める前にエラーを判定できる。
+    途中で読めなくなった場合(文字コードの判定誤りなど)は、それまでの結果に error を付けて閉じる。
+
+    Args:
+        stream (BinaryIO): アップロードされたファイル
+        encoding (Optional[str]): 文字コード(省略時は自動判定)
+        batch_size (int): 検証のバッチサイズ
+        conflict_checker (Optional[Any]): 重複・競合を判定するチェッカー
+
+    Raises:
+        CsvFormatError: ヘッダー行が無い・不正な場合
+        UnicodeDecodeError: 先頭のバッチを文字コード変換できない場合
+    """
+    report = CsvImportReport()
+    batches = iter_computer_batches(open_csv_rows(stream, encoding), report, batch_size, conflict_checker)
+    batch = next(batches, None)
+    yield '{"computers": ['
+
+    error: Optional[str] = None
+    separator = ""
+    while batch is not None:
+        yield separator + ",".join(computer.model_dump_json() for computer in batch)
+        separator = ","
+        try:
+            batch = next(batches, None)
+        except (CsvFormatError, UnicodeDecodeError, csv.Error) as e:
+            logger.error(f"CSV取り込み中にエラーが発生: {str(e)}")
+            error = f"CSVファイルを最後まで読み込めませんでした: {str(e)}"
+            batch = None
+
+    logger.info(
+        f"CSVを取り込みました: {report.total_rows}行中 {report.valid_rows}行が有効, "
+        f"エラー {report.error_count}行"
+    )
+    summary = report.to_dict()
+    if error is not None:
+        summary["error"] = error
+    yield "], " + json.dumps(summary, ensure_ascii=False)[1:]
@@ -1,26 +1,112 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
+from typing import Callable, Optional, TypeVar
+import asyncio
+import os
 
-# データベースファイルのパスを設定
-DATABASE_URL = f"sqlite:///{Path(__file__).parent.parent}/data.db"
+# データベースファイルのパスを設定(環境変数で上書き可能)
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{Path(__file__).parent.parent}/data.db")
 
-# SQLAlchemyエンジンを作成
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# SQLiteの接続設定(環境変数で上書き可能)
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")  # WALモードではNORMALでもコミット済みデータは破損しない
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", "2"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "8"))
+
+def _configure_sqlite(dbapi_connection, connection_record, read_only: bool = False):
+    """接続毎にWALモードと待機時間を設定"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+def _create_engine(pool_size: int, read_only: bool):
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={
+            "check_same_thread": False,
+            "timeout": DB_BUSY_TIMEOUT_MS / 1000
+        },
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=pool_size,
+        pool_pre_ping=True
+    )
+    event.listen(engine, "connect", partial(_configure_sqlite, read_only=read_only))
+    return engine
+
+# SQLAlchemyエンジンを作成(書き込み用と読み取り専用を分離)
+engine = _create_engine(DB_WRITE_POOL_SIZE, read_only=False)
+read_engine = _create_engine(DB_READ_POOL_SIZE, read_only=True)
 
 # セッションファクトリを作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# DB処理を実行するスレッドプール(イベントループをブロックしないため)
+# SQLiteの書き込みは直列化されるため、書き込み用スレッドは接続数と揃える
+_write_executor = ThreadPoolExecutor(max_workers=DB_WRITE_POOL_SIZE, thread_name_prefix="db-write")
+_read_executor = ThreadPoolExecutor(max_workers=DB_READ_POOL_SIZE, thread_name_prefix="db-read")
 
 # モデルのベースクラスを作成
 Base = declarative_base()
 
+T = TypeVar("T")
+
+async def run_in_session(
+    fn: Callable[[Session], T],
+    read_only: bool = False,
+    session_factory: Optional[Callable[[], Session]] = None
+) -> T:
+    """
+    DB処理をスレッドプールで実行する
+
+    セッションは実行スレッド内で作成・破棄するため、呼び出し元の
+    リクエストやバックグラウンド処理とセッションを共有しない。
+    コミットは fn の中で行うこと。
+
+    Args:
+        fn (Callable[[Session], T]): セッションを受け取って処理を行う関数
+        read_only (bool): 読み取り専用の接続プールを使うかどうか
+        session_factory (Optional[Callable[[], Session]]): セッションファクトリ(省略時は用途に応じて選択)
+
+    Returns:
+        T: fn の戻り値
+    """
+    factory = session_factory or (ReadSessionLocal if read_only else SessionLocal)
+
+    def run():
+        db = factory()
+        try:
+            return fn(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_read_executor if read_only else _write_executor, run)
+
 # 依存性注入のためのセッション取得関数
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
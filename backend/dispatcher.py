@@ -0,0 +1,308 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 優先度(大きいほど先に実行する)
+DEFAULT_PRIORITY = 0
+MIN_PRIORITY = -10
+MAX_PRIORITY = 10
+EXPEDITE_PRIORITY = 100  # 管理者の「至急」指定
+DISPATCH_STATS_RETENTION = 1000  # 待ち時間の統計を保持するリクエスト数
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """
+    "alice=2,bob=0.5" 形式の申請者毎の重みを解析する
+
+    Raises:
+        ValueError: 形式が不正な場合
+    """
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, weight = item.partition("=")
+        if not name.strip() or float(weight) <= 0:
+            raise ValueError(f"不正な重みの指定です: {item}")
+        weights[name.strip()] = float(weight)
+    return weights
+
+# 申請者毎の重み(環境変数で指定、未指定の申請者は 1)
+FAIR_SHARE_WEIGHTS = parse_weights(os.getenv("FAIR_SHARE_WEIGHTS", ""))
+
+class RequestQueueStats:
+    """リクエスト毎のキュー待ち時間の統計"""
+
+    __slots__ = ("request_id", "requester", "priority", "enqueued", "dispatched", "total_wait", "max_wait")
+
+    def __init__(self, request_id: str, requester: str, priority: int):
+        self.request_id = request_id
+        self.requester = requester
+        self.priority = priority
+        self.enqueued = 0
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "requester": self.requester,
+            "priority": self.priority,
+            "queued": self.enqueued - self.dispatched,
+            "dispatched": self.dispatched,
+            "avg_wait_seconds": self.total_wait / self.dispatched if self.dispatched else 0.0,
+            "max_wait_seconds": self.max_wait
+        }
+
+class _RequestQueue:
+    __slots__ = ("request_id", "requester", "level", "seq", "gen", "in_heap", "jobs")
+
+    def __init__(self, request_id: str, requester: str, level: int, seq: int):
+        self.request_id = request_id
+        self.requester = requester
+        self.level = level
+        self.seq = seq
+        self.gen = 0          # 取り出し・優先度変更で増え、古いヒープ要素を無効にする
+        self.in_heap = False
+        self.jobs: Deque[Tuple[float, Any]] = deque()  # (投入時刻, ジョブ)
+
+class _RequesterQueue:
+    __slots__ = ("requester", "vtime", "active", "requests")
+
+    def __init__(self, requester: str):
+        self.requester = requester
+        self.vtime = 0.0      # 仮想時刻(取り出す度に 1/重み 進む)
+        self.active = False   # 優先度レベルのヒープに要素があるか
+        self.requests: List[Tuple[int, int, _RequestQueue]] = []  # (seq, gen, リクエスト)
+
+class _Level:
+    __slots__ = ("clock", "requesters", "heap")
+
+    def __init__(self):
+        self.clock = 0.0
+        self.requesters: Dict[str, _RequesterQueue] = {}
+        self.heap: List[Tuple[float, int, str]] = []  # (仮想時刻, 順序, 申請者)
+
+class FairShareQueue:
+    """
+    優先度と申請者間の重み付き公平性に従ってジョブを取り出すキュー
+
+    - 優先度の高いレベルのジョブが残っている間は、低いレベルのジョブを取り出さない
+    - 同じレベル内では、申請者毎の仮想時刻(Start-time Fair Queuing)が最も小さい申請者から取り出す。
+      1台取り出す度に仮想時刻が 1/重み 進むため、500台のリクエストがあっても
+      他の申請者の1台は数台分の待ちで実行される
+    - 同じ申請者のリクエストは投入順、リクエスト内のジョブも投入順に取り出す
+
+    push / pop / expedite はいずれもヒープ操作のみで、キュー内のジョブ数に対して O(log n)。
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = FAIR_SHARE_WEIGHTS if weights is None else weights
+        self._levels: Dict[int, _Level] = {}
+        self._level_heap: List[int] = []  # -優先度
+        self._requests: Dict[str, _RequestQueue] = {}
+        self._stats: "OrderedDict[str, RequestQueueStats]" = OrderedDict()
+        self._seq = itertools.count()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def weight(self, requester: str) -> float:
+        return self.weights.get(requester, 1.0)
+
+    def push(self, job: Any, request_id: str, requester: Optional[str] = None, priority: int = DEFAULT_PRIORITY):
+        """
+        ジョブを追加する(リクエストの優先度は最初のジョブ、または expedite で決まる)
+        """
+        requester = requester or "-"
+        stats = self._stats.get(request_id)
+        if stats is None:
+            stats = RequestQueueStats(request_id, requester, priority)
+            self._stats[request_id] = stats
+            while len(self._stats) > DISPATCH_STATS_RETENTION:
+                self._stats.popitem(last=False)
+        stats.enqueued += 1
+
+        request = self._requests.get(request_id)
+        if request is None:
+            request = _RequestQueue(request_id, requester, stats.priority, next(self._seq))
+            self._requests[request_id] = request
+        request.jobs.append((time.monotonic(), job))
+        self._size += 1
+        if not request.in_heap:
+            self._attach(request)
+
+    def _attach(self, request: _RequestQueue):
+        level = self._levels.get(request.level)
+        if level is None:
+            level = self._levels[request.level] = _Level()
+            heapq.heappush(self._level_heap, -request.level)
+        requester = level.requesters.get(request.requester)
+        if requester is None:
+            requester = level.requesters[request.requester] = _RequesterQueue(request.requester)
+        heapq.heappush(requester.requests, (request.seq, request.gen, request))
+        request.in_heap = True
+        if not requester.active:
+            # 待機していなかった申請者は、現在の仮想時刻から参加する(過去の分を貯め込まない)
+            requester.vtime = max(requester.vtime, level.clock)
+            requester.active = True
+            heapq.heappush(level.heap, (requester.vtime, next(self._seq), requester.requester))
+
+    def pop(self) -> Any:
+        """
+        次に実行するジョブを取り出す
+
+        Raises:
+            IndexError: キューが空の場合
+        """
+        while self._level_heap:
+            level_key = -self._level_heap[0]
+            level = self._levels[level_key]
+            job = self._pop_level(level_key, level)
+            if job is not None:
+                return job
+            heapq.heappop(self._level_heap)
+            del self._levels[level_key]
+        raise IndexError("キューが空です")
+
+    def _pop_level(self, level_key: int, level: _Level) -> Any:
+        while level.heap:
+            _, _, name = heapq.heappop(level.heap)
+            requester = level.requesters[name]
+            request = self._head_request(requester)
+            if request is None:
+                requester.active = False
+                del level.requesters[name]
+                continue
+
+            enqueued_at, job = request.jobs.popleft()
+            self._size -= 1
+            if not request.jobs:
+                heapq.heappop(requester.requests)
+                request.gen += 1
+                request.in_heap = False
+                del self._requests[request.request_id]
+
+            level.clock = max(requester.vtime, level.clock)
+            requester.vtime = level.clock + 1.0 / self.weight(name)
+            if self._head_request(requester) is not None:
+                heapq.heappush(level.heap, (requester.vtime, next(self._seq), name))
+            else:
+                requester.active = False
+                del level.requesters[name]
+
+            stats = self._stats.get(request.request_id)
+            if stats is not None:
+                wait = time.monotonic() - enqueued_at
+                stats.dispatched += 1
+                stats.total_wait += wait
+                stats.max_wait = max(stats.max_wait, wait)
+            return job
+        return None
+
+    def _head_request(self, requester: _RequesterQueue) -> Optional[_RequestQueue]:
+        # 優先度変更などで無効になった要素を読み飛ばす
+        while requester.requests:
+            _, gen, request = requester.requests[0]
+            if gen == request.gen and request.jobs:
+                return request
+            heapq.heappop(requester.requests)
+        return None
+
+    def expedite(self, request_id: str, priority: int = EXPEDITE_PRIORITY) -> int:
+        """
+        リクエストの優先度を変更する(待機中のジョブは新しいレベルの先頭側に移る)
+
+        Returns:
+            int: 移動した待機中のジョブ数
+        """
+        stats = self._stats.get(request_id)
+        if stats is not None:
+            stats.priority = priority
+        request = self._requests.get(request_id)
+        if request is None or request.level == priority:
+            return 0
+        request.gen += 1
+        request.in_heap = False
+        request.level = priority
+        self._attach(request)
+        return len(request.jobs)
+
+    def queued(self, request_id: str) -> int:
+        """リクエストの待機中のジョブ数"""
+        request = self._requests.get(request_id)
+        return len(request.jobs) if request is not None else 0
+
+    def request_stats(self, request_id: str) -> Optional[Dict[str, Any]]:
+        stats = self._stats.get(request_id)
+        return stats.to_dict() if stats is not None else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """レベル・申請者毎の待機状況と、リクエスト毎の待ち時間を取得"""
+        by_requester: Dict[str, Dict[str, Any]] = {}
+        for stats in self._stats.values():
+            entry = by_requester.setdefault(stats.requester, {
+                "requester": stats.requester,
+                "weight": self.weight(stats.requester),
+                "queued": 0,
+                "dispatched": 0,
+                "total_wait_seconds": 0.0
+            })
+            entry["queued"] += stats.enqueued - stats.dispatched
+            entry["dispatched"] += stats.dispatched
+            entry["total_wait_seconds"] += stats.total_wait
+        for entry in by_requester.values():
+            dispatched = entry.pop("dispatched")
+            entry["avg_wait_seconds"] = entry.pop("total_wait_seconds") / dispatched if dispatched else 0.0
+            entry["dispatched"] = dispatched
+        levels: Dict[int, int] = {}
+        for request in self._requests.values():
+            levels[request.level] = levels.get(request.level, 0) + len(request.jobs)
+        return {
+            "queued": self._size,
+            "levels": dict(sorted(levels.items(), reverse=True)),
+            "requesters": sorted(by_requester.values(), key=lambda e: e["queued"], reverse=True),
+            "requests": [stats.to_dict() for stats in reversed(self._stats.values())]
+        }
+
+class JobDispatcher:
+    """
+    FairShareQueue を asyncio から使うための上限付きキュー
+
+    asyncio.Queue と同様に、満杯なら put は空きが出るまで、空なら get はジョブが来るまで待つ。
+    """
+
+    def __init__(self, maxsize: int = 0, weights: Optional[Dict[str, float]] = None):
+        self.maxsize = maxsize
+        self.queue = FairShareQueue(weights)
+        self._lock = asyncio.Lock()
+        self._not_empty = asyncio.Condition(self._lock)
+        self._not_full = asyncio.Condition(self._lock)
+
+    def qsize(self) -> int:
+        return len(self.queue)
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= len(self.queue)
+
+    async def put(self, job: Any, request_id: str, requester: Optional[str] = None, priority: int = DEFAULT_PRIORITY):
+        async with self._lock:
+            await self._not_full.wait_for(lambda: not self.full())
+            self.queue.push(job, request_id, requester, priority)
+            self._not_empty.notify()
+
+    async def get(self) -> Any:
+        async with self._lock:
+            await self._not_empty.wait_for(lambda: len(self.queue) > 0)
+            job = self.queue.pop()
+            self._not_full.notify()
+            return job
+
+    def expedite(self, request_id: str, priority: int = EXPEDITE_PRIORITY) -> int:
+        return self.queue.expedite(request_id, priority)
@@ -0,0 +1,286 @@
+import ipaddress
+import logging
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Session
+
+from .models import SetupProgressDB, ComputerInfoDB
+from .task_graph import TaskGraph, DEFAULT_TASK_WEIGHTS
+from .executor import MAX_TASKS_PER_HOST
+from .utils import TASK_SCRIPTS
+
+logger = logging.getLogger(__name__)
+
+# タスクの所要時間の統計の設定(環境変数で上書き可能)
+# PCをまとめて集計する単位(subnet: IPアドレスのサブネット毎、none: タスク毎のみ)
+DURATION_STATS_GROUP_BY = os.getenv("DURATION_STATS_GROUP_BY", "subnet")
+DURATION_STATS_SUBNET_PREFIX = int(os.getenv("DURATION_STATS_SUBNET_PREFIX", "24"))
+# グループの統計を使うのに必要な件数(少ない場合はタスク全体の統計を使う)
+DURATION_STATS_MIN_SAMPLES = int(os.getenv("DURATION_STATS_MIN_SAMPLES", "5"))
+# 起動時に読み込む直近の進捗ログの件数
+DURATION_STATS_WARMUP_ROWS = int(os.getenv("DURATION_STATS_WARMUP_ROWS", "50000"))
+# 新しい進捗ログを取り込む間隔(秒)
+DURATION_STATS_REFRESH_INTERVAL = float(os.getenv("DURATION_STATS_REFRESH_INTERVAL", "30"))
+DURATION_STATS_MAX_GROUPS = 10000  # 保持するグループ数の上限(超えた分はタスク全体の統計のみに加える)
+DURATION_STATS_BATCH = 5000        # 1回に読み取る進捗ログの件数
+
+class P2Quantile:
+    """
+    P² アルゴリズム(Jain & Chlamtac)による分位点の逐次推定
+
+    5個のマーカーだけを保持し、値を1件加える毎に O(1) で更新する。5件未満の間は正確な値を返す。
+    """
+
+    __slots__ = ("q", "count", "heights", "positions", "desired", "increments")
+
+    def __init__(self, q: float):
+        self.q = q
+        self.count = 0
+        self.heights: List[float] = []
+        self.positions = [1.0, 2.0, 3.0, 4.0, 5.0]
+        self.desired = [1.0, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5.0]
+        self.increments = [0.0, q / 2, q, (1 + q) / 2, 1.0]
+
+    def add(self, x: float):
+        self.count += 1
+        heights = self.heights
+        if self.count <= 5:
+            heights.append(x)
+            heights.sort()
+            return
+
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= heights[k + 1]:
+                k += 1
+        positions = self.positions
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if d > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (positions[i + step] - positions[i])
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i: int, step: int) -> float:
+        h, n = self.heights, self.positions
+        return h[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            return self.heights[min(int(self.q * self.count), self.count - 1)]
+        return self.heights[2]
+
+class DurationSummary:
+    """1つのタスク(とグループ)の所要時間の p50 / p90"""
+
+    __slots__ = ("p50", "p90")
+
+    def __init__(self):
+        self.p50 = P2Quantile(0.5)
+        self.p90 = P2Quantile(0.9)
+
+    @property
+    def count(self) -> int:
+        return self.p50.count
+
+    def add(self, seconds: float):
+        self.p50.add(seconds)
+        self.p90.add(seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"samples": self.count, "p50": self.p50.value(), "p90": self.p90.value()}
+
+@dataclass
+class HostEstimate:
+    """1台分の推定所要時間(タスクグラフを実行した場合の所要時間、秒)"""
+    p50: float
+    p90: float
+
+def host_group(ip_address: Optional[str]) -> Optional[str]:
+    """PCを集計するグループ(IPアドレスのサブネット)を求める"""
+    if DURATION_STATS_GROUP_BY != "subnet" or not ip_address:
+        return None
+    try:
+        network = ipaddress.ip_network(f"{ip_address}/{DURATION_STATS_SUBNET_PREFIX}", strict=False)
+    except ValueError:
+        return None
+    return str(network)
+
+def estimate_request_minutes(host_seconds: Sequence[float], parallel: int) -> Optional[int]:
+    """
+    リクエスト全体の推定所要時間(分)
+
+    並列数の範囲で長いジョブから順に実行した場合の完了時刻(最長の1台と、合計を並列数で割った値の大きい方)。
+    """
+    if not host_seconds:
+        return None
+    seconds = max(max(host_seconds), sum(host_seconds) / max(min(parallel, len(host_seconds)), 1))
+    return max(math.ceil(seconds / 60), 1)
+
+class DurationStats:
+    """
+    タスク毎(と、サブネット毎)の所要時間の統計
+
+    setup_progress の完了ログ(duration)を id の順に取り込み、分位点を逐次更新する。
+    取り込み済みの位置を覚えているため、定期的な取り込みは新しいログだけを読む。
+    統計の無いタスクは task_graph.DEFAULT_TASK_WEIGHTS の値を使う。
+    """
+
+    def __init__(self, min_samples: int = DURATION_STATS_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._tasks: Dict[str, DurationSummary] = {}
+        self._groups: Dict[Tuple[str, str], DurationSummary] = {}
+        self._cursor: Optional[int] = None
+        self.ingested = 0
+
+    def record(self, task_id: str, seconds: float, group: Optional[str] = None):
+        """タスクの所要時間を1件加える"""
+        if task_id not in TASK_SCRIPTS or seconds < 0:
+            # setup_completion などのタスク以外の完了ログは加えない
+            return
+        self._tasks.setdefault(task_id, DurationSummary()).add(seconds)
+        if group is not None:
+            key = (task_id, group)
+            summary = self._groups.get(key)
+            if summary is None and len(self._groups) < DURATION_STATS_MAX_GROUPS:
+                summary = self._groups[key] = DurationSummary()
+            if summary is not None:
+                summary.add(seconds)
+        self.ingested += 1
+
+    def ingest(self, db: Session, warmup_rows: int = DURATION_STATS_WARMUP_ROWS) -> int:
+        """
+        前回の取り込み以降に完了したタスクの所要時間を取り込む
+
+        初回は直近 warmup_rows 件の進捗ログから始める。
+
+        Returns:
+            int: 取り込んだ件数
+        """
+        if self._cursor is None:
+            last_id = db.query(func.max(SetupProgressDB.id)).scalar() or 0
+            self._cursor = max(last_id - warmup_rows, 0)
+        total = 0
+        while True:
+            rows = db.query(
+                SetupProgressDB.id,
+                SetupProgressDB.task_name,
+                SetupProgressDB.duration,
+                ComputerInfoDB.ip_address
+            ).outerjoin(
+                ComputerInfoDB,
+                and_(
+                    ComputerInfoDB.request_id == SetupProgressDB.request_id,
+                    ComputerInfoDB.computer_name == SetupProgressDB.computer_name
+                )
+            ).filter(
+                SetupProgressDB.id > self._cursor,
+                SetupProgressDB.status == "Completed",
+                SetupProgressDB.duration.isnot(None)
+            ).order_by(SetupProgressDB.id).limit(DURATION_STATS_BATCH).all()
+            for row_id, task_name, duration, ip_address in rows:
+                self._cursor = row_id
+                self.record(task_name, float(duration), host_group(ip_address))
+            total += len(rows)
+            if len(rows) < DURATION_STATS_BATCH:
+                break
+        if total:
+            logger.debug(f"タスクの所要時間を取り込みました: {total}件")
+        return total
+
+    def summary(self, task_id: str, group: Optional[str] = None) -> Optional[DurationSummary]:
+        """件数の足りるグループの統計、無ければタスク全体の統計"""
+        if group is not None:
+            summary = self._groups.get((task_id, group))
+            if summary is not None and summary.count >= self.min_samples:
+                return summary
+        summary = self._tasks.get(task_id)
+        if summary is not None and summary.count > 0:
+            return summary
+        return None
+
+    def task_weights(self, computer: Any = None, quantile: str = "p50") -> Dict[str, float]:
+        """
+        TaskGraph.from_options に渡すタスク毎の推定所要時間(秒)
+
+        Args:
+            computer (Any): 対象PC(サブネット毎の統計を使う場合)
+            quantile (str): "p50" または "p90"
+        """
+        group = host_group(computer.ip_address) if computer is not None else None
+        weights = {}
+        for task_id in set(self._tasks) | set(DEFAULT_TASK_WEIGHTS):
+            summary = self.summary(task_id, group)
+            if summary is not None:
+                weights[task_id] = getattr(summary, quantile).value()
+        return weights
+
+    def estimate_hosts(
+        self,
+        computers: Sequence[Any],
+        setup_options: Any,
+        host_options: Optional[Dict[str, Any]] = None,
+        max_parallel: int = MAX_TASKS_PER_HOST
+    ) -> List[HostEstimate]:
+        """
+        PC毎の推定所要時間(p50 / p90 の所要時間でタスクグラフを実行した場合の長さ)を求める
+
+        クリティカルパス長ではなく、ホスト毎の同時実行数とインストーラーの排他を含めた
+        TaskGraph.estimated_length を使う(インストーラーは1つずつしか実行できないため)。
+        同じ設定・同じグループのPCはグラフを1度だけ構築する。
+
+        Args:
+            max_parallel (int): ホスト毎に同時に実行するタスク数(FleetExecutor.max_tasks_per_host)
+        """
+        cache: Dict[tuple, HostEstimate] = {}
+        result = []
+        for computer in computers:
+            options = (host_options or {}).get(computer.computer_name, setup_options).dict()
+            group = host_group(computer.ip_address)
+            key = (tuple(sorted(options.items())), group)
+            if key not in cache:
+                cache[key] = HostEstimate(
+                    p50=TaskGraph.from_options(options, self.task_weights(computer, "p50")).estimated_length(max_parallel),
+                    p90=TaskGraph.from_options(options, self.task_weights(computer, "p90")).estimated_length(max_parallel)
+                )
+            result.append(cache[key])
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """タスク毎・グループ毎の統計を取得"""
+        groups: Dict[str, Dict[str, Any]] = {}
+        for (task_id, group), summary in self._groups.items():
+            groups.setdefault(group, {})[task_id] = summary.to_dict()
+        return {
+            "group_by": DURATION_STATS_GROUP_BY,
+            "ingested": self.ingested,
+            "tasks": {task_id: summary.to_dict() for task_id, summary in sorted(self._tasks.items())},
+            "defaults": DEFAULT_TASK_WEIGHTS,
+            "groups": dict(sorted(groups.items()))
+        }
+
+# アプリケーション全体で共有する所要時間の統計
+duration_stats = DurationStats()
@@ -18,6 +18,7 @@ class ErrorCategory(str, Enum):
     VALIDATION = "validation"   # バリデーション関連のエラー
     SETUP = "setup"            # セットアップ処理関連のエラー
     POWERSHELL = "powershell"  # PowerShell実行関連のエラー
+    TIMEOUT = "timeout"        # 実行時間超過のエラー
 
 class SetupError(Exception):
     """セットアップ処理に関するエラーの基本クラス"""
@@ -115,6 +116,58 @@ class NetworkError(SetupError):
             retry_count=retry_count
         )
 
+class WinRMError(NetworkError):
+    """WinRM(WS-Management)の通信・応答エラー"""
+    def __init__(
+        self,
+        message: str,
+        host: str,
+        status: Optional[int] = None,
+        fault_code: Optional[str] = None,
+        retry_count: int = 0
+    ):
+        super().__init__(message=message, host=host, retry_count=retry_count)
+        self.error_code = "WINRM_ERROR"
+        self.status = status
+        self.fault_code = fault_code
+        self.details.update({"status": status, "fault_code": fault_code})
+
+class AuthenticationError(SetupError):
+    """認証エラー(資格情報の誤り・アクセス拒否)"""
+    def __init__(
+        self,
+        message: str,
+        host: str,
+        details: Optional[Dict[str, Any]] = None
+    ):
+        super().__init__(
+            message=message,
+            severity=ErrorSeverity.ERROR,
+            category=ErrorCategory.AUTHENTICATION,
+            error_code="AUTHENTICATION_ERROR",
+            details={"host": host, **(details or {})},
+            max_retries=0  # 同じ資格情報での再試行はアカウントのロックアウトを招くためリトライしない
+        )
+
+class TaskTimeoutError(SetupError):
+    """タスク実行時間超過エラー"""
+    def __init__(
+        self,
+        message: str,
+        host: str,
+        task_name: str,
+        timeout: float,
+        retry_count: int = 0
+    ):
+        super().__init__(
+            message=message,
+            severity=ErrorSeverity.ERROR,
+            category=ErrorCategory.TIMEOUT,
+            error_code="TASK_TIMEOUT",
+            details={"host": host, "task_name": task_name, "timeout": timeout},
+            retry_count=retry_count
+        )
+
 class DatabaseError(SetupError):
     """データベースエラー"""
     def __init__(
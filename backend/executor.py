@@ -0,0 +1,552 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from .dispatcher import JobDispatcher, DEFAULT_PRIORITY, EXPEDITE_PRIORITY
+from .concurrency import AimdController, HostLimiter, AIMD_ENABLED, AIMD_MIN_HOSTS
+
+logger = logging.getLogger(__name__)
+
+# フリート実行の設定(環境変数で上書き可能)
+MAX_CONCURRENT_HOSTS = int(os.getenv("FLEET_MAX_CONCURRENT_HOSTS", "100"))
+MAX_CONCURRENT_SPAWNS = int(os.getenv("FLEET_MAX_CONCURRENT_SPAWNS", "50"))
+MAX_TASKS_PER_HOST = int(os.getenv("FLEET_MAX_TASKS_PER_HOST", "2"))
+QUEUE_DEPTH = int(os.getenv("FLEET_QUEUE_DEPTH", "1000"))
+HOST_TIMEOUT = float(os.getenv("HOST_TIMEOUT", "14400"))  # 1台あたりの実行期限(秒)
+THROUGHPUT_WINDOW = 60.0  # スループット計測の時間窓(秒)
+# ジョブが残っていないリクエストのキャンセル記録を保持する期間(秒)
+# (キャンセルの後にジョブが投入される場合に備えて、すぐには破棄しない)
+CANCEL_RETENTION = float(os.getenv("FLEET_CANCEL_RETENTION", "300"))
+
+@dataclass
+class HostJob:
+    """1台のコンピュータに対するセットアップジョブ"""
+    request_id: str
+    computer_info: Any
+    setup_options: Any
+    requester: Optional[str] = None  # 公平性の単位となる申請者
+    priority: int = DEFAULT_PRIORITY
+    job_id: Optional[int] = None  # host_jobs の id(永続化されたジョブの場合)
+    completed_steps: Set[str] = field(default_factory=set)  # 再開時に飛ばす完了済みタスク
+    estimated_seconds: Optional[float] = None  # 推定所要時間(リクエスト内では長いジョブから実行する)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+HostRunner = Callable[[HostJob], Awaitable[None]]
+
+class HostSlot:
+    """
+    ジョブが使っている同時実行ホスト数の枠
+
+    枠はワーカーが確保してジョブに渡す。再起動待ちなどで待機する間は枠を返却し、
+    ワーカーを次のジョブに回す(freed)。待機が終わると枠を確保し直して続きを実行する。
+    """
+
+    __slots__ = ("limiter", "holding", "freed")
+
+    def __init__(self, limiter: HostLimiter):
+        self.limiter = limiter
+        self.holding = True
+        self.freed = asyncio.Event()  # ワーカーがこのジョブを待つ必要が無くなった
+
+    async def acquire(self):
+        await self.limiter.acquire()
+        self.holding = True
+
+    def reclaim(self):
+        if not self.holding:
+            self.limiter.reclaim()
+            self.holding = True
+
+    def release(self):
+        if self.holding:
+            self.holding = False
+            self.limiter.release()
+
+def longest_first(jobs: List[HostJob]) -> List[HostJob]:
+    """リクエスト毎に推定所要時間の長い順に並べ替える(リクエストの順序・同じ長さのジョブの順序は保つ)"""
+    first_index: Dict[str, int] = {}
+    for index, job in enumerate(jobs):
+        first_index.setdefault(job.request_id, index)
+    return sorted(jobs, key=lambda job: (first_index[job.request_id], -(job.estimated_seconds or 0.0)))
+
+class FleetExecutor:
+    """
+    セットアップリクエストを全コンピュータに展開して並列実行するエグゼキューター
+
+    - 同時に処理するホスト数は、タスクの所要時間と失敗率に応じて min_concurrent_hosts 〜
+      max_concurrent_hosts の範囲で自動調整する(concurrency.AimdController)
+    - powershell.exe の同時起動数はフリート全体のセマフォで制限する
+    - 1台あたりの同時タスク数はホストごとのセマフォで制限する
+    - キューが満杯の場合、submit は空きが出るまで待機する
+    - キューからは優先度順・申請者間で重み付き公平に取り出す(dispatcher.FairShareQueue)
+    - 1台あたりの実行期限を超えたジョブ、cancel されたジョブは実行中でも中断する
+    """
+
+    def __init__(
+        self,
+        host_runner: HostRunner,
+        max_concurrent_hosts: int = MAX_CONCURRENT_HOSTS,
+        max_concurrent_spawns: int = MAX_CONCURRENT_SPAWNS,
+        max_tasks_per_host: int = MAX_TASKS_PER_HOST,
+        queue_depth: int = QUEUE_DEPTH,
+        host_timeout: float = HOST_TIMEOUT,
+        min_concurrent_hosts: int = AIMD_MIN_HOSTS,
+        adaptive: bool = AIMD_ENABLED,
+        cancel_retention: float = CANCEL_RETENTION
+    ):
+        self.host_runner = host_runner
+        self.max_concurrent_hosts = max_concurrent_hosts
+        self.min_concurrent_hosts = min_concurrent_hosts
+        self.adaptive = adaptive
+        self.max_concurrent_spawns = max_concurrent_spawns
+        self.max_tasks_per_host = max_tasks_per_host
+        self.queue_depth = queue_depth
+        self.host_timeout = host_timeout
+        self.cancel_retention = cancel_retention
+
+        self._queue: Optional[JobDispatcher] = None
+        self._spawn_semaphore: Optional[asyncio.Semaphore] = None
+        self._host_semaphores: Dict[str, List[Any]] = {}  # computer_name -> [Semaphore, 利用数]
+        self._workers: List[asyncio.Task] = []
+        self._control_task: Optional[asyncio.Task] = None
+        self.concurrency = self._create_controller()
+        self._completed_at: Deque[float] = deque()
+        self._running: Dict[Tuple[str, str], asyncio.Task] = {}  # (request_id, computer_name) -> 実行中のジョブ
+        self._slots: Dict[Tuple[str, str], HostSlot] = {}
+        self._supervisors: Set[asyncio.Task] = set()  # ジョブの完了を見届けるタスク(待機中のジョブを含む)
+        # キャンセルの記録(値はキャンセルした時刻)。ジョブが残っていないものは _prune_cancelled で破棄する
+        self._cancelled_requests: Dict[str, float] = {}
+        self._cancelled_hosts: Dict[Tuple[str, str], float] = {}
+        # キューへの投入中、またはキューから取り出して開始するまでのジョブ数(リクエスト毎)
+        self._pending: Dict[str, int] = {}
+        self._interrupted_hosts: Set[Tuple[str, str]] = set()
+        # 停止処理中(実行中のジョブは中断扱いとなり、次回起動時に再開される)
+        self.stopping = False
+
+        self.active_hosts = 0
+        self.parked_hosts = 0  # 枠を返却して再起動の完了などを待っているホスト数
+        self.tasks_in_flight = 0
+        self.completed_hosts = 0
+        self.failed_hosts = 0
+        self.cancelled_hosts = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    @property
+    def host_limit(self) -> int:
+        """現在の同時実行ホスト数の上限"""
+        return self.concurrency.limit
+
+    def _create_controller(self) -> AimdController:
+        return AimdController(
+            min_limit=min(self.min_concurrent_hosts, self.max_concurrent_hosts),
+            max_limit=self.max_concurrent_hosts,
+            enabled=self.adaptive
+        )
+
+    def _saturated(self) -> bool:
+        return self.active_hosts >= self.concurrency.limit or (self._queue is not None and self._queue.qsize() > 0)
+
+    async def start(self):
+        """ワーカーを起動"""
+        if self.running:
+            return
+        self.stopping = False
+        self._queue = JobDispatcher(maxsize=self.queue_depth)
+        self._spawn_semaphore = asyncio.Semaphore(self.max_concurrent_spawns)
+        self.concurrency = self._create_controller()
+        self._workers = [
+            asyncio.create_task(self._worker(i))
+            for i in range(self.max_concurrent_hosts)
+        ]
+        self._control_task = asyncio.create_task(self.concurrency.run(self._saturated))
+        logger.info(
+            f"フリートエグゼキューターを起動: ホスト並列数={self.concurrency.limit}"
+            f"(範囲 {self.concurrency.min_limit}〜{self.max_concurrent_hosts}, "
+            f"自動調整 {'有効' if self.adaptive else '無効'}), "
+            f"同時起動数={self.max_concurrent_spawns}, ホスト毎タスク数={self.max_tasks_per_host}, "
+            f"キュー深さ={self.queue_depth}"
+        )
+
+    async def stop(self):
+        """ワーカーを停止(実行中のジョブはキャンセルされる)"""
+        self.stopping = True
+        tasks = self._workers + list(self._supervisors) + ([self._control_task] if self._control_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._control_task = None
+        logger.info("フリートエグゼキューターを停止しました")
+
+    async def submit(
+        self,
+        request_id: str,
+        computers: List[Any],
+        setup_options: Any,
+        host_options: Optional[Dict[str, Any]] = None,
+        job_ids: Optional[List[int]] = None,
+        requester: Optional[str] = None,
+        priority: int = DEFAULT_PRIORITY,
+        estimated_seconds: Optional[List[float]] = None
+    ) -> int:
+        """
+        リクエストをコンピュータごとのジョブに展開してキューに投入する
+
+        Args:
+            request_id (str): リクエストID
+            computers (List[Any]): 対象コンピュータ情報のリスト
+            setup_options (Any): 全コンピュータ共通のセットアップオプション
+            host_options (Optional[Dict[str, Any]]): コンピュータ名毎の個別オプション
+            job_ids (Optional[List[int]]): 永続化したジョブの id(computers と同じ順序)
+            requester (Optional[str]): 申請者(申請者間で公平に実行する単位)
+            priority (int): リクエストの優先度(大きいほど先に実行する)
+            estimated_seconds (Optional[List[float]]): コンピュータ毎の推定所要時間(computers と同じ順序)
+
+        Returns:
+            int: 投入したジョブ数
+        """
+        jobs = [
+            HostJob(
+                request_id,
+                computer,
+                (host_options or {}).get(computer.computer_name, setup_options),
+                requester=requester,
+                priority=priority,
+                job_id=job_ids[index] if job_ids else None,
+                estimated_seconds=estimated_seconds[index] if estimated_seconds else None
+            )
+            for index, computer in enumerate(computers)
+        ]
+        await self.submit_jobs(jobs)
+        logger.info(f"リクエスト {request_id} のジョブを投入: {len(computers)}台")
+        return len(computers)
+
+    async def submit_jobs(self, jobs: List[HostJob]) -> int:
+        """
+        作成済みのジョブをキューに投入する(再起動後の再開などに使う)
+
+        同じリクエストのジョブは推定所要時間の長い順に並べ替える(最後に長いジョブが
+        残って全体の完了が遅れないようにする)。リクエスト間の順序は変えない。
+
+        Returns:
+            int: 投入したジョブ数
+        """
+        if not self.running:
+            raise RuntimeError("フリートエグゼキューターが起動していません")
+        request_ids = {job.request_id for job in jobs}
+        for request_id in request_ids:
+            self._hold(request_id)
+        try:
+            for job in longest_first(jobs):
+                await self._queue.put(job, job.request_id, job.requester, job.priority)
+        finally:
+            for request_id in request_ids:
+                self._unhold(request_id)
+        return len(jobs)
+
+    def expedite(self, request_id: str, priority: int = EXPEDITE_PRIORITY) -> int:
+        """
+        リクエストの待機中のジョブを優先して実行させる
+
+        Returns:
+            int: 優先させた待機中のジョブ数
+        """
+        if self._queue is None:
+            return 0
+        moved = self._queue.expedite(request_id, priority)
+        logger.info(f"リクエスト {request_id} の優先度を {priority} に変更しました(待機中 {moved}台)")
+        return moved
+
+    def request_queue_stats(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """リクエストのキュー待ち時間の統計を取得"""
+        return self._queue.queue.request_stats(request_id) if self._queue else None
+
+    def get_dispatch_stats(self) -> Dict[str, Any]:
+        """優先度・申請者毎の待機状況を取得"""
+        return self._queue.queue.get_stats() if self._queue else {}
+
+    def set_concurrency(
+        self,
+        min_hosts: Optional[int] = None,
+        max_hosts: Optional[int] = None,
+        adaptive: Optional[bool] = None
+    ) -> Dict[str, Any]:
+        """
+        同時実行ホスト数の範囲と自動調整の有無を変更する(管理者用)
+
+        上限を起動時より大きくした場合は、不足するワーカーを追加する。
+
+        Raises:
+            ValueError: 範囲が不正な場合
+
+        Returns:
+            Dict[str, Any]: 変更後の状態
+        """
+        self.concurrency.configure(min_hosts, max_hosts, adaptive)
+        self.min_concurrent_hosts = self.concurrency.min_limit
+        self.max_concurrent_hosts = self.concurrency.max_limit
+        self.adaptive = self.concurrency.enabled
+        if self.running:
+            for i in range(len(self._workers), self.max_concurrent_hosts):
+                self._workers.append(asyncio.create_task(self._worker(i)))
+        return self.concurrency.get_stats()
+
+    def record_task_result(self, task_id: str, latency: float, success: bool):
+        """タスクの所要時間と成否を同時実行数の自動調整に反映する"""
+        self.concurrency.record(task_id, latency, success)
+
+    @asynccontextmanager
+    async def task_slot(self, computer_name: str):
+        """
+        タスク実行スロットを確保する
+
+        ホスト毎の上限を先に確保してから全体の上限を確保するため、
+        1台に集中したタスクが全体のスロットを占有することはない。
+        """
+        entry = self._host_semaphores.get(computer_name)
+        if entry is None:
+            entry = [asyncio.Semaphore(self.max_tasks_per_host), 0]
+            self._host_semaphores[computer_name] = entry
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._spawn_semaphore:
+                    self.tasks_in_flight += 1
+                    try:
+                        yield
+                    finally:
+                        self.tasks_in_flight -= 1
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._host_semaphores[computer_name]
+
+    @asynccontextmanager
+    async def parked(self, request_id: str, computer_name: str):
+        """
+        ホストの待機中(再起動の完了待ちなど)は同時実行ホスト数の枠を返却する
+
+        ブロック内では PowerShell を実行しないこと(同じホストの他のタスクも含む。task_graph.ExclusiveGate で
+        他のタスクの終了を待ってから入る)。ブロックを抜けると、上限に達していても
+        枠を確保し直して続きを実行する(その分、新しいジョブの開始を待たせる)。
+        キャンセル・実行期限は待機中も有効。
+        """
+        key = (request_id, computer_name)
+        slot = self._slots.get(key)
+        if slot is None or not slot.holding:
+            # エグゼキューターの外から実行された場合・既に待機中の場合(枠を二重に返却しない)
+            yield
+            return
+        slot.release()
+        slot.freed.set()
+        self.active_hosts -= 1
+        self.parked_hosts += 1
+        logger.info(f"ホストの待機中は実行枠を解放します: {request_id}/{computer_name}")
+        try:
+            yield
+        finally:
+            self.parked_hosts -= 1
+            self.active_hosts += 1
+            slot.reclaim()
+
+    def cancel(self, request_id: str, computer_name: Optional[str] = None) -> int:
+        """
+        リクエスト全体、または特定のコンピュータのジョブをキャンセルする
+
+        キュー待ちのジョブは取り出した時点で破棄し、実行中のジョブは中断する。
+
+        Args:
+            request_id (str): リクエストID
+            computer_name (Optional[str]): 対象コンピュータ名(省略時はリクエスト全体)
+
+        Returns:
+            int: 中断した実行中ジョブの数
+        """
+        self._prune_cancelled()
+        if computer_name is None:
+            self._cancelled_requests[request_id] = time.monotonic()
+            targets = [key for key in self._running if key[0] == request_id]
+        else:
+            self._cancelled_hosts[(request_id, computer_name)] = time.monotonic()
+            targets = [key for key in self._running if key == (request_id, computer_name)]
+        for key in targets:
+            self._running[key].cancel()
+        logger.info(f"キャンセルを受け付けました: {request_id}/{computer_name or '*'} (実行中 {len(targets)}台)")
+        return len(targets)
+
+    def _is_cancelled(self, key: Tuple[str, str]) -> bool:
+        return key[0] in self._cancelled_requests or key in self._cancelled_hosts
+
+    def _hold(self, request_id: str):
+        self._pending[request_id] = self._pending.get(request_id, 0) + 1
+
+    def _unhold(self, request_id: str):
+        count = self._pending.pop(request_id) - 1
+        if count:
+            self._pending[request_id] = count
+
+    def _prune_cancelled(self):
+        """待機中・実行中のジョブが無く、保持期間を過ぎたキャンセルの記録を破棄する"""
+        if not self._cancelled_requests and not self._cancelled_hosts:
+            return
+        expired = time.monotonic() - self.cancel_retention
+        live = {key[0] for key in self._running}
+        live.update(self._pending)
+
+        def idle(request_id: str, cancelled_at: float) -> bool:
+            return (
+                cancelled_at < expired
+                and request_id not in live
+                and not (self._queue is not None and self._queue.queue.queued(request_id))
+            )
+
+        for request_id, cancelled_at in list(self._cancelled_requests.items()):
+            if idle(request_id, cancelled_at):
+                del self._cancelled_requests[request_id]
+        for key, cancelled_at in list(self._cancelled_hosts.items()):
+            if idle(key[0], cancelled_at):
+                del self._cancelled_hosts[key]
+
+    def is_cancelled(self, request_id: str, computer_name: str) -> bool:
+        """ジョブが cancel で中断されたか(停止や実行期限超過による中断と区別する)"""
+        return self._is_cancelled((request_id, computer_name))
+
+    def interrupt(self, request_id: str, computer_name: str) -> bool:
+        """
+        実行中のジョブを未完了のまま中断する(ジョブは後で再開される)
+
+        ワーカーがジョブの占有を失った場合など、キャンセルではなく
+        他のプロセスに引き継がせたいときに使う。
+
+        Returns:
+            bool: 実行中のジョブを中断したか
+        """
+        key = (request_id, computer_name)
+        task = self._running.get(key)
+        if task is None:
+            return False
+        self._interrupted_hosts.add(key)
+        task.cancel()
+        return True
+
+    def is_interrupted(self, request_id: str, computer_name: str) -> bool:
+        """ジョブが停止処理または interrupt により未完了のまま中断されたか"""
+        return self.stopping or (request_id, computer_name) in self._interrupted_hosts
+
+    async def _run_job(self, job: HostJob):
+        try:
+            await asyncio.wait_for(self.host_runner(job), self.host_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"ホストの実行期限({int(self.host_timeout)}秒)を超過しました")
+
+    async def _worker(self, worker_id: int):
+        limiter = self.concurrency.limiter
+        while True:
+            # 同時実行ホスト数の枠を確保してからキューから取り出す
+            slot = HostSlot(limiter)
+            await limiter.acquire()
+            try:
+                job = await self._queue.get()
+                self._hold(job.request_id)
+                try:
+                    if limiter.in_use > limiter.limit:
+                        # 待機中に上限が下がった場合は、枠が空くまで実行を待たせる
+                        slot.release()
+                        await slot.acquire()
+                finally:
+                    self._unhold(job.request_id)
+                await self._process(job, slot)
+            finally:
+                if not slot.freed.is_set():
+                    slot.release()
+
+    async def _process(self, job: HostJob, slot: HostSlot):
+        """ジョブを開始し、完了するか待機に入って枠を返却するまで待つ"""
+        key = (job.request_id, getattr(job.computer_info, "computer_name", "?"))
+        if self._is_cancelled(key):
+            self._cancelled_hosts.pop(key, None)
+            self.cancelled_hosts += 1
+            self._prune_cancelled()
+            return
+        if key in self._running:
+            # 一時停止・再開で同じジョブが再投入され、キューに残っていた方が後から来た
+            logger.debug(f"実行中のホストのため読み飛ばします: {key[0]}/{key[1]}")
+            return
+
+        self.active_hosts += 1
+        task = asyncio.create_task(self._run_job(job))
+        self._running[key] = task
+        self._slots[key] = slot
+        supervisor = asyncio.create_task(self._supervise(key, task, slot))
+        self._supervisors.add(supervisor)
+        supervisor.add_done_callback(self._supervisors.discard)
+        try:
+            await slot.freed.wait()
+        except asyncio.CancelledError:
+            if not slot.freed.is_set():
+                supervisor.cancel()
+                await asyncio.gather(supervisor, return_exceptions=True)
+            raise
+
+    async def _supervise(self, key: Tuple[str, str], task: asyncio.Task, slot: HostSlot):
+        try:
+            # ジョブ自体のキャンセルで止まらないよう wait で完了を待つ
+            await asyncio.wait({task})
+            if task.cancelled():
+                self.cancelled_hosts += 1
+            elif task.exception() is not None:
+                raise task.exception()
+            else:
+                self.completed_hosts += 1
+        except asyncio.CancelledError:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            raise
+        except Exception as e:
+            self.failed_hosts += 1
+            logger.error(f"ホストジョブが失敗: {key[0]}/{key[1]}: {str(e)}")
+        finally:
+            self._running.pop(key, None)
+            self._slots.pop(key, None)
+            self._cancelled_hosts.pop(key, None)
+            self._interrupted_hosts.discard(key)
+            self._prune_cancelled()
+            self.active_hosts -= 1
+            self._completed_at.append(time.monotonic())
+            slot.release()
+            slot.freed.set()
+
+    def hosts_per_minute(self) -> float:
+        """直近の時間窓で処理を終えたホスト数を1分あたりに換算"""
+        now = time.monotonic()
+        while self._completed_at and now - self._completed_at[0] > THROUGHPUT_WINDOW:
+            self._completed_at.popleft()
+        return len(self._completed_at) * 60.0 / THROUGHPUT_WINDOW
+
+    def get_stats(self) -> Dict[str, Any]:
+        """実行状況の統計を取得"""
+        return {
+            "running": self.running,
+            "queued_hosts": self._queue.qsize() if self._queue else 0,
+            "queue_depth": self.queue_depth,
+            "active_hosts": self.active_hosts,
+            "parked_hosts": self.parked_hosts,
+            "tasks_in_flight": self.tasks_in_flight,
+            "completed_hosts": self.completed_hosts,
+            "failed_hosts": self.failed_hosts,
+            "cancelled_hosts": self.cancelled_hosts,
+            "cancellations_tracked": len(self._cancelled_requests) + len(self._cancelled_hosts),
+            "hosts_per_minute": self.hosts_per_minute(),
+            "max_concurrent_hosts": self.max_concurrent_hosts,
+            "concurrency": self.concurrency.get_stats(),
+            "max_concurrent_spawns": self.max_concurrent_spawns,
+            "max_tasks_per_host": self.max_tasks_per_host
+        }
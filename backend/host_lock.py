@@ -0,0 +1,203 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ロックのリース期間(秒)。保持者は期限内に renew しないとロックを失う
+HOST_LOCK_LEASE = float(os.getenv("HOST_LOCK_LEASE", "600"))
+HOST_LOCK_TOP_CONTENDED = 10  # 統計に含める競合の多いホスト数
+
+@dataclass
+class HostLease:
+    """1台のホストに対するロックの保持権"""
+    computer_name: str
+    owner: str
+    token: int
+    acquired_at: float
+    expires_at: float
+    expired: bool = False  # リース切れで他の待機者に引き渡された
+
+@dataclass
+class _Waiter:
+    future: asyncio.Future
+    computer_name: str
+    owner: str
+    lease_seconds: float
+    requested_at: float
+
+@dataclass
+class _HostLockState:
+    holder: Optional[HostLease] = None
+    waiters: Deque[_Waiter] = field(default_factory=deque)
+
+def _key(computer_name: str) -> str:
+    # Windows のコンピュータ名は大文字小文字を区別しない
+    return computer_name.strip().casefold()
+
+class HostLockManager:
+    """
+    コンピュータ名単位の排他ロック
+
+    - 同じホストを対象とする処理は到着順(FIFO)に1つずつ実行する
+    - 保持者がリース期間内に renew しなかった場合、ロックは次の待機者に引き渡される
+    - ロックはホスト毎に独立しており、別のホストの処理を待たせることはない
+    """
+
+    def __init__(self, lease_seconds: float = HOST_LOCK_LEASE):
+        self.lease_seconds = lease_seconds
+        self._locks: Dict[str, _HostLockState] = {}
+        self._tokens = itertools.count(1)
+        self._contention: Dict[str, int] = {}
+
+        self.acquisitions = 0
+        self.contended_acquisitions = 0
+        self.expired_leases = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def is_locked(self, computer_name: str) -> bool:
+        state = self._locks.get(_key(computer_name))
+        return state is not None and state.holder is not None
+
+    async def acquire(self, computer_name: str, owner: str, lease_seconds: Optional[float] = None) -> HostLease:
+        """
+        ホストのロックを取得する(他の保持者がいれば順番が来るまで待つ)
+
+        Args:
+            computer_name (str): コンピュータ名
+            owner (str): 保持者の識別子(ログ・統計用)
+            lease_seconds (Optional[float]): リース期間(秒)
+
+        Returns:
+            HostLease: 取得したロック
+        """
+        key = _key(computer_name)
+        lease_seconds = lease_seconds or self.lease_seconds
+        state = self._locks.setdefault(key, _HostLockState())
+        started = time.monotonic()
+
+        if state.holder is None and not state.waiters:
+            return self._grant(state, computer_name, owner, lease_seconds)
+
+        self._contention[key] = self._contention.get(key, 0) + 1
+        logger.info(f"ホスト {computer_name} のロック待ち: {owner}(保持者: {state.holder.owner if state.holder else '-'})")
+        future = asyncio.get_running_loop().create_future()
+        state.waiters.append(_Waiter(future, computer_name, owner, lease_seconds, started))
+        try:
+            while True:
+                holder = state.holder
+                timeout = None if holder is None else max(holder.expires_at - time.monotonic(), 0)
+                try:
+                    lease = await asyncio.wait_for(asyncio.shield(future), timeout)
+                    break
+                except asyncio.TimeoutError:
+                    # 保持者がリースを更新しないまま期限を過ぎた
+                    if state.holder is holder and holder is not None and time.monotonic() >= holder.expires_at:
+                        self._expire(key, state)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(future.result())
+            else:
+                future.cancel()
+                self._discard_waiter(key, state, future)
+            raise
+        return lease
+
+    def _grant(
+        self,
+        state: _HostLockState,
+        computer_name: str,
+        owner: str,
+        lease_seconds: float,
+        requested_at: Optional[float] = None
+    ) -> HostLease:
+        """ロックを割り当てる(requested_at は待機した場合の待機開始時刻)"""
+        now = time.monotonic()
+        lease = HostLease(computer_name, owner, next(self._tokens), now, now + lease_seconds)
+        state.holder = lease
+        self.acquisitions += 1
+        if requested_at is not None:
+            wait = now - requested_at
+            self.contended_acquisitions += 1
+            self.total_wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        return lease
+
+    def _grant_next(self, key: str, state: _HostLockState):
+        state.holder = None
+        while state.waiters:
+            waiter = state.waiters.popleft()
+            if waiter.future.done():
+                continue
+            lease = self._grant(state, waiter.computer_name, waiter.owner, waiter.lease_seconds, waiter.requested_at)
+            waiter.future.set_result(lease)
+            return
+        del self._locks[key]
+
+    def _discard_waiter(self, key: str, state: _HostLockState, future: asyncio.Future):
+        state.waiters = deque(w for w in state.waiters if w.future is not future)
+        if state.holder is None and not state.waiters:
+            self._locks.pop(key, None)
+
+    def _expire(self, key: str, state: _HostLockState):
+        holder = state.holder
+        holder.expired = True
+        self.expired_leases += 1
+        logger.warning(f"ホスト {holder.computer_name} のロックのリースが切れたため次の待機者に引き渡します: {holder.owner}")
+        self._grant_next(key, state)
+
+    def renew(self, lease: HostLease, lease_seconds: Optional[float] = None) -> bool:
+        """
+        リースを延長する(現在の期限より短くはしない)
+
+        Returns:
+            bool: 延長できたか(既にロックを失っている場合は False)
+        """
+        state = self._locks.get(_key(lease.computer_name))
+        if state is None or state.holder is not lease:
+            return False
+        lease.expires_at = max(lease.expires_at, time.monotonic() + (lease_seconds or self.lease_seconds))
+        return True
+
+    def release(self, lease: HostLease):
+        """ロックを解放して次の待機者に引き渡す(リース切れで失ったロックは何もしない)"""
+        key = _key(lease.computer_name)
+        state = self._locks.get(key)
+        if state is None or state.holder is not lease:
+            return
+        self._grant_next(key, state)
+
+    @asynccontextmanager
+    async def hold(self, computer_name: str, owner: str, lease_seconds: Optional[float] = None):
+        """ロックを取得し、ブロックを抜けるときに解放する"""
+        lease = await self.acquire(computer_name, owner, lease_seconds)
+        try:
+            yield lease
+        finally:
+            self.release(lease)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ロックの競合状況を取得"""
+        top: List[Tuple[str, int]] = sorted(
+            self._contention.items(), key=lambda item: item[1], reverse=True
+        )[:HOST_LOCK_TOP_CONTENDED]
+        return {
+            "locked_hosts": sum(1 for s in self._locks.values() if s.holder is not None),
+            "waiting": sum(len(s.waiters) for s in self._locks.values()),
+            "acquisitions": self.acquisitions,
+            "contended_acquisitions": self.contended_acquisitions,
+            "expired_leases": self.expired_leases,
+            "total_wait_seconds": self.total_wait_seconds,
+            "max_wait_seconds": self.max_wait_seconds,
+            "most_contended_hosts": [{"computer_name": k, "waits": v} for k, v in top]
+        }
+
+# アプリケーション全体で共有するホストロック
+host_locks = HostLockManager()
@@ -0,0 +1,185 @@
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from .models import ComputerInfoDB, HostStatusDB, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+# IPアドレスの重複も競合とみなすか(環境変数で上書き可能)
+HOST_CONFLICT_CHECK_IP = os.getenv("HOST_CONFLICT_CHECK_IP", "true").lower() == "true"
+# ジョブを別プロセスのワーカーが実行する場合に、索引をDBから作り直す間隔(秒)
+HOST_INDEX_REFRESH_INTERVAL = float(os.getenv("HOST_INDEX_REFRESH_INTERVAL", "10"))
+
+# 実行待ち・実行中のホストの状態
+ACTIVE_HOST_STATES = (TaskStatus.PENDING.value, TaskStatus.IN_PROGRESS.value)
+
+@dataclass
+class HostConflict:
+    """重複・競合が見つかったホスト"""
+    index: int             # 入力リスト内の位置
+    computer_name: str
+    field: str             # "computer_name" または "ip_address"
+    value: str
+    request_id: Optional[str] = None  # 競合する実行中リクエスト(入力内の重複は None)
+
+    @property
+    def message(self) -> str:
+        label = "ホスト名" if self.field == "computer_name" else "IPアドレス"
+        if self.request_id is None:
+            return f"{label} {self.value} が重複しています"
+        return f"{label} {self.value} は実行中のリクエスト {self.request_id} の対象です"
+
+def _name_key(computer_name: Optional[str]) -> str:
+    # Windows のコンピュータ名は大文字小文字を区別しない
+    return (computer_name or "").strip().casefold()
+
+def _ip_key(ip_address: Optional[str]) -> str:
+    return (ip_address or "").strip()
+
+class ActiveHostIndex:
+    """
+    実行待ち・実行中のリクエストに含まれるホストの索引
+
+    ホスト名と IP アドレスからリクエストIDを引けるようにしておくことで、
+    取り込みやリクエスト作成時の競合チェックを1台あたり O(1) で行う。
+    起動時に host_status から再構築し、作成・完了・キャンセル時に更新する。
+    """
+
+    def __init__(self, check_ip: bool = HOST_CONFLICT_CHECK_IP):
+        self.check_ip = check_ip
+        self._by_name: Dict[str, str] = {}
+        self._by_ip: Dict[str, str] = {}
+        self._hosts: Dict[str, Dict[str, str]] = {}  # request_id -> {名前キー: IPキー}
+
+    def checker(self, request_id: Optional[str] = None) -> "HostConflictChecker":
+        """1台ずつ競合をチェックするチェッカーを作成(取り込み処理のように逐次確認する場合に使う)"""
+        return HostConflictChecker(self, request_id)
+
+    def find_conflicts(self, computers: Iterable[Any], request_id: Optional[str] = None) -> List[HostConflict]:
+        """
+        入力内の重複と、実行中リクエストとの競合を検出する
+
+        Args:
+            computers (Iterable[Any]): computer_name と ip_address を持つオブジェクト
+            request_id (Optional[str]): 自身のリクエストID(自身との競合は無視する)
+
+        Returns:
+            List[HostConflict]: 見つかった重複・競合(1台につき最初の1件)
+        """
+        checker = self.checker(request_id)
+        return [conflict for conflict in map(checker.check, computers) if conflict is not None]
+
+    def reserve(self, request_id: str, computers: Iterable[Any]):
+        """リクエストのホストを索引に登録する(競合チェックは呼び出し元で行うこと)"""
+        hosts = self._hosts.setdefault(request_id, {})
+        for computer in computers:
+            name = _name_key(computer.computer_name)
+            ip = _ip_key(computer.ip_address)
+            hosts[name] = ip
+            self._by_name[name] = request_id
+            if ip:
+                self._by_ip[ip] = request_id
+
+    def release(self, request_id: str, computer_name: Optional[str] = None):
+        """
+        完了・キャンセルしたホストを索引から外す
+
+        Args:
+            request_id (str): リクエストID
+            computer_name (Optional[str]): コンピュータ名(省略時はリクエスト全体)
+        """
+        hosts = self._hosts.get(request_id)
+        if hosts is None:
+            return
+        names = list(hosts) if computer_name is None else [_name_key(computer_name)]
+        for name in names:
+            ip = hosts.pop(name, None)
+            if self._by_name.get(name) == request_id:
+                del self._by_name[name]
+            if ip and self._by_ip.get(ip) == request_id:
+                del self._by_ip[ip]
+        if not hosts:
+            del self._hosts[request_id]
+
+    def rebuild(self, db: Session) -> int:
+        """
+        host_status の実行待ち・実行中ホストから索引を作り直す
+
+        Returns:
+            int: 登録したホスト数
+        """
+        rows = db.query(
+            HostStatusDB.request_id,
+            HostStatusDB.computer_name,
+            ComputerInfoDB.ip_address
+        ).outerjoin(
+            ComputerInfoDB,
+            (ComputerInfoDB.request_id == HostStatusDB.request_id)
+            & (ComputerInfoDB.computer_name == HostStatusDB.computer_name)
+        ).filter(HostStatusDB.state.in_(ACTIVE_HOST_STATES)).all()
+
+        self._by_name.clear()
+        self._by_ip.clear()
+        self._hosts.clear()
+        for request_id, computer_name, ip_address in rows:
+            self.reserve(request_id, [_HostRow(computer_name, ip_address)])
+        logger.debug(f"実行中ホストの索引を再構築しました: {len(rows)}台")
+        return len(rows)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """索引の状態を取得"""
+        return {
+            "active_requests": len(self._hosts),
+            "active_hosts": len(self._by_name)
+        }
+
+class HostConflictChecker:
+    """入力内の重複と実行中リクエストとの競合を1台ずつ判定する"""
+
+    def __init__(self, index: ActiveHostIndex, request_id: Optional[str] = None):
+        self.index = index
+        self.request_id = request_id
+        self._seen_names: Set[str] = set()
+        self._seen_ips: Set[str] = set()
+        self._position = 0
+
+    def check(self, computer: Any) -> Optional[HostConflict]:
+        """
+        次の1台を判定する
+
+        Returns:
+            Optional[HostConflict]: 重複・競合(問題なければ None)
+        """
+        position = self._position
+        self._position += 1
+        name = _name_key(computer.computer_name)
+        ip = _ip_key(computer.ip_address) if self.index.check_ip else ""
+        by_name = self.index._by_name
+        by_ip = self.index._by_ip
+
+        conflict = None
+        if name in self._seen_names:
+            conflict = HostConflict(position, computer.computer_name, "computer_name", computer.computer_name)
+        elif ip and ip in self._seen_ips:
+            conflict = HostConflict(position, computer.computer_name, "ip_address", computer.ip_address)
+        elif by_name.get(name, self.request_id) != self.request_id:
+            conflict = HostConflict(position, computer.computer_name, "computer_name", computer.computer_name, by_name[name])
+        elif ip and by_ip.get(ip, self.request_id) != self.request_id:
+            conflict = HostConflict(position, computer.computer_name, "ip_address", computer.ip_address, by_ip[ip])
+
+        self._seen_names.add(name)
+        if ip:
+            self._seen_ips.add(ip)
+        return conflict
+
+@dataclass
+class _HostRow:
+    computer_name: str
+    ip_address: Optional[str]
+
+# アプリケーション全体で共有する実行中ホストの索引
+active_hosts = ActiveHostIndex()
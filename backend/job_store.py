@@ -0,0 +1,511 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import DateTime, Float, String, case, func, insert, literal, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, selectinload
+
+from .executor import HostJob
+from .dispatcher import FAIR_SHARE_WEIGHTS
+from .models import (
+    HostJobDB, JobStepDB, JobLeaseDB, ComputerInfoDB, SetupRequestDB,
+    ComputerInfo, SetupOptions, PCSetupStatus, TaskStatus
+)
+
+logger = logging.getLogger(__name__)
+
+# ジョブの実行方式(環境変数で上書き可能)
+#   api    : APIサーバーのプロセス内で実行する(既定)
+#   worker : APIサーバーは登録のみ行い、python -m backend.worker がDBから取得して実行する
+JOB_EXECUTION_MODE = os.getenv("JOB_EXECUTION_MODE", "api")
+# ワーカーがジョブを占有する期間(秒)。期限内にハートビートが無ければ他のワーカーが引き継ぐ
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+# 再起動時に再開するジョブの状態
+UNFINISHED_JOB_STATES = (TaskStatus.PENDING.value, TaskStatus.IN_PROGRESS.value)
+# 受付制御で待機させているジョブの状態(実行枠が空くまでキューにもワーカーにも渡さない)
+PARKED_JOB_STATE = "parked"
+# 段階展開で、自分のウェーブの開始(または一時停止の解除)を待っているジョブの状態
+HELD_JOB_STATE = "held"
+# 終了していないジョブの状態(待機中を含む)
+OPEN_JOB_STATES = UNFINISHED_JOB_STATES + (PARKED_JOB_STATE, HELD_JOB_STATE)
+
+# 占有の候補として順位付けする件数(取得する件数に対する倍率)
+CLAIM_CANDIDATE_FACTOR = 2
+
+# ジョブを開始した時点で実行中に切り替えるリクエストの状態
+STARTABLE_REQUEST_STATES = ("Pending", PCSetupStatus.PENDING.value, PCSetupStatus.APPROVED.value)
+
+def insert_host_jobs(
+    db: Session,
+    request_id: str,
+    computers: Sequence[ComputerInfo],
+    computer_ids: Sequence[int],
+    requester: Optional[str] = None,
+    priority: int = 0,
+    state: str = TaskStatus.PENDING.value,
+    estimated_seconds: Optional[Sequence[Optional[float]]] = None,
+    waves: Optional[Sequence[Optional[int]]] = None,
+    unreachable: Optional[Dict[str, str]] = None
+) -> List[int]:
+    """
+    対象PC毎のジョブを登録する(コミットは呼び出し元で行う)
+
+    Args:
+        state (str): 初期状態(受付制御で待機させる場合は PARKED_JOB_STATE)
+        estimated_seconds (Optional[Sequence[Optional[float]]]): PC毎の推定所要時間(秒)
+        waves (Optional[Sequence[Optional[int]]]): PC毎の段階展開のウェーブ番号(1 以降のウェーブは HELD_JOB_STATE で登録する)
+        unreachable (Optional[Dict[str, str]]): 事前確認で到達できなかったPC名と理由(失敗として登録する)
+
+    Returns:
+        List[int]: 登録したジョブの id(computers と同じ順序)
+    """
+    unreachable = unreachable or {}
+    now = datetime.now()
+    rows = []
+    for index, (computer, computer_id) in enumerate(zip(computers, computer_ids)):
+        error = unreachable.get(computer.computer_name)
+        if error is not None:
+            job_state = TaskStatus.FAILED.value
+        elif waves and waves[index]:
+            job_state = HELD_JOB_STATE
+        else:
+            job_state = state
+        rows.append({
+            "request_id": request_id,
+            "computer_id": computer_id,
+            "computer_name": computer.computer_name,
+            "requester": requester,
+            "priority": priority,
+            "state": job_state,
+            "attempts": 0,
+            "estimated_seconds": estimated_seconds[index] if estimated_seconds else None,
+            "wave": waves[index] if waves else None,
+            "error": error,
+            "finished_at": now if error is not None else None
+        })
+    if not rows:
+        return []
+    return list(db.execute(
+        insert(HostJobDB).returning(HostJobDB.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all())
+
+def start_host_job(db: Session, job_id: int) -> bool:
+    """
+    ジョブを実行中にする(リクエストも未着手であれば実行中にする)
+
+    Returns:
+        bool: 開始できたか(キューで待っている間にキャンセル・一時停止されたジョブは False)
+    """
+    now = datetime.now()
+    job = db.get(HostJobDB, job_id)
+    if job is None or job.state not in UNFINISHED_JOB_STATES:
+        return False
+    job.state = TaskStatus.IN_PROGRESS.value
+    job.attempts = (job.attempts or 0) + 1
+    job.started_at = job.started_at or now
+    job.updated_at = now
+    db.query(SetupRequestDB).filter(
+        SetupRequestDB.request_id == job.request_id,
+        SetupRequestDB.status.in_(STARTABLE_REQUEST_STATES)
+    ).update({"status": PCSetupStatus.IN_PROGRESS.value}, synchronize_session=False)
+    db.commit()
+    return True
+
+def checkpoint_step(
+    db: Session,
+    job_id: int,
+    task_id: str,
+    started_at: Optional[datetime] = None,
+    finished_at: Optional[datetime] = None,
+    duration: Optional[int] = None
+):
+    """
+    タスクの完了を記録する(コミットは呼び出し元で行う)
+
+    再開時はここで記録されたタスクを実行済みとして飛ばす。
+    """
+    values = {
+        "job_id": job_id,
+        "task_id": task_id,
+        "state": TaskStatus.COMPLETED.value,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "duration": duration
+    }
+    stmt = sqlite_insert(JobStepDB).values(**values)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[JobStepDB.job_id, JobStepDB.task_id],
+        set_={k: stmt.excluded[k] for k in ("state", "started_at", "finished_at", "duration")}
+    ))
+    db.execute(
+        HostJobDB.__table__.update()
+        .where(HostJobDB.id == job_id)
+        .values(updated_at=finished_at or datetime.now())
+    )
+
+def finish_host_job(db: Session, job_id: int, state: str, error: Optional[str] = None) -> List[int]:
+    """
+    ジョブの最終状態を記録し、全ジョブが終わったリクエストの状態を確定する
+
+    段階展開のジョブは同じトランザクションでウェーブの集計に加える。
+
+    Returns:
+        List[int]: 次のウェーブとして実行待ちにしたジョブの id
+    """
+    now = datetime.now()
+    job = db.get(HostJobDB, job_id)
+    if job is None:
+        return []
+    released: List[int] = []
+    if job.state in UNFINISHED_JOB_STATES:
+        job.state = state
+        job.error = error
+        job.finished_at = now
+        job.updated_at = now
+        # SessionLocal は autoflush しないため、集計の前に反映する
+        db.flush()
+        if job.wave is not None:
+            from .rollout import record_wave_result
+            released = record_wave_result(db, job.request_id, job.wave, state)
+    refresh_request_status(db, job.request_id)
+    db.commit()
+    return released
+
+def cancel_host_jobs(db: Session, request_id: str, computer_name: Optional[str] = None) -> int:
+    """
+    未完了のジョブをキャンセル扱いにする(コミットは呼び出し元で行う)
+
+    Returns:
+        int: キャンセルしたジョブ数
+    """
+    jobs = db.query(HostJobDB).filter(
+        HostJobDB.request_id == request_id,
+        HostJobDB.state.in_(OPEN_JOB_STATES)
+    )
+    if computer_name is not None:
+        jobs = jobs.filter(HostJobDB.computer_name == computer_name)
+    now = datetime.now()
+    return jobs.update({
+        "state": TaskStatus.CANCELLED.value,
+        "finished_at": now,
+        "updated_at": now
+    }, synchronize_session=False)
+
+def refresh_request_status(db: Session, request_id: str) -> Optional[str]:
+    """
+    全ジョブが終了していればリクエストの状態を確定する(コミットは呼び出し元で行う)
+
+    Returns:
+        Optional[str]: 確定した状態(未完了のジョブが残っている場合は None)
+    """
+    counts: Dict[str, int] = dict(
+        db.query(HostJobDB.state, func.count())
+        .filter(HostJobDB.request_id == request_id)
+        .group_by(HostJobDB.state)
+        .all()
+    )
+    total = sum(counts.values())
+    if total == 0 or any(counts.get(state) for state in OPEN_JOB_STATES):
+        return None
+
+    completed = counts.get(TaskStatus.COMPLETED.value, 0)
+    if completed == total:
+        status = PCSetupStatus.COMPLETED.value
+    elif counts.get(TaskStatus.CANCELLED.value, 0) == total:
+        status = PCSetupStatus.CANCELLED.value
+    elif completed == 0:
+        status = PCSetupStatus.FAILED.value
+    else:
+        status = PCSetupStatus.PARTIALLY_FAILED.value
+
+    db.query(SetupRequestDB).filter(
+        SetupRequestDB.request_id == request_id,
+        SetupRequestDB.status != PCSetupStatus.CANCELLED.value
+    ).update({
+        "status": status,
+        "progress_version": func.coalesce(SetupRequestDB.progress_version, 0) + 1
+    }, synchronize_session=False)
+    return status
+
+def load_unfinished_jobs(db: Session) -> List[HostJob]:
+    """
+    未完了のジョブを、完了済みのタスクと合わせて投入順に読み込む
+
+    バックエンドの停止で中断したジョブは、最後に完了したタスクの次から再開される。
+
+    Returns:
+        List[HostJob]: 再投入するジョブ
+    """
+    jobs = _job_query(db).filter(HostJobDB.state.in_(UNFINISHED_JOB_STATES)).order_by(HostJobDB.id).all()
+    if not jobs:
+        return []
+    steps = db.query(JobStepDB.job_id, JobStepDB.task_id).join(
+        HostJobDB, HostJobDB.id == JobStepDB.job_id
+    ).filter(
+        HostJobDB.state.in_(UNFINISHED_JOB_STATES),
+        JobStepDB.state == TaskStatus.COMPLETED.value
+    )
+    result = _to_host_jobs(jobs, steps)
+    logger.info(
+        f"未完了のジョブを読み込みました: {len(result)}台"
+        f"(うち途中から再開 {sum(1 for job in result if job.completed_steps)}台)"
+    )
+    return result
+
+def load_jobs(db: Session, job_ids: Sequence[int]) -> List[HostJob]:
+    """指定したジョブを、完了済みのタスクと合わせて読み込む"""
+    if not job_ids:
+        return []
+    jobs = _job_query(db).filter(HostJobDB.id.in_(job_ids)).order_by(HostJobDB.id).all()
+    steps = db.query(JobStepDB.job_id, JobStepDB.task_id).filter(
+        JobStepDB.job_id.in_(job_ids),
+        JobStepDB.state == TaskStatus.COMPLETED.value
+    )
+    return _to_host_jobs(jobs, steps)
+
+def _job_query(db: Session):
+    return db.query(HostJobDB).options(
+        selectinload(HostJobDB.computer).selectinload(ComputerInfoDB.setup_options),
+        selectinload(HostJobDB.request).selectinload(SetupRequestDB.setup_options)
+    )
+
+def _to_host_jobs(jobs: Sequence[HostJobDB], steps: Iterable[Tuple[int, str]]) -> List[HostJob]:
+    completed: Dict[int, Set[str]] = {}
+    for job_id, task_id in steps:
+        completed.setdefault(job_id, set()).add(task_id)
+
+    result = []
+    for job in jobs:
+        if job.computer is None:
+            logger.warning(f"対象PCが見つからないジョブを読み飛ばします: {job.id}")
+            continue
+        options_row = job.computer.setup_options or job.request.setup_options
+        setup_options = (
+            SetupOptions.model_validate(options_row, from_attributes=True)
+            if options_row is not None else SetupOptions()
+        )
+        result.append(HostJob(
+            request_id=job.request_id,
+            computer_info=ComputerInfo.model_validate(job.computer, from_attributes=True),
+            setup_options=setup_options,
+            requester=job.requester,
+            priority=job.priority or 0,
+            job_id=job.id,
+            completed_steps=completed.get(job.id, set()),
+            estimated_seconds=job.estimated_seconds
+        ))
+    return result
+
+def claim_jobs(
+    db: Session,
+    worker_id: str,
+    limit: int,
+    lease_seconds: float = JOB_LEASE_SECONDS,
+    weights: Optional[Dict[str, float]] = None,
+    release: Sequence[int] = ()
+) -> List[int]:
+    """
+    未完了のジョブを優先度順・申請者間で公平に最大 limit 件占有する
+
+    候補の順位付け(未完了のジョブ全体を走査する)は書き込みの前に読み取りだけで行い、
+    占有は上位の候補に対する1つの INSERT ... SELECT ... ON CONFLICT 文で行う。
+    この文の中で占有の条件を確かめ直すため、複数のワーカーが同時に実行しても
+    同じジョブを二重に取得することはなく、SQLite の書き込みロックを持つのは候補の件数分だけで済む。
+    期限切れの占有(停止・異常終了したワーカーのもの)は上書きして引き継ぐ。別のジョブで
+    占有中のホストは対象外とし、同じPCを2台のワーカーが同時に操作しないようにする。
+
+    同じ優先度のジョブは、申請者毎の順番(row_number)を重みで割った値の小さい順に取るため、
+    大きなリクエストが先に投入されていても他の申請者のジョブが同じ取得回で選ばれる。
+    リクエスト内では推定所要時間の長いジョブから取る。
+
+    Args:
+        db (Session): セッション
+        worker_id (str): ワーカーの識別子
+        limit (int): 取得する最大件数
+        lease_seconds (float): 占有期間(秒)
+        weights (Optional[Dict[str, float]]): 申請者毎の重み(省略時は FAIR_SHARE_WEIGHTS)
+        release (Sequence[int]): 同じトランザクションで解除する占有(終わったジョブの id)
+
+    Returns:
+        List[int]: 占有したジョブの id
+    """
+    now = datetime.now()
+    expires_at = now + timedelta(seconds=lease_seconds)
+    host_key = func.lower(HostJobDB.computer_name)
+
+    leased = select(JobLeaseDB.job_id).where(
+        JobLeaseDB.job_id == HostJobDB.id,
+        JobLeaseDB.expires_at > now
+    ).exists()
+    host_busy = select(JobLeaseDB.job_id).where(
+        JobLeaseDB.computer_name == host_key,
+        JobLeaseDB.job_id != HostJobDB.id,
+        JobLeaseDB.expires_at > now
+    ).exists()
+    claimable = (HostJobDB.state.in_(UNFINISHED_JOB_STATES), ~leased, ~host_busy)
+
+    ranked: List[int] = []
+    if limit > 0:
+        unclaimed = select(
+            HostJobDB.id.label("job_id"),
+            host_key.label("host"),
+            HostJobDB.priority.label("priority"),
+            HostJobDB.requester.label("requester"),
+            func.coalesce(HostJobDB.estimated_seconds, 0.0).label("estimated_seconds"),
+            # リクエストの投入順(リクエスト内の最小の id)
+            func.min(HostJobDB.id).over(partition_by=HostJobDB.request_id).label("request_order")
+        ).where(*claimable).subquery()
+        weights = FAIR_SHARE_WEIGHTS if weights is None else weights
+        weight = case(
+            {name: float(value) for name, value in weights.items()},
+            value=unclaimed.c.requester,
+            else_=1.0
+        ) if weights else literal(1.0, Float)
+        # 申請者内ではリクエストの投入順、リクエスト内では推定所要時間の長い順に取る
+        eligible = select(
+            unclaimed.c.job_id,
+            unclaimed.c.host,
+            unclaimed.c.priority,
+            (func.row_number().over(
+                partition_by=(unclaimed.c.priority, unclaimed.c.requester),
+                order_by=(unclaimed.c.request_order, unclaimed.c.estimated_seconds.desc(), unclaimed.c.job_id)
+            ) / weight).label("share")
+        ).subquery()
+        # 他のワーカーに先に取られる分を見込んで多めに候補を取る
+        # (最初の書き込みより前の SELECT はトランザクションを開始しないため、書き込みロックを持たない)
+        # 1回の占有で同じホストのジョブを2件取らないよう、ホスト毎に最上位の候補だけを残す
+        # (INSERT ... SELECT の中では、同じ文で追加した占有は host_busy に見えない)
+        hosts: Set[str] = set()
+        for job_id, host in db.execute(
+            select(eligible.c.job_id, eligible.c.host)
+            .order_by(eligible.c.priority.desc(), eligible.c.share, eligible.c.job_id)
+            .limit(limit * CLAIM_CANDIDATE_FACTOR)
+        ):
+            if host not in hosts:
+                hosts.add(host)
+                ranked.append(job_id)
+
+    if release:
+        db.query(JobLeaseDB).filter(
+            JobLeaseDB.worker_id == worker_id,
+            JobLeaseDB.job_id.in_(release)
+        ).delete(synchronize_session=False)
+    if not ranked:
+        db.commit()
+        return []
+
+    candidates = select(
+        HostJobDB.id,
+        literal(worker_id, String),
+        host_key,
+        literal(now, DateTime),
+        literal(now, DateTime),
+        literal(expires_at, DateTime)
+    ).where(
+        HostJobDB.id.in_(ranked),
+        *claimable
+    ).order_by(
+        case({job_id: rank for rank, job_id in enumerate(ranked)}, value=HostJobDB.id)
+    ).limit(limit)
+
+    stmt = sqlite_insert(JobLeaseDB).from_select(
+        ["job_id", "worker_id", "computer_name", "claimed_at", "heartbeat_at", "expires_at"],
+        candidates
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[JobLeaseDB.job_id],
+        set_={k: stmt.excluded[k] for k in ("worker_id", "claimed_at", "heartbeat_at", "expires_at")},
+        where=JobLeaseDB.expires_at <= now
+    ).returning(JobLeaseDB.job_id)
+    job_ids = list(db.execute(stmt).scalars().all())
+    db.commit()
+    return job_ids
+
+def renew_leases(
+    db: Session,
+    worker_id: str,
+    job_ids: Sequence[int],
+    lease_seconds: float = JOB_LEASE_SECONDS
+) -> Tuple[Set[int], Set[int]]:
+    """
+    ハートビート: 占有中のジョブの期限を延長する
+
+    Returns:
+        Tuple[Set[int], Set[int]]: 延長できたジョブと、キャンセルされたジョブの id
+        (延長できなかったジョブは他のワーカーに引き継がれている)
+    """
+    if not job_ids:
+        return set(), set()
+    now = datetime.now()
+    renewed = set(db.execute(
+        JobLeaseDB.__table__.update()
+        .where(JobLeaseDB.worker_id == worker_id, JobLeaseDB.job_id.in_(job_ids))
+        .values(heartbeat_at=now, expires_at=now + timedelta(seconds=lease_seconds))
+        .returning(JobLeaseDB.job_id)
+    ).scalars().all())
+    cancelled = set(db.execute(
+        select(HostJobDB.id).where(
+            HostJobDB.id.in_(job_ids),
+            HostJobDB.state == TaskStatus.CANCELLED.value
+        )
+    ).scalars().all())
+    db.commit()
+    return renewed, cancelled
+
+def expedite_jobs(db: Session, request_id: str, priority: int) -> int:
+    """
+    リクエストと未完了のジョブの優先度を変更する(コミットは呼び出し元で行う)
+
+    Returns:
+        int: 変更した未完了のジョブ数
+    """
+    db.query(SetupRequestDB).filter(
+        SetupRequestDB.request_id == request_id
+    ).update({"priority": priority}, synchronize_session=False)
+    return db.query(HostJobDB).filter(
+        HostJobDB.request_id == request_id,
+        HostJobDB.state.in_(OPEN_JOB_STATES)
+    ).update({"priority": priority}, synchronize_session=False)
+
+def queue_wait_stats(db: Session, request_id: str) -> Dict[str, Any]:
+    """
+    リクエストのジョブの待ち時間(登録から最初の開始まで)を集計する
+
+    Returns:
+        Dict[str, Any]: 待機中・開始済みのジョブ数と待ち時間(秒)
+    """
+    rows = db.query(HostJobDB.state, HostJobDB.created_at, HostJobDB.started_at).filter(
+        HostJobDB.request_id == request_id
+    ).all()
+    now = datetime.now()
+    waits = sorted(
+        ((started_at or now) - created_at).total_seconds()
+        for _, created_at, started_at in rows if created_at is not None
+    )
+    started = sum(1 for _, _, started_at in rows if started_at is not None)
+    return {
+        "jobs": len(rows),
+        "waiting": len(rows) - started,
+        "started": started,
+        "avg_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+        "p50_wait_seconds": waits[len(waits) // 2] if waits else 0.0,
+        "max_wait_seconds": waits[-1] if waits else 0.0
+    }
+
+def release_leases(db: Session, worker_id: str, job_ids: Optional[Sequence[int]] = None) -> int:
+    """
+    占有を解除する(job_ids 省略時はワーカーの全占有)
+
+    Returns:
+        int: 解除した件数
+    """
+    query = db.query(JobLeaseDB).filter(JobLeaseDB.worker_id == worker_id)
+    if job_ids is not None:
+        query = query.filter(JobLeaseDB.job_id.in_(job_ids))
+    count = query.delete(synchronize_session=False)
+    db.commit()
+    return count
@@ -1,24 +1,215 @@
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Response, UploadFile, File
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from typing import List, Optional, Dict
-from datetime import datetime
+from typing import Any, List, Optional, Dict, Set
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import chain
 import asyncio
 import logging
-from logging.config import dictConfig
 import json
+import time
 
-from .database import get_db
-from .models import SetupRequestDB, SetupProgressDB, ComputerInfoDB, SetupOptionsDB
+from .database import run_in_session
+from .models import (
+    SetupRequestDB, SetupProgressDB, TaskLogDB, HostStatusDB,
+    ComputerInfo, SetupOptions, BulkSetupRequest, ConcurrencySettings, RolloutSettings,
+    HostStatus, TaskStatus, PCSetupStatus
+)
 from .auth import get_current_active_user
 from .utils import generate_request_id
-from .logging_config import logging_config
+from .executor import FleetExecutor, HostJob
+from .runner_pool import runner_pool
+from .winrm_client import winrm_pool
+from .progress_writer import progress_writer, ProgressEvent
+from .progress_broker import progress_broker, format_sse, ProgressTailer, PROGRESS_STREAM_KEEPALIVE
+from .retry_policy import retry_policy, get_task_timeout, classify_task_failure
+from .errors import SetupError, TaskTimeoutError
+from .task_graph import TaskGraph, TaskNode, ExclusiveGate
+from .request_store import insert_setup_request
+from .host_registry import active_hosts, ACTIVE_HOST_STATES, HOST_INDEX_REFRESH_INTERVAL
+from .host_lock import host_locks, HostLease
+from .job_store import (
+    start_host_job, finish_host_job, checkpoint_step, cancel_host_jobs,
+    refresh_request_status, load_unfinished_jobs, load_jobs, expedite_jobs, queue_wait_stats,
+    JOB_EXECUTION_MODE, PARKED_JOB_STATE
+)
+from .admission import (
+    admission, AdmissionDecision, load_backlog,
+    ADMIT, PARK, REJECT, ADMISSION_CHECK_INTERVAL
+)
+from .duration_stats import duration_stats, estimate_request_minutes, DURATION_STATS_REFRESH_INTERVAL
+from .rollout import (
+    plan_waves, create_rollout, pause_rollout, resume_rollout, advance_if_drained, rollout_status
+)
+from .preflight import preflight, probe_result_record
+from .reboot_watcher import reboot_watcher, is_rebooting, REBOOT_PARK_TIMEOUT
+from .dispatcher import DEFAULT_PRIORITY, MIN_PRIORITY, MAX_PRIORITY, EXPEDITE_PRIORITY
+from .csv_import import iter_import_json, CsvFormatError
+from .request_list import (
+    RequestListFilter, query_request_page, serialize_request, parse_fields,
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+)
+from . import logging_config  # インポート時にロギング設定が適用される
 
-# ロギング設定
-dictConfig(logging_config)
 logger = logging.getLogger("backend")
 
 app = FastAPI(title="PC Setup Automation System")
 
+# HOST_TIMEOUT を超えて打ち切ったホストのエラー(キャンセルとは区別して失敗として記録する)
+HOST_TIMEOUT_MESSAGE = "ホストの実行期限を超過しました"
+
+async def run_host_job(job: HostJob):
+    """フリートエグゼキューターから1台分のセットアップを実行"""
+    computer_name = job.computer_info.computer_name
+    state, error = TaskStatus.FAILED.value, None
+    try:
+        if job.job_id is not None and not await run_in_session(partial(start_host_job, job_id=job.job_id)):
+            # キューで待っている間にキャンセル・一時停止されたジョブは実行しない
+            state = None
+            return
+        await execute_setup_tasks(
+            job.request_id,
+            job.computer_info,
+            job.setup_options,
+            job_id=job.job_id,
+            completed_steps=job.completed_steps
+        )
+        state = TaskStatus.COMPLETED.value
+    except asyncio.CancelledError:
+        if fleet_executor.is_interrupted(job.request_id, computer_name):
+            # 停止・占有の喪失による中断は未完了のまま残し、後で再開する
+            state = None
+        elif fleet_executor.is_cancelled(job.request_id, computer_name):
+            state = TaskStatus.CANCELLED.value
+        else:
+            error = HOST_TIMEOUT_MESSAGE
+        raise
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        if state is not None:
+            # 成否に関わらず、このホストは別のリクエストの対象にできる
+            active_hosts.release(job.request_id, computer_name)
+            if job.job_id is not None:
+                released = await asyncio.shield(run_in_session(partial(
+                    finish_host_job, job_id=job.job_id, state=state, error=error
+                )))
+                if released:
+                    # 段階展開の次のウェーブ(投入はこのホストの実行枠を待たずに行う)
+                    spawn_background(submit_released_jobs(released))
+
+fleet_executor = FleetExecutor(host_runner=run_host_job)
+
+# 実行中のバックグラウンド処理(完了まで参照を保持する)
+background_jobs: Set[asyncio.Task] = set()
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    background_jobs.add(task)
+    task.add_done_callback(background_jobs.discard)
+
+async def submit_released_jobs(job_ids: List[int]):
+    """実行待ちに戻したジョブをフリートエグゼキューターに投入する"""
+    if not job_ids or JOB_EXECUTION_MODE != "api":
+        # ワーカー実行時は、実行待ちになったジョブをワーカーが占有する
+        return
+    try:
+        jobs = await run_in_session(partial(load_jobs, job_ids=job_ids), read_only=True)
+        await fleet_executor.submit_jobs(jobs)
+    except Exception as e:
+        logger.error(f"ジョブの投入に失敗: {str(e)}")
+
+async def resume_unfinished_jobs():
+    """前回の停止時に未完了だったジョブを、完了済みのタスクを飛ばして再投入する"""
+    jobs = await run_in_session(load_unfinished_jobs, read_only=True)
+    for job in jobs:
+        active_hosts.reserve(job.request_id, [job.computer_info])
+    await fleet_executor.submit_jobs(jobs)
+
+PROGRESS_TAIL_BATCH = 5000  # 1回に読み取る進捗ログの最大件数
+
+async def fetch_progress_after(last_id: Optional[int]) -> List[Dict[str, Any]]:
+    """id が last_id より大きい進捗ログを読む(None の場合は最新の1件)"""
+    def load(db: Session):
+        query = db.query(SetupProgressDB)
+        if last_id is None:
+            rows = query.order_by(SetupProgressDB.id.desc()).limit(1).all()
+        else:
+            rows = query.filter(SetupProgressDB.id > last_id).order_by(SetupProgressDB.id).limit(PROGRESS_TAIL_BATCH).all()
+        return [progress_log_record(row) for row in rows]
+    return await run_in_session(load, read_only=True)
+
+# ワーカーが書き込んだ進捗をストリームに流す(JOB_EXECUTION_MODE=worker の場合のみ使う)
+progress_tailer = ProgressTailer(progress_broker, fetch_progress_after)
+
+async def refresh_active_hosts():
+    """ワーカーが完了させたホストを索引から外すため、定期的にDBから作り直す"""
+    while True:
+        await asyncio.sleep(HOST_INDEX_REFRESH_INTERVAL)
+        try:
+            await run_in_session(active_hosts.rebuild, read_only=True)
+        except Exception as e:
+            logger.error(f"実行中ホストの索引の再構築に失敗: {str(e)}")
+
+async def release_parked_requests():
+    """受付制御で待機中のリクエストを、実行枠に空きが出た分だけ実行待ちにする"""
+    while True:
+        await asyncio.sleep(ADMISSION_CHECK_INTERVAL)
+        try:
+            released = await run_in_session(admission.release_parked)
+            for request_id, job_ids in released.items():
+                logger.info(f"待機中のリクエスト {request_id} の実行を開始します: {len(job_ids)}台")
+                await submit_released_jobs(job_ids)
+        except Exception as e:
+            logger.error(f"待機中のリクエストの解放に失敗: {str(e)}")
+
+async def refresh_duration_stats():
+    """完了したタスクの所要時間を定期的に統計に取り込む(ワーカーが実行した分を含む)"""
+    while True:
+        await asyncio.sleep(DURATION_STATS_REFRESH_INTERVAL)
+        try:
+            await run_in_session(duration_stats.ingest, read_only=True)
+        except Exception as e:
+            logger.error(f"タスクの所要時間の取り込みに失敗: {str(e)}")
+
+@app.on_event("startup")
+async def start_fleet_executor():
+    hosts = await run_in_session(active_hosts.rebuild, read_only=True)
+    logger.info(f"実行中ホストの索引を構築しました: {hosts}台")
+    samples = await run_in_session(duration_stats.ingest, read_only=True)
+    logger.info(f"過去のタスクの所要時間を読み込みました: {samples}件")
+    await progress_writer.start()
+    app.state.background_tasks = [
+        asyncio.create_task(release_parked_requests()),
+        asyncio.create_task(refresh_duration_stats())
+    ]
+    if JOB_EXECUTION_MODE == "worker":
+        # ジョブは python -m backend.worker が実行する
+        await progress_tailer.start()
+        app.state.background_tasks.append(asyncio.create_task(refresh_active_hosts()))
+        logger.info("ジョブはワーカーで実行します(JOB_EXECUTION_MODE=worker)")
+        return
+    await runner_pool.start()
+    await winrm_pool.start()
+    await fleet_executor.start()
+    # キューが満杯の間 submit は待機するため、起動処理を止めないよう別タスクで投入する
+    app.state.background_tasks.append(asyncio.create_task(resume_unfinished_jobs()))
+
+@app.on_event("shutdown")
+async def stop_fleet_executor():
+    for task in getattr(app.state, "background_tasks", []):
+        task.cancel()
+    await progress_tailer.stop()
+    await fleet_executor.stop()
+    await runner_pool.stop()
+    await winrm_pool.stop()
+    # 未書き込みの進捗を確実に保存する
+    await progress_writer.stop()
+
 def log_progress(
     request_id: str,
     computer_name: str,
@@ -28,12 +219,10 @@ def log_progress(
     progress_value: float,
     start_time: Optional[datetime] = None,
     end_time: Optional[datetime] = None,
-    duration: Optional[int] = None,
-    db: Session = Depends(get_db)
+    duration: Optional[int] = None
 ):
-    """進捗状況をログに記録"""
-    # 進捗ログを作成
-    progress_log = SetupProgressDB(
+    """進捗状況をログに記録(書き込みは progress_writer がまとめて行う)"""
+    progress_writer.write(ProgressEvent(
         request_id=request_id,
         computer_name=computer_name,
         task_name=task,
@@ -43,38 +232,49 @@ def log_progress(
         start_time=start_time,
         end_time=end_time,
         duration=duration
-    )
-    
-    # リクエストの進捗状況を更新
-    request = db.query(SetupRequestDB).filter(
-        SetupRequestDB.request_id == request_id
-    ).first()
-    
-    if request:
-        if not request.current_progress:
-            request.current_progress = {}
-        request.current_progress[computer_name] = progress_value
-        
-        # 所要時間の更新
-        if duration and status in ["Completed", "Failed"]:
-            if not request.actual_time:
-                request.actual_time = 0
-            request.actual_time += duration
-    
-    db.add(progress_log)
-    db.commit()
+    ))
 
 async def execute_setup_tasks(
     request_id: str,
-    computer_info: ComputerInfoDB,
-    setup_options: SetupOptionsDB,
-    db: Session
+    computer_info: ComputerInfo,
+    setup_options: SetupOptions,
+    job_id: Optional[int] = None,
+    completed_steps: Optional[Set[str]] = None
+):
+    """
+    セットアップタスクを実行(ホストのロックを保持している間だけ操作する)
+
+    Args:
+        request_id (str): リクエストID
+        computer_info (ComputerInfo): 対象コンピュータ
+        setup_options (SetupOptions): セットアップオプション
+        job_id (Optional[int]): チェックポイントを記録するジョブの id
+        completed_steps (Optional[Set[str]]): 前回までに完了したタスク(再開時は実行しない)
+    """
+    # 別のリクエストが同じホストを操作中(再起動中など)であれば、終わるまで待つ
+    async with host_locks.hold(computer_info.computer_name, owner=request_id) as host_lease:
+        await _execute_setup_tasks_locked(
+            request_id, computer_info, setup_options, host_lease, job_id, completed_steps or set()
+        )
+
+async def _execute_setup_tasks_locked(
+    request_id: str,
+    computer_info: ComputerInfo,
+    setup_options: SetupOptions,
+    host_lease: HostLease,
+    job_id: Optional[int],
+    completed_steps: Set[str]
 ):
-    """セットアップタスクを実行"""
+    completed_tasks = 0
+    total_tasks = 1
     try:
         start_time = datetime.now()
-        total_tasks = len([opt for opt in setup_options.dict().values() if opt])
-        completed_tasks = 0
+        # 過去の所要時間から、クリティカルパス上のタスクを先に実行する
+        task_graph = TaskGraph.from_options(setup_options.dict(), duration_stats.task_weights(computer_info))
+        total_tasks = max(len(task_graph), 1)
+        resumed = len(completed_steps & set(task_graph.nodes))
+        # 再起動の完了待ちは、実行中の他のタスクの終了を待ってからホスト単位で行う
+        gate = ExclusiveGate()
 
         # 初期状態を記録
         log_progress(
@@ -82,62 +282,36 @@ async def execute_setup_tasks(
             computer_name=computer_info.computer_name,
             task="setup_initialization",
             status="Started",
-            message="セットアップを開始します",
-            progress_value=0.0,
-            start_time=start_time,
-            db=db
+            message=(
+                f"セットアップを再開します(完了済みの{resumed}件のタスクは実行しません)"
+                if resumed else "セットアップを開始します"
+            ),
+            progress_value=(resumed / total_tasks) * 100,
+            start_time=start_time
         )
 
-        # OS設定タスク
-        if setup_options.setup_desktop_icons:
-            await execute_task(
-                "setup_desktop_icons",
-                "デスクトップアイコンの表示設定",
-                request_id,
-                computer_info,
-                db,
-                completed_tasks,
-                total_tasks
-            )
-            completed_tasks += 1
-
-        if setup_options.move_vpn_icon:
+        # 依存関係に従い、独立したタスクは並列に実行する
+        async def run_node(node: TaskNode):
+            nonlocal completed_tasks
+            if node.task_id in completed_steps:
+                # 前回までに完了したタスクは繰り返さない(後続タスクの依存関係は満たされる)
+                completed_tasks += 1
+                return
             await execute_task(
-                "move_vpn_icon",
-                "FortiClientVPNアイコンの移動",
+                node.task_id,
+                node.name,
                 request_id,
                 computer_info,
-                db,
+                setup_options,
                 completed_tasks,
-                total_tasks
+                total_tasks,
+                host_lease=host_lease,
+                job_id=job_id,
+                gate=gate
             )
             completed_tasks += 1
 
-        # Microsoft 365関連タスク
-        if setup_options.install_office:
-            await execute_task(
-                "install_office",
-                "Microsoft 365のインストール",
-                request_id,
-                computer_info,
-                db,
-                completed_tasks,
-                total_tasks
-            )
-            completed_tasks += 1
-
-        # アプリケーションインストール
-        if setup_options.install_carbon_black:
-            await execute_task(
-                "install_carbon_black",
-                "Carbon Blackのインストール",
-                request_id,
-                computer_info,
-                db,
-                completed_tasks,
-                total_tasks
-            )
-            completed_tasks += 1
+        await task_graph.run(run_node, max_parallel=fleet_executor.max_tasks_per_host, gate=gate)
 
         # 完了状態を記録
         end_time = datetime.now()
@@ -151,9 +325,43 @@ async def execute_setup_tasks(
             progress_value=100.0,
             start_time=start_time,
             end_time=end_time,
-            duration=duration,
-            db=db
+            duration=duration
+        )
+
+    except asyncio.CancelledError:
+        if job_id is not None and fleet_executor.is_interrupted(request_id, computer_info.computer_name):
+            # 停止・占有の喪失による中断(ホストは実行中のまま残り、後で再開される)
+            log_progress(
+                request_id=request_id,
+                computer_name=computer_info.computer_name,
+                task="setup_interrupted",
+                status="Interrupted",
+                message="実行が中断されました。完了済みのタスクの次から再開します",
+                progress_value=(completed_tasks / total_tasks) * 100
+            )
+            raise
+        if fleet_executor.is_cancelled(request_id, computer_info.computer_name) or fleet_executor.is_interrupted(
+            request_id, computer_info.computer_name
+        ):
+            log_progress(
+                request_id=request_id,
+                computer_name=computer_info.computer_name,
+                task="setup_cancelled",
+                status="Cancelled",
+                message="セットアップがキャンセルされました",
+                progress_value=0.0
+            )
+            raise
+        # ホストの実行期限超過(run_host_job と同じくキャンセルではなく失敗として記録する)
+        log_progress(
+            request_id=request_id,
+            computer_name=computer_info.computer_name,
+            task="setup_timeout",
+            status="Failed",
+            message=f"{HOST_TIMEOUT_MESSAGE}({int(fleet_executor.host_timeout)}秒)",
+            progress_value=0.0
         )
+        raise
 
     except Exception as e:
         logger.error(f"セットアップ実行中にエラーが発生: {str(e)}", exc_info=True)
@@ -163,26 +371,109 @@ async def execute_setup_tasks(
             task="setup_error",
             status="Failed",
             message=f"エラーが発生しました: {str(e)}",
-            progress_value=0.0,
-            db=db
+            progress_value=0.0
         )
         raise
 
+def create_task_log(db: Session, **fields) -> int:
+    """タスクログを作成してIDを返す"""
+    task_log = TaskLogDB(**fields)
+    db.add(task_log)
+    db.commit()
+    return task_log.id
+
+def update_task_log(db: Session, task_log_id: int, **fields):
+    """タスクログを更新"""
+    db.query(TaskLogDB).filter(TaskLogDB.id == task_log_id).update(fields)
+    db.commit()
+
+def save_task_log(db: Session, task_log_id: Optional[int], initial: Dict[str, Any], **fields) -> int:
+    """タスクログを更新してIDを返す(未作成の場合は initial の値に fields を重ねて作成する)"""
+    if task_log_id is None:
+        return create_task_log(db, **{**initial, **fields})
+    update_task_log(db, task_log_id, **fields)
+    return task_log_id
+
+async def wait_for_reboot(
+    task_id: str,
+    task_name: str,
+    request_id: str,
+    computer_info: ComputerInfo,
+    progress: float,
+    start_time: datetime,
+    host_lease: Optional[HostLease] = None,
+    gate: Optional[ExclusiveGate] = None
+):
+    """
+    再起動したホストが WinRM に応答するまで、同時実行ホスト数の枠を解放して待つ
+
+    gate を指定した場合は、同じホストで実行中の他のタスクが終わるのを待ち、新しいタスクを
+    開始させずに待つ(再起動中のホストに PowerShell を実行しない)。
+
+    Raises:
+        TaskTimeoutError: REBOOT_PARK_TIMEOUT 秒以内に応答しなかった場合
+    """
+    log_progress(
+        request_id=request_id,
+        computer_name=computer_info.computer_name,
+        task=task_id,
+        status="In Progress",
+        message=f"{task_name}: ホストの再起動の完了を待っています",
+        progress_value=progress,
+        start_time=start_time
+    )
+    if host_lease is not None:
+        # 待っている間に他のリクエストがホストを操作しないよう、ロックを延長する
+        host_locks.renew(host_lease, REBOOT_PARK_TIMEOUT + host_locks.lease_seconds)
+
+    async def wait_parked() -> float:
+        async with fleet_executor.parked(request_id, computer_info.computer_name):
+            return await reboot_watcher.wait_until_back(
+                computer_info.ip_address or computer_info.computer_name, REBOOT_PARK_TIMEOUT
+            )
+
+    try:
+        waited = await (gate.run_exclusive(wait_parked) if gate is not None else wait_parked())
+    except asyncio.TimeoutError:
+        raise TaskTimeoutError(
+            f"{task_name}の後、{int(REBOOT_PARK_TIMEOUT)}秒以内にホストが応答しませんでした",
+            host=computer_info.computer_name,
+            task_name=task_id,
+            timeout=REBOOT_PARK_TIMEOUT
+        )
+    if waited is None:
+        logger.info(f"{computer_info.computer_name} の再起動は同時に完了を待った他のタスクで確認済みです")
+        return
+    logger.info(f"{computer_info.computer_name} の再起動が完了しました({int(waited)}秒)。残りのタスクを続けます")
+
 async def execute_task(
     task_id: str,
     task_name: str,
     request_id: str,
-    computer_info: ComputerInfoDB,
-    setup_options: SetupOptionsDB,
-    db: Session,
+    computer_info: ComputerInfo,
+    setup_options: SetupOptions,
     completed_tasks: int,
-    total_tasks: int
+    total_tasks: int,
+    host_lease: Optional[HostLease] = None,
+    job_id: Optional[int] = None,
+    gate: Optional[ExclusiveGate] = None
 ):
-    """個別のタスクを実行"""
+    """個別のタスクを実行(job_id を指定した場合は完了時にチェックポイントを記録する)"""
+    start_time = datetime.now()
+    progress = (completed_tasks / total_tasks) * 100
+    # リトライ回数などを記録するタスクログ。書き込みのトランザクションを減らすため、
+    # 開始時には作成せず、完了(チェックポイントと同じトランザクション)・再試行・失敗・キャンセルの時点で作成する
+    task_log = {
+        "request_id": request_id,
+        "computer_name": computer_info.computer_name,
+        "task_name": task_id,
+        "status": TaskStatus.IN_PROGRESS.value,
+        "start_time": start_time,
+        "error_count": 0,
+        "retry_count": 0
+    }
+    task_log_id = None
     try:
-        start_time = datetime.now()
-        progress = (completed_tasks / total_tasks) * 100
-
         # タスク開始を記録
         log_progress(
             request_id=request_id,
@@ -191,51 +482,153 @@ async def execute_task(
             status="In Progress",
             message=f"{task_name}を実行中...",
             progress_value=progress,
-            start_time=start_time,
-            db=db
-        )
-
-        # PowerShellスクリプトの実行
-        from .utils import execute_setup_task
-        success, message, result = await execute_setup_task(
-            task_id,
-            computer_info,
-            setup_options.dict()
+            start_time=start_time
         )
 
-        end_time = datetime.now()
-        duration = int((end_time - start_time).total_seconds())
-
-        if success:
-            # タスク完了を記録
+        # スクリプトが出力する進捗行をタスク内の途中経過として記録
+        def on_script_progress(percent: float, script_message: str):
             log_progress(
                 request_id=request_id,
                 computer_name=computer_info.computer_name,
                 task=task_id,
-                status="Completed",
-                message=f"{task_name}が完了しました: {message}",
-                progress_value=progress + (100 / total_tasks),
-                start_time=start_time,
-                end_time=end_time,
-                duration=duration,
-                db=db
+                status="In Progress",
+                message=f"{task_name}: {script_message}",
+                progress_value=progress + (100 / total_tasks) * percent / 100,
+                start_time=start_time
             )
-        else:
-            # エラーを記録
-            log_progress(
-                request_id=request_id,
-                computer_name=computer_info.computer_name,
-                task=task_id,
-                status="Failed",
-                message=f"{task_name}の実行中にエラーが発生: {message}",
-                progress_value=progress,
-                start_time=start_time,
+
+        error_count = 0
+
+        from .utils import execute_setup_task
+        timeout = get_task_timeout(task_id)
+        retry_count = 0
+        while True:
+            if host_lease is not None:
+                # タスクの実行期限の間はロックを失わないようリースを延長する
+                host_locks.renew(host_lease, timeout + host_locks.lease_seconds)
+            try:
+                # PowerShellスクリプトの実行(フリート全体・ホスト毎の同時実行数を制限)
+                # 期限を超えた場合はキャンセルされ、子プロセスごと終了する
+                async with fleet_executor.task_slot(computer_info.computer_name):
+                    attempt_started = time.monotonic()
+                    try:
+                        success, message, result = await asyncio.wait_for(
+                            execute_setup_task(
+                                task_id,
+                                computer_info,
+                                setup_options.dict(),
+                                on_progress=on_script_progress
+                            ),
+                            timeout
+                        )
+                        # 所要時間と成否から同時実行ホスト数を自動調整する
+                        fleet_executor.record_task_result(task_id, time.monotonic() - attempt_started, success)
+                    except asyncio.TimeoutError:
+                        fleet_executor.record_task_result(task_id, time.monotonic() - attempt_started, False)
+                        raise TaskTimeoutError(
+                            f"{task_name}が{int(timeout)}秒以内に完了しませんでした",
+                            host=computer_info.computer_name,
+                            task_name=task_id,
+                            timeout=timeout
+                        )
+                if not success:
+                    raise classify_task_failure(message, computer_info.computer_name, task_id)
+                break
+
+            except SetupError as error:
+                error.retry_count = retry_count
+                error_count += 1
+                if not retry_policy.should_retry(error):
+                    task_log_id = await run_in_session(lambda db: save_task_log(
+                        db,
+                        task_log_id,
+                        task_log,
+                        status=TaskStatus.FAILED.value,
+                        end_time=datetime.now(),
+                        error_count=error_count,
+                        details=json.loads(json.dumps(error.to_dict(), default=str))
+                    ))
+                    raise
+
+                # カテゴリに応じたジッター付き指数バックオフで再試行
+                delay = retry_policy.backoff(error)
+                error.increment_retry()
+                retry_count = error.retry_count
+                task_log_id = await run_in_session(lambda db: save_task_log(
+                    db,
+                    task_log_id,
+                    task_log,
+                    error_count=error_count,
+                    retry_count=retry_count
+                ))
+                log_progress(
+                    request_id=request_id,
+                    computer_name=computer_info.computer_name,
+                    task=task_id,
+                    status="Retrying",
+                    message=f"{task_name}を{int(delay)}秒後に再試行します({retry_count}回目): {error.message}",
+                    progress_value=progress,
+                    start_time=start_time
+                )
+                await asyncio.sleep(delay)
+
+        if is_rebooting(task_id, result):
+            # 再起動の完了を待つ間は実行枠を他のホストに回す
+            try:
+                await wait_for_reboot(
+                    task_id, task_name, request_id, computer_info, progress, start_time, host_lease, gate
+                )
+            except TaskTimeoutError:
+                task_log_id = await run_in_session(lambda db: save_task_log(
+                    db,
+                    task_log_id,
+                    task_log,
+                    status=TaskStatus.FAILED.value,
+                    end_time=datetime.now(),
+                    error_count=error_count + 1
+                ))
+                raise
+
+        end_time = datetime.now()
+        duration = int((end_time - start_time).total_seconds())
+
+        def record_completion(db: Session):
+            if job_id is not None:
+                checkpoint_step(db, job_id, task_id, start_time, end_time, duration)
+            save_task_log(
+                db,
+                task_log_id,
+                task_log,
+                status=TaskStatus.COMPLETED.value,
                 end_time=end_time,
-                duration=duration,
-                db=db
+                duration=duration
             )
-            raise Exception(message)
 
+        # タスクログとチェックポイントを同じトランザクションで記録する
+        await run_in_session(record_completion)
+
+        # タスク完了を記録
+        log_progress(
+            request_id=request_id,
+            computer_name=computer_info.computer_name,
+            task=task_id,
+            status="Completed",
+            message=f"{task_name}が完了しました: {message}",
+            progress_value=progress + (100 / total_tasks),
+            start_time=start_time,
+            end_time=end_time,
+            duration=duration
+        )
+
+    except asyncio.CancelledError:
+        await run_in_session(lambda db: save_task_log(
+            db,
+            task_log_id,
+            task_log,
+            status=TaskStatus.CANCELLED.value,
+            end_time=datetime.now()
+        ))
+        raise
     except Exception as e:
         logger.error(f"タスク実行中にエラーが発生: {str(e)}", exc_info=True)
         log_progress(
@@ -244,65 +637,680 @@ async def execute_task(
             task=task_id,
             status="Failed",
             message=f"{task_name}の実行中にエラーが発生: {str(e)}",
-            progress_value=progress,
-            db=db
+            progress_value=progress
         )
         raise
 
+@app.post("/api/setup/upload-csv")
+async def upload_computers_csv(
+    file: UploadFile = File(...),
+    current_user = Depends(get_current_active_user)
+):
+    """
+    登録ユーザ情報CSVを取り込み、コンピュータ情報と行単位のエラー報告を返す
+
+    不正な行があっても取り込みは中断せず、errors に行番号と理由を返す。
+    取り込めたコンピュータはバッチ毎にJSONにして返すため、行数が多くてもメモリに溜めない。
+    """
+    chunks = iter_import_json(file.file, conflict_checker=active_hosts.checker())
+    try:
+        # 解析はファイルを逐次読みしながら行うため、イベントループ外で実行する。
+        # ヘッダーの不正は先頭のバッチまでに判明するので、ここで 400 を返せる
+        loop = asyncio.get_running_loop()
+        first = await loop.run_in_executor(None, next, chunks)
+    except CsvFormatError as e:
+        await file.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    except UnicodeDecodeError:
+        await file.close()
+        raise HTTPException(status_code=400, detail="CSVファイルの文字コードを判別できませんでした")
+    except Exception as e:
+        await file.close()
+        logger.error(f"CSV取り込み中にエラーが発生: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"CSVファイルの取り込みに失敗しました: {str(e)}"
+        )
+
+    # 残りはスレッドプールで読み進めながら送り、送り終えてからファイルを閉じる
+    return StreamingResponse(
+        chain([first], chunks),
+        media_type="application/json",
+        background=BackgroundTask(file.close)
+    )
+
+def reserve_hosts(request_id: str, computers: List[ComputerInfo]):
+    """
+    対象PCの重複・実行中リクエストとの競合を確認し、実行中ホストとして登録する
+
+    確認から登録までの間に await を挟まないため、同時に作成されたリクエスト同士でも競合を見逃さない。
+
+    Raises:
+        HTTPException: 重複・競合がある場合(409)
+    """
+    conflicts = active_hosts.find_conflicts(computers)
+    if conflicts:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": "対象PCが重複しているか、実行中の別のリクエストの対象になっています",
+                "conflicts": [
+                    {
+                        "computer_name": conflict.computer_name,
+                        "field": conflict.field,
+                        "value": conflict.value,
+                        "request_id": conflict.request_id,
+                        "message": conflict.message
+                    }
+                    for conflict in conflicts
+                ]
+            }
+        )
+    active_hosts.reserve(request_id, computers)
+
+def validate_priority(priority: int, current_user):
+    """
+    リクエストの優先度を検証する(通常より高い優先度は管理者のみ指定できる)
+
+    Raises:
+        HTTPException: 範囲外(400)または権限が無い(403)場合
+    """
+    if not MIN_PRIORITY <= priority <= MAX_PRIORITY:
+        raise HTTPException(
+            status_code=400,
+            detail=f"優先度は{MIN_PRIORITY}から{MAX_PRIORITY}の範囲で指定してください"
+        )
+    if priority > DEFAULT_PRIORITY and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="通常より高い優先度は管理者のみ指定できます")
+
+def save_admitted_request(
+    db: Session,
+    request_id: str,
+    requester: str,
+    computers: List[ComputerInfo],
+    setup_options: SetupOptions,
+    host_options: Optional[Dict[str, SetupOptions]] = None,
+    priority: int = DEFAULT_PRIORITY,
+    rollout: Optional[RolloutSettings] = None,
+    unreachable: Optional[Dict[str, str]] = None
+):
+    """
+    受付制御の判定を行い、受け付けたリクエストを保存する
+
+    PC毎の推定所要時間(過去の所要時間の p50 / p90)とリクエスト全体の推定所要時間も合わせて保存する。
+    判定と保存を同じトランザクションで行う。上限を超えたリクエストは承認済み(実行待ち)として
+    ジョブを待機させる。拒否した場合は何も保存しない。
+    段階展開を指定した場合は、カナリア(ウェーブ 0)以外のジョブを保留で登録する。
+    事前確認で到達できなかったPC(unreachable)は失敗として登録し、受付制御の見積もり・ウェーブには含めない。
+
+    Returns:
+        Tuple[AdmissionDecision, List[int], List[Optional[int]], List[float]]: 判定結果と ComputerInfoDB の id、
+        すぐに実行する HostJobDB の id(保留・失敗として登録したPCは None)、
+        PC毎の推定所要時間(秒)(いずれも computers と同じ順序)
+    """
+    unreachable = unreachable or {}
+    estimates = duration_stats.estimate_hosts(
+        computers, setup_options, host_options, max_parallel=fleet_executor.max_tasks_per_host
+    )
+    host_seconds = [estimate.p50 for estimate in estimates]
+    runnable = [index for index, computer in enumerate(computers) if computer.computer_name not in unreachable]
+    runnable_seconds = [host_seconds[index] for index in runnable]
+    decision = admission.decide(load_backlog(db), len(runnable), sum(runnable_seconds), priority)
+    if decision.action == REJECT:
+        return decision, [], [], host_seconds
+    parked = decision.action == PARK
+    waves = None
+    if rollout:
+        waves = [None] * len(computers)
+        for index, wave in zip(runnable, plan_waves(len(runnable), rollout.canary_size, rollout.growth_factor)):
+            waves[index] = wave
+    computer_ids, job_ids = insert_setup_request(
+        db,
+        request_id,
+        requester,
+        PCSetupStatus.APPROVED.value if parked else "Pending",
+        computers,
+        setup_options,
+        host_options,
+        priority=priority,
+        job_state=PARKED_JOB_STATE if parked else TaskStatus.PENDING.value,
+        estimated_seconds=host_seconds,
+        waves=waves,
+        estimated_p90_seconds=[estimate.p90 for estimate in estimates],
+        estimated_time=estimate_request_minutes(runnable_seconds, admission.fleet_capacity),
+        unreachable=unreachable
+    )
+    if waves:
+        create_rollout(db, request_id, rollout, waves)
+    if unreachable:
+        # 全てのPCに到達できなかった場合はこの時点で確定する
+        refresh_request_status(db, request_id)
+    db.commit()
+    return decision, computer_ids, [
+        job_id if computers[index].computer_name not in unreachable and (waves is None or waves[index] == 0) else None
+        for index, job_id in enumerate(job_ids)
+    ], host_seconds
+
+def admission_response(decision: AdmissionDecision, response: Response) -> Dict[str, Any]:
+    """
+    受付結果をレスポンスに反映する
+
+    Raises:
+        HTTPException: 拒否した場合(429、Retry-After 付き)
+    """
+    if decision.action == REJECT:
+        raise HTTPException(
+            status_code=429,
+            detail=f"混雑のため受け付けられませんでした。{decision.retry_after}秒後に再度申請してください: {decision.reason}",
+            headers={"Retry-After": str(decision.retry_after)}
+        )
+    if decision.action == PARK:
+        response.status_code = 202
+        return {
+            "admission": decision.action,
+            "status": PCSetupStatus.APPROVED.value,
+            "estimated_wait_seconds": decision.estimated_wait_seconds,
+            "message": f"セットアップリクエストを受け付けました。実行枠に空きが出るまで待機します({decision.reason})"
+        }
+    return {
+        "admission": decision.action,
+        "estimated_wait_seconds": decision.estimated_wait_seconds,
+        "message": "セットアップリクエストを受け付けました"
+    }
+
+async def check_reachability(computers: List[ComputerInfo]) -> Dict[str, str]:
+    """
+    受付時に対象PCの WinRM ポートへの到達性を確認する
+
+    Returns:
+        Dict[str, str]: 到達できなかったPC名と理由
+    """
+    results = await preflight.check(computers)
+    return {name: result.error for name, result in results.items() if not result.reachable}
+
+async def start_admitted_request(
+    request_id: str,
+    decision: AdmissionDecision,
+    computers: List[ComputerInfo],
+    setup_options: SetupOptions,
+    host_options: Optional[Dict[str, SetupOptions]],
+    job_ids: List[Optional[int]],
+    host_seconds: List[float],
+    unreachable: Dict[str, str],
+    requester: str,
+    priority: int
+) -> Dict[str, Any]:
+    """
+    到達できなかったPCの失敗を記録し、すぐに実行するジョブをフリートエグゼキューターに投入する
+
+    Returns:
+        Dict[str, Any]: レスポンスの共通部分(推定所要時間・到達できなかったPC)
+    """
+    for computer_name, error in unreachable.items():
+        active_hosts.release(request_id, computer_name)
+        log_progress(
+            request_id=request_id,
+            computer_name=computer_name,
+            task="setup_unreachable",
+            status="Failed",
+            message=f"到達性の事前確認に失敗したため実行しません: {error}",
+            progress_value=0.0
+        )
+
+    # 段階展開の場合は先頭のカナリアの分のみ
+    runnable = [index for index, job_id in enumerate(job_ids) if job_id is not None]
+    if decision.action == ADMIT and JOB_EXECUTION_MODE == "api" and runnable:
+        await fleet_executor.submit(
+            request_id, [computers[index] for index in runnable], setup_options, host_options,
+            job_ids=[job_ids[index] for index in runnable], requester=requester, priority=priority,
+            estimated_seconds=[host_seconds[index] for index in runnable]
+        )
+
+    return {
+        "estimated_time": estimate_request_minutes(
+            [seconds for computer, seconds in zip(computers, host_seconds) if computer.computer_name not in unreachable],
+            admission.fleet_capacity
+        ),
+        "unreachable": [
+            {"computer_name": computer_name, "error": error} for computer_name, error in unreachable.items()
+        ]
+    }
+
 @app.post("/api/setup/request")
 async def create_setup_request(
-    background_tasks: BackgroundTasks,
-    computer_info: ComputerInfoDB,
-    setup_options: SetupOptionsDB,
-    current_user = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    computers: List[ComputerInfo],
+    setup_options: SetupOptions,
+    response: Response,
+    priority: int = DEFAULT_PRIORITY,
+    rollout: Optional[RolloutSettings] = None,
+    current_user = Depends(get_current_active_user)
 ):
-    """セットアップリクエストを作成"""
+    """
+    セットアップリクエストを作成
+
+    受付制御の上限を超える場合は、承認済み(実行待ち)として 202 を返すか、429 を返す。
+    rollout を指定すると、カナリアから順にウェーブ単位で実行する。
+    WinRM ポートに到達できないPCは、スクリプトを実行せずに失敗として記録し、unreachable に返す。
+    """
+    validate_priority(priority, current_user)
+    request_id = generate_request_id()
+    reserve_hosts(request_id, computers)
     try:
-        request_id = generate_request_id()
-        
-        # リクエストをデータベースに保存
-        setup_request = SetupRequestDB(
+        unreachable = await check_reachability(computers)
+
+        # 受付の判定と、リクエスト・ホスト毎のジョブの保存
+        decision, _, job_ids, host_seconds = await run_in_session(partial(
+            save_admitted_request,
             request_id=request_id,
-            requester_id=current_user.id,
-            computer_info=computer_info,
+            requester=current_user.username,
+            computers=computers,
             setup_options=setup_options,
-            status="Pending",
-            request_date=datetime.now()
-        )
-        db.add(setup_request)
-        db.commit()
+            priority=priority,
+            rollout=rollout,
+            unreachable=unreachable
+        ))
+        result = admission_response(decision, response)
+
+        return {
+            "request_id": request_id,
+            **await start_admitted_request(
+                request_id, decision, computers, setup_options, None, job_ids, host_seconds,
+                unreachable, current_user.username, priority
+            ),
+            **result
+        }
 
-        # バックグラウンドでセットアップタスクを実行
-        background_tasks.add_task(
-            execute_setup_tasks,
-            request_id,
-            computer_info,
-            setup_options,
-            db
+    except HTTPException:
+        active_hosts.release(request_id)
+        raise
+    except Exception as e:
+        active_hosts.release(request_id)
+        logger.error(f"セットアップリクエスト作成中にエラーが発生: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"セットアップリクエストの作成に失敗しました: {str(e)}"
         )
 
-        return {"request_id": request_id, "message": "セットアップリクエストを受け付けました"}
+@app.post("/api/setup/requests/bulk")
+async def create_bulk_setup_request(
+    bulk_request: BulkSetupRequest,
+    response: Response,
+    current_user = Depends(get_current_active_user)
+):
+    """
+    多数のコンピュータを対象とするセットアップリクエストを一括作成
+
+    各コンピュータの setup_options を指定するとそのPCだけ個別設定となり、
+    省略したPCにはリクエスト共通の setup_options が適用される。
+    登録は1トランザクション内の executemany で行う。
+    受付制御の上限を超える場合は、承認済み(実行待ち)として 202 を返すか、429 を返す。
+    rollout を指定すると、カナリアから順にウェーブ単位で実行する。
+    WinRM ポートに到達できないPCは、スクリプトを実行せずに失敗として記録し、unreachable に返す。
+    """
+    if not bulk_request.computers:
+        raise HTTPException(status_code=400, detail="対象コンピュータが指定されていません")
+    validate_priority(bulk_request.priority, current_user)
+
+    request_id = generate_request_id()
+    computers = [
+        ComputerInfo(**computer.dict(exclude={"setup_options"}))
+        for computer in bulk_request.computers
+    ]
+    reserve_hosts(request_id, computers)
+    try:
+        host_options = {
+            computer.computer_name: computer.setup_options
+            for computer in bulk_request.computers
+            if computer.setup_options is not None
+        }
+        unreachable = await check_reachability(computers)
+
+        decision, computer_ids, job_ids, host_seconds = await run_in_session(partial(
+            save_admitted_request,
+            request_id=request_id,
+            requester=current_user.username,
+            computers=computers,
+            setup_options=bulk_request.setup_options,
+            host_options=host_options,
+            priority=bulk_request.priority,
+            rollout=bulk_request.rollout,
+            unreachable=unreachable
+        ))
+        result = admission_response(decision, response)
+
+        return {
+            "request_id": request_id,
+            "computer_ids": computer_ids,
+            "count": len(computer_ids),
+            **await start_admitted_request(
+                request_id, decision, computers, bulk_request.setup_options, host_options, job_ids, host_seconds,
+                unreachable, current_user.username, bulk_request.priority
+            ),
+            **result
+        }
 
+    except HTTPException:
+        active_hosts.release(request_id)
+        raise
     except Exception as e:
-        logger.error(f"セットアップリクエスト作成中にエラーが発生: {str(e)}", exc_info=True)
+        active_hosts.release(request_id)
+        logger.error(f"一括セットアップリクエスト作成中にエラーが発生: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"セットアップリクエストの作成に失敗しました: {str(e)}"
         )
 
+def host_status_record(host: HostStatusDB) -> HostStatus:
+    """ホストの状態に、実行中であれば完了予定時刻(開始時刻 + 推定所要時間)を加える"""
+    status = HostStatus.model_validate(host, from_attributes=True)
+    if host.state == TaskStatus.IN_PROGRESS.value and host.started_at and host.estimated_seconds is not None:
+        status.estimated_finish_at = host.started_at + timedelta(seconds=host.estimated_seconds)
+    return status
+
+def progress_log_record(log: SetupProgressDB) -> Dict[str, Any]:
+    """進捗ログの行を辞書に変換"""
+    return {column.name: getattr(log, column.name) for column in SetupProgressDB.__table__.columns}
+
+async def authorize_request_access(request_id: str, current_user) -> str:
+    """リクエストの存在と閲覧・操作権限を確認し、申請者名を返す"""
+    requester = await run_in_session(
+        lambda db: db.query(SetupRequestDB.requester).filter(
+            SetupRequestDB.request_id == request_id
+        ).scalar(),
+        read_only=True
+    )
+    if requester is None:
+        raise HTTPException(
+            status_code=404,
+            detail="指定されたリクエストが見つかりません"
+        )
+    if current_user.role != "admin" and requester != current_user.username:
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    return requester
+
+@app.post("/api/setup/cancel/{request_id}")
+async def cancel_setup_request(
+    request_id: str,
+    computer_name: Optional[str] = None,
+    current_user = Depends(get_current_active_user)
+):
+    """セットアップリクエスト全体、または指定したコンピュータのみをキャンセル"""
+    await authorize_request_access(request_id, current_user)
+
+    cancelled = fleet_executor.cancel(request_id, computer_name)
+    active_hosts.release(request_id, computer_name)
+
+    def mark_cancelled(db: Session):
+        # 未完了のホストはキャンセル扱いにする(再起動時に実行中として扱わないため)
+        hosts = db.query(HostStatusDB).filter(
+            HostStatusDB.request_id == request_id,
+            HostStatusDB.state.in_(ACTIVE_HOST_STATES)
+        )
+        if computer_name is not None:
+            hosts = hosts.filter(HostStatusDB.computer_name == computer_name)
+        hosts.update({
+            "state": TaskStatus.CANCELLED.value,
+            "finished_at": datetime.now(),
+            "updated_at": datetime.now()
+        }, synchronize_session=False)
+        # 再起動時に再開しないよう、ジョブもキャンセル扱いにする
+        cancel_host_jobs(db, request_id, computer_name)
+
+        values = {"progress_version": func.coalesce(SetupRequestDB.progress_version, 0) + 1}
+        if computer_name is None:
+            values["status"] = PCSetupStatus.CANCELLED.value
+        db.query(SetupRequestDB).filter(
+            SetupRequestDB.request_id == request_id
+        ).update(values, synchronize_session=False)
+        if computer_name is not None:
+            # 残りのホストが全て終了していればリクエストの状態を確定する
+            refresh_request_status(db, request_id)
+        # 段階展開で現在のウェーブが残っていなければ次のウェーブに進む
+        released = advance_if_drained(db, request_id)
+        db.commit()
+        return released
+
+    await submit_released_jobs(await run_in_session(mark_cancelled))
+
+    return {
+        "request_id": request_id,
+        "computer_name": computer_name,
+        "cancelled_running_hosts": cancelled,
+        "message": "キャンセルを受け付けました"
+    }
+
+@app.post("/api/setup/requests/{request_id}/expedite")
+async def expedite_setup_request(
+    request_id: str,
+    current_user = Depends(get_current_active_user)
+):
+    """リクエストの待機中のジョブを、他の全リクエストより先に実行させる(管理者のみ)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    await authorize_request_access(request_id, current_user)
+
+    def update_priority(db: Session) -> int:
+        jobs = expedite_jobs(db, request_id, EXPEDITE_PRIORITY)
+        db.commit()
+        return jobs
+
+    unfinished = await run_in_session(update_priority)
+    # ワーカー実行時は、次の占有から新しい優先度が使われる
+    queued = fleet_executor.expedite(request_id, EXPEDITE_PRIORITY)
+    logger.info(f"リクエスト {request_id} を至急扱いにしました(実行者: {current_user.username})")
+    return {
+        "request_id": request_id,
+        "priority": EXPEDITE_PRIORITY,
+        "unfinished_jobs": unfinished,
+        "queued_jobs": queued,
+        "message": "リクエストを至急扱いにしました"
+    }
+
+@app.get("/api/setup/requests/{request_id}/rollout")
+async def get_request_rollout(
+    request_id: str,
+    current_user = Depends(get_current_active_user)
+):
+    """段階展開の進行状況(現在のウェーブ・失敗率・一時停止の理由)を取得"""
+    await authorize_request_access(request_id, current_user)
+    status = await run_in_session(partial(rollout_status, request_id=request_id), read_only=True)
+    if status is None:
+        raise HTTPException(status_code=404, detail="このリクエストは段階展開ではありません")
+    return status
+
+@app.post("/api/setup/requests/{request_id}/rollout/pause")
+async def pause_request_rollout(
+    request_id: str,
+    current_user = Depends(get_current_active_user)
+):
+    """段階展開を一時停止する(実行中のホストは最後まで実行し、未開始のホストは保留にする)"""
+    await authorize_request_access(request_id, current_user)
+
+    def pause(db: Session) -> int:
+        held = pause_rollout(db, request_id, f"{current_user.username} が一時停止しました")
+        db.commit()
+        return held
+
+    held = await run_in_session(pause)
+    if held < 0:
+        raise HTTPException(status_code=409, detail="実行中の段階展開ではありません")
+    return {
+        "request_id": request_id,
+        "held_jobs": held,
+        "message": "段階展開を一時停止しました"
+    }
+
+@app.post("/api/setup/requests/{request_id}/rollout/resume")
+async def resume_request_rollout(
+    request_id: str,
+    current_user = Depends(get_current_active_user)
+):
+    """一時停止した段階展開を再開する(管理者のみ)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    await authorize_request_access(request_id, current_user)
+
+    def resume(db: Session) -> Optional[List[int]]:
+        job_ids = resume_rollout(db, request_id)
+        db.commit()
+        return job_ids
+
+    job_ids = await run_in_session(resume)
+    if job_ids is None:
+        raise HTTPException(status_code=409, detail="一時停止中の段階展開ではありません")
+    await submit_released_jobs(job_ids)
+    logger.info(f"リクエスト {request_id} の段階展開を再開しました(実行者: {current_user.username})")
+    return {
+        "request_id": request_id,
+        "resumed_jobs": len(job_ids),
+        "message": "段階展開を再開しました"
+    }
+
+@app.get("/api/setup/requests/{request_id}/queue")
+async def get_request_queue_stats(
+    request_id: str,
+    current_user = Depends(get_current_active_user)
+):
+    """リクエストのキュー待ち時間(公平性の確認用)を取得"""
+    await authorize_request_access(request_id, current_user)
+    stats = await run_in_session(partial(queue_wait_stats, request_id=request_id), read_only=True)
+    return {
+        "request_id": request_id,
+        **stats,
+        "dispatcher": fleet_executor.request_queue_stats(request_id)
+    }
+
+@app.post("/api/setup/preflight")
+async def run_preflight_check(
+    computers: List[ComputerInfo],
+    refresh: bool = False,
+    current_user = Depends(get_current_active_user)
+):
+    """
+    リクエストを作成せずに、対象PCの WinRM ポートへの到達性を確認する
+
+    refresh を指定するとキャッシュを使わずに確認し直す。
+    """
+    if refresh:
+        for computer in computers:
+            preflight.invalidate(computer.ip_address or computer.computer_name)
+    results = await preflight.check(computers)
+    return {
+        "enabled": preflight.enabled,
+        "count": len(results),
+        "unreachable_count": sum(1 for result in results.values() if not result.reachable),
+        "results": [probe_result_record(name, result) for name, result in results.items()]
+    }
+
+@app.get("/api/setup/capacity")
+async def get_setup_capacity(
+    current_user = Depends(get_current_active_user)
+):
+    """受付状況(実行枠・受け付けた作業量・待機中のリクエスト)を取得"""
+    backlog = await run_in_session(load_backlog, read_only=True)
+    stats = fleet_executor.get_stats()
+    return {
+        **admission.snapshot(backlog),
+        "execution_mode": JOB_EXECUTION_MODE,
+        "queued_hosts": stats["queued_hosts"],
+        "active_hosts": stats["active_hosts"],
+        "hosts_per_minute": stats["hosts_per_minute"]
+    }
+
+@app.get("/api/setup/executor/stats")
+async def get_executor_stats(
+    current_user = Depends(get_current_active_user)
+):
+    """フリートエグゼキューターの実行状況(スループット・実行中タスク数)を取得"""
+    return {
+        **fleet_executor.get_stats(),
+        "execution_mode": JOB_EXECUTION_MODE,
+        "runner_pool": runner_pool.get_stats(),
+        "winrm_pool": winrm_pool.get_stats(),
+        "progress_writer": progress_writer.get_stats(),
+        "progress_broker": progress_broker.get_stats(),
+        "active_hosts": active_hosts.get_stats(),
+        "host_locks": host_locks.get_stats(),
+        "reboot_watcher": reboot_watcher.get_stats(),
+        "preflight": preflight.get_stats(),
+        "dispatcher": fleet_executor.get_dispatch_stats()
+    }
+
+@app.get("/api/setup/duration-stats")
+async def get_duration_stats(
+    current_user = Depends(get_current_active_user)
+):
+    """タスク毎(とサブネット毎)の所要時間の統計(p50 / p90)を取得"""
+    return duration_stats.get_stats()
+
+@app.put("/api/setup/executor/concurrency")
+async def update_executor_concurrency(
+    settings: ConcurrencySettings,
+    current_user = Depends(get_current_active_user)
+):
+    """同時実行ホスト数の範囲と自動調整の有無を変更(管理者のみ)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+    try:
+        stats = fleet_executor.set_concurrency(settings.min_hosts, settings.max_hosts, settings.adaptive)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"同時実行ホスト数の設定を変更しました(実行者: {current_user.username}): {settings.dict()}")
+    return stats
+
+def progress_etag(request_id: str, version: Optional[int], cursor: Optional[int]) -> str:
+    """進捗レスポンスの ETag(リクエストの版数とカーソルから生成)"""
+    return f'"{request_id}-{version or 0}-{cursor or 0}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match ヘッダーが ETag に一致するか判定"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
 @app.get("/api/setup/progress/{request_id}")
 async def get_setup_progress(
     request_id: str,
-    current_user = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    response: Response,
+    cursor: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None),
+    current_user = Depends(get_current_active_user)
 ):
-    """セットアップの進捗状況を取得"""
+    """
+    セットアップの進捗状況を取得
+
+    cursor(前回のレスポンスの cursor)を指定すると、それより後の進捗ログだけを返す。
+    If-None-Match が現在の ETag と一致する場合は、進捗ログを読まずに 304 を返す。
+    """
     try:
-        # リクエストの存在確認
-        request = db.query(SetupRequestDB).filter(
-            SetupRequestDB.request_id == request_id
-        ).first()
+        def load_progress(db: Session):
+            # リクエストの存在確認(版数だけで変更の有無を判定する)
+            request = db.query(SetupRequestDB).filter(
+                SetupRequestDB.request_id == request_id
+            ).first()
+            if not request:
+                return None, None, [], []
+
+            etag = progress_etag(request_id, request.progress_version, cursor)
+            if etag_matches(if_none_match, etag):
+                return request, etag, None, None
+
+            # ホスト毎の現在の状態(1台1行)
+            host_statuses = db.query(HostStatusDB).filter(
+                HostStatusDB.request_id == request_id
+            ).all()
+
+            # 進捗ログの取得(カーソル指定時は差分のみ)
+            query = db.query(SetupProgressDB).filter(
+                SetupProgressDB.request_id == request_id
+            )
+            if cursor is not None:
+                query = query.filter(SetupProgressDB.id > cursor)
+            progress_logs = query.order_by(SetupProgressDB.id.desc()).all()
+            return request, etag, host_statuses, progress_logs
+
+        request, etag, host_statuses, progress_logs = await run_in_session(load_progress, read_only=True)
         
         if not request:
             raise HTTPException(
@@ -310,17 +1318,20 @@ async def get_setup_progress(
                 detail="指定されたリクエストが見つかりません"
             )
 
-        # 進捗ログの取得
-        progress_logs = db.query(SetupProgressDB).filter(
-            SetupProgressDB.request_id == request_id
-        ).order_by(SetupProgressDB.start_time.desc()).all()
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if progress_logs is None:
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
 
         return {
             "request_id": request_id,
             "status": request.status,
-            "current_progress": request.current_progress,
+            "current_progress": {host.computer_name: host.progress for host in host_statuses},
+            "hosts": [host_status_record(host) for host in host_statuses],
+            "estimated_time": request.estimated_time,
             "actual_time": request.actual_time,
-            "progress_logs": [log.__dict__ for log in progress_logs]
+            "cursor": progress_logs[0].id if progress_logs else cursor,
+            "progress_logs": [progress_log_record(log) for log in progress_logs]
         }
 
     except HTTPException:
@@ -332,28 +1343,146 @@ async def get_setup_progress(
             detail=f"進捗状況の取得に失敗しました: {str(e)}"
         )
 
+@app.get("/api/setup/progress/{request_id}/stream")
+async def stream_setup_progress(
+    request_id: str,
+    cursor: Optional[int] = None,
+    last_event_id: Optional[str] = Header(None),
+    current_user = Depends(get_current_active_user)
+):
+    """
+    進捗イベントを Server-Sent Events で配信
+
+    cursor(または再接続時の Last-Event-ID)を指定すると、その id より後の
+    進捗ログをDBから送ってからライブ配信に切り替える。
+    """
+    await authorize_request_access(request_id, current_user)
+    if last_event_id and last_event_id.isdigit():
+        cursor = int(last_event_id)
+
+    # 取りこぼしが無いよう、DBから読み直す前に購読を開始する
+    subscription = progress_broker.subscribe(request_id)
+
+    async def event_stream():
+        last_id = cursor or 0
+        try:
+            if cursor is not None:
+                backlog = await run_in_session(
+                    lambda db: db.query(SetupProgressDB).filter(
+                        SetupProgressDB.request_id == request_id,
+                        SetupProgressDB.id > cursor
+                    ).order_by(SetupProgressDB.id).all(),
+                    read_only=True
+                )
+                for log in backlog:
+                    yield format_sse(progress_log_record(log))
+                    last_id = log.id
+
+            while True:
+                record = await subscription.get(PROGRESS_STREAM_KEEPALIVE)
+                if subscription.lagged:
+                    # 配信が追いつかない場合は、カーソルから再接続させる
+                    yield f"event: reset\ndata: {last_id}\n\n"
+                    return
+                if record is None:
+                    yield ": keepalive\n\n"
+                    continue
+                if record["id"] <= last_id:
+                    continue
+                yield format_sse(record)
+                last_id = record["id"]
+        finally:
+            progress_broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/setup/hosts")
+async def get_host_statuses(
+    request_id: Optional[str] = None,
+    state: Optional[TaskStatus] = None,
+    current_user = Depends(get_current_active_user)
+):
+    """
+    ホスト毎の現在の状態を取得
+
+    request_id と state を指定すると「リクエスト内の失敗ホスト」、state のみを指定すると
+    「フリート全体の実行中ホスト」のように、host_status の索引だけで絞り込める。
+    """
+    if request_id is None and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+
+    def load_hosts(db: Session):
+        query = db.query(HostStatusDB)
+        if request_id is not None:
+            query = query.filter(HostStatusDB.request_id == request_id)
+            if current_user.role != "admin":
+                query = query.join(SetupRequestDB).filter(
+                    SetupRequestDB.requester == current_user.username
+                )
+        if state is not None:
+            query = query.filter(HostStatusDB.state == state.value)
+        return query.all()
+
+    hosts = await run_in_session(load_hosts, read_only=True)
+    return {"hosts": [host_status_record(host) for host in hosts]}
+
 @app.get("/api/setup/requests")
 async def get_setup_requests(
-    current_user = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    status: Optional[str] = None,
+    requester: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user = Depends(get_current_active_user)
 ):
-    """セットアップリクエスト一覧を取得"""
+    """
+    セットアップリクエスト一覧を取得
+
+    新しい順に limit 件ずつ返す。次のページはレスポンスの next_cursor を cursor に指定して取得する。
+    fields(カンマ区切り)で返すフィールドを絞り込める。
+
+    Args:
+        status (Optional[str]): ステータスで絞り込み
+        requester (Optional[str]): 申請者名(前方一致)で絞り込み(管理者のみ)
+        created_from (Optional[datetime]): 申請日時の下限(この日時を含む)
+        created_to (Optional[datetime]): 申請日時の上限(この日時を含まない)
+        fields (Optional[str]): 返すフィールド
+        limit (int): 1ページの件数
+        cursor (Optional[str]): 前ページの next_cursor
+    """
     try:
-        # ユーザーの権限に応じてリクエストを取得
-        if current_user.role == "admin":
-            requests = db.query(SetupRequestDB).all()
-        else:
-            requests = db.query(SetupRequestDB).filter(
-                SetupRequestDB.requester_id == current_user.id
-            ).all()
+        selected_fields = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        return {
-            "requests": [request.__dict__ for request in requests]
-        }
+    # 管理者以外は自分のリクエストのみ
+    filters = RequestListFilter(status=status, created_from=created_from, created_to=created_to)
+    if current_user.role == "admin":
+        filters.requester_prefix = requester
+    else:
+        filters.requester = current_user.username
 
+    try:
+        def load_requests(db: Session):
+            requests, next_cursor = query_request_page(db, filters, selected_fields, limit, cursor)
+            return {
+                "requests": [serialize_request(request, selected_fields) for request in requests],
+                "next_cursor": next_cursor
+            }
+
+        return await run_in_session(load_requests, read_only=True)
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"リクエスト一覧の取得中にエラーが発生: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500,
             detail=f"リクエスト一覧の取得に失敗しました: {str(e)}"
-        )
\ No newline at end of file
+        )
@@ -2,7 +2,7 @@ from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from enum import Enum
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, JSON, Index
 from sqlalchemy.orm import relationship
 
 from .database import Base
@@ -68,6 +68,7 @@ class PCSetupStatus(str, Enum):
     PARTIALLY_FAILED = "partially_failed"  # 一部失敗
     ROLLBACK = "rollback"        # ロールバック中
     ROLLBACK_FAILED = "rollback_failed"  # ロールバック失敗
+    CANCELLED = "cancelled"      # キャンセル
 
 class TaskStatus(str, Enum):
     PENDING = "pending"          # 実行待ち
@@ -76,6 +77,7 @@ class TaskStatus(str, Enum):
     FAILED = "failed"           # 失敗
     SKIPPED = "skipped"         # スキップ
     WARNING = "warning"         # 警告付きで完了
+    CANCELLED = "cancelled"     # キャンセル
 
 class ErrorSeverity(str, Enum):
     INFO = "info"           # 情報
@@ -102,12 +104,14 @@ class ComputerInfoDB(Base):
     request_id = Column(String, ForeignKey('setup_requests.request_id'))
 
     request = relationship("SetupRequestDB", back_populates="computers")
+    setup_options = relationship("SetupOptionsDB", back_populates="computer", uselist=False)
 
 class SetupOptionsDB(Base):
     __tablename__ = "setup_options"
 
     id = Column(Integer, primary_key=True, index=True)
     request_id = Column(String, ForeignKey('setup_requests.request_id'))
+    computer_id = Column(Integer, ForeignKey('computers.id'), nullable=True, index=True)  # 個別設定の対象PC(共通設定はNULL)
     
     # OS設定
     setup_desktop_icons = Column(Boolean, default=False)
@@ -140,9 +144,16 @@ class SetupOptionsDB(Base):
     restart_system = Column(Boolean, default=False)
 
     request = relationship("SetupRequestDB", back_populates="setup_options")
+    computer = relationship("ComputerInfoDB", back_populates="setup_options")
 
 class SetupRequestDB(Base):
     __tablename__ = "setup_requests"
+    __table_args__ = (
+        # 一覧のキーセットページング(created_at, request_id の降順)用
+        Index("ix_setup_requests_created_at_request_id", "created_at", "request_id"),
+        Index("ix_setup_requests_status_created_at", "status", "created_at"),
+        Index("ix_setup_requests_requester_created_at", "requester", "created_at"),
+    )
 
     request_id = Column(String, primary_key=True, index=True)
     requester = Column(String)
@@ -152,13 +163,24 @@ class SetupRequestDB(Base):
     approved_by = Column(String, nullable=True)
     approved_at = Column(DateTime, nullable=True)
     rejection_reason = Column(String, nullable=True)
-    current_progress = Column(JSON, default=dict)
+    current_progress = Column(JSON, default=dict)  # 旧形式(ホスト毎の状態は host_status を参照)
     estimated_time = Column(Integer, nullable=True)  # 推定所要時間(分)
     actual_time = Column(Integer, nullable=True)     # 実際の所要時間(分)
+    progress_version = Column(Integer, default=0)    # 進捗が更新される度に増える版数(ETag に使用)
+    priority = Column(Integer, default=0)            # 実行の優先度(大きいほど先に実行する)
 
     computers = relationship("ComputerInfoDB", back_populates="request")
-    setup_options = relationship("SetupOptionsDB", back_populates="request", uselist=False)
+    # リクエスト共通の設定(PC別の個別設定は ComputerInfoDB.setup_options)
+    setup_options = relationship(
+        "SetupOptionsDB",
+        primaryjoin="and_(SetupRequestDB.request_id == SetupOptionsDB.request_id, SetupOptionsDB.computer_id.is_(None))",
+        back_populates="request",
+        uselist=False
+    )
     progress_logs = relationship("SetupProgressDB", back_populates="request")
+    host_statuses = relationship("HostStatusDB", back_populates="request")
+    host_jobs = relationship("HostJobDB", back_populates="request")
+    rollout = relationship("RolloutDB", back_populates="request", uselist=False)
     task_logs = relationship("TaskLogDB", back_populates="request")
     error_logs = relationship("ErrorLogDB", back_populates="request")
 
@@ -179,6 +201,106 @@ class SetupProgressDB(Base):
 
     request = relationship("SetupRequestDB", back_populates="progress_logs")
 
+class HostStatusDB(Base):
+    """リクエスト内の各コンピュータの現在の状態(1台1行)"""
+    __tablename__ = "host_status"
+    __table_args__ = (
+        # 「リクエストX内の失敗ホスト」を索引だけで引けるようにする
+        Index("ix_host_status_request_state", "request_id", "state"),
+        # 「フリート全体の実行中ホスト」を索引だけで引けるようにする
+        Index("ix_host_status_state", "state"),
+    )
+
+    request_id = Column(String, ForeignKey('setup_requests.request_id'), primary_key=True)
+    computer_name = Column(String, primary_key=True)
+    current_task = Column(String, nullable=True)
+    progress = Column(Float, default=0.0)
+    state = Column(String, default=TaskStatus.PENDING.value)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.now)
+    estimated_seconds = Column(Float, nullable=True)      # 推定所要時間(秒、過去の所要時間の中央値から)
+    estimated_p90_seconds = Column(Float, nullable=True)  # 推定所要時間の90パーセンタイル(秒)
+
+    request = relationship("SetupRequestDB", back_populates="host_statuses")
+
+class HostJobDB(Base):
+    """コンピュータ1台分のセットアップジョブ(バックエンドの再起動を跨いで保持する)"""
+    __tablename__ = "host_jobs"
+    __table_args__ = (
+        # 未完了のジョブを優先度・投入順に引けるようにする
+        Index("ix_host_jobs_state_priority_id", "state", "priority", "id"),
+        Index("ix_host_jobs_request_state", "request_id", "state"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    request_id = Column(String, ForeignKey('setup_requests.request_id'))
+    computer_id = Column(Integer, ForeignKey('computers.id'))
+    computer_name = Column(String)
+    requester = Column(String)             # 申請者間で公平に実行するため setup_requests から複製
+    priority = Column(Integer, default=0)  # リクエストの優先度の複製
+    state = Column(String, default=TaskStatus.PENDING.value)
+    attempts = Column(Integer, default=0)  # 実行(再開)された回数
+    estimated_seconds = Column(Float, nullable=True)  # 推定所要時間(秒、受付制御の見積もりと長いジョブからの実行に使う)
+    wave = Column(Integer, nullable=True)  # 段階展開のウェーブ番号(0 がカナリア、段階展開しない場合は None)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.now)
+
+    request = relationship("SetupRequestDB", back_populates="host_jobs")
+    computer = relationship("ComputerInfoDB")
+    steps = relationship("JobStepDB", back_populates="job")
+
+class RolloutDB(Base):
+    """段階展開(カナリア → 徐々に大きくなるウェーブ)の進行状況"""
+    __tablename__ = "rollouts"
+
+    request_id = Column(String, ForeignKey('setup_requests.request_id'), primary_key=True)
+    canary_size = Column(Integer)
+    growth_factor = Column(Float)
+    failure_threshold = Column(Float)   # ウェーブ内の失敗率がこれを超えたら一時停止する
+    state = Column(String)              # running / paused / completed
+    current_wave = Column(Integer, default=0)
+    total_waves = Column(Integer)
+    # 現在のウェーブの集計(ジョブの終了毎に加算する)
+    wave_total = Column(Integer, default=0)
+    wave_finished = Column(Integer, default=0)
+    wave_failed = Column(Integer, default=0)
+    paused_reason = Column(String, nullable=True)
+    paused_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.now)
+
+    request = relationship("SetupRequestDB", back_populates="rollout")
+
+class JobLeaseDB(Base):
+    """ワーカーが実行中のジョブの占有権(期限内にハートビートが無ければ他のワーカーが引き継ぐ)"""
+    __tablename__ = "job_leases"
+    __table_args__ = (
+        Index("ix_job_leases_worker_id", "worker_id"),
+    )
+
+    job_id = Column(Integer, ForeignKey('host_jobs.id'), primary_key=True)
+    worker_id = Column(String)
+    computer_name = Column(String, index=True)  # 同じホストのジョブを複数のワーカーが同時に実行しないため
+    claimed_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    expires_at = Column(DateTime, index=True)
+
+class JobStepDB(Base):
+    """ジョブ内のタスクの実行結果(タスク完了毎のチェックポイント)"""
+    __tablename__ = "job_steps"
+
+    job_id = Column(Integer, ForeignKey('host_jobs.id'), primary_key=True)
+    task_id = Column(String, primary_key=True)
+    state = Column(String)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    duration = Column(Integer, nullable=True)  # 所要時間(秒)
+
+    job = relationship("HostJobDB", back_populates="steps")
+
 class TaskLogDB(Base):
     __tablename__ = "task_logs"
 
@@ -258,6 +380,29 @@ class SetupOptions(BaseModel):
     cleanup_system: bool = False
     restart_system: bool = False
 
+class BulkComputerInfo(ComputerInfo):
+    # 省略時はリクエスト共通の設定を使う
+    setup_options: Optional[SetupOptions] = None
+
+class RolloutSettings(BaseModel):
+    # カナリアの台数と、以降のウェーブを何倍ずつ大きくするか
+    canary_size: int = Field(5, ge=1)
+    growth_factor: float = Field(2.0, ge=1.0)
+    # ウェーブ内の失敗率がこれを超えたら自動的に一時停止する
+    failure_threshold: float = Field(0.1, ge=0.0, le=1.0)
+
+class BulkSetupRequest(BaseModel):
+    computers: List[BulkComputerInfo]
+    setup_options: SetupOptions = Field(default_factory=SetupOptions)
+    priority: int = 0
+    rollout: Optional[RolloutSettings] = None  # 指定すると段階展開する
+
+class ConcurrencySettings(BaseModel):
+    # 省略した項目は変更しない
+    min_hosts: Optional[int] = None
+    max_hosts: Optional[int] = None
+    adaptive: Optional[bool] = None
+
 class TaskLog(BaseModel):
     computer_name: str
     task_name: str
@@ -295,6 +440,19 @@ class SetupRequest(BaseModel):
     estimated_time: Optional[int] = None
     actual_time: Optional[int] = None
 
+class HostStatus(BaseModel):
+    request_id: str
+    computer_name: str
+    current_task: Optional[str] = None
+    progress: float = 0.0
+    state: TaskStatus = TaskStatus.PENDING
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    estimated_seconds: Optional[float] = None
+    estimated_p90_seconds: Optional[float] = None
+    estimated_finish_at: Optional[datetime] = None  # 実行中のホストの完了予定時刻(中央値から)
+
 class SetupProgress(BaseModel):
     computer_name: str
     task_name: str
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# 受付時の到達性の事前確認の設定(環境変数で上書き可能)
+PREFLIGHT_ENABLED = os.getenv("PREFLIGHT_ENABLED", "true").lower() == "true"
+PREFLIGHT_PORTS = tuple(
+    int(port) for port in os.getenv("PREFLIGHT_PORTS", "5985,5986").split(",") if port.strip()
+)
+PREFLIGHT_TIMEOUT = float(os.getenv("PREFLIGHT_TIMEOUT", "3"))              # 1台の接続確認の期限(秒)
+PREFLIGHT_CONCURRENCY = int(os.getenv("PREFLIGHT_CONCURRENCY", "2000"))     # 同時に確認するホスト数
+PREFLIGHT_CACHE_TTL = float(os.getenv("PREFLIGHT_CACHE_TTL", "300"))        # 到達できた結果を使い回す期間(秒)
+# 到達できなかった結果を使い回す期間(秒)。電源を入れて再申請した場合にすぐ確認し直せるよう短くする
+PREFLIGHT_NEGATIVE_TTL = float(os.getenv("PREFLIGHT_NEGATIVE_TTL", "30"))
+# コンピュータ名の名前解決も確認するか
+PREFLIGHT_DNS_CHECK = os.getenv("PREFLIGHT_DNS_CHECK", "false").lower() == "true"
+PREFLIGHT_MAX_CACHE = 100000  # キャッシュするホスト数の上限
+
+@dataclass
+class ProbeResult:
+    """1台分の到達性の確認結果"""
+    address: str
+    reachable: bool
+    port: Optional[int] = None       # 接続できたポート
+    error: Optional[str] = None      # 到達できなかった理由
+    latency_ms: Optional[float] = None
+    checked_at: float = 0.0          # time.monotonic()
+
+async def probe_ports(address: str, ports: Sequence[int], timeout: float) -> Optional[int]:
+    """
+    いずれかのポートに TCP 接続できるかを確認する(全ポートを同時に試す)
+
+    Returns:
+        Optional[int]: 最初に接続できたポート(どのポートにも接続できない場合は None)
+    """
+    async def connect(port: int) -> int:
+        _, writer = await asyncio.open_connection(address, port)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return port
+
+    attempts = [asyncio.create_task(connect(port)) for port in ports]
+    try:
+        for attempt in asyncio.as_completed(attempts, timeout=timeout):
+            try:
+                return await attempt
+            except asyncio.TimeoutError:
+                break
+            except OSError:
+                continue
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+        await asyncio.gather(*attempts, return_exceptions=True)
+    return None
+
+async def resolve(name: str, timeout: float) -> bool:
+    """名前解決できるか"""
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.wait_for(loop.getaddrinfo(name, None, type=socket.SOCK_STREAM), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    return True
+
+class Preflight:
+    """
+    セットアップの受付時に、対象PCの WinRM ポートへ到達できるかを確認する
+
+    PowerShell を起動して New-PSSession のタイムアウトを待つより前に、到達できないPCを
+    見つけるための確認。全ホストを concurrency 台まで同時に確認し、結果は TTL の間
+    キャッシュする(同じアドレスの確認が重なった場合は1回にまとめる)。
+    """
+
+    def __init__(
+        self,
+        ports: Sequence[int] = PREFLIGHT_PORTS,
+        timeout: float = PREFLIGHT_TIMEOUT,
+        concurrency: int = PREFLIGHT_CONCURRENCY,
+        cache_ttl: float = PREFLIGHT_CACHE_TTL,
+        negative_ttl: float = PREFLIGHT_NEGATIVE_TTL,
+        dns_check: bool = PREFLIGHT_DNS_CHECK,
+        enabled: bool = PREFLIGHT_ENABLED
+    ):
+        self.ports = tuple(ports)
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.cache_ttl = cache_ttl
+        self.negative_ttl = negative_ttl
+        self.dns_check = dns_check
+        self.enabled = enabled
+        self._cache: Dict[str, ProbeResult] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.probes = 0
+        self.cache_hits = 0
+        self.unreachable = 0
+
+    async def check(self, computers: Sequence[Any]) -> Dict[str, ProbeResult]:
+        """
+        対象PCの到達性をまとめて確認する
+
+        Args:
+            computers (Sequence[Any]): 対象PC(ip_address が無い場合はコンピュータ名で接続する)
+
+        Returns:
+            Dict[str, ProbeResult]: コンピュータ名毎の確認結果(無効な場合は空)
+        """
+        if not self.enabled or not computers:
+            return {}
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        by_name: Dict[str, ProbeResult] = {}
+        misses = []
+        for computer in computers:
+            # キャッシュにあるホストはタスクを作らずに済ませる
+            cached = self._cached(computer.ip_address or computer.computer_name, started)
+            if cached is not None:
+                by_name[computer.computer_name] = cached
+            else:
+                misses.append(computer)
+        self.cache_hits += len(computers) - len(misses)
+        results = await asyncio.gather(*(self._check_one(computer) for computer in misses))
+        by_name.update((computer.computer_name, result) for computer, result in zip(misses, results))
+        unreachable = sum(1 for result in by_name.values() if not result.reachable)
+        logger.info(
+            f"到達性の事前確認: {len(computers)}台中 {unreachable}台に到達できません"
+            f"(確認 {len(misses)}台, {time.monotonic() - started:.1f}秒)"
+        )
+        return by_name
+
+    def _cached(self, address: str, now: float) -> Optional[ProbeResult]:
+        cached = self._cache.get(address)
+        if cached is None:
+            return None
+        ttl = self.cache_ttl if cached.reachable else self.negative_ttl
+        return cached if now - cached.checked_at < ttl else None
+
+    async def _check_one(self, computer: Any) -> ProbeResult:
+        address = computer.ip_address or computer.computer_name
+        if self.dns_check and not await resolve(computer.computer_name, self.timeout):
+            return self._store(ProbeResult(
+                address=address,
+                reachable=False,
+                error=f"コンピュータ名 {computer.computer_name} を名前解決できません",
+                checked_at=time.monotonic()
+            ))
+        inflight = self._inflight.get(address)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[address] = future
+        try:
+            result = self._store(await self._probe(address))
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 待っている他の確認が無ければ、取り出されない例外として警告されないようにする
+            future.exception()
+            raise
+        finally:
+            del self._inflight[address]
+
+    async def _probe(self, address: str) -> ProbeResult:
+        async with self._semaphore:
+            self.probes += 1
+            started = time.monotonic()
+            port = await probe_ports(address, self.ports, self.timeout)
+            finished = time.monotonic()
+        if port is None:
+            return ProbeResult(
+                address=address,
+                reachable=False,
+                error=f"WinRM(ポート {', '.join(map(str, self.ports))})に {self.timeout:g}秒以内に接続できません",
+                checked_at=finished
+            )
+        return ProbeResult(
+            address=address,
+            reachable=True,
+            port=port,
+            latency_ms=(finished - started) * 1000,
+            checked_at=finished
+        )
+
+    def _store(self, result: ProbeResult) -> ProbeResult:
+        if not result.reachable:
+            self.unreachable += 1
+        self._cache.pop(result.address, None)
+        self._cache[result.address] = result
+        if len(self._cache) > PREFLIGHT_MAX_CACHE:
+            # 古い順(挿入順)に捨てる
+            for address in list(self._cache)[:len(self._cache) - PREFLIGHT_MAX_CACHE]:
+                del self._cache[address]
+        return result
+
+    def invalidate(self, address: Optional[str] = None):
+        """キャッシュを破棄する(address を省略した場合は全て)"""
+        if address is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(address, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """確認の件数とキャッシュの状況を取得"""
+        return {
+            "enabled": self.enabled,
+            "ports": list(self.ports),
+            "dns_check": self.dns_check,
+            "cached_hosts": len(self._cache),
+            "probes_in_flight": len(self._inflight),
+            "probes": self.probes,
+            "cache_hits": self.cache_hits,
+            "unreachable": self.unreachable
+        }
+
+def probe_result_record(computer_name: str, result: ProbeResult) -> Dict[str, Any]:
+    """確認結果をレスポンス用の辞書に変換"""
+    record = asdict(result)
+    record.pop("checked_at")
+    return {"computer_name": computer_name, **record}
+
+# アプリケーション全体で共有する到達性の確認
+preflight = Preflight()
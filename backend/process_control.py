@@ -0,0 +1,43 @@
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+def new_process_group_kwargs() -> Dict[str, Any]:
+    """子プロセスをまとめて終了できるよう、新しいプロセスグループで起動するための引数"""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+async def kill_process_tree(process: asyncio.subprocess.Process):
+    """
+    プロセスとその子孫プロセスを強制終了する
+
+    Args:
+        process (asyncio.subprocess.Process): new_process_group_kwargs() で起動したプロセス
+    """
+    if process.returncode is not None:
+        return
+    try:
+        if sys.platform == "win32":
+            killer = await asyncio.create_subprocess_exec(
+                "taskkill", "/T", "/F", "/PID", str(process.pid),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            await killer.wait()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError, OSError) as e:
+        logger.warning(f"プロセスツリーの終了に失敗したためプロセスのみ終了します: pid={process.pid}: {str(e)}")
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    await process.wait()
+    logger.info(f"プロセスツリーを終了しました: pid={process.pid}")
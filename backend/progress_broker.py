@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 購読者1件あたりの未送信イベントの上限(環境変数で上書き可能)
+PROGRESS_SUBSCRIBER_QUEUE = int(os.getenv("PROGRESS_SUBSCRIBER_QUEUE", "1000"))
+# イベントが無い間に送るキープアライブの間隔(秒)
+PROGRESS_STREAM_KEEPALIVE = float(os.getenv("PROGRESS_STREAM_KEEPALIVE", "15"))
+# 別プロセスのワーカーが書き込んだ進捗をDBから読み取る間隔(秒)
+PROGRESS_TAIL_INTERVAL = float(os.getenv("PROGRESS_TAIL_INTERVAL", "1"))
+
+def _json_default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def format_sse(record: Dict[str, Any], event: str = "progress") -> str:
+    """進捗イベントを Server-Sent Events の1メッセージに変換(id はカーソルとして使われる)"""
+    data = json.dumps(record, ensure_ascii=False, default=_json_default)
+    return f"id: {record['id']}\nevent: {event}\ndata: {data}\n\n"
+
+class Subscription:
+    """1件の購読(1本のストリーム接続)"""
+
+    def __init__(self, request_id: str, max_queue: int):
+        self.request_id = request_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        # 取りこぼしが発生した購読は、クライアントにカーソルからの再接続を促して終了する
+        self.lagged = False
+
+    def offer(self, record: Dict[str, Any]):
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.lagged = True
+            # 待機中の get を起こすための番兵
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        次のイベントを待つ
+
+        Returns:
+            Optional[Dict[str, Any]]: イベント(timeout までに届かなければ None)
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class ProgressBroker:
+    """
+    書き込み済みの進捗イベントをリクエスト単位で配信するプロセス内 pub/sub
+
+    progress_writer がコミット後に publish するため、配信されるイベントは
+    必ずDBにも存在する。各イベントは setup_progress の id を持つので、
+    切断したクライアントは最後に受け取った id をカーソルにして再開できる。
+    """
+
+    def __init__(self, max_queue: int = PROGRESS_SUBSCRIBER_QUEUE):
+        self.max_queue = max_queue
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self.published = 0
+        self.lagged_subscribers = 0
+
+    def subscribe(self, request_id: str) -> Subscription:
+        """リクエストの進捗イベントを購読する"""
+        subscription = Subscription(request_id, self.max_queue)
+        self._subscriptions.setdefault(request_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """購読を解除する"""
+        subscriptions = self._subscriptions.get(subscription.request_id)
+        if subscriptions is None:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.request_id]
+
+    def publish(self, records: List[Dict[str, Any]]):
+        """
+        書き込み済みの進捗イベントを購読者に配信する
+
+        Args:
+            records (List[Dict[str, Any]]): id 付きの進捗イベント(id の昇順)
+        """
+        for record in records:
+            subscriptions = self._subscriptions.get(record["request_id"])
+            if not subscriptions:
+                continue
+            for subscription in subscriptions:
+                was_lagged = subscription.lagged
+                subscription.offer(record)
+                if subscription.lagged and not was_lagged:
+                    self.lagged_subscribers += 1
+                    logger.warning(f"進捗ストリームの購読者が追いつけないため切断: {record['request_id']}")
+            self.published += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """配信状況の統計を取得"""
+        return {
+            "requests": len(self._subscriptions),
+            "subscribers": sum(len(s) for s in self._subscriptions.values()),
+            "published": self.published,
+            "lagged_subscribers": self.lagged_subscribers
+        }
+
+class ProgressTailer:
+    """
+    DBの進捗ログを定期的に読み取り、ブローカーに配信する
+
+    ジョブを別プロセスのワーカーが実行する場合、進捗はこのプロセスの
+    progress_writer を通らないため、APIサーバー側で新しい行を追いかける。
+    購読者の数に関わらず、問い合わせは間隔毎に1回だけとなる。
+    """
+
+    def __init__(
+        self,
+        broker: ProgressBroker,
+        fetch_after: Callable[[Optional[int]], Awaitable[List[Dict[str, Any]]]],
+        interval: float = PROGRESS_TAIL_INTERVAL
+    ):
+        """
+        Args:
+            broker (ProgressBroker): 配信先のブローカー
+            fetch_after (Callable): id が指定値より大きい進捗ログを id の昇順で返す
+                (None の場合は最新の1件のみを返し、読み取り開始位置とする)
+            interval (float): 読み取り間隔(秒)
+        """
+        self.broker = broker
+        self.fetch_after = fetch_after
+        self.interval = interval
+        self.last_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is not None:
+            return
+        latest = await self.fetch_after(None)
+        self.last_id = latest[-1]["id"] if latest else 0
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                records = await self.fetch_after(self.last_id)
+            except Exception as e:
+                logger.error(f"進捗ログの読み取りに失敗: {str(e)}")
+                continue
+            if records:
+                self.broker.publish(records)
+                self.last_id = records[-1]["id"]
+
+# アプリケーション全体で共有する進捗ブローカー
+progress_broker = ProgressBroker()
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import insert, update, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, run_in_session
+from .models import SetupRequestDB, SetupProgressDB, HostStatusDB, TaskStatus
+from .progress_broker import ProgressBroker, progress_broker
+
+logger = logging.getLogger(__name__)
+
+# 書き込みバッファの設定(環境変数で上書き可能)
+PROGRESS_FLUSH_INTERVAL_MS = int(os.getenv("PROGRESS_FLUSH_INTERVAL_MS", "200"))
+PROGRESS_FLUSH_BATCH = int(os.getenv("PROGRESS_FLUSH_BATCH", "500"))
+PROGRESS_MAX_BUFFER = int(os.getenv("PROGRESS_MAX_BUFFER", "100000"))
+
+# ホスト全体の状態を表すタスク名と、それに対応するホストの状態
+HOST_FINAL_STATES = {
+    "setup_completion": TaskStatus.COMPLETED.value,
+    "setup_error": TaskStatus.FAILED.value,
+    "setup_unreachable": TaskStatus.FAILED.value,
+    "setup_cancelled": TaskStatus.CANCELLED.value
+}
+HOST_START_TASK = "setup_initialization"
+
+@dataclass
+class ProgressEvent:
+    """進捗ログ1件分のイベント"""
+    request_id: str
+    computer_name: str
+    task_name: str
+    status: str
+    progress: float
+    message: str
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    duration: Optional[int] = None
+    timestamp: datetime = field(default_factory=datetime.now)
+
+class ProgressWriter:
+    """
+    進捗ログの書き込みをまとめて行うライトビハインドバッファ
+
+    イベントはメモリに溜め、flush_interval_ms 毎または batch_size 件毎に
+    1トランザクションで書き込む(グループコミット)。同じホストの
+    host_status への更新は1回のフラッシュ内で最新の状態にまとめ、1行ずつ upsert する。
+    書き込みはDB用スレッドプールで行うため、イベントループはブロックされない。
+    コミット済みのイベントは setup_progress の id を付けて broker に配信する。
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        flush_interval_ms: int = PROGRESS_FLUSH_INTERVAL_MS,
+        batch_size: int = PROGRESS_FLUSH_BATCH,
+        max_buffer: int = PROGRESS_MAX_BUFFER,
+        broker: Optional[ProgressBroker] = progress_broker
+    ):
+        self.session_factory = session_factory
+        self.broker = broker
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+
+        self._events: List[ProgressEvent] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self.events_written = 0
+        self.events_dropped = 0
+        self.coalesced_updates = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+
+    def write(self, event: ProgressEvent):
+        """イベントをバッファに追加(DBへの書き込みは行わない)"""
+        if len(self._events) >= self.max_buffer:
+            self.events_dropped += 1
+            logger.error(f"進捗バッファが上限に達したためイベントを破棄: {event.request_id}/{event.computer_name}")
+            return
+        self._events.append(event)
+        if len(self._events) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self):
+        """定期フラッシュを開始"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """定期フラッシュを停止し、残りのイベントを書き込む"""
+        if self._task is not None:
+            # フラッシュ途中で中断しないよう、ループの終了を待つ
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._stopping = False
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """バッファ中のイベントを1トランザクションで書き込む"""
+        async with self._flush_lock:
+            events, self._events = self._events, []
+            if not events:
+                return
+            started = time.perf_counter()
+            try:
+                records = await run_in_session(
+                    lambda db: self._write_batch(db, events),
+                    session_factory=self.session_factory
+                )
+            except Exception as e:
+                # 書き込みに失敗したイベントはバッファの先頭に戻して次回再試行する
+                logger.error(f"進捗ログの書き込みに失敗: {str(e)}", exc_info=True)
+                self._events = events + self._events
+                overflow = len(self._events) - self.max_buffer
+                if overflow > 0:
+                    del self._events[:overflow]
+                    self.events_dropped += overflow
+                return
+            self.flushes += 1
+            self.events_written += len(events)
+            self.last_flush_seconds = time.perf_counter() - started
+            if self.broker is not None:
+                self.broker.publish(records)
+
+    def _write_batch(self, db: Session, events: List[ProgressEvent]) -> List[Dict[str, Any]]:
+        # ホスト毎の状態は最後の値だけを反映する
+        host_rows: Dict[tuple, Dict[str, Any]] = {}
+        request_durations: Dict[str, int] = {}
+        for event in events:
+            key = (event.request_id, event.computer_name)
+            row = host_rows.get(key)
+            if row is None:
+                row = {
+                    "request_id": event.request_id,
+                    "computer_name": event.computer_name,
+                    "current_task": None,
+                    "started_at": None
+                }
+                host_rows[key] = row
+            else:
+                self.coalesced_updates += 1
+            apply_host_event(row, event)
+
+            request_durations.setdefault(event.request_id, 0)
+            if event.duration and event.status in ["Completed", "Failed"]:
+                request_durations[event.request_id] += event.duration
+
+        records = [asdict(event) for event in events]
+        ids = db.execute(
+            insert(SetupProgressDB).returning(SetupProgressDB.id, sort_by_parameter_order=True),
+            records
+        ).scalars().all()
+        for record, progress_id in zip(records, ids):
+            record["id"] = progress_id
+
+        # (request_id, computer_name) の主キーで1ホスト1行を upsert
+        statement = sqlite_insert(HostStatusDB)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[HostStatusDB.request_id, HostStatusDB.computer_name],
+                set_={
+                    "progress": statement.excluded.progress,
+                    "state": statement.excluded.state,
+                    "current_task": func.coalesce(statement.excluded.current_task, HostStatusDB.current_task),
+                    "started_at": func.coalesce(statement.excluded.started_at, HostStatusDB.started_at),
+                    "finished_at": statement.excluded.finished_at,
+                    "updated_at": statement.excluded.updated_at
+                }
+            ),
+            list(host_rows.values())
+        )
+
+        # 進捗を受け取ったリクエストは版数を上げ、ETag を無効にする
+        for request_id, seconds in request_durations.items():
+            values = {"progress_version": func.coalesce(SetupRequestDB.progress_version, 0) + 1}
+            if seconds:
+                values["actual_time"] = func.coalesce(SetupRequestDB.actual_time, 0) + seconds
+            db.execute(
+                update(SetupRequestDB)
+                .where(SetupRequestDB.request_id == request_id)
+                .values(**values)
+            )
+
+        db.commit()
+        return records
+
+    def get_stats(self) -> Dict[str, Any]:
+        """書き込み状況の統計を取得"""
+        return {
+            "buffered_events": len(self._events),
+            "events_written": self.events_written,
+            "events_dropped": self.events_dropped,
+            "coalesced_updates": self.coalesced_updates,
+            "flushes": self.flushes,
+            "last_flush_seconds": self.last_flush_seconds
+        }
+
+def apply_host_event(row: Dict[str, Any], event: ProgressEvent):
+    """進捗イベントをホスト状態の行に反映する"""
+    row["progress"] = event.progress
+    row["updated_at"] = event.timestamp
+    if event.task_name in HOST_FINAL_STATES:
+        row["state"] = HOST_FINAL_STATES[event.task_name]
+        row["finished_at"] = event.end_time or event.timestamp
+        return
+
+    row["state"] = TaskStatus.IN_PROGRESS.value
+    row["finished_at"] = None
+    if event.task_name == HOST_START_TASK:
+        row["started_at"] = event.start_time or event.timestamp
+    else:
+        row["current_task"] = event.task_name
+
+# アプリケーション全体で共有する進捗ライター
+progress_writer = ProgressWriter()
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from .preflight import probe_ports
+
+logger = logging.getLogger(__name__)
+
+# 再起動待ちの設定(環境変数で上書き可能)
+REBOOT_PARK_TIMEOUT = float(os.getenv("REBOOT_PARK_TIMEOUT", "1800"))      # 再起動の完了を待つ上限(秒)
+REBOOT_POLL_INTERVAL = float(os.getenv("REBOOT_POLL_INTERVAL", "10"))      # 応答を確認する間隔(秒)
+REBOOT_PROBE_TIMEOUT = float(os.getenv("REBOOT_PROBE_TIMEOUT", "3"))       # 1回の接続確認の期限(秒)
+# 停止を検知できないまま応答が続いた場合に、再起動が終わったとみなすまでの時間(秒)
+REBOOT_DOWN_GRACE = float(os.getenv("REBOOT_DOWN_GRACE", "180"))
+# 応答が戻ってから、ログオン・サービスの起動を待つ時間(秒)
+REBOOT_SETTLE_SECONDS = float(os.getenv("REBOOT_SETTLE_SECONDS", "30"))
+REBOOT_PROBE_PORTS = tuple(
+    int(port) for port in os.getenv("REBOOT_PROBE_PORTS", "5985,5986").split(",") if port.strip()
+)
+REBOOT_MAX_PROBES = 200  # 同時に行う接続確認の数
+# 成功すると必ず再起動するタスク(スクリプトは再起動を指示するだけで、完了は待たない)
+REBOOT_TASKS = {"restart_system"}
+
+# 再起動待ちの段階
+GOING_DOWN = "going_down"  # 再起動を指示したが、まだ応答している
+DOWN = "down"              # 応答が無い
+SETTLING = "settling"      # 応答が戻り、落ち着くのを待っている
+
+@dataclass
+class _Watch:
+    address: str
+    started: float
+    future: asyncio.Future
+    phase: str = GOING_DOWN
+    changed: float = field(default_factory=time.monotonic)
+
+def is_rebooting(task_id: str, result: Optional[Dict[str, Any]]) -> bool:
+    """
+    タスクの完了後にホストが再起動するか
+
+    REBOOT_TASKS のほか、スクリプトの結果に "rebooting": true を含む場合
+    (Windows Update が自動で再起動した場合など)も再起動とみなす。
+    """
+    if task_id in REBOOT_TASKS:
+        return True
+    if not isinstance(result, dict):
+        return False
+    details = result.get("details")
+    return bool(result.get("rebooting") or (isinstance(details, dict) and details.get("rebooting")))
+
+class RebootWatcher:
+    """
+    再起動中のホストが WinRM に応答するまで待つ
+
+    待機中の全ホストを1つのループでまとめて確認するため、ホスト数に関わらず
+    タスクは1つ、接続確認は REBOOT_POLL_INTERVAL 毎に1台1回で済む。
+    待っているホストが無くなるとループは終了する。
+
+    再起動の指示直後はまだ応答することがあるため、一度応答が無くなる(停止を検知する)のを待ってから
+    応答の回復を待つ。確認の間隔より速く再起動した場合に備え、REBOOT_DOWN_GRACE 秒経っても
+    応答し続けているホストは再起動が終わったものとみなす。
+    """
+
+    def __init__(
+        self,
+        poll_interval: float = REBOOT_POLL_INTERVAL,
+        down_grace: float = REBOOT_DOWN_GRACE,
+        settle_seconds: float = REBOOT_SETTLE_SECONDS,
+        ports: Sequence[int] = REBOOT_PROBE_PORTS,
+        probe_timeout: float = REBOOT_PROBE_TIMEOUT
+    ):
+        self.poll_interval = poll_interval
+        self.down_grace = down_grace
+        self.settle_seconds = settle_seconds
+        self.ports = tuple(ports)
+        self.probe_timeout = probe_timeout
+        self._watches: Dict[int, _Watch] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._probe_semaphore: Optional[asyncio.Semaphore] = None
+        self.recovered_hosts = 0
+        self.timed_out_hosts = 0
+
+    async def wait_until_back(self, address: str, timeout: float = REBOOT_PARK_TIMEOUT) -> float:
+        """
+        再起動したホストが応答するまで待つ
+
+        Args:
+            address (str): ホストのアドレス(IPアドレスまたはコンピュータ名)
+            timeout (float): 待つ上限(秒)
+
+        Returns:
+            float: 待った時間(秒)
+
+        Raises:
+            asyncio.TimeoutError: timeout 秒以内に応答しなかった場合
+        """
+        loop = asyncio.get_running_loop()
+        watch = _Watch(address=address, started=time.monotonic(), future=loop.create_future())
+        self._watches[id(watch)] = watch
+        if self._task is None or self._task.done():
+            self._probe_semaphore = asyncio.Semaphore(REBOOT_MAX_PROBES)
+            self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(asyncio.shield(watch.future), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out_hosts += 1
+            raise
+        finally:
+            self._watches.pop(id(watch), None)
+        self.recovered_hosts += 1
+        return time.monotonic() - watch.started
+
+    async def _run(self):
+        while self._watches:
+            await asyncio.sleep(self.poll_interval)
+            watches = list(self._watches.values())
+            results = await asyncio.gather(*(self._probe(watch.address) for watch in watches))
+            now = time.monotonic()
+            for watch, reachable in zip(watches, results):
+                if not watch.future.done():
+                    self._advance(watch, reachable, now)
+
+    async def _probe(self, address: str) -> bool:
+        async with self._probe_semaphore:
+            return await probe_ports(address, self.ports, self.probe_timeout) is not None
+
+    def _advance(self, watch: _Watch, reachable: bool, now: float):
+        if not reachable:
+            if watch.phase != DOWN:
+                watch.phase, watch.changed = DOWN, now
+            return
+        if watch.phase == DOWN or (watch.phase == GOING_DOWN and now - watch.started >= self.down_grace):
+            watch.phase, watch.changed = SETTLING, now
+        if watch.phase == SETTLING and now - watch.changed >= self.settle_seconds:
+            logger.info(f"再起動したホストが応答しました: {watch.address}({int(now - watch.started)}秒)")
+            watch.future.set_result(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """再起動を待っているホストの状況を取得"""
+        now = time.monotonic()
+        hosts: List[Dict[str, Any]] = [
+            {"address": watch.address, "phase": watch.phase, "waiting_seconds": now - watch.started}
+            for watch in self._watches.values()
+        ]
+        return {
+            "waiting_hosts": len(hosts),
+            "recovered_hosts": self.recovered_hosts,
+            "timed_out_hosts": self.timed_out_hosts,
+            "hosts": hosts
+        }
+
+# アプリケーション全体で共有する再起動の監視
+reboot_watcher = RebootWatcher()
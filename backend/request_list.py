@@ -0,0 +1,154 @@
+import base64
+import binascii
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session, load_only, selectinload
+
+from .models import SetupRequestDB, ComputerInfoDB, SetupOptionsDB
+
+# 一覧で返せる列(current_progress などの重いJSON列は含めない)
+REQUEST_LIST_COLUMNS = (
+    "request_id",
+    "requester",
+    "status",
+    "created_at",
+    "updated_at",
+    "approved_by",
+    "approved_at",
+    "rejection_reason",
+    "estimated_time",
+    "actual_time"
+)
+REQUEST_LIST_RELATIONS = ("computers", "setup_options")
+REQUEST_LIST_DEFAULT_FIELDS = REQUEST_LIST_COLUMNS + ("computers",)
+
+# 一覧に含めるコンピュータ情報(認証情報は返さない)
+COMPUTER_SUMMARY_FIELDS = ("computer_name", "ip_address", "login_type", "full_name")
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+@dataclass
+class RequestListFilter:
+    """一覧の絞り込み条件"""
+    status: Optional[str] = None
+    requester: Optional[str] = None
+    requester_prefix: Optional[str] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+
+def encode_cursor(created_at: datetime, request_id: str) -> str:
+    """(created_at, request_id) をページングカーソルに変換"""
+    raw = f"{created_at.isoformat()}|{request_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    ページングカーソルを (created_at, request_id) に戻す
+
+    Raises:
+        ValueError: カーソルの形式が不正な場合
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, request_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), request_id
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise ValueError(f"不正なカーソルです: {cursor}") from e
+
+def parse_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    """
+    fields パラメータ(カンマ区切り)を検証する
+
+    Raises:
+        ValueError: 未知のフィールドが含まれる場合
+    """
+    if not fields:
+        return REQUEST_LIST_DEFAULT_FIELDS
+    selected = tuple(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in selected if f not in REQUEST_LIST_COLUMNS + REQUEST_LIST_RELATIONS]
+    if unknown:
+        raise ValueError(f"指定できないフィールドです: {', '.join(unknown)}")
+    # カーソルの生成に必要な列は常に読み込む
+    return tuple(dict.fromkeys(("request_id", "created_at") + selected))
+
+def query_request_page(
+    db: Session,
+    filters: RequestListFilter,
+    fields: Sequence[str],
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None
+) -> Tuple[List[SetupRequestDB], Optional[str]]:
+    """
+    (created_at, request_id) のキーセットページングでリクエスト一覧を取得する
+
+    OFFSET を使わないため、何ページ目でも索引を辿るだけで済む。
+    関連(computers, setup_options)は selectin で一括読み込みし、N+1 クエリを避ける。
+
+    Args:
+        db (Session): セッション
+        filters (RequestListFilter): 絞り込み条件
+        fields (Sequence[str]): 読み込むフィールド
+        limit (int): 1ページの件数
+        cursor (Optional[str]): 前ページの next_cursor
+
+    Returns:
+        Tuple[List[SetupRequestDB], Optional[str]]: リクエストのリストと次ページのカーソル
+    """
+    columns = [getattr(SetupRequestDB, f) for f in fields if f in REQUEST_LIST_COLUMNS]
+    options = [load_only(*columns)]
+    if "computers" in fields:
+        options.append(selectinload(SetupRequestDB.computers).load_only(
+            *(getattr(ComputerInfoDB, f) for f in COMPUTER_SUMMARY_FIELDS)
+        ))
+    if "setup_options" in fields:
+        options.append(selectinload(SetupRequestDB.setup_options))
+
+    query = db.query(SetupRequestDB).options(*options)
+    if filters.status:
+        query = query.filter(SetupRequestDB.status == filters.status)
+    if filters.requester:
+        query = query.filter(SetupRequestDB.requester == filters.requester)
+    if filters.requester_prefix:
+        query = query.filter(SetupRequestDB.requester.startswith(filters.requester_prefix, autoescape=True))
+    if filters.created_from:
+        query = query.filter(SetupRequestDB.created_at >= filters.created_from)
+    if filters.created_to:
+        query = query.filter(SetupRequestDB.created_at < filters.created_to)
+    if cursor:
+        created_at, request_id = decode_cursor(cursor)
+        query = query.filter(
+            tuple_(SetupRequestDB.created_at, SetupRequestDB.request_id) < tuple_(created_at, request_id)
+        )
+
+    # 1件多く読み、次ページの有無を判定する
+    rows = query.order_by(
+        SetupRequestDB.created_at.desc(),
+        SetupRequestDB.request_id.desc()
+    ).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].request_id)
+    return rows, next_cursor
+
+def serialize_request(request: SetupRequestDB, fields: Sequence[str]) -> Dict[str, Any]:
+    """一覧用にリクエストを辞書に変換"""
+    data = {f: getattr(request, f) for f in fields if f in REQUEST_LIST_COLUMNS}
+    if "computers" in fields:
+        data["computers"] = [
+            {f: getattr(computer, f) for f in COMPUTER_SUMMARY_FIELDS}
+            for computer in request.computers
+        ]
+    if "setup_options" in fields:
+        options = request.setup_options
+        data["setup_options"] = None if options is None else {
+            column.name: getattr(options, column.name)
+            for column in SetupOptionsDB.__table__.columns
+            if column.name not in ("id", "request_id")
+        }
+    return data
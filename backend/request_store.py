@@ -0,0 +1,132 @@
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from .models import (
+    SetupRequestDB, ComputerInfoDB, SetupOptionsDB, HostStatusDB,
+    ComputerInfo, SetupOptions, TaskStatus
+)
+from .job_store import insert_host_jobs
+
+# 1回の executemany で送る行数(環境変数で上書き可能)
+BULK_INSERT_BATCH = int(os.getenv("BULK_INSERT_BATCH", "500"))
+
+COMPUTER_COLUMNS = tuple(
+    column.name for column in ComputerInfoDB.__table__.columns
+    if column.name not in ("id", "request_id")
+)
+
+def _batches(rows: Sequence[Dict[str, Any]], size: int):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def insert_setup_request(
+    db: Session,
+    request_id: str,
+    requester: str,
+    status: str,
+    computers: Sequence[ComputerInfo],
+    setup_options: SetupOptions,
+    host_options: Optional[Dict[str, SetupOptions]] = None,
+    batch_size: int = BULK_INSERT_BATCH,
+    priority: int = 0,
+    job_state: str = TaskStatus.PENDING.value,
+    estimated_seconds: Optional[Sequence[float]] = None,
+    waves: Optional[Sequence[Optional[int]]] = None,
+    estimated_p90_seconds: Optional[Sequence[float]] = None,
+    estimated_time: Optional[int] = None,
+    unreachable: Optional[Dict[str, str]] = None
+) -> Tuple[List[int], List[int]]:
+    """
+    リクエストと対象PC・設定・ホスト状態・ジョブを Core の executemany でまとめて登録する
+
+    ORM の unit of work を通さず、テーブル毎に batch_size 行ずつ INSERT する。
+    コミットは行わないため、呼び出し元のトランザクションでまとめて確定すること。
+
+    Args:
+        db (Session): セッション
+        request_id (str): リクエストID
+        requester (str): 申請者
+        status (str): 初期ステータス
+        computers (Sequence[ComputerInfo]): 対象PC
+        setup_options (SetupOptions): リクエスト共通の設定
+        host_options (Optional[Dict[str, SetupOptions]]): PC名毎の個別設定
+        batch_size (int): 1回の INSERT で送る行数
+        priority (int): 実行の優先度
+        job_state (str): ジョブの初期状態(受付制御で待機させる場合は PARKED_JOB_STATE)
+        estimated_seconds (Optional[Sequence[float]]): PC毎の推定所要時間(秒)
+        waves (Optional[Sequence[Optional[int]]]): PC毎の段階展開のウェーブ番号
+        estimated_p90_seconds (Optional[Sequence[float]]): PC毎の推定所要時間の90パーセンタイル(秒)
+        estimated_time (Optional[int]): リクエスト全体の推定所要時間(分)
+        unreachable (Optional[Dict[str, str]]): 事前確認で到達できなかったPC名と理由(ホスト・ジョブを失敗として登録する)
+
+    Returns:
+        Tuple[List[int], List[int]]: 登録した ComputerInfoDB と HostJobDB の id(computers と同じ順序)
+    """
+    db.execute(insert(SetupRequestDB).values(
+        request_id=request_id,
+        requester=requester,
+        status=status,
+        progress_version=0,
+        priority=priority,
+        estimated_time=estimated_time
+    ))
+
+    computer_rows = []
+    for computer in computers:
+        values = computer.dict()
+        row = {name: values.get(name) for name in COMPUTER_COLUMNS}
+        row["request_id"] = request_id
+        computer_rows.append(row)
+
+    computer_ids: List[int] = []
+    for batch in _batches(computer_rows, batch_size):
+        computer_ids.extend(db.execute(
+            insert(ComputerInfoDB).returning(ComputerInfoDB.id, sort_by_parameter_order=True),
+            batch
+        ).scalars().all())
+
+    options_rows = [{**setup_options.dict(), "request_id": request_id, "computer_id": None}]
+    for computer, computer_id in zip(computers, computer_ids):
+        options = (host_options or {}).get(computer.computer_name)
+        if options is not None:
+            options_rows.append({**options.dict(), "request_id": request_id, "computer_id": computer_id})
+    for batch in _batches(options_rows, batch_size):
+        db.execute(insert(SetupOptionsDB), batch)
+
+    unreachable = unreachable or {}
+    now = datetime.now()
+    status_rows = [
+        {
+            "request_id": request_id,
+            "computer_name": computer.computer_name,
+            "progress": 0.0,
+            "state": TaskStatus.FAILED.value if computer.computer_name in unreachable else TaskStatus.PENDING.value,
+            "finished_at": now if computer.computer_name in unreachable else None,
+            "estimated_seconds": estimated_seconds[index] if estimated_seconds else None,
+            "estimated_p90_seconds": estimated_p90_seconds[index] if estimated_p90_seconds else None
+        }
+        for index, computer in enumerate(computers)
+    ]
+    for batch in _batches(status_rows, batch_size):
+        db.execute(insert(HostStatusDB), batch)
+
+    job_ids: List[int] = []
+    for start in range(0, len(computers), batch_size):
+        job_ids.extend(insert_host_jobs(
+            db,
+            request_id,
+            computers[start:start + batch_size],
+            computer_ids[start:start + batch_size],
+            requester=requester,
+            priority=priority,
+            state=job_state,
+            estimated_seconds=estimated_seconds[start:start + batch_size] if estimated_seconds else None,
+            waves=waves[start:start + batch_size] if waves else None,
+            unreachable=unreachable
+        ))
+
+    return computer_ids, job_ids
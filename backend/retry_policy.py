@@ -0,0 +1,130 @@
+import os
+import random
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from .errors import (
+    ErrorCategory, SetupError, AuthenticationError, NetworkError, PowerShellError, ValidationError
+)
+
+# タスク単位の実行期限(秒)。ホスト単位の期限は executor.HOST_TIMEOUT
+TASK_TIMEOUT = float(os.getenv("TASK_TIMEOUT", "1800"))
+
+# 既定より長い実行期限が必要なタスク
+TASK_TIMEOUTS = {
+    "install_office": 5400,
+    "update_office": 3600,
+    "update_windows": 7200,
+    "restart_system": 600  # 再起動の指示まで(完了は reboot_watcher で待つ)
+}
+
+def get_task_timeout(task_id: str) -> float:
+    """タスクの実行期限を取得"""
+    return float(TASK_TIMEOUTS.get(task_id, TASK_TIMEOUT))
+
+@dataclass
+class RetryRule:
+    """エラーカテゴリ毎のリトライ設定"""
+    max_retries: int
+    base_delay: float = 5.0    # 初回リトライまでの基準待機時間(秒)
+    max_delay: float = 300.0   # 待機時間の上限(秒)
+
+DEFAULT_RETRY_RULES: Dict[ErrorCategory, RetryRule] = {
+    ErrorCategory.NETWORK: RetryRule(max_retries=3, base_delay=5.0, max_delay=120.0),
+    ErrorCategory.TIMEOUT: RetryRule(max_retries=1, base_delay=30.0, max_delay=300.0),
+    ErrorCategory.POWERSHELL: RetryRule(max_retries=1, base_delay=10.0, max_delay=60.0),
+    ErrorCategory.SETUP: RetryRule(max_retries=1, base_delay=10.0, max_delay=60.0),
+    ErrorCategory.SYSTEM: RetryRule(max_retries=0),
+    ErrorCategory.VALIDATION: RetryRule(max_retries=0),
+    ErrorCategory.AUTHENTICATION: RetryRule(max_retries=0),
+    ErrorCategory.DATABASE: RetryRule(max_retries=0)
+}
+
+class RetryPolicy:
+    """
+    SetupError のカテゴリに基づくリトライ判定と待機時間の計算
+
+    リトライ回数は SetupError.retry_count で管理し、カテゴリ毎の上限と
+    エラー自身の max_retries の両方を満たす場合のみリトライする。
+    """
+
+    def __init__(
+        self,
+        rules: Optional[Dict[ErrorCategory, RetryRule]] = None,
+        rng: Optional[random.Random] = None
+    ):
+        self.rules = {**DEFAULT_RETRY_RULES, **(rules or {})}
+        self.rng = rng or random.Random()
+
+    def should_retry(self, error: SetupError) -> bool:
+        """リトライすべきかどうかを判定"""
+        rule = self.rules.get(error.category)
+        if rule is None:
+            return False
+        return error.can_retry() and error.retry_count < rule.max_retries
+
+    def backoff(self, error: SetupError) -> float:
+        """
+        次のリトライまでの待機時間(秒)を計算
+
+        指数バックオフの上限値から一様に選ぶ(フルジッター)ことで、
+        同時に失敗した多数のホストのリトライが同じ時刻に集中しないようにする。
+        """
+        rule = self.rules.get(error.category) or RetryRule(max_retries=0)
+        ceiling = min(rule.max_delay, rule.base_delay * (2 ** error.retry_count))
+        return self.rng.uniform(0, ceiling)
+
+# スクリプトのエラーメッセージからネットワーク障害と判断する文字列
+NETWORK_ERROR_MARKERS = (
+    "winrm",
+    "wsman",
+    "new-pssession",
+    "rpc server",
+    "network path",
+    "connection",
+    "接続",
+    "到達できません"
+)
+
+# 資格情報の誤り・アクセス拒否。WinRM の接続エラーとして報告されることが多いため、
+# ネットワーク障害より先に判定する(リトライするとアカウントがロックアウトされうる)
+AUTHENTICATION_ERROR_MARKERS = (
+    "access is denied",
+    "logon failure",
+    "user name or password is incorrect",
+    "unauthorized",
+    "認証に失敗",
+    "アクセスが拒否",
+    "ユーザー名またはパスワードが正しくありません"
+)
+
+# 設定・入力の不備で、リトライしても解決しないエラー
+VALIDATION_ERROR_MARKERS = (
+    "ログイン情報が不足",
+    "スクリプトが定義されていません",
+    "スクリプトが見つかりません"
+)
+
+def classify_task_failure(message: str, computer_name: str, task_name: str) -> SetupError:
+    """
+    タスクの失敗メッセージを SetupError に分類する
+
+    Args:
+        message (str): execute_setup_task が返したエラーメッセージ
+        computer_name (str): 対象コンピュータ名
+        task_name (str): タスク名
+
+    Returns:
+        SetupError: カテゴリ付きのエラー
+    """
+    lowered = message.lower()
+    if any(marker in message for marker in VALIDATION_ERROR_MARKERS):
+        return ValidationError(message, details={"host": computer_name, "task_name": task_name})
+    if any(marker in lowered for marker in AUTHENTICATION_ERROR_MARKERS):
+        return AuthenticationError(message, host=computer_name, details={"task_name": task_name})
+    if any(marker in lowered for marker in NETWORK_ERROR_MARKERS):
+        return NetworkError(message, host=computer_name)
+    return PowerShellError(message, exit_code=1, stderr=message, command=task_name)
+
+# アプリケーション全体で共有するリトライポリシー
+retry_policy = RetryPolicy()
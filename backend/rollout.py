@@ -0,0 +1,259 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from .job_store import HELD_JOB_STATE, PARKED_JOB_STATE, OPEN_JOB_STATES
+from .models import HostJobDB, RolloutDB, RolloutSettings, TaskStatus
+
+logger = logging.getLogger(__name__)
+
+# 段階展開の状態
+ROLLOUT_RUNNING = "running"
+ROLLOUT_PAUSED = "paused"
+ROLLOUT_COMPLETED = "completed"
+
+def plan_waves(count: int, canary_size: int, growth_factor: float) -> List[int]:
+    """
+    対象PCの並び順にウェーブ番号を割り当てる
+
+    ウェーブ 0 がカナリア(canary_size 台)、以降は直前のウェーブの growth_factor 倍
+    (最低でも1台ずつ増える)の大きさとする。例: 5台, 2倍 → 5, 10, 20, 40, ...
+
+    Returns:
+        List[int]: PC毎のウェーブ番号
+    """
+    waves: List[int] = []
+    size, wave = canary_size, 0
+    while len(waves) < count:
+        waves.extend([wave] * min(size, count - len(waves)))
+        size = max(int(size * growth_factor), size + 1)
+        wave += 1
+    return waves
+
+def create_rollout(db: Session, request_id: str, settings: RolloutSettings, waves: List[Optional[int]]):
+    """
+    段階展開の進行状況を登録する(コミットは呼び出し元で行う)
+
+    ウェーブ番号が None のPC(事前確認で到達できなかったPC)はどのウェーブにも含めない。
+    """
+    db.add(RolloutDB(
+        request_id=request_id,
+        canary_size=settings.canary_size,
+        growth_factor=settings.growth_factor,
+        failure_threshold=settings.failure_threshold,
+        state=ROLLOUT_RUNNING if 0 in waves else ROLLOUT_COMPLETED,
+        current_wave=0,
+        total_waves=max((wave for wave in waves if wave is not None), default=-1) + 1,
+        wave_total=waves.count(0),
+        wave_finished=0,
+        wave_failed=0,
+        updated_at=datetime.now()
+    ))
+
+def record_wave_result(db: Session, request_id: str, wave: int, state: str) -> List[int]:
+    """
+    終了したジョブをウェーブの集計に加え、一時停止・次のウェーブへの移行を判定する(コミットは呼び出し元で行う)
+
+    集計は加算の UPDATE で行い、setup_progress は読み直さない。失敗率
+    (失敗した台数 / ウェーブの台数)が閾値を超えた時点で、ウェーブの残りを待たずに一時停止する。
+
+    Returns:
+        List[int]: 次のウェーブとして実行待ちにしたジョブの id
+    """
+    failed = 1 if state == TaskStatus.FAILED.value else 0
+    row = db.execute(
+        update(RolloutDB)
+        .where(RolloutDB.request_id == request_id, RolloutDB.current_wave == wave)
+        .values(
+            wave_finished=RolloutDB.wave_finished + 1,
+            wave_failed=RolloutDB.wave_failed + failed,
+            updated_at=datetime.now()
+        )
+        .returning(
+            RolloutDB.state, RolloutDB.wave_total, RolloutDB.wave_finished,
+            RolloutDB.wave_failed, RolloutDB.failure_threshold
+        )
+    ).first()
+    if row is None or row.state != ROLLOUT_RUNNING:
+        # 以前のウェーブの遅れて終わったジョブ、または一時停止中
+        return []
+
+    failure_rate = row.wave_failed / max(row.wave_total, 1)
+    if failed and failure_rate > row.failure_threshold:
+        pause_rollout(
+            db,
+            request_id,
+            f"ウェーブ {wave} の失敗率 {failure_rate:.0%} が閾値 {row.failure_threshold:.0%} を超えました"
+            f"({row.wave_failed}/{row.wave_total}台)"
+        )
+        return []
+    if row.wave_finished >= row.wave_total:
+        return _start_next_wave(db, request_id, wave + 1)
+    return []
+
+def _start_next_wave(db: Session, request_id: str, wave: int) -> List[int]:
+    job_ids = list(db.execute(
+        update(HostJobDB)
+        .where(
+            HostJobDB.request_id == request_id,
+            HostJobDB.wave == wave,
+            HostJobDB.state == HELD_JOB_STATE
+        )
+        .values(state=TaskStatus.PENDING.value, updated_at=datetime.now())
+        .returning(HostJobDB.id)
+    ).scalars().all())
+    values: Dict[str, Any] = {
+        "current_wave": wave,
+        "wave_total": len(job_ids),
+        "wave_finished": 0,
+        "wave_failed": 0,
+        "updated_at": datetime.now()
+    }
+    if not job_ids:
+        values["state"] = ROLLOUT_COMPLETED
+    db.execute(update(RolloutDB).where(RolloutDB.request_id == request_id).values(**values))
+    if job_ids:
+        logger.info(f"リクエスト {request_id} のウェーブ {wave} を開始します: {len(job_ids)}台")
+    else:
+        logger.info(f"リクエスト {request_id} の段階展開が完了しました")
+    return sorted(job_ids)
+
+def pause_rollout(db: Session, request_id: str, reason: str) -> int:
+    """
+    段階展開を一時停止する(コミットは呼び出し元で行う)
+
+    まだ開始していないジョブ(キュー待ち・ワーカーの占有待ちを含む)を保留に戻す。
+    キューに残ったジョブは開始時の状態確認で読み飛ばされるため、実行中のホストを
+    除いて即座に止まる。実行中のホストは中断せずに終わらせる。
+
+    Returns:
+        int: 保留に戻したジョブ数(段階展開でないか既に停止・完了している場合は -1)
+    """
+    paused = db.execute(
+        update(RolloutDB)
+        .where(RolloutDB.request_id == request_id, RolloutDB.state == ROLLOUT_RUNNING)
+        .values(state=ROLLOUT_PAUSED, paused_reason=reason, paused_at=datetime.now(), updated_at=datetime.now())
+    ).rowcount
+    if not paused:
+        return -1
+    held = db.execute(
+        update(HostJobDB)
+        .where(
+            HostJobDB.request_id == request_id,
+            HostJobDB.state.in_((TaskStatus.PENDING.value, PARKED_JOB_STATE))
+        )
+        .values(state=HELD_JOB_STATE, updated_at=datetime.now())
+    ).rowcount
+    logger.warning(f"リクエスト {request_id} の段階展開を一時停止しました(保留 {held}台): {reason}")
+    return held
+
+def resume_rollout(db: Session, request_id: str) -> Optional[List[int]]:
+    """
+    一時停止した段階展開を再開する(コミットは呼び出し元で行う)
+
+    現在のウェーブの未実行のジョブを実行待ちに戻し、その台数を分母として
+    失敗率の集計をやり直す(既に失敗したホストで直ちに再停止しないため)。
+
+    Returns:
+        Optional[List[int]]: 実行待ちに戻したジョブの id(一時停止していない場合は None)
+    """
+    rollout = db.get(RolloutDB, request_id)
+    if rollout is None or rollout.state != ROLLOUT_PAUSED:
+        return None
+    job_ids = list(db.execute(
+        update(HostJobDB)
+        .where(
+            HostJobDB.request_id == request_id,
+            HostJobDB.wave <= rollout.current_wave,
+            HostJobDB.state == HELD_JOB_STATE
+        )
+        .values(state=TaskStatus.PENDING.value, updated_at=datetime.now())
+        .returning(HostJobDB.id)
+    ).scalars().all())
+    running = db.scalar(
+        select(func.count()).select_from(HostJobDB).where(
+            HostJobDB.request_id == request_id,
+            HostJobDB.wave == rollout.current_wave,
+            HostJobDB.state == TaskStatus.IN_PROGRESS.value
+        )
+    ) or 0
+    rollout.state = ROLLOUT_RUNNING
+    rollout.paused_reason = None
+    rollout.paused_at = None
+    rollout.wave_total = len(job_ids) + running
+    rollout.wave_finished = 0
+    rollout.wave_failed = 0
+    rollout.updated_at = datetime.now()
+    db.flush()
+    if not job_ids and not running:
+        # 停止中に現在のウェーブが全て終わっていた
+        return _start_next_wave(db, request_id, rollout.current_wave + 1)
+    logger.info(f"リクエスト {request_id} の段階展開を再開しました: ウェーブ {rollout.current_wave}")
+    return sorted(job_ids)
+
+def advance_if_drained(db: Session, request_id: str) -> List[int]:
+    """
+    キャンセル後に現在のウェーブの台数を数え直し、残りが無ければ次のウェーブを開始する(コミットは呼び出し元で行う)
+
+    キャンセルしたジョブは終了時の集計を通らないため、ウェーブの台数から除く。
+
+    Returns:
+        List[int]: 次のウェーブとして実行待ちにしたジョブの id
+    """
+    rollout = db.get(RolloutDB, request_id)
+    if rollout is None or rollout.state == ROLLOUT_COMPLETED:
+        return []
+    remaining = db.scalar(
+        select(func.count()).select_from(HostJobDB).where(
+            HostJobDB.request_id == request_id,
+            HostJobDB.wave == rollout.current_wave,
+            HostJobDB.state.in_(OPEN_JOB_STATES)
+        )
+    ) or 0
+    rollout.wave_total = rollout.wave_finished + remaining
+    rollout.updated_at = datetime.now()
+    db.flush()
+    if remaining:
+        return []
+    if rollout.state == ROLLOUT_RUNNING:
+        return _start_next_wave(db, request_id, rollout.current_wave + 1)
+    if not db.scalar(select(func.count()).select_from(HostJobDB).where(
+        HostJobDB.request_id == request_id,
+        HostJobDB.state.in_(OPEN_JOB_STATES)
+    )):
+        # 一時停止中にリクエスト全体がキャンセルされた
+        rollout.state = ROLLOUT_COMPLETED
+    return []
+
+def rollout_status(db: Session, request_id: str) -> Optional[Dict[str, Any]]:
+    """段階展開の進行状況とウェーブ毎のジョブの状態を取得"""
+    rollout = db.get(RolloutDB, request_id)
+    if rollout is None:
+        return None
+    waves: Dict[int, Dict[str, int]] = {}
+    for wave, state, count in db.query(HostJobDB.wave, HostJobDB.state, func.count()).filter(
+        HostJobDB.request_id == request_id
+    ).group_by(HostJobDB.wave, HostJobDB.state):
+        waves.setdefault(wave, {})[state] = count
+    return {
+        "request_id": request_id,
+        "state": rollout.state,
+        "canary_size": rollout.canary_size,
+        "growth_factor": rollout.growth_factor,
+        "failure_threshold": rollout.failure_threshold,
+        "current_wave": rollout.current_wave,
+        "total_waves": rollout.total_waves,
+        "wave_total": rollout.wave_total,
+        "wave_finished": rollout.wave_finished,
+        "wave_failed": rollout.wave_failed,
+        "wave_failure_rate": rollout.wave_failed / rollout.wave_total if rollout.wave_total else 0.0,
+        "paused_reason": rollout.paused_reason,
+        "paused_at": rollout.paused_at,
+        "waves": [
+            {"wave": wave, "hosts": sum(states.values()), "states": states}
+            for wave, states in sorted(waves.items(), key=lambda item: item[0] if item[0] is not None else -1)
+        ]
+    }
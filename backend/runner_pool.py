@@ -0,0 +1,266 @@
+import asyncio
+import json
+import logging
+import os
+import shlex
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set
+from uuid import uuid4
+
+from .errors import PowerShellError
+from .process_control import kill_process_tree, new_process_group_kwargs
+
+logger = logging.getLogger(__name__)
+
+SCRIPTS_DIR = Path(__file__).parent.parent / "scripts"
+
+# ランナープールの設定(環境変数で上書き可能)
+# RUNNER_COMMAND を指定するとワーカーの起動コマンドを差し替えられる
+# (例: Linux上では "python3 -u scripts/stub_runner.py" で同じプロトコルを話すスタブワーカーを使う)
+RUNNER_POOL_ENABLED = os.getenv("RUNNER_POOL_ENABLED", "true").lower() == "true"
+RUNNER_COMMAND = os.getenv("RUNNER_COMMAND")
+RUNNER_POOL_SIZE = int(os.getenv("RUNNER_POOL_SIZE", "50"))
+RUNNER_IDLE_TIMEOUT = float(os.getenv("RUNNER_IDLE_TIMEOUT", "300"))
+RUNNER_STREAM_LIMIT = 16 * 1024 * 1024  # 1行あたりの最大バイト数
+
+OutputCallback = Callable[[str, str], None]
+
+def default_runner_command() -> List[str]:
+    """ワーカープロセスの起動コマンドを取得"""
+    if RUNNER_COMMAND:
+        return shlex.split(RUNNER_COMMAND)
+    return [
+        "powershell.exe",
+        "-NoLogo",
+        "-NoProfile",
+        "-ExecutionPolicy", "Bypass",
+        "-File", str(SCRIPTS_DIR / "runner_host.ps1")
+    ]
+
+class RunnerWorker:
+    """標準入出力でJSON行をやり取りする常駐ワーカープロセス"""
+
+    def __init__(self, command: List[str]):
+        self.command = command
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.hosts: Set[str] = set()  # リモートセッションを保持しているホスト
+        self.busy = False
+        self.last_used = time.monotonic()
+        self.tasks_run = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=RUNNER_STREAM_LIMIT,
+            **new_process_group_kwargs()
+        )
+        logger.info(f"ランナーワーカーを起動: pid={self.process.pid}")
+
+    async def run(
+        self,
+        request: Dict[str, Any],
+        on_output: Optional[OutputCallback] = None
+    ) -> Dict[str, Any]:
+        """要求を1件送信し、出力行を逐次通知しながら対応する結果を受け取る"""
+        self.process.stdin.write((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        await self.process.stdin.drain()
+
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                raise PowerShellError(
+                    message="ランナーワーカーが予期せず終了しました",
+                    exit_code=self.process.returncode if self.process.returncode is not None else -1,
+                    stderr="",
+                    command=" ".join(self.command)
+                )
+            try:
+                message = json.loads(line.decode("utf-8", errors="replace"))
+            except json.JSONDecodeError:
+                logger.debug(f"ランナーワーカーの出力を無視: {line[:200]!r}")
+                continue
+            if message.get("id") != request["id"]:
+                continue
+            if message.get("type") == "output":
+                if on_output is not None:
+                    on_output(message.get("stream", "stdout"), message.get("line", ""))
+            elif message.get("type") == "result":
+                self.tasks_run += 1
+                return message
+
+    async def close(self, timeout: float = 5.0):
+        """ワーカーを終了(応答しない場合は子プロセスごと強制終了)"""
+        if not self.alive:
+            return
+        try:
+            self.process.stdin.write(b'{"type": "shutdown"}\n')
+            await self.process.stdin.drain()
+            self.process.stdin.close()
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            await kill_process_tree(self.process)
+        logger.info(f"ランナーワーカーを終了: pid={self.process.pid}")
+
+    async def kill(self):
+        """実行中のタスクごとワーカーを強制終了"""
+        if self.alive:
+            await kill_process_tree(self.process)
+
+class RunnerPool:
+    """
+    常駐ワーカーのプール
+
+    - 同じホストのタスクは、そのホストのセッションを保持するワーカーに優先して割り当てる
+    - ワーカーは必要に応じて最大 max_workers まで起動する
+    - idle_timeout を超えてアイドル状態のワーカーは回収する
+    """
+
+    def __init__(
+        self,
+        command: Optional[List[str]] = None,
+        max_workers: int = RUNNER_POOL_SIZE,
+        idle_timeout: float = RUNNER_IDLE_TIMEOUT
+    ):
+        self.command = command or default_runner_command()
+        self.max_workers = max_workers
+        self.idle_timeout = idle_timeout
+        self._workers: List[RunnerWorker] = []
+        self._condition = asyncio.Condition()
+        self._reaper: Optional[asyncio.Task] = None
+        self.spawned = 0
+        self.reaped = 0
+
+    async def start(self):
+        """アイドルワーカーの回収を開始"""
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        """回収を停止し、全ワーカーを終了"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+        workers, self._workers = self._workers, []
+        await asyncio.gather(*(worker.close() for worker in workers), return_exceptions=True)
+
+    async def run_script(
+        self,
+        script_path: str,
+        computer_name: str,
+        username: str,
+        password: str,
+        args: Optional[Dict[str, Any]] = None,
+        on_output: Optional[OutputCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        プール内のワーカーでスクリプトを実行する
+
+        Args:
+            script_path (str): 実行するスクリプトの絶対パス
+            computer_name (str): 対象コンピュータ名
+            username (str): 実行ユーザー名
+            password (str): パスワード
+            args (Optional[Dict[str, Any]]): スクリプトに渡す追加の引数
+            on_output (Optional[OutputCallback]): 出力行を受け取るコールバック(ストリーム名, 行)
+
+        Returns:
+            Dict[str, Any]: exit_code を含む実行結果
+        """
+        request = {
+            "type": "run",
+            "id": str(uuid4()),
+            "script": script_path,
+            "computer_name": computer_name,
+            "username": username,
+            "password": password,
+            "args": args or {}
+        }
+        worker = await self._acquire(computer_name)
+        healthy = False
+        try:
+            result = await worker.run(request, on_output)
+            worker.hosts.add(computer_name)
+            healthy = True
+            return result
+        finally:
+            await self._release(worker, healthy)
+
+    async def _acquire(self, computer_name: str) -> RunnerWorker:
+        async with self._condition:
+            while True:
+                idle = sorted(
+                    (w for w in self._workers if not w.busy and w.alive),
+                    key=lambda w: w.last_used,
+                    reverse=True
+                )
+                worker = next((w for w in idle if computer_name in w.hosts), None)
+                if worker is None and idle:
+                    worker = idle[0]
+                if worker is None and len(self._workers) < self.max_workers:
+                    worker = RunnerWorker(self.command)
+                    self._workers.append(worker)
+                if worker is not None:
+                    worker.busy = True
+                    break
+                await self._condition.wait()
+
+        if worker.process is None:
+            try:
+                await worker.start()
+                self.spawned += 1
+            except BaseException:
+                await self._release(worker, healthy=False)
+                raise
+        return worker
+
+    async def _release(self, worker: RunnerWorker, healthy: bool):
+        # 途中で失敗・キャンセルされたワーカーは入出力の状態が不明なため破棄する
+        # (実行中のスクリプトが残らないよう子プロセスごと終了する)
+        if not healthy:
+            await asyncio.shield(worker.kill())
+        async with self._condition:
+            worker.busy = False
+            worker.last_used = time.monotonic()
+            if not healthy or not worker.alive:
+                if worker in self._workers:
+                    self._workers.remove(worker)
+            self._condition.notify()
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 1.0))
+            now = time.monotonic()
+            async with self._condition:
+                expired = [
+                    w for w in self._workers
+                    if not w.busy and (not w.alive or now - w.last_used > self.idle_timeout)
+                ]
+                for worker in expired:
+                    self._workers.remove(worker)
+                self._condition.notify(len(expired))
+            for worker in expired:
+                await worker.close()
+                self.reaped += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """プールの状態を取得"""
+        return {
+            "workers": len(self._workers),
+            "busy_workers": sum(1 for w in self._workers if w.busy),
+            "max_workers": self.max_workers,
+            "spawned": self.spawned,
+            "reaped": self.reaped,
+            "sessions": sum(len(w.hosts) for w in self._workers)
+        }
+
+# アプリケーション全体で共有するランナープール
+runner_pool = RunnerPool()
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, IO, Optional
+
+logger = logging.getLogger(__name__)
+
+# メモリに保持する出力末尾の上限(バイト)と1行あたりの上限(バイト)
+OUTPUT_TAIL_BYTES = int(os.getenv("SCRIPT_OUTPUT_TAIL_BYTES", str(256 * 1024)))
+MAX_LINE_BYTES = int(os.getenv("SCRIPT_OUTPUT_MAX_LINE_BYTES", str(64 * 1024)))
+READ_CHUNK_SIZE = 64 * 1024
+
+# スクリプトが出力する進捗行の形式:
+#   {"type": "progress", "percent": 40, "message": "ODTをダウンロード中"}
+PROGRESS_LINE_TYPE = "progress"
+
+ProgressCallback = Callable[[float, str], None]
+
+_JSON_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")  # json.loads が許す空白
+
+def _encoded_size(line: str) -> int:
+    """改行を含めた1行の UTF-8 でのバイト数"""
+    return (len(line) if line.isascii() else len(line.encode("utf-8"))) + 1
+
+class _BoundedTail:
+    """末尾の行だけを合計バイト数(UTF-8)の上限内で保持するバッファ"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.lines: Deque[str] = deque()
+        self.size = 0
+        self.dropped_lines = 0
+
+    def append(self, line: str):
+        self.lines.append(line)
+        self.size += _encoded_size(line)
+        while self.size > self.max_bytes and len(self.lines) > 1:
+            self.size -= _encoded_size(self.lines.popleft())
+            self.dropped_lines += 1
+
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+class ScriptOutputCollector:
+    """
+    スクリプトの出力を1行ずつ受け取り、進捗行の通知と末尾の保持を行う
+
+    出力全体はログファイルに逐次書き出し、メモリには末尾のみを保持するため、
+    スクリプトがどれだけ出力してもタスクあたりのメモリ使用量は一定に保たれる。
+    """
+
+    def __init__(
+        self,
+        on_progress: Optional[ProgressCallback] = None,
+        log_file: Optional[IO[str]] = None,
+        tail_bytes: int = OUTPUT_TAIL_BYTES
+    ):
+        self.on_progress = on_progress
+        self.log_file = log_file
+        self.stdout = _BoundedTail(tail_bytes)
+        self.stderr = _BoundedTail(tail_bytes)
+        self.total_bytes = 0
+        self.last_progress: Optional[float] = None
+
+    def feed(self, stream: str, line: str):
+        """
+        出力を1行処理する
+
+        Args:
+            stream (str): "stdout" または "stderr"
+            line (str): 改行を含まない出力行
+        """
+        self.total_bytes += _encoded_size(line)
+        if self.log_file is not None:
+            prefix = "[STDERR] " if stream == "stderr" else ""
+            self.log_file.write(f"{prefix}{line}\n")
+
+        if stream == "stdout" and self._handle_progress(line):
+            return
+        (self.stderr if stream == "stderr" else self.stdout).append(line)
+
+    def _handle_progress(self, line: str) -> bool:
+        stripped = line.strip()
+        if not (stripped.startswith("{") and stripped.endswith("}") and PROGRESS_LINE_TYPE in stripped):
+            return False
+        try:
+            data = json.loads(stripped)
+        except json.JSONDecodeError:
+            return False
+        if not isinstance(data, dict) or data.get("type") != PROGRESS_LINE_TYPE:
+            return False
+
+        try:
+            percent = min(max(float(data.get("percent", 0)), 0.0), 100.0)
+        except (TypeError, ValueError):
+            percent = 0.0
+        self.last_progress = percent
+        if self.on_progress is not None:
+            try:
+                self.on_progress(percent, str(data.get("message", "")))
+            except Exception as e:
+                logger.error(f"進捗の通知中にエラーが発生: {str(e)}")
+        return True
+
+    def stdout_text(self) -> str:
+        return self.stdout.text()
+
+    def stderr_text(self) -> str:
+        return self.stderr.text()
+
+    def summary(self) -> dict:
+        """出力量の概要"""
+        return {
+            "total_bytes": self.total_bytes,
+            "dropped_stdout_lines": self.stdout.dropped_lines,
+            "dropped_stderr_lines": self.stderr.dropped_lines
+        }
+
+async def iter_lines(
+    reader: asyncio.StreamReader,
+    max_line_bytes: int = MAX_LINE_BYTES
+) -> AsyncIterator[str]:
+    """
+    ストリームから行を逐次読み出す
+
+    上限を超える長さの行は切り詰めるため、改行を含まない巨大な出力でも
+    バッファが際限なく大きくなることはない。
+    """
+    buffer = b""
+    while True:
+        chunk = await reader.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line[:max_line_bytes].decode("utf-8", errors="replace").rstrip("\r")
+        # 改行が来るまでは行の先頭だけを残し、残りは読み捨てる
+        if len(buffer) > max_line_bytes:
+            buffer = buffer[:max_line_bytes]
+    if buffer:
+        yield buffer[:max_line_bytes].decode("utf-8", errors="replace").rstrip("\r")
+
+def parse_result_json(text: str) -> Optional[dict]:
+    """
+    出力末尾からスクリプトの結果JSONを取り出す
+
+    出力全体がJSONでない場合は、行頭の "{" から始まる最後のJSONを探す。
+    候補は末尾から1つずつ元の文字列上で直接デコードし(部分文字列を作らない)、
+    最初に成功したものを返すため、出力が大きくても時間・メモリは出力長にほぼ比例する。
+    """
+    start = _WHITESPACE.match(text).end()
+    index = len(text)
+    while True:
+        try:
+            data, end = _JSON_DECODER.raw_decode(text, start)
+            # 候補の後ろに空白以外が残る場合は、その行から始まるJSONではない
+            if _WHITESPACE.match(text, end).end() == len(text):
+                return data
+        except json.JSONDecodeError:
+            pass
+        index = text.rfind("\n{", 0, index)
+        if index == -1:
+            return None
+        start = index + 1
@@ -0,0 +1,360 @@
+import asyncio
+import heapq
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .utils import TASK_SCRIPTS
+
+logger = logging.getLogger(__name__)
+
+# タスクの表示名
+TASK_NAMES = {
+    "setup_desktop_icons": "デスクトップアイコンの表示設定",
+    "move_vpn_icon": "FortiClientVPNアイコンの移動",
+    "disable_ipv6": "IPv6の無効化",
+    "disable_defender": "Windows Defenderファイアウォールの無効化",
+    "unpin_mail_store": "Mail、Storeのピン留めを外す",
+    "setup_edge_defaults": "Edgeのデフォルトサイト設定",
+    "set_edge_as_default": "Edgeの既定のブラウザ設定",
+    "setup_default_mail": "既定のプログラム設定(メール、Webブラウザ)",
+    "setup_default_pdf": "既定のプログラム設定(.pdf、.pdx)",
+    "install_office": "Microsoft 365のインストール",
+    "setup_office_auth": "Microsoft 365の認証設定",
+    "configure_office_apps": "Microsoft 365のアプリケーション設定",
+    "install_dvd_software": "DVDソフトウェアのインストール",
+    "install_carbon_black": "Carbon Blackのインストール",
+    "install_forticlient_vpn": "FortiClient VPNのインストール",
+    "install_ares_standard": "ARES Standardのインストール",
+    "install_apex_one": "TrendMicro ApexOneのインストール",
+    "install_virus_buster": "TrendMicro ウィルスバスターCloudのインストール",
+    "update_office": "Microsoft 365 アップデート",
+    "update_windows": "Windows Update",
+    "cleanup_system": "システムクリーンアップ",
+    "restart_system": "再起動"
+}
+
+# タスク間の依存関係(キーのタスクは値のタスクの完了後に実行)
+TASK_DEPENDENCIES = {
+    "set_edge_as_default": ["setup_edge_defaults"],
+    "setup_default_mail": ["set_edge_as_default"],
+    "setup_office_auth": ["install_office"],
+    "configure_office_apps": ["setup_office_auth"],
+    "update_office": ["configure_office_apps"],
+    "move_vpn_icon": ["install_forticlient_vpn"]
+}
+
+# 他の全タスクの完了後に、この順序で実行するタスク
+FINAL_TASKS = ["cleanup_system", "restart_system"]
+
+# 同時に実行できないタスクのグループ(Windows Installerは同時に1つしか動作しない)
+TASK_RESOURCES = {
+    "install_office": "installer",
+    "install_dvd_software": "installer",
+    "install_carbon_black": "installer",
+    "install_forticlient_vpn": "installer",
+    "install_ares_standard": "installer",
+    "install_apex_one": "installer",
+    "install_virus_buster": "installer",
+    "update_office": "installer",
+    "update_windows": "installer"
+}
+
+# クリティカルパス計算に用いる推定所要時間(秒)
+DEFAULT_TASK_WEIGHTS = {
+    "install_office": 1800,
+    "update_office": 900,
+    "update_windows": 2400,
+    "install_carbon_black": 300,
+    "install_forticlient_vpn": 300,
+    "install_apex_one": 600,
+    "install_virus_buster": 600,
+    "install_ares_standard": 300,
+    "install_dvd_software": 300,
+    "cleanup_system": 600,
+    "restart_system": 180
+}
+DEFAULT_WEIGHT = 60
+
+class ExclusiveGate:
+    """
+    TaskGraph.run の実行中に、ホスト全体に関わる処理(再起動の完了待ちなど)を単独で行うためのゲート
+
+    run_exclusive を呼んだタスクは、同じホストで実行中の他のタスクが終わるのを待ってから処理を行う。
+    待っている間と処理の間は、TaskGraph.run は新しいタスクを開始しない。
+    """
+
+    def __init__(self):
+        self.running = 0    # 実行中のタスク数(TaskGraph.run が更新する)
+        self.entering = 0   # run_exclusive を待っている・実行中のタスク数
+        self.completed = 0  # 完了した処理の数
+        self._condition = asyncio.Condition()
+        self._lock = asyncio.Lock()
+
+    @property
+    def closed(self) -> bool:
+        """新しいタスクの開始を止めているか"""
+        return self.entering > 0
+
+    async def update(self, running: int):
+        """実行中のタスク数を更新する(TaskGraph.run から呼ぶ)"""
+        async with self._condition:
+            self.running = running
+            self._condition.notify_all()
+
+    async def run_exclusive(self, action: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        """
+        他の実行中のタスクが終わってから action を単独で実行する
+
+        複数のタスクが同時に呼んだ場合は1つずつ実行し、待っている間に他のタスクの処理が
+        成功した場合は、その結果を共有したものとして action を実行せずに None を返す
+        (同じ再起動を2度待たないため)。
+
+        Returns:
+            Optional[Any]: action の戻り値(他のタスクの処理を共有した場合は None)
+        """
+        async with self._condition:
+            self.entering += 1
+            self._condition.notify_all()
+        try:
+            completed = self.completed
+            async with self._lock:
+                if self.completed != completed:
+                    return None
+                async with self._condition:
+                    # run_exclusive を待っているタスク以外が終わるまで待つ
+                    await self._condition.wait_for(lambda: self.running <= self.entering)
+                result = await action()
+                self.completed += 1
+                return result
+        finally:
+            self.entering -= 1
+
+@dataclass
+class TaskNode:
+    """タスクグラフのノード"""
+    task_id: str
+    name: str
+    depends_on: Set[str] = field(default_factory=set)
+    weight: float = DEFAULT_WEIGHT
+    resource: Optional[str] = None
+    priority: float = 0.0  # このタスクから終端までの最長経路(クリティカルパス長)
+
+class TaskGraph:
+    """1台のコンピュータで実行するタスクの依存グラフ"""
+
+    def __init__(self, nodes: Dict[str, TaskNode]):
+        self.nodes = nodes
+        self._order = self._topological_order()
+        self._compute_priorities()
+
+    @classmethod
+    def from_options(
+        cls,
+        setup_options: Dict[str, Any],
+        weights: Optional[Dict[str, float]] = None
+    ) -> "TaskGraph":
+        """
+        セットアップオプションからタスクグラフを構築する
+
+        Args:
+            setup_options (Dict[str, Any]): SetupOptions の辞書表現
+            weights (Optional[Dict[str, float]]): タスク毎の推定所要時間(秒)
+
+        Returns:
+            TaskGraph: 選択されたタスクのみを含むグラフ
+        """
+        weights = {**DEFAULT_TASK_WEIGHTS, **(weights or {})}
+        selected = [name for name, enabled in setup_options.items() if enabled]
+
+        unsupported = [name for name in selected if name not in TASK_SCRIPTS]
+        if unsupported:
+            logger.warning(f"スクリプトが未定義のためスキップするタスク: {unsupported}")
+        selected = [name for name in selected if name in TASK_SCRIPTS]
+        selected_set = set(selected)
+
+        def resolve(task_id: str, visited: Set[str]) -> Set[str]:
+            # 未選択のタスクを経由する依存関係は、その先の選択済みタスクに繋ぎ替える
+            resolved = set()
+            for dep in TASK_DEPENDENCIES.get(task_id, []):
+                if dep in visited:
+                    continue
+                visited.add(dep)
+                if dep in selected_set:
+                    resolved.add(dep)
+                else:
+                    resolved |= resolve(dep, visited)
+            return resolved
+
+        final = [name for name in FINAL_TASKS if name in selected_set]
+        regular = [name for name in selected if name not in final]
+
+        nodes = {}
+        for task_id in regular:
+            nodes[task_id] = TaskNode(
+                task_id=task_id,
+                name=TASK_NAMES.get(task_id, task_id),
+                depends_on=resolve(task_id, {task_id}) - set(final),
+                weight=weights.get(task_id, DEFAULT_WEIGHT),
+                resource=TASK_RESOURCES.get(task_id)
+            )
+        for index, task_id in enumerate(final):
+            nodes[task_id] = TaskNode(
+                task_id=task_id,
+                name=TASK_NAMES.get(task_id, task_id),
+                depends_on=set(regular) | set(final[:index]),
+                weight=weights.get(task_id, DEFAULT_WEIGHT),
+                resource=TASK_RESOURCES.get(task_id)
+            )
+        return cls(nodes)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def _topological_order(self) -> List[str]:
+        in_degree = {task_id: len(node.depends_on) for task_id, node in self.nodes.items()}
+        dependents = self.dependents()
+        ready = [task_id for task_id, degree in in_degree.items() if degree == 0]
+        order = []
+        while ready:
+            task_id = ready.pop()
+            order.append(task_id)
+            for child in dependents[task_id]:
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    ready.append(child)
+        if len(order) != len(self.nodes):
+            raise ValueError("タスクの依存関係が循環しています")
+        return order
+
+    def dependents(self) -> Dict[str, Set[str]]:
+        """タスク毎に、そのタスクに依存するタスクの集合を返す"""
+        result = {task_id: set() for task_id in self.nodes}
+        for task_id, node in self.nodes.items():
+            for dep in node.depends_on:
+                result[dep].add(task_id)
+        return result
+
+    def _compute_priorities(self):
+        dependents = self.dependents()
+        for task_id in reversed(self._order):
+            node = self.nodes[task_id]
+            node.priority = node.weight + max(
+                (self.nodes[child].priority for child in dependents[task_id]),
+                default=0
+            )
+
+    def critical_path_length(self) -> float:
+        """クリティカルパスの長さ(推定最短所要時間)"""
+        return max((node.priority for node in self.nodes.values()), default=0)
+
+    def estimated_length(self, max_parallel: int = 1) -> float:
+        """
+        run と同じ規則で実行した場合の推定所要時間(秒)
+
+        クリティカルパスが長いタスクから、同時実行数の上限とリソースの排他を守って開始する
+        スケジュールを weight で模擬する。インストーラーのように同時に実行できないタスクが多い場合は、
+        クリティカルパス長より長くなる。
+
+        Args:
+            max_parallel (int): 同時に実行するタスク数の上限(run と同じ値を渡す)
+        """
+        dependents = self.dependents()
+        remaining = {task_id: len(node.depends_on) for task_id, node in self.nodes.items()}
+        ready = [task_id for task_id, count in remaining.items() if count == 0]
+        running: List[Tuple[float, str]] = []  # (終了時刻, タスク) のヒープ
+        busy_resources: Set[str] = set()
+        now = 0.0
+        while ready or running:
+            ready.sort(key=lambda task_id: self.nodes[task_id].priority, reverse=True)
+            for task_id in list(ready):
+                if len(running) >= max_parallel:
+                    break
+                node = self.nodes[task_id]
+                if node.resource and node.resource in busy_resources:
+                    continue
+                ready.remove(task_id)
+                if node.resource:
+                    busy_resources.add(node.resource)
+                heapq.heappush(running, (now + node.weight, task_id))
+            if not running:
+                break
+            now = running[0][0]
+            # 同時に終わるタスクはまとめて完了させる
+            while running and running[0][0] == now:
+                _, task_id = heapq.heappop(running)
+                node = self.nodes[task_id]
+                if node.resource:
+                    busy_resources.discard(node.resource)
+                for child in dependents[task_id]:
+                    remaining[child] -= 1
+                    if remaining[child] == 0:
+                        ready.append(child)
+        return now
+
+    async def run(
+        self,
+        runner: Callable[[TaskNode], Awaitable[Any]],
+        max_parallel: int = 1,
+        gate: Optional[ExclusiveGate] = None
+    ):
+        """
+        依存関係を満たしたタスクから並列に実行する
+
+        実行可能なタスクが複数ある場合はクリティカルパスが長いものを優先する。
+        いずれかのタスクが失敗した場合は新たなタスクを開始せず、
+        実行中のタスクの終了を待ってから最初の例外を送出する。
+
+        Args:
+            runner (Callable[[TaskNode], Awaitable[Any]]): 1タスクを実行するコルーチン関数
+            max_parallel (int): 同時に実行するタスク数の上限
+            gate (Optional[ExclusiveGate]): タスクが単独で処理を行うためのゲート(閉じている間は新しいタスクを開始しない)
+        """
+        dependents = self.dependents()
+        remaining = {task_id: len(node.depends_on) for task_id, node in self.nodes.items()}
+        ready = [task_id for task_id, count in remaining.items() if count == 0]
+        running: Dict[asyncio.Task, str] = {}
+        busy_resources: Set[str] = set()
+        error: Optional[BaseException] = None
+
+        try:
+            while ready or running:
+                if error is None and not (gate is not None and gate.closed):
+                    ready.sort(key=lambda task_id: self.nodes[task_id].priority, reverse=True)
+                    for task_id in list(ready):
+                        if len(running) >= max_parallel:
+                            break
+                        node = self.nodes[task_id]
+                        if node.resource and node.resource in busy_resources:
+                            continue
+                        ready.remove(task_id)
+                        if node.resource:
+                            busy_resources.add(node.resource)
+                        running[asyncio.create_task(runner(node))] = task_id
+                if gate is not None:
+                    await gate.update(len(running))
+
+                if not running:
+                    break
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task_id = running.pop(task)
+                    node = self.nodes[task_id]
+                    if node.resource:
+                        busy_resources.discard(node.resource)
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    for child in dependents[task_id]:
+                        remaining[child] -= 1
+                        if remaining[child] == 0:
+                            ready.append(child)
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        if error is not None:
+            raise error
@@ -1,5 +1,3 @@
-import csv
-from io import StringIO
 from typing import List, Dict, Any, Optional, Tuple
 import logging
 from datetime import datetime
@@ -11,6 +9,11 @@ import os
 from uuid import uuid4
 
 from .models import ComputerInfo, LoginType, SetupRequest, SetupOptions
+from .runner_pool import runner_pool, RUNNER_POOL_ENABLED
+from .winrm_client import winrm_pool
+from .errors import AuthenticationError
+from .script_output import ScriptOutputCollector, ProgressCallback, iter_lines, parse_result_json
+from .process_control import kill_process_tree, new_process_group_kwargs
 
 # ログディレクトリの設定
 CURRENT_DIR = Path(__file__).parent
@@ -30,16 +33,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# スクリプトの実行方式(環境変数で上書き可能)
+#   powershell : powershell.exe(ランナープールまたは都度起動)から New-PSSession で対象PCに接続する(既定)
+#   winrm      : WS-Management で対象PCに直接接続し、スクリプトを対象PC上で実行する(Linux上でも動作する)
+SCRIPT_EXECUTOR_BACKEND = os.getenv("SCRIPT_EXECUTOR_BACKEND", "powershell")
+
+# タスクとスクリプトのマッピング
+TASK_SCRIPTS = {
+    "setup_desktop_icons": "setup_desktop.ps1",
+    "move_vpn_icon": "move_vpn_icon.ps1",
+    "install_office": "install_office.ps1",
+    "setup_office_auth": "setup_office_auth.ps1",
+    "install_carbon_black": "install_carbon_black.ps1",
+    "install_forticlient_vpn": "install_forticlient.ps1",
+    "update_windows": "update_windows.ps1",
+    "cleanup_system": "cleanup_system.ps1",
+    "restart_system": "restart_system.ps1"
+}
+
 def generate_request_id() -> str:
     """一意のリクエストIDを生成"""
     return str(uuid4())
 
+def script_log_path(computer_name: str, script_path: str) -> Path:
+    """
+    スクリプト1回分の出力を書き出すログファイルのパスを生成
+
+    同じ秒に実行されたリトライや別タスクのログを上書きしないよう、ミリ秒と一意な接尾辞を付ける。
+    """
+    now = datetime.now()
+    return LOGS_DIR / (
+        f"script_{now.strftime('%Y%m%d_%H%M%S')}_{now.microsecond // 1000:03d}_"
+        f"{computer_name}_{Path(script_path).stem}_{uuid4().hex[:8]}.log"
+    )
+
 async def execute_powershell_script(
     script_path: str,
     computer_name: str,
     username: str,
     password: str,
-    args: Optional[Dict[str, Any]] = None
+    args: Optional[Dict[str, Any]] = None,
+    on_progress: Optional[ProgressCallback] = None
 ) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
     """
     PowerShellスクリプトを実行する
@@ -50,12 +84,16 @@ async def execute_powershell_script(
         username (str): 実行ユーザー名
         password (str): パスワード
         args (Optional[Dict[str, Any]]): スクリプトに渡す追加の引数
+        on_progress (Optional[ProgressCallback]): 進捗行を受け取るコールバック(進捗率, メッセージ)
 
     Returns:
         Tuple[bool, str, Optional[Dict[str, Any]]]: 
             - 成功したかどうか
             - メッセージ
             - スクリプトの出力(JSON形式の場合)
+
+    Raises:
+        AuthenticationError: 対象PCへの認証に失敗した場合(リトライしない)
     """
     try:
         # スクリプトの存在確認
@@ -63,53 +101,103 @@ async def execute_powershell_script(
         if not os.path.exists(script_path):
             raise FileNotFoundError(f"スクリプトが見つかりません: {script_path}")
 
-        # コマンドの構築
-        cmd = [
-            "powershell.exe",
-            "-ExecutionPolicy", "Bypass",
-            "-File", script_path,
-            "-ComputerName", computer_name,
-            "-Username", username,
-            "-Password", password
-        ]
-
-        # 追加の引数を追加
-        if args:
-            for key, value in args.items():
-                cmd.extend([f"-{key}", str(value)])
-
-        # スクリプトの実行
         logger.info(f"PowerShellスクリプトを実行: {script_path}")
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-
-        # 出力の取得
-        stdout, stderr = await process.communicate()
-        stdout_str = stdout.decode('utf-8', errors='replace')
-        stderr_str = stderr.decode('utf-8', errors='replace')
 
-        # 実行結果のログ記録
-        log_file = LOGS_DIR / f"script_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+        # 出力はログファイルへ逐次書き出し、メモリには末尾のみ保持する
+        log_file = script_log_path(computer_name, script_path)
         with open(log_file, 'w', encoding='utf-8') as f:
-            f.write(f"=== STDOUT ===\n{stdout_str}\n\n=== STDERR ===\n{stderr_str}")
+            collector = ScriptOutputCollector(on_progress=on_progress, log_file=f)
+
+            if SCRIPT_EXECUTOR_BACKEND == "winrm":
+                # WinRM で直接実行(PC毎の接続とシェルを再利用)
+                result = await winrm_pool.run_script(
+                    script_path,
+                    computer_name,
+                    username,
+                    password,
+                    args,
+                    on_output=collector.feed
+                )
+                returncode = result.get("exit_code", 1)
+            elif RUNNER_POOL_ENABLED:
+                # 常駐ワーカーで実行(ホスト毎のリモートセッションを再利用)
+                result = await runner_pool.run_script(
+                    script_path,
+                    computer_name,
+                    username,
+                    password,
+                    args,
+                    on_output=collector.feed
+                )
+                returncode = result.get("exit_code", 1)
+            else:
+                # コマンドの構築
+                cmd = [
+                    "powershell.exe",
+                    "-ExecutionPolicy", "Bypass",
+                    "-File", script_path,
+                    "-ComputerName", computer_name,
+                    "-Username", username,
+                    "-Password", password
+                ]
+
+                # 追加の引数を追加
+                if args:
+                    for key, value in args.items():
+                        cmd.extend([f"-{key}", str(value)])
+
+                # スクリプトの実行
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    **new_process_group_kwargs()
+                )
+
+                # 出力を到着順に1行ずつ処理
+                async def pump(reader: asyncio.StreamReader, stream: str):
+                    async for line in iter_lines(reader):
+                        collector.feed(stream, line)
+
+                try:
+                    await asyncio.gather(
+                        pump(process.stdout, "stdout"),
+                        pump(process.stderr, "stderr")
+                    )
+                    returncode = await process.wait()
+                except BaseException:
+                    # タイムアウト・キャンセル時は子プロセスごと終了させる
+                    await asyncio.shield(kill_process_tree(process))
+                    raise
+
+        stdout_str = collector.stdout_text()
+        stderr_str = collector.stderr_text()
+        summary = collector.summary()
+        if summary["dropped_stdout_lines"] or summary["dropped_stderr_lines"]:
+            logger.info(f"スクリプト出力の先頭を破棄しました(全文は {log_file}): {summary}")
 
         # エラーチェック
-        if process.returncode != 0:
+        if returncode != 0:
             error_msg = f"スクリプト実行エラー: {stderr_str}"
             logger.error(error_msg)
             return False, error_msg, None
 
         # JSON出力の解析を試みる
-        try:
-            result_data = json.loads(stdout_str)
+        result_data = parse_result_json(stdout_str)
+        if isinstance(result_data, dict) and result_data.get("success") is False:
+            # スクリプト内で捕捉されたエラーは終了コード0でJSONとして報告される
+            error_msg = f"スクリプト実行エラー: {result_data.get('message', '')}"
+            logger.error(error_msg)
+            return False, error_msg, result_data
+        if result_data is not None:
             return True, "スクリプトが正常に実行されました", result_data
-        except json.JSONDecodeError:
-            # JSON形式でない場合は標準出力をそのまま返す
-            return True, stdout_str, None
+        # JSON形式でない場合は標準出力をそのまま返す
+        return True, stdout_str, None
 
+    except AuthenticationError as e:
+        # 認証エラーはメッセージに埋もれさせず、リトライしないよう種別のまま返す
+        logger.error(f"スクリプトを実行できませんでした(認証エラー): {e.message}")
+        raise
     except Exception as e:
         error_msg = f"スクリプト実行中に例外が発生: {str(e)}"
         logger.error(error_msg, exc_info=True)
@@ -118,7 +206,8 @@ async def execute_powershell_script(
 async def execute_setup_task(
     task_name: str,
     computer_info: ComputerInfo,
-    setup_options: Dict[str, Any]
+    setup_options: Dict[str, Any],
+    on_progress: Optional[ProgressCallback] = None
 ) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
     """
     セットアップタスクを実行する
@@ -127,24 +216,13 @@ async def execute_setup_task(
         task_name (str): 実行するタスク名
         computer_info (ComputerInfo): コンピュータ情報
         setup_options (Dict[str, Any]): セットアップオプション
+        on_progress (Optional[ProgressCallback]): スクリプトの進捗行を受け取るコールバック
 
     Returns:
         Tuple[bool, str, Optional[Dict[str, Any]]]: 実行結果
     """
-    # タスクとスクリプトのマッピング
-    task_scripts = {
-        "setup_desktop_icons": "setup_desktop.ps1",
-        "move_vpn_icon": "move_vpn_icon.ps1",
-        "install_office": "install_office.ps1",
-        "setup_office_auth": "setup_office_auth.ps1",
-        "install_carbon_black": "install_carbon_black.ps1",
-        "install_forticlient_vpn": "install_forticlient.ps1",
-        "update_windows": "update_windows.ps1",
-        "cleanup_system": "cleanup_system.ps1"
-    }
-
     # タスクに対応するスクリプトの取得
-    script_name = task_scripts.get(task_name)
+    script_name = TASK_SCRIPTS.get(task_name)
     if not script_name:
         return False, f"タスク '{task_name}' に対応するスクリプトが定義されていません", None
 
@@ -159,7 +237,8 @@ async def execute_setup_task(
         computer_info.computer_name,
         username,
         password,
-        setup_options
+        setup_options,
+        on_progress=on_progress
     )
 
     return success, message, result
@@ -174,103 +253,6 @@ def get_login_credentials(computer_info: ComputerInfo) -> Tuple[Optional[str], O
         return computer_info.local_new_username, computer_info.local_new_password
     return None, None
 
-def parse_csv_data(csv_content: str) -> List[ComputerInfo]:
-    """CSVファイルの内容をパースしてComputerInfoオブジェクトのリストを返す"""
-    try:
-        # CSVの行を分割
-        lines = csv_content.splitlines()
-        
-        # 10行目以降のデータを取得
-        if len(lines) < 10:
-            raise ValueError("CSVファイルのデータが不足しています")
-        
-        # ヘッダー行を取得(5行目)
-        header_line = lines[4].strip()
-        if not header_line:
-            raise ValueError("ヘッダー行が空です")
-        
-        headers = []
-        current_header = ""
-        in_quotes = False
-        
-        # ヘッダーを適切に分割(カンマを含むヘッダーに対応)
-        for char in header_line:
-            if char == '"':
-                in_quotes = not in_quotes
-            elif char == ',' and not in_quotes:
-                if current_header.strip():
-                    headers.append(current_header.strip())
-                current_header = ""
-            else:
-                current_header += char
-        
-        if current_header.strip():
-            headers.append(current_header.strip())
-        
-        # 空のヘッダーを除外
-        headers = [h.strip('"') for h in headers if h.strip()]
-        
-        # データ行の処理
-        data_lines = [line for line in lines[9:] if line.strip()]
-        if not data_lines:
-            raise ValueError("データが見つかりません")
-        
-        # DictReaderでパース
-        reader = csv.DictReader(StringIO('\n'.join(data_lines)), fieldnames=headers)
-        
-        # ヘッダーとデータの内容をログに出力
-        logger.info(f"ヘッダー: {headers}")
-        logger.info(f"データ行数: {len(data_lines)}")
-
-        # ヘッダーとログイン種別の対応を確認
-        login_type_header = next((h for h in headers if h in ['ログイン種別', 'login_type', 'ログインタイプ']), None)
-        if not login_type_header:
-            raise ValueError("ヘッダーに'ログイン種別'、'login_type'、または'ログインタイプ'が見つかりません")
-        logger.info(f"ログインタイプヘッダー: {login_type_header}")
-        computers = []
-        
-        for row in reader:
-            # LoginTypeの検証と変換
-            login_type_map = {
-                'AD': LoginType.AD,
-                'ActiveDirectory': LoginType.AD,
-                '既存ローカル': LoginType.LOCAL_EXISTING,
-                'LocalExisting': LoginType.LOCAL_EXISTING,
-                '新規ローカル': LoginType.LOCAL_NEW,
-                'LocalNew': LoginType.LOCAL_NEW
-            }
-            
-            login_type_value = row.get(login_type_header, '').strip()
-            login_type = login_type_map.get(login_type_value)
-            if not login_type:
-                logger.error(f"不正なログインタイプです: {login_type_value}")
-                logger.error(f"行の内容: {row}")
-                logger.error(f"利用可能なキー: {row.keys()}")
-                raise ValueError(f"不正なログインタイプです: {login_type_value}\n有効な値: AD, 既存ローカル, 新規ローカル")
-            logger.info(f"ログインタイプ: {login_type_value} -> {login_type}")
-            
-            # ComputerInfoオブジェクトの作成
-            computer = ComputerInfo(
-                computer_name=row.get('computer_name') or row.get('ホスト名'),
-                ip_address=row.get('ip_address') or row.get('IPアドレス'),
-                login_type=login_type,
-                ad_username=row.get('ad_username') or row.get('ADユーザ'),
-                ad_password=row.get('ad_password') or row.get('ADパスワード'),
-                local_existing_username=row.get('local_existing_username') or row.get('既存ローカルユーザ'),
-                local_existing_password=row.get('local_existing_password') or row.get('既存ローカルユーザパスワード'),
-                full_name=row.get('full_name') or row.get('フルネーム'),
-                local_new_username=row.get('local_new_username') or row.get('新規ローカルユーザー名'),
-                local_new_password=row.get('local_new_password') or row.get('新規ローカルユーザーパスワード'),
-                admin_privilege=(row.get('admin_privilege') or row.get('Administrator権限', '')).lower() == 'yes'
-            )
-            computers.append(computer)
-        
-        return computers
-    
-    except Exception as e:
-        logger.error(f"CSVパースエラー: {str(e)}")
-        raise
-
 def create_setup_request(
     requester: str,
     computers: List[ComputerInfo],
@@ -0,0 +1,677 @@
+import asyncio
+import base64
+import codecs
+import hashlib
+import json
+import logging
+import os
+import ssl
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+from xml.sax.saxutils import escape
+
+from .errors import AuthenticationError, WinRMError
+
+logger = logging.getLogger(__name__)
+
+# WinRM クライアントの設定(環境変数で上書き可能)
+WINRM_TRANSPORT = os.getenv("WINRM_TRANSPORT", "https")  # https / http(http は AllowUnencrypted が必要)
+WINRM_PORT = int(os.getenv("WINRM_PORT", "5986" if WINRM_TRANSPORT == "https" else "5985"))
+WINRM_VERIFY_TLS = os.getenv("WINRM_VERIFY_TLS", "true").lower() == "true"
+WINRM_CA_FILE = os.getenv("WINRM_CA_FILE")
+WINRM_CONNECT_TIMEOUT = float(os.getenv("WINRM_CONNECT_TIMEOUT", "10"))
+# Receive の待ち時間(秒)。出力が無い間はこの時間だけサーバー側で待ってから応答が返る
+WINRM_OPERATION_TIMEOUT = float(os.getenv("WINRM_OPERATION_TIMEOUT", "20"))
+WINRM_MAX_SHELLS_PER_HOST = int(os.getenv("WINRM_MAX_SHELLS_PER_HOST", "2"))
+WINRM_IDLE_TIMEOUT = float(os.getenv("WINRM_IDLE_TIMEOUT", "300"))  # 使われていないシェルを閉じるまでの時間(秒)
+WINRM_MAX_ENVELOPE_SIZE = 512000
+WINRM_STDIN_CHUNK = 96 * 1024       # Send 1回で送る標準入力のバイト数(Base64 で約 128KB)
+WINRM_MAX_RESPONSE_BYTES = 16 * 1024 * 1024
+
+OutputCallback = Callable[[str, str], None]
+
+NS = {
+    "s": "http://www.w3.org/2003/05/soap-envelope",
+    "a": "http://schemas.xmlsoap.org/ws/2004/08/addressing",
+    "w": "http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd",
+    "p": "http://schemas.microsoft.com/wbem/wsman/1/wsman.xsd",
+    "rsp": "http://schemas.microsoft.com/wbem/wsman/1/windows/shell",
+    "f": "http://schemas.microsoft.com/wbem/wsman/1/wsmanfault"
+}
+SHELL_URI = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd"
+ACTION_CREATE = "http://schemas.xmlsoap.org/ws/2004/09/transfer/Create"
+ACTION_DELETE = "http://schemas.xmlsoap.org/ws/2004/09/transfer/Delete"
+ACTION_COMMAND = f"{NS['rsp']}/Command"
+ACTION_SEND = f"{NS['rsp']}/Send"
+ACTION_RECEIVE = f"{NS['rsp']}/Receive"
+ACTION_SIGNAL = f"{NS['rsp']}/Signal"
+SIGNAL_TERMINATE = f"{NS['rsp']}/signal/terminate"
+COMMAND_DONE = f"{NS['rsp']}/CommandState/Done"
+# Receive の待ち時間内に出力が無かった場合の WS-Management のエラー(出力が出るまで繰り返す)
+FAULT_OPERATION_TIMEOUT = "2150858793"
+# アクセス拒否(ERROR_ACCESS_DENIED)。リトライしても解決しないため認証エラーとして扱う
+FAULT_ACCESS_DENIED = "5"
+
+# 対象PC上で最初に実行するブートストラップ。標準入力から JSON(スクリプト本文と引数)を受け取り、
+# スクリプトをスクリプトブロックとして実行する。出力は runner_host.ps1 と同じく1行ずつ返す。
+# 引数(パスワードを含む)はコマンドラインに載せない。
+BOOTSTRAP = r"""
+$ProgressPreference = 'SilentlyContinue'
+[Console]::InputEncoding = New-Object System.Text.UTF8Encoding $false
+[Console]::OutputEncoding = New-Object System.Text.UTF8Encoding $false
+$payload = [Console]::In.ReadToEnd() | ConvertFrom-Json
+$params = @{}
+foreach ($property in $payload.params.PSObject.Properties) {
+    $params[$property.Name] = $property.Value
+}
+$exitCode = 0
+try {
+    & ([ScriptBlock]::Create($payload.script)) @params 2>&1 | ForEach-Object {
+        if ($_ -is [System.Management.Automation.ErrorRecord]) {
+            [Console]::Error.WriteLine($_.ToString())
+        }
+        else {
+            foreach ($text in ($_ | Out-String -Stream)) {
+                [Console]::Out.WriteLine($text)
+            }
+        }
+    }
+}
+catch {
+    [Console]::Error.WriteLine($_.ToString())
+    $exitCode = 1
+}
+[Console]::Out.Flush()
+exit $exitCode
+"""
+
+def encode_command(script: str) -> str:
+    """powershell.exe -EncodedCommand に渡す形式(UTF-16LE の Base64)に変換"""
+    return base64.b64encode(script.encode("utf-16-le")).decode("ascii")
+
+def create_ssl_context(verify: bool = WINRM_VERIFY_TLS, ca_file: Optional[str] = WINRM_CA_FILE) -> ssl.SSLContext:
+    """HTTPS 接続に使う SSL コンテキストを作成"""
+    context = ssl.create_default_context(cafile=ca_file)
+    if not verify:
+        # 自己署名証明書の WinRM リスナーに接続する場合
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+class HttpConnection:
+    """
+    1本の keep-alive な HTTP/1.1 接続
+
+    WinRM の要求は1つずつ応答を待つため、パイプライン化はしない。サーバーが接続を閉じた場合は
+    次の要求で接続し直す。
+    """
+
+    def __init__(self, host: str, port: int, ssl_context: Optional[ssl.SSLContext] = None):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self.connects = 0
+        self.requests = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host, self.port,
+                ssl=self.ssl_context,
+                server_hostname=self.host if self.ssl_context else None
+            ),
+            WINRM_CONNECT_TIMEOUT
+        )
+        self.connects += 1
+
+    async def post(self, path: str, body: bytes, headers: Dict[str, str], timeout: float) -> Tuple[int, bytes]:
+        """
+        POST を送信して応答を受け取る
+
+        Returns:
+            Tuple[int, bytes]: ステータスコードと本文
+        """
+        # 再利用した接続がサーバー側で閉じられていた場合に限り、1回だけ接続し直す
+        for attempt in range(2):
+            reused = self.connected
+            if not reused:
+                await self._connect()
+            try:
+                self._send(path, body, headers)
+                await self._writer.drain()
+                return await asyncio.wait_for(self._read_response(), timeout)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                self.close()
+                if not reused or attempt:
+                    raise ConnectionError(f"{self.host}:{self.port} との接続が切断されました: {e}") from e
+            except BaseException:
+                # 応答の途中で中断した接続は再利用できない
+                self.close()
+                raise
+        raise ConnectionError(f"{self.host}:{self.port} との接続が切断されました")
+
+    def _send(self, path: str, body: bytes, headers: Dict[str, str]):
+        lines = [
+            f"POST {path} HTTP/1.1",
+            f"Host: {self.host}:{self.port}",
+            f"Content-Length: {len(body)}",
+            "Connection: keep-alive"
+        ]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        self.requests += 1
+
+    async def _read_response(self) -> Tuple[int, bytes]:
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError("応答の前に接続が閉じられました")
+        parts = status_line.decode("latin-1").split(" ", 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise ConnectionError(f"不正な HTTP 応答です: {status_line[:100]!r}")
+        status = int(parts[1])
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    # トレーラーを読み捨てる
+                    while (await self._reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                if len(body) + size > WINRM_MAX_RESPONSE_BYTES:
+                    raise ConnectionError("応答が大きすぎます")
+                body.extend(await self._reader.readexactly(size))
+                await self._reader.readexactly(2)
+            body = bytes(body)
+        else:
+            length = int(headers.get("content-length", "0"))
+            if length > WINRM_MAX_RESPONSE_BYTES:
+                raise ConnectionError("応答が大きすぎます")
+            body = await self._reader.readexactly(length) if length else b""
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, body
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+class WinRMClient:
+    """
+    1台のPCに対する WS-Management(WinRM)のクライアント
+
+    Basic 認証で接続し、cmd シェルの作成・コマンドの実行・標準入出力のやり取りを行う。
+    NTLM / Kerberos のメッセージ暗号化には対応しないため、HTTPS(または AllowUnencrypted を
+    許可した HTTP)で使う。
+    """
+
+    def __init__(
+        self,
+        host: str,
+        username: str,
+        password: str,
+        transport: str = WINRM_TRANSPORT,
+        port: int = WINRM_PORT,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        operation_timeout: float = WINRM_OPERATION_TIMEOUT
+    ):
+        self.host = host
+        if transport == "https" and ssl_context is None:
+            ssl_context = create_ssl_context()
+        self.url = f"{transport}://{host}:{port}/wsman"
+        self.connection = HttpConnection(host, port, ssl_context if transport == "https" else None)
+        credentials = base64.b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+        self._headers = {
+            "Authorization": f"Basic {credentials}",
+            "Content-Type": "application/soap+xml;charset=UTF-8",
+            "User-Agent": "pc-setup-winrm"
+        }
+        self.operation_timeout = operation_timeout
+
+    def _envelope(
+        self,
+        action: str,
+        body: str = "",
+        shell_id: Optional[str] = None,
+        options: Optional[Dict[str, str]] = None
+    ) -> bytes:
+        selector = (
+            f'<w:SelectorSet><w:Selector Name="ShellId">{escape(shell_id)}</w:Selector></w:SelectorSet>'
+            if shell_id else ""
+        )
+        option_set = (
+            "<w:OptionSet>"
+            + "".join(f'<w:Option Name="{name}">{escape(value)}</w:Option>' for name, value in options.items())
+            + "</w:OptionSet>"
+            if options else ""
+        )
+        return (
+            f'<s:Envelope xmlns:s="{NS["s"]}" xmlns:a="{NS["a"]}" xmlns:w="{NS["w"]}" '
+            f'xmlns:p="{NS["p"]}" xmlns:rsp="{NS["rsp"]}">'
+            "<s:Header>"
+            f"<a:To>{escape(self.url)}</a:To>"
+            '<a:ReplyTo><a:Address s:mustUnderstand="true">'
+            "http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</a:Address></a:ReplyTo>"
+            f'<w:MaxEnvelopeSize s:mustUnderstand="true">{WINRM_MAX_ENVELOPE_SIZE}</w:MaxEnvelopeSize>'
+            f"<a:MessageID>uuid:{uuid4()}</a:MessageID>"
+            '<w:Locale xml:lang="en-US" s:mustUnderstand="false"/>'
+            '<p:DataLocale xml:lang="en-US" s:mustUnderstand="false"/>'
+            f"<w:OperationTimeout>PT{self.operation_timeout:g}S</w:OperationTimeout>"
+            f'<w:ResourceURI s:mustUnderstand="true">{SHELL_URI}</w:ResourceURI>'
+            f'<a:Action s:mustUnderstand="true">{action}</a:Action>'
+            f"{selector}{option_set}"
+            "</s:Header>"
+            f"<s:Body>{body}</s:Body>"
+            "</s:Envelope>"
+        ).encode("utf-8")
+
+    async def _request(self, envelope: bytes) -> ET.Element:
+        try:
+            status, body = await self.connection.post(
+                "/wsman", envelope, self._headers, timeout=self.operation_timeout + WINRM_CONNECT_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise WinRMError(f"WinRM に接続できません({self.url}): {e}", host=self.host) from e
+        if status == 401:
+            raise AuthenticationError(
+                f"WinRM の認証に失敗しました({self.url})。Basic 認証が有効か、資格情報を確認してください",
+                host=self.host,
+                details={"status": status}
+            )
+        try:
+            root = ET.fromstring(body) if body else None
+        except ET.ParseError:
+            root = None
+        if status != 200:
+            fault_code, reason = _parse_fault(root)
+            if status == 403 or fault_code == FAULT_ACCESS_DENIED:
+                raise AuthenticationError(
+                    f"WinRM の要求が拒否されました(HTTP {status}): {reason or 'アクセスが拒否されました'}",
+                    host=self.host,
+                    details={"status": status, "fault_code": fault_code}
+                )
+            raise WinRMError(
+                f"WinRM の要求が失敗しました(HTTP {status}{f', {fault_code}' if fault_code else ''}): "
+                f"{reason or body[:200].decode('utf-8', errors='replace')}",
+                host=self.host,
+                status=status,
+                fault_code=fault_code
+            )
+        if root is None:
+            raise WinRMError("WinRM の応答を解析できませんでした", host=self.host, status=status)
+        return root
+
+    async def open_shell(self) -> str:
+        """cmd シェルを作成して ShellId を返す"""
+        root = await self._request(self._envelope(
+            ACTION_CREATE,
+            "<rsp:Shell><rsp:InputStreams>stdin</rsp:InputStreams>"
+            "<rsp:OutputStreams>stdout stderr</rsp:OutputStreams></rsp:Shell>",
+            options={"WINRS_NOPROFILE": "TRUE", "WINRS_CODEPAGE": "65001"}
+        ))
+        shell_id = root.findtext(".//rsp:ShellId", namespaces=NS) or root.findtext(
+            ".//w:Selector[@Name='ShellId']", namespaces=NS
+        )
+        if not shell_id:
+            raise WinRMError("WinRM のシェルを作成できませんでした(ShellId がありません)", host=self.host)
+        return shell_id
+
+    async def run_command(self, shell_id: str, command: str, arguments: List[str]) -> str:
+        """コマンドを開始して CommandId を返す"""
+        args = "".join(f"<rsp:Arguments>{escape(argument)}</rsp:Arguments>" for argument in arguments)
+        root = await self._request(self._envelope(
+            ACTION_COMMAND,
+            f"<rsp:CommandLine><rsp:Command>{escape(command)}</rsp:Command>{args}</rsp:CommandLine>",
+            shell_id=shell_id,
+            options={"WINRS_CONSOLEMODE_STDIN": "TRUE", "WINRS_SKIP_CMD_SHELL": "FALSE"}
+        ))
+        command_id = root.findtext(".//rsp:CommandId", namespaces=NS)
+        if not command_id:
+            raise WinRMError("WinRM のコマンドを開始できませんでした(CommandId がありません)", host=self.host)
+        return command_id
+
+    async def send_input(self, shell_id: str, command_id: str, data: bytes):
+        """標準入力を送り、閉じる(大きい入力は分割して送る)"""
+        chunks = [data[start:start + WINRM_STDIN_CHUNK] for start in range(0, len(data), WINRM_STDIN_CHUNK)] or [b""]
+        for index, chunk in enumerate(chunks):
+            end = ' End="true"' if index == len(chunks) - 1 else ""
+            await self._request(self._envelope(
+                ACTION_SEND,
+                f'<rsp:Send><rsp:Stream Name="stdin" CommandId="{escape(command_id)}"{end}>'
+                f"{base64.b64encode(chunk).decode('ascii')}</rsp:Stream></rsp:Send>",
+                shell_id=shell_id
+            ))
+
+    async def receive(self, shell_id: str, command_id: str) -> Tuple[List[Tuple[str, bytes]], Optional[int]]:
+        """
+        出力を1回受け取る
+
+        Returns:
+            Tuple[List[Tuple[str, bytes]], Optional[int]]: (ストリーム名, データ) のリストと、
+            コマンドが終了していれば終了コード
+        """
+        try:
+            root = await self._request(self._envelope(
+                ACTION_RECEIVE,
+                f'<rsp:Receive><rsp:DesiredStream CommandId="{escape(command_id)}">stdout stderr'
+                "</rsp:DesiredStream></rsp:Receive>",
+                shell_id=shell_id,
+                options={"WSMAN_CMDSHELL_OPTION_KEEPALIVE": "TRUE"}
+            ))
+        except WinRMError as e:
+            if e.fault_code == FAULT_OPERATION_TIMEOUT:
+                # 待ち時間内に出力が無かっただけ
+                return [], None
+            raise
+        streams = [
+            (stream.get("Name", "stdout"), base64.b64decode(stream.text))
+            for stream in root.iterfind(".//rsp:Stream", NS)
+            if stream.text
+        ]
+        state = root.find(".//rsp:CommandState", NS)
+        if state is not None and state.get("State") == COMMAND_DONE:
+            exit_code = state.findtext("rsp:ExitCode", namespaces=NS)
+            return streams, int(exit_code) if exit_code is not None else 0
+        return streams, None
+
+    async def signal_terminate(self, shell_id: str, command_id: str):
+        """実行中のコマンドを終了させる"""
+        await self._request(self._envelope(
+            ACTION_SIGNAL,
+            f'<rsp:Signal CommandId="{escape(command_id)}"><rsp:Code>{SIGNAL_TERMINATE}</rsp:Code></rsp:Signal>',
+            shell_id=shell_id
+        ))
+
+    async def close_shell(self, shell_id: str):
+        """シェルを削除する"""
+        await self._request(self._envelope(ACTION_DELETE, shell_id=shell_id))
+
+    def close(self):
+        self.connection.close()
+
+def _parse_fault(root: Optional[ET.Element]) -> Tuple[Optional[str], Optional[str]]:
+    """SOAP Fault から WS-Management のエラーコードと理由を取り出す"""
+    if root is None:
+        return None, None
+    fault = root.find(".//f:WSManFault", NS)
+    code = fault.get("Code") if fault is not None else None
+    reason = root.findtext(".//f:Message", namespaces=NS) or root.findtext(".//s:Reason/s:Text", namespaces=NS)
+    return code, reason.strip() if reason else None
+
+class _LineSplitter:
+    """Receive で分割されて届くバイト列を UTF-8 の行に組み立てる"""
+
+    def __init__(self, stream: str, on_output: Optional[OutputCallback]):
+        self.stream = stream
+        self.on_output = on_output
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._pending = ""
+
+    def feed(self, data: bytes, final: bool = False):
+        lines = (self._pending + self._decoder.decode(data, final)).split("\n")
+        self._pending = lines.pop()
+        if final and self._pending:
+            # 改行で終わらない最後の行
+            lines.append(self._pending)
+            self._pending = ""
+        if self.on_output is not None:
+            for line in lines:
+                self.on_output(self.stream, line.rstrip("\r"))
+
+class WinRMShell:
+    """接続とシェルの組(同じPCへの後続のスクリプトで再利用する)"""
+
+    def __init__(self, key: Tuple[str, str, str], client: WinRMClient, shell_id: str):
+        self.key = key
+        self.client = client
+        self.shell_id = shell_id
+        self.command_id: Optional[str] = None  # 実行中のコマンド
+        self.last_used = time.monotonic()
+        self.commands_run = 0
+
+    async def run(self, script: str, params: Dict[str, Any], on_output: Optional[OutputCallback] = None) -> int:
+        """
+        スクリプトを対象PC上で実行する
+
+        スクリプト本文と引数は標準入力で渡し、BOOTSTRAP がスクリプトブロックとして実行する。
+
+        Returns:
+            int: 終了コード
+        """
+        self.command_id = await self.client.run_command(self.shell_id, "powershell.exe", [
+            "-NoLogo", "-NoProfile", "-NonInteractive", "-ExecutionPolicy", "Bypass",
+            "-EncodedCommand", encode_command(BOOTSTRAP)
+        ])
+        payload = json.dumps({"script": script, "params": params}, ensure_ascii=False).encode("utf-8")
+        await self.client.send_input(self.shell_id, self.command_id, payload)
+
+        splitters = {name: _LineSplitter(name, on_output) for name in ("stdout", "stderr")}
+        while True:
+            streams, exit_code = await self.client.receive(self.shell_id, self.command_id)
+            for name, data in streams:
+                splitters.get(name, splitters["stdout"]).feed(data)
+            if exit_code is not None:
+                break
+        for splitter in splitters.values():
+            splitter.feed(b"", final=True)
+        self.command_id = None
+        self.commands_run += 1
+        return exit_code
+
+    async def discard(self):
+        """実行中のコマンドを終了させ、シェルを削除して接続を閉じる(失敗は無視する)"""
+        # 中断した要求の応答が残っている可能性があるため、新しい接続で送る
+        self.client.connection.close()
+        try:
+            if self.command_id is not None:
+                await asyncio.wait_for(self.client.signal_terminate(self.shell_id, self.command_id), WINRM_CONNECT_TIMEOUT)
+            await asyncio.wait_for(self.client.close_shell(self.shell_id), WINRM_CONNECT_TIMEOUT)
+        except Exception as e:
+            logger.debug(f"WinRM のシェルを削除できませんでした({self.client.host}): {str(e)}")
+        finally:
+            self.client.close()
+
+class WinRMPool:
+    """
+    PC毎の WinRM シェルのプール
+
+    - 同じPC・同じユーザーへのスクリプトは、開いたままの接続とシェルを再利用する
+      (TLS のハンドシェイク・認証・シェルの作成はPC毎に最初の1回だけ)
+    - 1台あたりのシェル数は max_shells_per_host まで。超えた分は空くまで待つ
+    - idle_timeout を超えて使われていないシェルは閉じる
+    """
+
+    def __init__(
+        self,
+        max_shells_per_host: int = WINRM_MAX_SHELLS_PER_HOST,
+        idle_timeout: float = WINRM_IDLE_TIMEOUT,
+        client_factory: Callable[[str, str, str], WinRMClient] = WinRMClient
+    ):
+        self.max_shells_per_host = max_shells_per_host
+        self.idle_timeout = idle_timeout
+        self.client_factory = client_factory
+        self._idle: Dict[Tuple[str, str, str], List[WinRMShell]] = {}
+        self._open: Dict[Tuple[str, str, str], int] = {}  # PC毎に開いている(実行中を含む)シェル数
+        self._condition = asyncio.Condition()
+        self._reaper: Optional[asyncio.Task] = None
+        self.shells_opened = 0
+        self.shells_reused = 0
+        self.shells_closed = 0
+
+    async def start(self):
+        """アイドルシェルの回収を開始"""
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        """回収を停止し、アイドルシェルを全て閉じる"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+        async with self._condition:
+            shells = [shell for shells in self._idle.values() for shell in shells]
+            self._idle.clear()
+            self._open.clear()
+        await asyncio.gather(*(self._close(shell) for shell in shells), return_exceptions=True)
+
+    async def run_script(
+        self,
+        script_path: str,
+        computer_name: str,
+        username: str,
+        password: str,
+        args: Optional[Dict[str, Any]] = None,
+        on_output: Optional[OutputCallback] = None
+    ) -> Dict[str, Any]:
+        """
+        スクリプトを WinRM で対象PC上で実行する
+
+        スクリプトは対象PC自身で動くため、-ComputerName には localhost を渡す。
+
+        Args:
+            script_path (str): 実行するスクリプトの絶対パス(内容を読み取って送る)
+            computer_name (str): 対象コンピュータ名
+            username (str): 実行ユーザー名
+            password (str): パスワード
+            args (Optional[Dict[str, Any]]): スクリプトに渡す追加の引数
+            on_output (Optional[OutputCallback]): 出力行を受け取るコールバック(ストリーム名, 行)
+
+        Returns:
+            Dict[str, Any]: exit_code を含む実行結果(runner_pool.run_script と同じ形式)
+        """
+        script = Path(script_path).read_text(encoding="utf-8-sig")
+        params = {"ComputerName": "localhost", "Username": username, "Password": password, **(args or {})}
+        while True:
+            shell, reused = await self._acquire(computer_name, username, password)
+            healthy = False
+            try:
+                exit_code = await shell.run(script, params, on_output)
+                healthy = True
+                return {"exit_code": exit_code}
+            except WinRMError:
+                if reused and shell.command_id is None:
+                    # 再利用したシェルが対象PCの再起動・シェルの期限切れで無くなっていた(新しいシェルで実行し直す)
+                    logger.info(f"WinRM のシェルを作成し直します: {computer_name}")
+                    continue
+                raise
+            finally:
+                await self._release(shell, healthy)
+
+    async def _acquire(self, computer_name: str, username: str, password: str) -> Tuple[WinRMShell, bool]:
+        """
+        シェルを取得する
+
+        シェルはPC・ユーザー・パスワードの組毎に再利用する(誤ったパスワードの要求が、
+        別の要求で認証済みのシェルを使わないようにする)。
+
+        Returns:
+            Tuple[WinRMShell, bool]: シェルと、アイドルのシェルを再利用したか
+        """
+        key = (computer_name, username, hashlib.sha256(password.encode("utf-8")).hexdigest())
+        async with self._condition:
+            while True:
+                idle = self._idle.get(key)
+                if idle:
+                    shell = idle.pop()
+                    self.shells_reused += 1
+                    return shell, True
+                if self._open.get(key, 0) < self.max_shells_per_host:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    break
+                await self._condition.wait()
+
+        # 接続・シェルの作成はロックの外で行う(他のPCの取得を待たせない)
+        client = self.client_factory(computer_name, username, password)
+        try:
+            shell_id = await client.open_shell()
+        except BaseException:
+            client.close()
+            async with self._condition:
+                self._forget(key)
+                self._condition.notify_all()
+            raise
+        self.shells_opened += 1
+        logger.info(f"WinRM のシェルを作成しました: {computer_name}")
+        return WinRMShell(key, client, shell_id), False
+
+    async def _release(self, shell: WinRMShell, healthy: bool):
+        if healthy:
+            async with self._condition:
+                if self._open.get(shell.key):
+                    shell.last_used = time.monotonic()
+                    self._idle.setdefault(shell.key, []).append(shell)
+                    self._condition.notify_all()
+                    return
+            # プールの停止後に終わったシェル
+            await self._close(shell)
+            return
+        # 途中で失敗・キャンセルしたシェルは状態が不明なため、コマンドを止めて破棄する
+        await asyncio.shield(self._close(shell))
+        async with self._condition:
+            self._forget(shell.key)
+            self._condition.notify_all()
+
+    def _forget(self, key: Tuple[str, str, str]):
+        count = self._open.get(key, 0) - 1
+        if count > 0:
+            self._open[key] = count
+        else:
+            self._open.pop(key, None)
+            self._idle.pop(key, None)
+
+    async def _close(self, shell: WinRMShell):
+        await shell.discard()
+        self.shells_closed += 1
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 1.0))
+            now = time.monotonic()
+            expired: List[WinRMShell] = []
+            async with self._condition:
+                for key in list(self._idle):
+                    keep = []
+                    for shell in self._idle[key]:
+                        (expired if now - shell.last_used > self.idle_timeout else keep).append(shell)
+                    self._idle[key] = keep
+                for shell in expired:
+                    self._forget(shell.key)
+                self._condition.notify_all()
+            for shell in expired:
+                await self._close(shell)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """プールの状態を取得"""
+        return {
+            "hosts": len(self._open),
+            "open_shells": sum(self._open.values()),
+            "idle_shells": sum(len(shells) for shells in self._idle.values()),
+            "max_shells_per_host": self.max_shells_per_host,
+            "shells_opened": self.shells_opened,
+            "shells_reused": self.shells_reused,
+            "shells_closed": self.shells_closed
+        }
+
+# アプリケーション全体で共有する WinRM シェルのプール
+winrm_pool = WinRMPool()
@@ -0,0 +1,249 @@
+"""
+セットアップジョブを実行するワーカー
+
+    python -m backend.worker
+
+APIサーバーを JOB_EXECUTION_MODE=worker で起動すると、リクエストはDBに登録される
+だけとなり、ジョブはこのワーカーがDBから占有(job_leases)して実行する。
+ワーカーは同じDBに対して複数プロセス・複数台で起動でき、停止・異常終了した
+ワーカーのジョブは占有の期限切れ後に他のワーカーが完了済みのタスクの次から引き継ぐ。
+
+DBへの書き込みはジョブ1件あたり約6トランザクション(3タスクの場合)で、SQLite では
+全ワーカーの書き込みが1本に直列化される。ワーカー1プロセスはジョブ1件あたり約40msの
+CPUを使うため、タスクが短い場合の全体の上限はおおよそ CPUコア数 x 25 ジョブ/秒となる
+(計測方法は benchmarks/bench_workers.py)。
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+from .database import run_in_session
+from .executor import FleetExecutor, HostJob
+from .job_store import claim_jobs, renew_leases, release_leases, load_jobs, JOB_LEASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# ワーカーの設定(環境変数で上書き可能)
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", str(JOB_LEASE_SECONDS / 4)))
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2"))
+WORKER_CAPACITY = int(os.getenv("WORKER_CAPACITY", "0"))  # 同時に占有するジョブ数(0 はホスト並列数と同じ)
+# 空きがこの件数まとまるまで、ポーリング間隔の間は占有を待つ(0 は同時占有数の 1/4)
+WORKER_CLAIM_BATCH = int(os.getenv("WORKER_CLAIM_BATCH", "0"))
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+class JobWorker:
+    """
+    DBのジョブを占有してフリートエグゼキューターで実行する
+
+    - 空きのある分だけジョブを占有し、占有中のジョブにはハートビートを送り続ける
+    - ハートビートで占有を失ったと分かったジョブは中断する(引き継いだワーカーが再開する)
+    - キャンセルされたジョブは中断してキャンセル扱いにする
+    - 空きが claim_batch 件まとまるか、ポーリング間隔が経つと次のジョブを取りに行く
+      (占有の書き込みは未完了のジョブ全体を走査するため、ジョブ1件毎には行わない)
+    - 終わったジョブの占有は、次の占有と同じトランザクションでまとめて解除する
+    """
+
+    def __init__(
+        self,
+        executor: FleetExecutor,
+        worker_id: Optional[str] = None,
+        capacity: int = WORKER_CAPACITY,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        heartbeat_interval: float = WORKER_HEARTBEAT_INTERVAL,
+        poll_interval: float = WORKER_POLL_INTERVAL,
+        claim_batch: int = WORKER_CLAIM_BATCH
+    ):
+        self.executor = executor
+        self.worker_id = worker_id or default_worker_id()
+        self.capacity = capacity or executor.max_concurrent_hosts
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.claim_batch = claim_batch or max(self.capacity // 4, 1)
+
+        self._held: Dict[int, HostJob] = {}  # job_id -> 占有中のジョブ
+        self._finished: List[int] = []  # 終わったジョブ(占有は次の占有時にまとめて解除する)
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._host_runner = executor.host_runner
+        executor.host_runner = self._run_claimed
+
+        self.claimed_jobs = 0
+        self.finished_jobs = 0
+        self.lost_leases = 0
+        self.started_at = time.monotonic()
+
+    async def start(self):
+        await self.executor.start()
+        self.started_at = time.monotonic()
+        self._tasks = [
+            asyncio.create_task(self._claim_loop()),
+            asyncio.create_task(self._heartbeat_loop())
+        ]
+        logger.info(f"ワーカーを起動: {self.worker_id}(同時占有数={self.capacity})")
+
+    async def stop(self):
+        """停止する(実行中のジョブは中断し、占有を解除して他のワーカーに引き継ぐ)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.executor.stop()
+        released = await run_in_session(partial(release_leases, worker_id=self.worker_id))
+        logger.info(f"ワーカーを停止しました: {self.worker_id}(解除した占有 {released}件)")
+
+    async def _claim_loop(self):
+        timed_out = True
+        while True:
+            # 自動調整で同時実行ホスト数が下がっている間は、余分に占有せず他のワーカーに回す
+            # 再起動待ちで枠を解放しているジョブは数えない
+            free = min(self.capacity, self.executor.host_limit) - (len(self._held) - self.executor.parked_hosts)
+            # ジョブが1件終わる度には占有せず、空きがまとまるかポーリング間隔が経つのを待つ
+            limit = free if free > 0 and (timed_out or free >= self.claim_batch) else 0
+            claimed = 0
+            if limit or (timed_out and self._finished):
+                try:
+                    claimed = await self._claim(limit)
+                except Exception as e:
+                    logger.error(f"ジョブの占有に失敗: {str(e)}")
+            if limit and claimed == limit:
+                # 空きが埋まるまで続けて取得する
+                timed_out = True
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                timed_out = False
+            except asyncio.TimeoutError:
+                timed_out = True
+
+    async def _claim(self, limit: int) -> int:
+        release, self._finished = self._finished, []
+        try:
+            job_ids = await run_in_session(partial(
+                claim_jobs,
+                worker_id=self.worker_id,
+                limit=limit,
+                lease_seconds=self.lease_seconds,
+                release=release
+            ))
+        except BaseException:
+            self._finished.extend(release)
+            raise
+        if not job_ids:
+            return 0
+        jobs = await run_in_session(partial(load_jobs, job_ids=job_ids), read_only=True)
+        for job in jobs:
+            self._held[job.job_id] = job
+        self.claimed_jobs += len(jobs)
+        resumed = sum(1 for job in jobs if job.completed_steps)
+        logger.info(f"ジョブを占有しました: {len(jobs)}件(途中から再開 {resumed}件)")
+        await self.executor.submit_jobs(jobs)
+        return len(job_ids)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            held = list(self._held)
+            if not held:
+                continue
+            try:
+                renewed, cancelled = await run_in_session(partial(
+                    renew_leases,
+                    worker_id=self.worker_id,
+                    job_ids=held,
+                    lease_seconds=self.lease_seconds
+                ))
+            except Exception as e:
+                logger.error(f"ハートビートに失敗: {str(e)}")
+                continue
+            for job_id in held:
+                job = self._held.get(job_id)
+                if job is None:
+                    continue
+                computer_name = job.computer_info.computer_name
+                if job_id in cancelled:
+                    self.executor.cancel(job.request_id, computer_name)
+                elif job_id not in renewed:
+                    self.lost_leases += 1
+                    logger.warning(f"ジョブの占有を失ったため中断します: {job_id}({computer_name})")
+                    if not self.executor.interrupt(job.request_id, computer_name):
+                        # キュー待ちのジョブは取り出した時点で破棄させる
+                        self.executor.cancel(job.request_id, computer_name)
+                    self._held.pop(job_id, None)
+
+    async def _run_claimed(self, job: HostJob):
+        try:
+            if job.job_id in self._held:
+                await self._host_runner(job)
+        finally:
+            if self._held.pop(job.job_id, None) is not None:
+                self.finished_jobs += 1
+                # 占有は次の占有と同じトランザクションで解除する(停止時は release_leases で全て解除する)
+                self._finished.append(job.job_id)
+            self._wakeup.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ワーカーの実行状況を取得"""
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "worker_id": self.worker_id,
+            "capacity": self.capacity,
+            "claim_batch": self.claim_batch,
+            "held_jobs": len(self._held),
+            "claimed_jobs": self.claimed_jobs,
+            "finished_jobs": self.finished_jobs,
+            "lost_leases": self.lost_leases,
+            "jobs_per_minute": self.finished_jobs * 60.0 / elapsed,
+            **self.executor.get_stats()
+        }
+
+async def run_worker():
+    """ワーカーを起動し、SIGINT / SIGTERM を受けるまで実行する"""
+    from .main import fleet_executor, refresh_duration_stats
+    from .duration_stats import duration_stats
+    from .progress_writer import progress_writer
+    from .runner_pool import runner_pool
+    from .winrm_client import winrm_pool
+
+    worker = JobWorker(fleet_executor)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows ではシグナルハンドラを登録できないため KeyboardInterrupt で止める
+            pass
+
+    # タスクの実行順(クリティカルパス)の判断に過去の所要時間を使う
+    await run_in_session(duration_stats.ingest, read_only=True)
+    stats_task = asyncio.create_task(refresh_duration_stats())
+    await progress_writer.start()
+    await runner_pool.start()
+    await winrm_pool.start()
+    await worker.start()
+    try:
+        await stop.wait()
+    finally:
+        stats_task.cancel()
+        await worker.stop()
+        await runner_pool.stop()
+        await winrm_pool.stop()
+        # 未書き込みの進捗を確実に保存する
+        await progress_writer.stop()
+
+if __name__ == "__main__":
+    from . import logging_config  # インポート時にロギング設定が適用される
+    try:
+        asyncio.run(run_worker())
+    except KeyboardInterrupt:
+        pass
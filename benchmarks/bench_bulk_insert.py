@@ -0,0 +1,115 @@
+"""
+リクエスト登録のベンチマーク(ORM のオブジェクト毎の登録と Core の executemany の比較)
+
+一時ディレクトリの SQLite(本番と同じ WAL・synchronous 設定)に、1リクエスト N 台分の
+対象PC・設定・ホスト状態・ジョブを登録し、コミットまでの時間と1秒あたりの行数を表示する。
+
+    python -m benchmarks.bench_bulk_insert --hosts 500 5000 20000 --repeat 3
+
+各方式とも同じ行(リクエスト1行 + PC毎に computers / host_status / host_jobs の3行 + 共通設定1行)を登録する。
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable, List
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend.database import Base, _configure_sqlite
+from backend.models import (
+    SetupRequestDB, ComputerInfoDB, SetupOptionsDB, HostStatusDB, HostJobDB,
+    ComputerInfo, SetupOptions, LoginType, TaskStatus
+)
+from backend.request_store import insert_setup_request
+
+def make_computers(count: int) -> List[ComputerInfo]:
+    return [
+        ComputerInfo(
+            computer_name=f"PC-{index:06d}",
+            ip_address=f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+            login_type=LoginType.AD,
+            ad_username="admin",
+            ad_password="password",
+            full_name=f"利用者 {index}"
+        )
+        for index in range(count)
+    ]
+
+def insert_per_object(db: Session, request_id: str, computers: List[ComputerInfo], setup_options: SetupOptions):
+    """変更前の登録方法(ORM のオブジェクトを組み立てて unit of work で INSERT する)"""
+    computer_rows = [ComputerInfoDB(**computer.dict()) for computer in computers]
+    db.add(SetupRequestDB(
+        request_id=request_id,
+        requester="bench",
+        status="Pending",
+        computers=computer_rows,
+        setup_options=SetupOptionsDB(**setup_options.dict()),
+        host_statuses=[
+            HostStatusDB(computer_name=computer.computer_name, progress=0.0, state=TaskStatus.PENDING.value)
+            for computer in computers
+        ],
+        host_jobs=[
+            HostJobDB(
+                computer=row,
+                computer_name=row.computer_name,
+                requester="bench",
+                state=TaskStatus.PENDING.value
+            )
+            for row in computer_rows
+        ]
+    ))
+
+def insert_bulk(db: Session, request_id: str, computers: List[ComputerInfo], setup_options: SetupOptions):
+    """request_store.insert_setup_request(Core の executemany)"""
+    insert_setup_request(db, request_id, "bench", "Pending", computers, setup_options)
+
+def measure(
+    session_factory: Callable[[], Session],
+    insert_fn: Callable[..., None],
+    request_id: str,
+    computers: List[ComputerInfo],
+    setup_options: SetupOptions
+) -> float:
+    started = time.perf_counter()
+    with session_factory() as db:
+        insert_fn(db, request_id, computers, setup_options)
+        db.commit()
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--hosts", type=int, nargs="+", default=[500, 5000, 20000], help="1リクエストの台数")
+    parser.add_argument("--repeat", type=int, default=3, help="各条件の試行回数(中央値を表示)")
+    args = parser.parse_args()
+
+    setup_options = SetupOptions(install_office=True, update_windows=True)
+    methods = (("per-object", insert_per_object), ("bulk", insert_bulk))
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{Path(directory) / 'bench.db'}")
+        event.listen(engine, "connect", partial(_configure_sqlite, read_only=False))
+        Base.metadata.create_all(engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        print(f"{'hosts':>8} {'method':>12} {'seconds':>9} {'rows/s':>10}")
+        for hosts in args.hosts:
+            computers = make_computers(hosts)
+            rows = 2 + hosts * 3
+            rates = {}
+            for name, insert_fn in methods:
+                elapsed = statistics.median(
+                    measure(session_factory, insert_fn, f"{name}-{hosts}-{attempt}", computers, setup_options)
+                    for attempt in range(args.repeat)
+                )
+                rates[name] = rows / elapsed
+                print(f"{hosts:>8} {name:>12} {elapsed:>9.3f} {rates[name]:>10,.0f}")
+            print(f"{hosts:>8} {'speedup':>12} {'':>9} {rates['bulk'] / rates['per-object']:>9.1f}x")
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
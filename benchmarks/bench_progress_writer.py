@@ -0,0 +1,118 @@
+"""
+進捗ログ書き込みのベンチマーク(イベント毎のコミットと ProgressWriter のグループコミットの比較)
+
+一時ディレクトリの SQLite(本番と同じ WAL・synchronous 設定)に、H 台のホストに分散した
+N 件の進捗イベントを書き込み、全件のコミットまでの時間と1秒あたりのイベント数を表示する。
+
+    python -m benchmarks.bench_progress_writer --events 3000 30000 --hosts 300 --repeat 3
+
+どちらの方式も ProgressWriter と同じ行(setup_progress 1行 + host_status の upsert + リクエストの版数の更新)を書き込む。
+イベント毎の方式は、変更前の log_progress と同じく1イベントを1トランザクションでコミットする。
+"""
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable, List
+
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.orm import Session, sessionmaker
+
+from backend.database import Base, _configure_sqlite
+from backend.models import SetupRequestDB, SetupProgressDB
+from backend.progress_writer import ProgressWriter, ProgressEvent
+
+TASKS = ("setup_initialization", "setup_desktop_icons", "install_office", "update_windows", "setup_completion")
+
+def make_events(request_id: str, count: int, hosts: int) -> List[ProgressEvent]:
+    """ホスト毎に開始・タスクの進捗・完了の順に届くイベント"""
+    return [
+        ProgressEvent(
+            request_id=request_id,
+            computer_name=f"PC-{index % hosts:06d}",
+            task_name=TASKS[min(index // hosts, len(TASKS) - 1)],
+            status="In Progress",
+            progress=min(100.0, index // hosts * 10.0),
+            message="ベンチマーク"
+        )
+        for index in range(count)
+    ]
+
+def write_per_event(session_factory: Callable[[], Session], events: List[ProgressEvent]):
+    """変更前の書き込み方法(イベント毎に1トランザクション)"""
+    writer = ProgressWriter(session_factory=session_factory, broker=None)
+    for progress_event in events:
+        with session_factory() as db:
+            writer._write_batch(db, [progress_event])
+
+def write_buffered(session_factory: Callable[[], Session], events: List[ProgressEvent]):
+    """ProgressWriter(バッファに溜めて flush_interval 毎・batch_size 件毎にまとめて書き込む)"""
+    async def run():
+        writer = ProgressWriter(session_factory=session_factory, broker=None)
+        await writer.start()
+        for progress_event in events:
+            writer.write(progress_event)
+            if writer.get_stats()["buffered_events"] >= writer.batch_size:
+                # イベントの発生元と同じく、書き込みの間もイベントループに制御を返す
+                await asyncio.sleep(0)
+        await writer.stop()
+
+    asyncio.run(run())
+
+def measure(
+    session_factory: Callable[[], Session],
+    write_fn: Callable[..., None],
+    request_id: str,
+    count: int,
+    hosts: int
+) -> float:
+    with session_factory() as db:
+        db.add(SetupRequestDB(request_id=request_id, requester="bench", status="In Progress"))
+        db.commit()
+    events = make_events(request_id, count, hosts)
+
+    started = time.perf_counter()
+    write_fn(session_factory, events)
+    elapsed = time.perf_counter() - started
+
+    with session_factory() as db:
+        written = db.scalar(
+            select(func.count()).select_from(SetupProgressDB).where(SetupProgressDB.request_id == request_id)
+        )
+    assert written == count, f"{request_id}: {written}/{count}件しか書き込まれていません"
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, nargs="+", default=[3000, 30000], help="書き込むイベント数")
+    parser.add_argument("--hosts", type=int, default=300, help="イベントを分散させるホスト数")
+    parser.add_argument("--repeat", type=int, default=3, help="各条件の試行回数(中央値を表示)")
+    args = parser.parse_args()
+
+    methods = (("per-event", write_per_event), ("buffered", write_buffered))
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{Path(directory) / 'bench.db'}")
+        event.listen(engine, "connect", partial(_configure_sqlite, read_only=False))
+        Base.metadata.create_all(engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        print(f"{'events':>8} {'method':>12} {'seconds':>9} {'events/s':>10}")
+        for count in args.events:
+            rates = {}
+            for name, write_fn in methods:
+                elapsed = statistics.median(
+                    measure(session_factory, write_fn, f"{name}-{count}-{attempt}", count, args.hosts)
+                    for attempt in range(args.repeat)
+                )
+                rates[name] = count / elapsed
+                print(f"{count:>8} {name:>12} {elapsed:>9.3f} {rates[name]:>10,.0f}")
+            print(f"{count:>8} {'speedup':>12} {'':>9} {rates['buffered'] / rates['per-event']:>9.1f}x")
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
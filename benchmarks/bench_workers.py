@@ -0,0 +1,213 @@
+"""
+ジョブワーカーのスループットのベンチマーク(ワーカープロセス数によるスケーリング)
+
+一時ディレクトリの SQLite に N 台分のジョブを登録し、python -m backend.worker と同じ
+JobWorker + FleetExecutor を W 個の別プロセスで起動して、全ジョブの完了までの時間を測る。
+スクリプトの実行だけを一定時間待つ擬似タスクに置き換え、占有・ハートビート・
+チェックポイント・進捗の書き込みなどDB側の処理は実際のコードで行う。
+
+    python -m benchmarks.bench_workers --workers 1 2 4 --jobs 200 --capacity 10 --task-seconds 1.0
+
+ワーカー数毎に、所要時間・1秒あたりのジョブ数・1ワーカーに対する倍率と、
+1ジョブあたりの書き込みトランザクション数(全ワーカーのコミット数 / ジョブ数)・
+ワーカープロセスのCPU時間を表示する。ワーカー数がCPUコア数を超えると、
+ジョブ毎のCPU時間(cpu ms/job)で頭打ちになる点に注意。
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+# 擬似タスクとして実行するタスク(順に依存する3タスク)
+BENCH_OPTIONS = {"install_forticlient_vpn": True, "move_vpn_icon": True, "cleanup_system": True}
+
+def prepare_database(database_url: str, jobs: int):
+    """テーブルを作成し、jobs 台分のリクエストを1件登録する"""
+    from sqlalchemy import create_engine
+    from backend.database import Base
+    from backend.models import ComputerInfo, LoginType, SetupOptions
+    from backend.request_store import insert_setup_request
+    from sqlalchemy.orm import Session
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    computers = [
+        ComputerInfo(
+            computer_name=f"PC-{index:05d}",
+            ip_address=f"10.1.{index // 256 % 256}.{index % 256}",
+            login_type=LoginType.AD,
+            ad_username="admin",
+            ad_password="password",
+            full_name=f"利用者 {index}"
+        )
+        for index in range(jobs)
+    ]
+    with Session(engine) as db:
+        insert_setup_request(db, "bench", "bench", "Pending", computers, SetupOptions(**BENCH_OPTIONS))
+        db.commit()
+    engine.dispose()
+
+def job_summary(database_url: str) -> Dict[str, object]:
+    """ジョブの状態毎の件数と、最後に終わったジョブの終了時刻"""
+    from sqlalchemy import create_engine, func, select
+    from backend.models import HostJobDB
+
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        states = dict(connection.execute(
+            select(HostJobDB.state, func.count()).group_by(HostJobDB.state)
+        ).all())
+        last_finished = connection.execute(select(func.max(HostJobDB.finished_at))).scalar()
+    engine.dispose()
+    return {"states": states, "last_finished": last_finished}
+
+async def run_child(args):
+    """ワーカープロセス側: 開始の合図を待ってから、全ジョブが終わるまでジョブを占有して実行する"""
+    from sqlalchemy import event, func, select
+    from backend import utils
+    from backend.database import engine, run_in_session
+    from backend.job_store import OPEN_JOB_STATES
+    from backend.main import fleet_executor
+    from backend.models import HostJobDB
+    from backend.progress_writer import progress_writer
+    from backend.worker import JobWorker
+
+    logging.getLogger().setLevel(logging.WARNING)
+    commits = 0
+
+    def count_commit(connection):
+        nonlocal commits
+        commits += 1
+
+    event.listen(engine, "commit", count_commit)
+
+    async def fake_setup_task(task_name, computer_info, setup_options, on_progress=None):
+        if on_progress is not None:
+            on_progress(50.0, "擬似タスクを実行中")
+        await asyncio.sleep(args.task_seconds)
+        return True, "擬似タスクが完了しました", {}
+
+    utils.execute_setup_task = fake_setup_task
+
+    def open_jobs(db) -> int:
+        return db.execute(
+            select(func.count()).select_from(HostJobDB).where(HostJobDB.state.in_(OPEN_JOB_STATES))
+        ).scalar()
+
+    worker = JobWorker(fleet_executor, capacity=args.capacity, poll_interval=0.2)
+    ready_dir = Path(args.ready_dir)
+    (ready_dir / f"{os.getpid()}.ready").touch()
+    while not (ready_dir / "start").exists():
+        await asyncio.sleep(0.02)
+
+    cpu_started = time.process_time()
+    await progress_writer.start()
+    await worker.start()
+    try:
+        while await run_in_session(open_jobs, read_only=True):
+            await asyncio.sleep(0.2)
+    finally:
+        await worker.stop()
+        await progress_writer.stop()
+    print(json.dumps({
+        "finished_jobs": worker.finished_jobs,
+        "commits": commits,
+        "cpu_seconds": time.process_time() - cpu_started
+    }), flush=True)
+
+def run_workers(workers: int, args) -> Dict[str, float]:
+    """workers 個のワーカープロセスで全ジョブを実行し、結果を集計する"""
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f"sqlite:///{Path(directory) / 'bench.db'}"
+        prepare_database(database_url, args.jobs)
+        env = {
+            **os.environ,
+            "DATABASE_URL": database_url,
+            "FLEET_ADAPTIVE_CONCURRENCY": "false",
+            "PREFLIGHT_ENABLED": "false"
+        }
+        command = [
+            sys.executable, "-m", "benchmarks.bench_workers", "--child",
+            "--capacity", str(args.capacity),
+            "--task-seconds", str(args.task_seconds),
+            "--ready-dir", directory
+        ]
+        processes = [
+            subprocess.Popen(command, env=env, stdout=subprocess.PIPE, text=True)
+            for _ in range(workers)
+        ]
+        # 起動(import)の時間を含めないよう、全プロセスの準備ができてから開始する
+        while len(list(Path(directory).glob("*.ready"))) < workers:
+            if any(process.poll() is not None for process in processes):
+                raise RuntimeError("ワーカープロセスが起動できませんでした")
+            time.sleep(0.05)
+        started = datetime.now()
+        (Path(directory) / "start").touch()
+
+        reports: List[Dict[str, int]] = []
+        for process in processes:
+            stdout, _ = process.communicate()
+            lines = [line for line in stdout.splitlines() if line.startswith("{")]
+            if process.returncode != 0 or not lines:
+                raise RuntimeError(f"ワーカープロセスが異常終了しました: {process.returncode}")
+            reports.append(json.loads(lines[-1]))
+
+        summary = job_summary(database_url)
+        completed = summary["states"].get("completed", 0)
+        if completed != args.jobs:
+            raise RuntimeError(f"完了しなかったジョブがあります: {summary['states']}")
+        elapsed = (summary["last_finished"] - started).total_seconds()
+        return {
+            "seconds": elapsed,
+            "jobs_per_second": args.jobs / elapsed,
+            "commits_per_job": sum(report["commits"] for report in reports) / args.jobs,
+            "cpu_ms_per_job": sum(report["cpu_seconds"] for report in reports) * 1000 / args.jobs
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="ワーカープロセス数")
+    parser.add_argument("--jobs", type=int, default=200, help="ジョブ数(台数)")
+    parser.add_argument("--capacity", type=int, default=10, help="1ワーカーの同時占有数")
+    parser.add_argument("--task-seconds", type=float, default=1.0, help="擬似タスク1件の所要時間(秒)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--ready-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(run_child(args))
+        return
+
+    tasks = len(BENCH_OPTIONS)
+    print(
+        f"jobs={args.jobs}, capacity={args.capacity}/worker, "
+        f"{tasks} tasks x {args.task_seconds:g}s per job, cpu cores={os.cpu_count()}"
+    )
+    print(
+        f"{'workers':>8} {'seconds':>9} {'jobs/s':>8} {'speedup':>8} {'ideal':>7} "
+        f"{'tx/job':>7} {'cpu ms/job':>11}"
+    )
+    baseline = None
+    for workers in args.workers:
+        result = run_workers(workers, args)
+        baseline = baseline or result["jobs_per_second"] / workers
+        # 書き込みの待ちが無い場合の所要時間(同時占有数 x ワーカー数 で並列に実行した場合)
+        waves = -(-args.jobs // (args.capacity * workers))
+        ideal = waves * tasks * args.task_seconds
+        print(
+            f"{workers:>8} {result['seconds']:>9.1f} {result['jobs_per_second']:>8.2f} "
+            f"{result['jobs_per_second'] / baseline:>7.2f}x {ideal:>6.1f}s {result['commits_per_job']:>7.1f} "
+            f"{result['cpu_ms_per_job']:>11.1f}"
+        )
+
+if __name__ == "__main__":
+    main()
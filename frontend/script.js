@@ -1,5 +1,17 @@
 // モジュールスコープ変数
 let currentUser = null;  // ログインユーザー名
+let statusStreamController = null;  // 進捗ストリームの接続(AbortController)
+let statusRenderScheduled = false;  // ステータス再描画の予約状態
+let requestListCursor = null;  // 申請一覧の次ページのカーソル
+let requestFilterTimer = null;  // 申請者フィルター入力の遅延実行タイマー
+let capacityTimer = null;  // 受付状況の定期更新タイマー
+
+// ステータス更新の設定
+const STATUS_POLLING_INTERVAL_MS = 5000;
+const STATUS_STREAM_RETRY_LIMIT = 3;  // この回数連続で接続に失敗したらポーリングに切り替える
+const REQUEST_LIST_PAGE_SIZE = 50;
+const REQUEST_FILTER_DELAY_MS = 300;
+const CAPACITY_REFRESH_INTERVAL_MS = 30000;
 
 // 状態管理用変数
 const state = {
@@ -90,6 +102,10 @@ function showLoggedOutUI() {
     if (logoutBtn) logoutBtn.classList.add('hidden');
     if (userInfo) userInfo.classList.add('hidden');
     if (mainNav) mainNav.classList.add('hidden');
+    if (capacityTimer) {
+        clearInterval(capacityTimer);
+        capacityTimer = null;
+    }
 }
 function logout() {
     localStorage.removeItem('token');
@@ -441,6 +457,7 @@ function showNewRequestForm() {
     document.getElementById('requestList').classList.add('hidden');
     document.getElementById('newRequestBtn').classList.add('active');
     document.getElementById('requestListBtn').classList.remove('active');
+    startCapacityUpdates();
 }
 
 // 申請一覧の表示
@@ -450,6 +467,50 @@ function showRequestList() {
     document.getElementById('newRequestBtn').classList.remove('active');
     document.getElementById('requestListBtn').classList.add('active');
     loadRequestList();
+    startCapacityUpdates();
+}
+
+// 受付状況(実行枠・待ち時間)の表示を開始
+function startCapacityUpdates() {
+    loadCapacityStatus();
+    if (!capacityTimer) {
+        capacityTimer = setInterval(loadCapacityStatus, CAPACITY_REFRESH_INTERVAL_MS);
+    }
+}
+
+async function loadCapacityStatus() {
+    try {
+        const response = await fetchWithToken(`${API_BASE_URL}/setup/capacity`);
+        if (!response.ok) return;
+        displayCapacityStatus(await response.json());
+    } catch (error) {
+        console.error('受付状況の取得に失敗しました:', error);
+    }
+}
+
+function formatWaitTime(seconds) {
+    if (seconds < 60) return '待ちなし';
+    if (seconds < 3600) return `約${Math.ceil(seconds / 60)}分`;
+    return `約${(seconds / 3600).toFixed(1)}時間`;
+}
+
+function displayCapacityStatus(capacity) {
+    const labels = {
+        admit: ['すぐに実行できます', 'capacity-admit'],
+        park: ['混雑中: 申請は承認済み(実行待ち)として順番に実行されます', 'capacity-park'],
+        reject: ['混雑中: 現在は申請を受け付けていません', 'capacity-reject']
+    };
+    const [label, className] = labels[capacity.accepting] || labels.admit;
+    const html = `
+        <span class="capacity-label">${label}</span>
+        <span>実行中 ${capacity.running_hosts}台 / 実行待ち ${capacity.admitted_hosts - capacity.running_hosts}台(上限 ${capacity.max_hosts}台)</span>
+        <span>待機中の申請 ${capacity.parked_requests}件(${capacity.parked_hosts}台)</span>
+        <span>推定待ち時間 ${formatWaitTime(capacity.estimated_wait_seconds)}</span>
+    `;
+    document.querySelectorAll('.capacity-status').forEach(element => {
+        element.className = `capacity-status ${className}`;
+        element.innerHTML = html;
+    });
 }
 
 async function importCSV() {
@@ -497,7 +558,7 @@ async function importCSV() {
                 <h3>CSVインポート結果</h3>
                 <div class="import-status error">
                     <p>❌ インポートに失敗しました</p>
-                    <p>エラー内容: ${errorMessage}</p>
+                    <p>エラー内容: ${escapeHtml(errorMessage)}</p>
                     <p>確認事項:</p>
                     <ul>
                         <li>CSVファイルの形式が正しいか確認してください</li>
@@ -511,12 +572,20 @@ async function importCSV() {
 
         const data = JSON.parse(responseText);
         console.log('パース済みデータ:', data);
+        if (data.error) {
+            // 応答の途中で読み込めなくなった場合は、一部だけ取り込んだ結果を使わない
+            throw new Error(data.error);
+        }
         currentComputerList = data.computers;
         
         if (currentComputerList && currentComputerList.length > 0) {
             console.log('コンピュータリスト:', currentComputerList);
             displayComputerList(currentComputerList);
+            displayImportErrors(data);
             nextBtn.classList.remove('hidden');
+        } else if (data.error_count > 0) {
+            preview.innerHTML = '<h3>CSVインポート結果</h3>';
+            displayImportErrors(data);
         } else {
             preview.innerHTML = `
                 <h3>CSVインポート結果</h3>
@@ -533,7 +602,7 @@ async function importCSV() {
                 <h3>CSVインポート結果</h3>
                 <div class="import-status error">
                     <p>❌ 予期せぬエラーが発生しました</p>
-                    <p>エラー内容: ${error.message}</p>
+                    <p>エラー内容: ${escapeHtml(error.message)}</p>
                 </div>
             `;
         }
@@ -557,6 +626,34 @@ async function validateAndProceed() {
     showStep2();
 }
 
+// HTMLに埋め込む文字列のエスケープ(CSVの値はそのまま表示する)
+function escapeHtml(value) {
+    return String(value)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
+// 取り込めなかった行の表示
+function displayImportErrors(report) {
+    if (!report.error_count) return;
+    const preview = document.getElementById('csvPreview');
+    const more = report.errors_truncated ? `<p>ほか ${report.error_count - report.errors.length}行のエラーは省略されています</p>` : '';
+    preview.insertAdjacentHTML('beforeend', `
+        <div class="import-status error">
+            <p>⚠️ ${report.total_rows}行中 ${report.error_count}行を取り込めませんでした</p>
+            <ul>
+                ${report.errors.map(error => `
+                    <li>${error.row}行目${error.computer_name ? `(${escapeHtml(error.computer_name)})` : ''}: ${escapeHtml(error.message)}</li>
+                `).join('')}
+            </ul>
+            ${more}
+        </div>
+    `);
+}
+
 // コンピュータリストの表示
 // コンピュータリストの表示
 function displayComputerList(computers) {
@@ -900,47 +997,59 @@ async function submitSetupRequest() {
             body: formData
         });
 
+        if (response.status === 429) {
+            const retryAfter = parseInt(response.headers.get('Retry-After') || '0', 10);
+            loadCapacityStatus();
+            throw new Error(`混雑のため申請を受け付けられませんでした。約${Math.ceil(retryAfter / 60)}分後に再度申請してください。`);
+        }
         if (!response.ok) {
             const error = await response.json();
             throw new Error(error.detail || 'セットアップリクエストの作成に失敗しました。');
         }
 
         const data = await response.json();
-        alert('セットアップリクエストを作成しました。\n申請ID: ' + data.request_id);
+        if (data.admission === 'park') {
+            alert('セットアップリクエストを受け付けました(実行待ち)。\n実行枠に空きが出ると順番に実行されます。\n'
+                + `申請ID: ${data.request_id}\n推定待ち時間: ${formatWaitTime(data.estimated_wait_seconds)}`);
+        } else {
+            alert('セットアップリクエストを作成しました。\n申請ID: ' + data.request_id);
+        }
         showRequestList();
     } catch (error) {
         alert(error.message);
     }
 }
 
-// 申請一覧の読み込みと表示
-async function loadRequestList() {
+// 申請一覧の読み込みと表示(append が true の場合は次のページを追加で読み込む)
+async function loadRequestList(append = false) {
     try {
         const statusFilter = document.getElementById('statusFilter').value;
         const requesterFilter = document.getElementById('requesterFilter').value;
 
-        let url = `${API_BASE_URL}/setup/list`;
-        if (statusFilter) url += `?status=${statusFilter}`;
-        if (requesterFilter) url += `${statusFilter ? '&' : '?'}requester=${requesterFilter}`;
+        const params = new URLSearchParams({ limit: REQUEST_LIST_PAGE_SIZE });
+        if (statusFilter) params.set('status', statusFilter);
+        if (requesterFilter) params.set('requester', requesterFilter);
+        if (append && requestListCursor) params.set('cursor', requestListCursor);
 
-        const response = await fetchWithToken(url);
+        const response = await fetchWithToken(`${API_BASE_URL}/setup/requests?${params}`);
         if (!response.ok) {
             const error = await response.json();
             throw new Error(error.detail || '申請一覧の取得に失敗しました。');
         }
 
         const data = await response.json();
-        displayRequestList(data.requests);
+        requestListCursor = data.next_cursor;
+        displayRequestList(data.requests, append);
     } catch (error) {
         alert(error.message);
     }
 }
 
 // 申請一覧の表示
-function displayRequestList(requests) {
+function displayRequestList(requests, append = false) {
     const container = document.getElementById('requestListContent');
     const userRole = localStorage.getItem('userRole');
-    container.innerHTML = requests.map(request => `
+    const html = requests.map(request => `
         <div class="request-card">
             <div class="request-header">
                 <span class="request-id">申請ID: ${request.request_id}</span>
@@ -958,6 +1067,18 @@ function displayRequestList(requests) {
             </div>
         </div>
     `).join('');
+
+    const loadMoreBtn = container.querySelector('.load-more-btn');
+    if (loadMoreBtn) loadMoreBtn.remove();
+    if (append) {
+        container.insertAdjacentHTML('beforeend', html);
+    } else {
+        container.innerHTML = html;
+    }
+    if (requestListCursor) {
+        container.insertAdjacentHTML('beforeend',
+            '<button class="load-more-btn" onclick="loadRequestList(true)">さらに表示</button>');
+    }
 }
 
 // ステータステキストの取得
@@ -1087,7 +1208,16 @@ async function showStatus(requestId) {
 function displayStatusModal(statusData, requestId) {
     if (!statusData || !requestId) return;
 
+    renderStatusModal(statusData);
+
     const modal = document.getElementById('statusModal');
+    modal.classList.remove('hidden');
+    activeRequestId = requestId;
+    startStatusUpdates(statusData, requestId);
+}
+
+// ステータスモーダルの内容を描画
+function renderStatusModal(statusData) {
     const progressContainer = document.getElementById('progressContainer');
     const logContainer = document.getElementById('logContainer');
 
@@ -1149,27 +1279,143 @@ function displayStatusModal(statusData, requestId) {
             }).join('')}
         </div>
     `;
+}
 
-    modal.classList.remove('hidden');
-    activeRequestId = requestId;
-    startStatusPolling();
+// ステータスの更新を開始(進捗ストリームを優先し、使えない場合はポーリング)
+function startStatusUpdates(statusData, requestId) {
+    if (statusStreamController || statusPollingInterval) return;
+    if (!window.ReadableStream || !window.TextDecoder) {
+        startStatusPolling();
+        return;
+    }
+    startStatusStream(statusData, requestId, getLatestProgressId(statusData), 0);
+}
+
+// 取得済みログの最新の進捗ID(ストリーム再開のカーソル)
+function getLatestProgressId(statusData) {
+    const ids = (statusData.logs || []).map(log => log.id).filter(id => Number.isInteger(id));
+    return ids.length ? Math.max(...ids) : null;
 }
 
-// ステータスの定期更新
+// 進捗ストリーム(Server-Sent Events)の受信
+async function startStatusStream(statusData, requestId, cursor, failures) {
+    const controller = new AbortController();
+    statusStreamController = controller;
+    let lastId = cursor;
+
+    try {
+        let token = getToken();
+        if (isTokenExpired(token)) {
+            token = await refreshToken();
+        }
+        const query = lastId !== null ? `?cursor=${lastId}` : '';
+        const response = await fetch(`${API_BASE_URL}/setup/progress/${requestId}/stream${query}`, {
+            headers: {
+                'Accept': 'text/event-stream',
+                'Authorization': `Bearer ${token}`
+            },
+            signal: controller.signal
+        });
+        if (!response.ok || !response.body) {
+            throw new Error(`進捗ストリームに接続できませんでした(${response.status})`);
+        }
+        failures = 0;
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                const message = parseSseMessage(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+                if (message.event === 'progress' && message.data) {
+                    const log = JSON.parse(message.data);
+                    lastId = log.id;
+                    applyProgressEvent(statusData, log);
+                    scheduleStatusRender(statusData, requestId);
+                }
+            }
+        }
+    } catch (error) {
+        if (controller.signal.aborted) return;
+        console.warn('[Progress Stream Error]:', error.message);
+        failures += 1;
+    }
+
+    // 切断(サーバーからの reset を含む)後はカーソルから再接続する
+    if (statusStreamController !== controller) return;
+    statusStreamController = null;
+    if (activeRequestId !== requestId) return;
+    if (failures >= STATUS_STREAM_RETRY_LIMIT) {
+        console.warn('進捗ストリームが利用できないため、ポーリングに切り替えます');
+        startStatusPolling();
+        return;
+    }
+    setTimeout(() => {
+        if (activeRequestId === requestId && !statusStreamController && !statusPollingInterval) {
+            startStatusStream(statusData, requestId, lastId, failures);
+        }
+    }, 1000 * (failures + 1));
+}
+
+// SSEメッセージ1件の解析
+function parseSseMessage(text) {
+    const message = { event: 'message', data: '' };
+    text.split('\n').forEach(line => {
+        if (line.startsWith(':')) return;  // キープアライブ
+        const separator = line.indexOf(':');
+        const field = separator >= 0 ? line.slice(0, separator) : line;
+        const value = separator >= 0 ? line.slice(separator + 1).replace(/^ /, '') : '';
+        if (field === 'event') message.event = value;
+        if (field === 'data') message.data += value;
+        if (field === 'id') message.id = value;
+    });
+    return message;
+}
+
+// 受信した進捗イベントを表示中のステータスに反映
+function applyProgressEvent(statusData, log) {
+    statusData.computer_progress = statusData.computer_progress || {};
+    statusData.computer_progress[log.computer_name] = log.progress;
+    statusData.logs = [log, ...(statusData.logs || [])];
+
+    const values = Object.values(statusData.computer_progress);
+    statusData.progress = values.length ? values.reduce((sum, value) => sum + value, 0) / values.length : 0;
+}
+
+// 連続したイベントの再描画を1フレームにまとめる
+function scheduleStatusRender(statusData, requestId) {
+    if (statusRenderScheduled) return;
+    statusRenderScheduled = true;
+    requestAnimationFrame(() => {
+        statusRenderScheduled = false;
+        if (activeRequestId === requestId) renderStatusModal(statusData);
+    });
+}
+
+// ステータスの定期更新(進捗ストリームが使えない場合のフォールバック)
 function startStatusPolling() {
     if (statusPollingInterval) {
         clearInterval(statusPollingInterval);
     }
     statusPollingInterval = setInterval(() => {
         if (activeRequestId) showStatus(activeRequestId);
-    }, 5000);
+    }, STATUS_POLLING_INTERVAL_MS);
 }
 
 // モーダルを閉じる
 function closeModal() {
     const modal = document.getElementById('statusModal');
     modal.classList.add('hidden');
-    
+
+    if (statusStreamController) {
+        statusStreamController.abort();
+        statusStreamController = null;
+    }
     if (statusPollingInterval) {
         clearInterval(statusPollingInterval);
         statusPollingInterval = null;
@@ -1377,5 +1623,7 @@ function updatePCCardDisplay(pcName) {
 
 // フィルター適用
 function filterRequests() {
-    loadRequestList();
+    // 入力の度に問い合わせないよう、入力が落ち着いてから検索する
+    clearTimeout(requestFilterTimer);
+    requestFilterTimer = setTimeout(() => loadRequestList(), REQUEST_FILTER_DELAY_MS);
 }
\ No newline at end of file
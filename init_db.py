@@ -1,5 +1,5 @@
 from backend.database import engine, Base
-from backend.models import User, ComputerInfoDB, SetupOptionsDB, SetupRequestDB, SetupProgressDB
+from backend.models import User, ComputerInfoDB, SetupOptionsDB, SetupRequestDB, SetupProgressDB, HostStatusDB, HostJobDB, JobStepDB, JobLeaseDB, RolloutDB
 
 def init_db():
     Base.metadata.create_all(bind=engine)
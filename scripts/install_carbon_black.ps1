@@ -9,6 +9,10 @@ param (
     [Parameter(Mandatory=$true)]
     [string]$Password,
 
+    # ランナーホストから再利用するセッション(省略時は新規作成)
+    [Parameter(Mandatory=$false)]
+    [System.Management.Automation.Runspaces.PSSession]$Session,
+
     [Parameter(Mandatory=$false)]
     [string]$InstallerUrl = "",  # Carbon BlackインストーラーのダウンロードURL
 
@@ -24,12 +28,17 @@ $result = @{
 }
 
 try {
-    # 資格情報の作成
-    $securePassword = ConvertTo-SecureString -String $Password -AsPlainText -Force
-    $credential = New-Object System.Management.Automation.PSCredential ($Username, $securePassword)
-
-    # リモートセッションの作成
-    $session = New-PSSession -ComputerName $ComputerName -Credential $credential
+    # ランナーホストから有効なセッションが渡されていない場合のみ新規作成
+    # (PowerShellの変数名は大文字小文字を区別しないため $session は $Session と同一)
+    if (-not $Session -or $Session.State -ne "Opened") {
+        # 資格情報の作成
+        $securePassword = ConvertTo-SecureString -String $Password -AsPlainText -Force
+        $credential = New-Object System.Management.Automation.PSCredential ($Username, $securePassword)
+
+        # リモートセッションの作成
+        $session = New-PSSession -ComputerName $ComputerName -Credential $credential
+        $ownsSession = $true
+    }
 
     # Carbon Blackインストールスクリプトブロック
     $scriptBlock = {
@@ -133,8 +142,8 @@ catch {
     $result.message = "エラーが発生しました: $_"
 }
 finally {
-    # セッションの終了
-    if ($session) {
+    # 自身で作成したセッションのみ終了
+    if ($session -and $ownsSession) {
         Remove-PSSession $session
     }
 }
@@ -9,6 +9,10 @@ param (
     [Parameter(Mandatory=$true)]
     [string]$Password,
 
+    # ランナーホストから再利用するセッション(省略時は新規作成)
+    [Parameter(Mandatory=$false)]
+    [System.Management.Automation.Runspaces.PSSession]$Session,
+
     [Parameter(Mandatory=$false)]
     [string]$Channel = "Current",  # Current, MonthlyEnterprise, SemiAnnual
 
@@ -23,13 +27,29 @@ $result = @{
     "details" = @{}
 }
 
+# 進捗をバックエンドへ通知(1行のJSONとして出力)
+function Write-TaskProgress {
+    param (
+        [int]$Percent,
+        [string]$Message
+    )
+    Write-Output (@{ "type" = "progress"; "percent" = $Percent; "message" = $Message } | ConvertTo-Json -Compress)
+}
+
 try {
-    # 資格情報の作成
-    $securePassword = ConvertTo-SecureString -String $Password -AsPlainText -Force
-    $credential = New-Object System.Management.Automation.PSCredential ($Username, $securePassword)
+    # ランナーホストから有効なセッションが渡されていない場合のみ新規作成
+    # (PowerShellの変数名は大文字小文字を区別しないため $session は $Session と同一)
+    if (-not $Session -or $Session.State -ne "Opened") {
+        # 資格情報の作成
+        $securePassword = ConvertTo-SecureString -String $Password -AsPlainText -Force
+        $credential = New-Object System.Management.Automation.PSCredential ($Username, $securePassword)
+
+        # リモートセッションの作成
+        $session = New-PSSession -ComputerName $ComputerName -Credential $credential
+        $ownsSession = $true
+    }
 
-    # リモートセッションの作成
-    $session = New-PSSession -ComputerName $ComputerName -Credential $credential
+    Write-TaskProgress -Percent 10 -Message "リモートセッションを確立しました"
 
     # Office 365インストールスクリプトブロック
     $scriptBlock = {
@@ -116,7 +136,9 @@ try {
     }
 
     # スクリプトブロックの実行
+    Write-TaskProgress -Percent 20 -Message "Microsoft 365のインストールを開始します"
     $remoteResult = Invoke-Command -Session $session -ScriptBlock $scriptBlock -ArgumentList $Channel, $Language
+    Write-TaskProgress -Percent 90 -Message "インストール結果を確認しています"
 
     # 結果の設定
     $result.success = $true
@@ -133,8 +155,8 @@ catch {
     $result.message = "エラーが発生しました: $_"
 }
 finally {
-    # セッションの終了
-    if ($session) {
+    # 自身で作成したセッションのみ終了
+    if ($session -and $ownsSession) {
         Remove-PSSession $session
     }
 }
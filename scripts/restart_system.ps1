@@ -0,0 +1,42 @@
+[CmdletBinding()]
+param (
+    [Parameter(Mandatory=$true)]
+    [string]$ComputerName,
+    
+    [Parameter(Mandatory=$true)]
+    [string]$Username,
+    
+    [Parameter(Mandatory=$true)]
+    [string]$Password
+)
+
+# 結果を格納するハッシュテーブル
+$result = @{
+    "success" = $false
+    "message" = ""
+    "details" = @{}
+}
+
+try {
+    # 資格情報の作成
+    $securePassword = ConvertTo-SecureString -String $Password -AsPlainText -Force
+    $credential = New-Object System.Management.Automation.PSCredential ($Username, $securePassword)
+
+    # 再起動を指示する(WinRMの応答はサーバー側の reboot_watcher が待つため、ここでは待たない)
+    Restart-Computer -ComputerName $ComputerName -Credential $credential -Force
+
+    # 結果の設定
+    $result.success = $true
+    $result.message = "再起動を指示しました"
+    $result.details = @{
+        "computer" = $ComputerName
+        "rebooting" = $true
+        "timestamp" = (Get-Date).ToString("yyyy-MM-dd HH:mm:ss")
+    }
+}
+catch {
+    $result.message = "エラーが発生しました: $_"
+}
+
+# 結果をJSON形式で出力
+$result | ConvertTo-Json -Depth 10
@@ -0,0 +1,130 @@
+#
+# 常駐型ランナーホスト
+#
+# 標準入力から1行1件のJSONでタスク要求を受け取り、スクリプトを実行して
+# 出力を1行ずつ、終了時に結果を、それぞれ1行のJSONで標準出力に返す。リモートセッションはホスト毎に保持し、
+# 同じコンピュータへの後続タスクで再利用する。
+#
+# 要求:   {"type": "run", "id": "...", "script": "C:\...\install_office.ps1",
+#          "computer_name": "...", "username": "...", "password": "...", "args": {...}}
+#         {"type": "shutdown"}
+# 応答:   {"type": "output", "id": "...", "stream": "stdout", "line": "..."}  (出力1行ごと)
+#         {"type": "result", "id": "...", "exit_code": 0}
+#
+
+[Console]::InputEncoding = [System.Text.Encoding]::UTF8
+[Console]::OutputEncoding = [System.Text.Encoding]::UTF8
+
+# コンピュータ名+ユーザー名をキーとしたセッションキャッシュ
+$sessions = @{}
+
+function Get-CachedSession {
+    param (
+        [string]$ComputerName,
+        [string]$Username,
+        [string]$Password
+    )
+
+    $key = "$ComputerName|$Username"
+    $cached = $sessions[$key]
+    if ($cached -and $cached.State -eq "Opened") {
+        return $cached
+    }
+    if ($cached) {
+        Remove-PSSession $cached -ErrorAction SilentlyContinue
+    }
+
+    $securePassword = ConvertTo-SecureString -String $Password -AsPlainText -Force
+    $credential = New-Object System.Management.Automation.PSCredential ($Username, $securePassword)
+    $session = New-PSSession -ComputerName $ComputerName -Credential $credential
+    $sessions[$key] = $session
+    return $session
+}
+
+function Write-Response {
+    param ([hashtable]$Response)
+    [Console]::Out.WriteLine(($Response | ConvertTo-Json -Compress -Depth 10))
+    [Console]::Out.Flush()
+}
+
+function Write-OutputLine {
+    param (
+        [string]$Id,
+        [string]$Stream,
+        [string]$Line
+    )
+    Write-Response @{
+        "type" = "output"
+        "id" = $Id
+        "stream" = $Stream
+        "line" = $Line
+    }
+}
+
+while ($true) {
+    $line = [Console]::In.ReadLine()
+    if ($null -eq $line) {
+        break
+    }
+    if (-not $line.Trim()) {
+        continue
+    }
+
+    $request = $line | ConvertFrom-Json
+    if ($request.type -eq "shutdown") {
+        break
+    }
+
+    $exitCode = 0
+    try {
+        $params = @{
+            ComputerName = $request.computer_name
+            Username = $request.username
+            Password = $request.password
+        }
+        if ($request.args) {
+            foreach ($property in $request.args.PSObject.Properties) {
+                $params[$property.Name] = $property.Value
+            }
+        }
+
+        # スクリプトがセッション引数を受け付ける場合はキャッシュしたセッションを渡す
+        $command = Get-Command $request.script
+        if ($command.Parameters.ContainsKey("Session")) {
+            try {
+                $params["Session"] = Get-CachedSession -ComputerName $request.computer_name -Username $request.username -Password $request.password
+            }
+            catch {
+                # セッションを作成できない場合はスクリプト側での作成に任せる
+                Write-OutputLine -Id $request.id -Stream "stderr" -Line "セッションの作成に失敗しました: $_"
+            }
+        }
+
+        # 出力はバッファせず、発生した順に1行ずつ返す
+        & $request.script @params 2>&1 | ForEach-Object {
+            if ($_ -is [System.Management.Automation.ErrorRecord]) {
+                Write-OutputLine -Id $request.id -Stream "stderr" -Line $_.ToString()
+            }
+            else {
+                foreach ($text in ($_ | Out-String -Stream)) {
+                    Write-OutputLine -Id $request.id -Stream "stdout" -Line $text
+                }
+            }
+        }
+    }
+    catch {
+        $exitCode = 1
+        Write-OutputLine -Id $request.id -Stream "stderr" -Line $_.ToString()
+    }
+
+    Write-Response @{
+        "type" = "result"
+        "id" = $request.id
+        "exit_code" = $exitCode
+    }
+}
+
+# 保持しているセッションをすべて終了
+foreach ($session in $sessions.Values) {
+    Remove-PSSession $session -ErrorAction SilentlyContinue
+}
@@ -0,0 +1,84 @@
+#
+# ランナーホストのスタブ(Windows以外での動作確認用)
+#
+# runner_host.ps1 と同じJSON行のプロトコルを話すが、スクリプトは実行せず、
+# 進捗行と結果のJSONを出力として返すだけのワーカー。RUNNER_COMMAND に指定して使う:
+#
+#   RUNNER_COMMAND="python3 -u scripts/stub_runner.py" uvicorn backend.main:app
+#
+# 要求:   {"type": "run", "id": "...", "script": "...", "computer_name": "...",
+#          "username": "...", "password": "...", "args": {...}}
+#         {"type": "shutdown"}
+# 応答:   {"type": "output", "id": "...", "stream": "stdout", "line": "..."}  (出力1行ごと)
+#         {"type": "result", "id": "...", "exit_code": 0}
+#
+# 環境変数:
+#   STUB_RUNNER_DELAY       1タスクあたりの擬似的な実行時間(秒, 既定 0)
+#   STUB_RUNNER_FAIL_HOSTS  失敗させるコンピュータ名(カンマ区切り)
+#
+
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+DELAY = float(os.getenv("STUB_RUNNER_DELAY", "0"))
+FAIL_HOSTS = {name for name in os.getenv("STUB_RUNNER_FAIL_HOSTS", "").split(",") if name}
+PROGRESS_STEPS = (0, 50, 100)
+
+def write_response(response: dict):
+    sys.stdout.write(json.dumps(response, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+def write_output(request_id: str, line: str, stream: str = "stdout"):
+    write_response({"type": "output", "id": request_id, "stream": stream, "line": line})
+
+def run(request: dict) -> int:
+    """要求を1件処理し、終了コードを返す"""
+    request_id = request["id"]
+    script = Path(request.get("script", "")).name
+    computer_name = request.get("computer_name", "")
+
+    for index, percent in enumerate(PROGRESS_STEPS):
+        if index and DELAY:
+            time.sleep(DELAY / (len(PROGRESS_STEPS) - 1))
+        write_output(request_id, json.dumps(
+            {"type": "progress", "percent": percent, "message": f"{script} を実行中"},
+            ensure_ascii=False
+        ))
+
+    success = computer_name not in FAIL_HOSTS
+    if not success:
+        write_output(request_id, f"{computer_name} でのスクリプトの実行に失敗しました(スタブ)", "stderr")
+    result = {
+        "success": success,
+        "message": f"{script} を実行しました(スタブ)" if success else "スタブで失敗させました",
+        "details": {
+            "computer": computer_name,
+            "script": script,
+            "args": request.get("args") or {},
+            "pid": os.getpid()
+        }
+    }
+    write_output(request_id, json.dumps(result, ensure_ascii=False))
+    return 0 if success else 1
+
+def main():
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if request.get("type") == "shutdown":
+            break
+        if request.get("type") != "run":
+            continue
+        try:
+            exit_code = run(request)
+        except Exception as e:
+            write_output(request["id"], str(e), "stderr")
+            exit_code = 1
+        write_response({"type": "result", "id": request["id"], "exit_code": exit_code})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import sys
+from functools import partial
+from pathlib import Path
+
+import pytest
+
+# テストからバックエンドをパッケージとして import できるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """本番と同じ設定の一時 SQLite のセッションファクトリ(data.db には触れない)"""
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+
+    from backend.database import Base, _configure_sqlite
+    from backend import models  # noqa: F401 (テーブル定義の登録)
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    event.listen(engine, "connect", partial(_configure_sqlite, read_only=False))
+    Base.metadata.create_all(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
@@ -0,0 +1,183 @@
+"""
+テスト用の WinRM(WS-Management)サーバー
+
+127.0.0.1 の空きポートで /wsman の cmd シェル(Create / Command / Send / Receive / Signal / Delete)を
+最小限に模倣し、受け取った要求を記録する。Receive の応答は receives で1回分ずつ指定する。
+"""
+import asyncio
+import base64
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from backend.winrm_client import (
+    NS, COMMAND_DONE, FAULT_ACCESS_DENIED, FAULT_OPERATION_TIMEOUT, WinRMClient
+)
+
+# シェルが存在しない(期限切れ・対象PCの再起動)場合の WS-Management のエラー
+FAULT_INVALID_SELECTORS = "2150858843"
+
+# Receive 1回分の応答。None は待ち時間内に出力が無かった(OperationTimeout)ことを表す
+Receive = Optional[List[Tuple[str, bytes]]]
+
+class FakeWinRMServer:
+    """
+    /wsman の模倣サーバー
+
+    Args:
+        receives (Sequence[Receive]): コマンド毎の Receive の応答(最後の応答でコマンドが終了する)
+        exit_code (int): コマンドの終了コード
+        chunked (bool): 応答を Transfer-Encoding: chunked で分割して返すか
+        hang (bool): コマンドを終了させず、Receive に OperationTimeout を返し続けるか
+        deny (bool): 認証は通し、シェルの作成をアクセス拒否(HTTP 500, Code=5)にするか
+    """
+
+    def __init__(
+        self,
+        receives: Sequence[Receive] = ((("stdout", b'{"success": true}\r\n'),),),
+        exit_code: int = 0,
+        chunked: bool = False,
+        hang: bool = False,
+        deny: bool = False,
+        username: str = "admin",
+        password: str = "pw"
+    ):
+        self.receives = list(receives)
+        self.exit_code = exit_code
+        self.chunked = chunked
+        self.hang = hang
+        self.deny = deny
+        self.authorization = "Basic " + base64.b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+        self.port: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._polls: Dict[str, int] = {}
+        # 記録
+        self.connections = 0
+        self.actions: List[str] = []
+        self.shells: Dict[str, List[str]] = {}  # ShellId 毎の CommandId
+        self.stdin: Dict[str, bytes] = {}
+        self.arguments: Dict[str, List[str]] = {}
+        self.signals: List[str] = []
+        self.deleted: List[str] = []
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def client(self, host: str, username: str, password: str) -> WinRMClient:
+        """WinRMPool.client_factory として使うクライアントの生成(コンピュータ名に関わらずこのサーバーに接続する)"""
+        return WinRMClient("127.0.0.1", username, password, transport="http", port=self.port, operation_timeout=1)
+
+    def forget_shells(self):
+        """対象PCの再起動などでシェルが無くなった状態にする"""
+        self.shells.clear()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers: Dict[str, str] = {}
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                status, response = await self._handle(headers.get("authorization"), body)
+                self._respond(writer, status, response.encode("utf-8"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _respond(self, writer: asyncio.StreamWriter, status: int, data: bytes):
+        if self.chunked and data:
+            # 小さいチャンクに分け、チャンクの境界が XML の途中に来るようにする
+            chunks = b"".join(
+                b"%x\r\n" % len(data[start:start + 37]) + data[start:start + 37] + b"\r\n"
+                for start in range(0, len(data), 37)
+            )
+            writer.write(
+                f"HTTP/1.1 {status} X\r\nTransfer-Encoding: chunked\r\n\r\n".encode("latin-1") + chunks + b"0\r\n\r\n"
+            )
+        else:
+            writer.write(f"HTTP/1.1 {status} X\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+
+    async def _handle(self, authorization: Optional[str], body: bytes) -> Tuple[int, str]:
+        if authorization != self.authorization:
+            return 401, ""
+        root = ET.fromstring(body)
+        action = root.findtext(".//a:Action", namespaces=NS).rsplit("/", 1)[1]
+        shell_id = root.findtext(".//w:Selector[@Name='ShellId']", namespaces=NS)
+        self.actions.append(action)
+
+        if action == "Create":
+            if self.deny:
+                return _fault(FAULT_ACCESS_DENIED, "Access is denied.")
+            shell_id = f"shell-{len(self.actions)}"
+            self.shells[shell_id] = []
+            return 200, _envelope(f"<rsp:Shell><rsp:ShellId>{shell_id}</rsp:ShellId></rsp:Shell>")
+        if shell_id not in self.shells:
+            return _fault(FAULT_INVALID_SELECTORS, "The request for the Windows Remote Shell with ShellId failed")
+
+        if action == "Command":
+            command_id = f"command-{len(self.actions)}"
+            self.shells[shell_id].append(command_id)
+            self.arguments[command_id] = [element.text for element in root.iterfind(".//rsp:Arguments", NS)]
+            return 200, _envelope(f"<rsp:CommandResponse><rsp:CommandId>{command_id}</rsp:CommandId></rsp:CommandResponse>")
+        if action == "Send":
+            stream = root.find(".//rsp:Stream", NS)
+            command_id = stream.get("CommandId")
+            self.stdin[command_id] = self.stdin.get(command_id, b"") + base64.b64decode(stream.text or "")
+            return 200, _envelope("<rsp:SendResponse/>")
+        if action == "Receive":
+            command_id = root.find(".//rsp:DesiredStream", NS).get("CommandId")
+            return await self._receive(command_id)
+        if action == "Signal":
+            self.signals.append(root.find(".//rsp:Signal", NS).get("CommandId"))
+            return 200, _envelope("<rsp:SignalResponse/>")
+        if action == "Delete":
+            self.deleted.append(shell_id)
+            self.shells.pop(shell_id, None)
+            return 200, _envelope("")
+        return _fault("1", f"unsupported action: {action}")
+
+    async def _receive(self, command_id: str) -> Tuple[int, str]:
+        index = self._polls.get(command_id, 0)
+        self._polls[command_id] = index + 1
+        if self.hang or self.receives[index] is None:
+            # 実際のサーバーは OperationTimeout の間だけ待ってから返す
+            await asyncio.sleep(0.05)
+            return _fault(FAULT_OPERATION_TIMEOUT, "The WS-Management service cannot complete the operation")
+        streams = "".join(
+            f'<rsp:Stream Name="{name}" CommandId="{command_id}">{base64.b64encode(data).decode("ascii")}</rsp:Stream>'
+            for name, data in self.receives[index]
+        )
+        state = ""
+        if index == len(self.receives) - 1:
+            state = (
+                f'<rsp:Stream Name="stdout" CommandId="{command_id}" End="true"></rsp:Stream>'
+                f'<rsp:CommandState CommandId="{command_id}" State="{COMMAND_DONE}">'
+                f"<rsp:ExitCode>{self.exit_code}</rsp:ExitCode></rsp:CommandState>"
+            )
+        return 200, _envelope(f"<rsp:ReceiveResponse>{streams}{state}</rsp:ReceiveResponse>")
+
+def _envelope(body: str) -> str:
+    return (
+        f'<s:Envelope xmlns:s="{NS["s"]}" xmlns:rsp="{NS["rsp"]}" xmlns:w="{NS["w"]}">'
+        f"<s:Body>{body}</s:Body></s:Envelope>"
+    )
+
+def _fault(code: str, message: str) -> Tuple[int, str]:
+    return 500, (
+        f'<s:Envelope xmlns:s="{NS["s"]}" xmlns:f="{NS["f"]}"><s:Body><s:Fault>'
+        f"<s:Reason><s:Text>{message}</s:Text></s:Reason>"
+        f'<s:Detail><f:WSManFault Code="{code}"><f:Message>{message}</f:Message></f:WSManFault></s:Detail>'
+        "</s:Fault></s:Body></s:Envelope>"
+    )
@@ -0,0 +1,61 @@
+import pytest
+
+from backend.admission import (
+    ADMIT, PARK, REJECT, ADMISSION_MAX_RETRY_AFTER, ADMISSION_MIN_RETRY_AFTER,
+    AdmissionController, Backlog
+)
+
+def controller(**kwargs) -> AdmissionController:
+    options = dict(max_hosts=100, max_backlog_seconds=3600, overload_action=PARK, max_parked_hosts=500, fleet_capacity=10)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+def test_request_within_limits_is_admitted():
+    admission = controller()
+    decision = admission.decide(Backlog(admitted_hosts=50, admitted_seconds=5 * 3600), hosts=20, host_seconds=3600)
+    assert decision.action == ADMIT
+    assert decision.estimated_wait_seconds == pytest.approx(5 * 3600 / 10)
+    assert admission.admitted_requests == 1
+
+def test_too_many_hosts_are_parked():
+    decision = controller().decide(Backlog(admitted_hosts=90), hosts=20, host_seconds=0)
+    assert decision.action == PARK
+    assert "90/100台" in decision.reason
+    assert ADMISSION_MIN_RETRY_AFTER <= decision.retry_after <= ADMISSION_MAX_RETRY_AFTER
+
+def test_backlog_time_over_the_limit_is_parked():
+    # 受け付け済み 30000秒 + 新規 10000秒 をフリートの10並列で消化すると4000秒かかる
+    decision = controller().decide(Backlog(admitted_hosts=10, admitted_seconds=30_000), hosts=5, host_seconds=10_000)
+    assert decision.action == PARK
+    assert "推定消化時間" in decision.reason
+    assert decision.retry_after == 400
+
+def test_reject_mode_returns_retry_after():
+    admission = controller(overload_action=REJECT)
+    decision = admission.decide(Backlog(admitted_hosts=100), hosts=1, host_seconds=0)
+    assert decision.action == REJECT
+    assert decision.retry_after >= ADMISSION_MIN_RETRY_AFTER
+    assert admission.rejected_requests == 1
+
+def test_parked_capacity_overflow_is_rejected():
+    backlog = Backlog(admitted_hosts=100, parked_hosts=490, parked_requests=3, parked_max_priority=0)
+    assert controller().decide(backlog, hosts=20, host_seconds=0).action == REJECT
+
+def test_parked_requests_go_first_unless_outranked():
+    admission = controller()
+    backlog = Backlog(admitted_hosts=1, parked_hosts=50, parked_requests=2, parked_max_priority=0)
+    # 空きがあっても、待機中のリクエストを追い越さない
+    same = admission.decide(backlog, hosts=1, host_seconds=0, priority=0)
+    assert same.action == PARK
+    assert "2件" in same.reason
+    # 優先度の高いリクエストは先に受け付ける
+    assert admission.decide(backlog, hosts=1, host_seconds=0, priority=5).action == ADMIT
+
+def test_idle_fleet_admits_an_oversized_request():
+    decision = controller().decide(Backlog(), hosts=1000, host_seconds=10 ** 7)
+    assert decision.action == ADMIT
+    assert decision.estimated_wait_seconds == 0.0
+
+def test_invalid_overload_action_is_rejected():
+    with pytest.raises(ValueError):
+        controller(overload_action="drop")
@@ -0,0 +1,99 @@
+import asyncio
+
+from backend.concurrency import AimdController, HostLimiter
+
+def controller(**kwargs) -> AimdController:
+    options = dict(
+        min_limit=5, max_limit=50, enabled=True, increase_step=5, decrease_factor=0.5,
+        failure_threshold=0.1, latency_threshold=2.0, min_samples=5
+    )
+    options.update(kwargs)
+    return AimdController(**options)
+
+def record(aimd: AimdController, count: int, latency: float = 10.0, failures: int = 0):
+    for index in range(count):
+        aimd.record("install_office", latency, success=index >= failures)
+
+def test_limit_increases_additively_while_saturated_and_healthy():
+    aimd = controller()
+    record(aimd, 10)
+    assert aimd.adjust(saturated=True).action == "increase"
+    record(aimd, 10)
+    decision = aimd.adjust(saturated=True)
+    assert (decision.previous_limit, decision.limit) == (10, 15)
+
+def test_limit_is_held_when_not_saturated():
+    aimd = controller()
+    record(aimd, 10)
+    decision = aimd.adjust(saturated=False)
+    assert decision.action == "hold"
+    assert aimd.limit == 5
+
+def test_failures_decrease_the_limit_multiplicatively():
+    aimd = controller()
+    aimd.limiter.set_limit(40)
+    record(aimd, 10, failures=2)
+    decision = aimd.adjust(saturated=True)
+    assert decision.action == "decrease"
+    assert decision.limit == 20
+    assert decision.failure_rate == 0.2
+
+def test_slow_tasks_decrease_the_limit():
+    aimd = controller()
+    aimd.limiter.set_limit(40)
+    record(aimd, 1, latency=10.0)  # 平常時の所要時間
+    aimd.adjust(saturated=False)
+    record(aimd, 10, latency=30.0)
+    decision = aimd.adjust(saturated=True)
+    assert decision.action == "decrease"
+    # 平常時の値はゆっくりとしか追従しないため、遅くなった分がそのまま倍率に現れる
+    assert decision.latency_ratio > 2.9
+    assert decision.limit == 20
+
+def test_too_few_samples_do_not_decrease():
+    aimd = controller()
+    aimd.limiter.set_limit(40)
+    record(aimd, 4, failures=4)
+    decision = aimd.adjust(saturated=False)
+    assert decision.action == "hold"
+    assert aimd.limit == 40
+
+def test_limit_stays_within_the_configured_range():
+    aimd = controller(min_limit=5, max_limit=12)
+    for _ in range(3):
+        record(aimd, 10)
+        aimd.adjust(saturated=True)
+    assert aimd.limit == 12
+    assert aimd.last_decision.action == "hold"
+
+    for _ in range(5):
+        record(aimd, 10, failures=10)
+        aimd.adjust(saturated=True)
+    assert aimd.limit == 5
+
+def test_disabled_controller_holds_the_maximum():
+    aimd = controller(enabled=False, max_limit=30)
+    record(aimd, 10, failures=10)
+    decision = aimd.adjust(saturated=True)
+    assert decision.action == "hold"
+    assert aimd.limit == 30
+
+def test_lowering_the_limit_does_not_interrupt_holders():
+    async def scenario():
+        limiter = HostLimiter(2)
+        await limiter.acquire()
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.set_limit(1)
+        limiter.release()
+        await asyncio.sleep(0)
+        # 上限を下げた分の空きは再び割り当てない
+        blocked = not waiter.done()
+        limiter.release()
+        await asyncio.wait_for(waiter, 1)
+        return blocked, limiter.in_use
+
+    blocked, in_use = asyncio.run(scenario())
+    assert blocked
+    assert in_use == 1
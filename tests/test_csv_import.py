@@ -0,0 +1,69 @@
+import io
+import json
+import tracemalloc
+
+import pytest
+
+from backend.csv_import import CsvFormatError, iter_import_json
+
+HEADER = "ホスト名,IPアドレス,ログイン種別,ADユーザ,ADパスワード,フルネーム"
+
+def write_csv(path, rows):
+    """5行目がヘッダー、10行目以降がデータの登録ユーザ情報CSV"""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("登録ユーザ情報\n\n\n\n" + HEADER + "\n" + "\n" * 4)
+        for row in rows:
+            f.write(row + "\n")
+
+def test_rows_and_errors_are_reported():
+    path_rows = [
+        "PC-001,10.0.0.1,AD,user1,pw1,山田 太郎",
+        "PC-002,10.0.0.2,不明,user2,pw2,",
+        "",
+        "PC-003,10.0.0.3,AD,user3,pw3,"
+    ]
+    content = ("\n" * 4 + HEADER + "\n" * 5 + "\n".join(path_rows) + "\n").encode("utf-8")
+    data = json.loads("".join(iter_import_json(io.BytesIO(content), batch_size=1)))
+    assert [computer["computer_name"] for computer in data["computers"]] == ["PC-001", "PC-003"]
+    assert data["computers"][0]["login_type"] == "AD"
+    assert data["total_rows"] == 3
+    assert data["error_count"] == 1
+    assert data["errors"][0]["row"] == 11
+    assert data["errors"][0]["computer_name"] == "PC-002"
+    assert "error" not in data
+
+def test_missing_header_fails_before_any_output():
+    chunks = iter_import_json(io.BytesIO("a,b\n".encode("utf-8")))
+    with pytest.raises(CsvFormatError):
+        next(chunks)
+
+def test_50k_rows_are_streamed_in_bounded_memory(tmp_path):
+    rows = 50_000
+    source = tmp_path / "computers.csv"
+    write_csv(source, (f"PC-{index:05d},10.0.{index // 256 % 256}.{index % 256},AD,user{index},pw{index}," for index in range(rows)))
+
+    output = tmp_path / "response.json"
+    with open(source, "rb") as stream, open(output, "w", encoding="utf-8") as response:
+        tracemalloc.start()
+        try:
+            for chunk in iter_import_json(stream, batch_size=1000):
+                response.write(chunk)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    with open(output, encoding="utf-8") as f:
+        data = json.load(f)
+    assert len(data["computers"]) == rows
+    assert data["valid_rows"] == rows
+    assert data["computers"][-1]["computer_name"] == f"PC-{rows - 1:05d}"
+    # 保持するのは1バッチ分だけ(全件をリストに溜めると数十MBになる)
+    assert peak < 8 * 1024 * 1024
+
+def test_decode_error_after_the_first_batch_is_reported_in_the_response():
+    # 先読みした範囲は UTF-8 として読めるが、その後に Shift_JIS の行がある
+    rows = "".join(f"PC-{index:05d},10.0.0.1,AD,user,pw,\n" for index in range(3000))
+    content = ("\n" * 4 + HEADER + "\n" * 5 + rows).encode("utf-8") + "PC-X,10.0.0.1,AD,user,pw,山田\n".encode("cp932")
+    data = json.loads("".join(iter_import_json(io.BytesIO(content), batch_size=100)))
+    assert "最後まで読み込めませんでした" in data["error"]
+    assert len(data["computers"]) == 3000
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from backend.dispatcher import FairShareQueue, parse_weights
+
+def drain(queue: FairShareQueue):
+    return [queue.pop() for _ in range(len(queue))]
+
+def test_requesters_share_by_weight():
+    queue = FairShareQueue(weights={"alice": 2.0})
+    for index in range(6):
+        queue.push(f"alice-{index}", "REQ-A", "alice")
+        queue.push(f"bob-{index}", "REQ-B", "bob")
+    order = [job.split("-")[0] for job in drain(queue)[:9]]
+    # 重み2の alice は bob の2倍の割合で取り出される
+    assert order.count("alice") == 6
+    assert order.count("bob") == 3
+
+def test_small_request_is_not_starved_by_a_large_one():
+    queue = FairShareQueue(weights={})
+    for index in range(500):
+        queue.push(f"big-{index}", "REQ-BIG", "alice")
+    queue.push("small", "REQ-SMALL", "bob")
+    order = drain(queue)
+    # 500台のリクエストが先に投入されていても、他の申請者の1台はすぐに取り出される
+    assert order.index("small") <= 2
+    # 同じリクエスト内は投入順
+    assert [job for job in order if job != "small"] == [f"big-{index}" for index in range(500)]
+
+def test_requests_of_the_same_requester_are_fifo():
+    queue = FairShareQueue(weights={})
+    queue.push("first-0", "REQ-1", "alice")
+    queue.push("second-0", "REQ-2", "alice")
+    queue.push("first-1", "REQ-1", "alice")
+    assert drain(queue) == ["first-0", "first-1", "second-0"]
+
+def test_higher_priority_levels_are_drained_first():
+    queue = FairShareQueue(weights={})
+    queue.push("low", "REQ-LOW", "alice", priority=-5)
+    queue.push("normal", "REQ-NORMAL", "bob")
+    queue.push("high", "REQ-HIGH", "carol", priority=5)
+    assert drain(queue) == ["high", "normal", "low"]
+
+def test_expedite_moves_queued_jobs_to_the_new_level():
+    queue = FairShareQueue(weights={})
+    for index in range(3):
+        queue.push(f"normal-{index}", "REQ-NORMAL", "alice")
+        queue.push(f"late-{index}", "REQ-LATE", "bob")
+    queue.pop()
+    moved = queue.expedite("REQ-LATE", priority=100)
+    assert moved == 3
+    assert drain(queue)[:3] == ["late-0", "late-1", "late-2"]
+    # 優先度はリクエストの統計にも反映される
+    assert queue.request_stats("REQ-LATE")["priority"] == 100
+
+def test_empty_queue_raises_index_error():
+    queue = FairShareQueue(weights={})
+    queue.push("job", "REQ-1", "alice")
+    queue.pop()
+    with pytest.raises(IndexError):
+        queue.pop()
+    assert queue.get_stats()["queued"] == 0
+
+def test_invalid_weights_are_rejected():
+    assert parse_weights("alice=2, bob=0.5") == {"alice": 2.0, "bob": 0.5}
+    with pytest.raises(ValueError):
+        parse_weights("alice=0")
+
+def seconds_per_job(jobs: int, requesters: int = 50) -> float:
+    """jobs 件を投入して全て取り出すまでの1件あたりの時間(秒、3回の最小値)"""
+    best = float("inf")
+    for _ in range(3):
+        queue = FairShareQueue(weights={})
+        started = time.perf_counter()
+        for index in range(jobs):
+            queue.push(index, f"REQ-{index % (requesters * 2)}", f"user-{index % requesters}", priority=index % 3)
+        drain(queue)
+        best = min(best, time.perf_counter() - started)
+    return best / jobs
+
+def test_push_and_pop_scale_logarithmically():
+    # キュー内のジョブ数に比例する処理があれば、10倍のジョブで1件あたりの時間も約10倍になる
+    small = seconds_per_job(1_000)
+    large = seconds_per_job(10_000)
+    assert large < small * 3
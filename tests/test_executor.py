@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+from backend.executor import FleetExecutor
+
+def computer(name: str):
+    return SimpleNamespace(computer_name=name)
+
+def make_executor(host_runner, **kwargs) -> FleetExecutor:
+    options = dict(max_concurrent_hosts=2, min_concurrent_hosts=2, adaptive=False, cancel_retention=0)
+    options.update(kwargs)
+    return FleetExecutor(host_runner, **options)
+
+async def wait_until(predicate, timeout: float = 2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "条件が成立しませんでした"
+        await asyncio.sleep(0.01)
+
+def test_request_cancel_is_forgotten_after_its_jobs_finish():
+    started = []
+
+    async def host_runner(job):
+        started.append(job.computer_info.computer_name)
+        await asyncio.sleep(10)
+
+    async def scenario():
+        executor = make_executor(host_runner)
+        await executor.start()
+        try:
+            await executor.submit("req-1", [computer(f"PC-{i}") for i in range(5)], None)
+            await wait_until(lambda: executor.active_hosts == 2)
+            assert executor.cancel("req-1") == 2
+            # キュー待ちのジョブも取り出した時点で破棄される
+            await wait_until(lambda: executor.cancelled_hosts == 5)
+            return executor.get_stats()
+        finally:
+            await executor.stop()
+
+    stats = asyncio.run(scenario())
+    assert len(started) == 2
+    assert stats["active_hosts"] == 0
+    assert stats["cancellations_tracked"] == 0
+
+def test_cancel_of_unknown_host_does_not_accumulate():
+    async def host_runner(job):
+        await asyncio.sleep(0)
+
+    async def scenario():
+        executor = make_executor(host_runner)
+        await executor.start()
+        try:
+            for i in range(100):
+                executor.cancel(f"req-{i}", "PC-finished")
+            return executor.get_stats()
+        finally:
+            await executor.stop()
+
+    stats = asyncio.run(scenario())
+    # 直前の1件以外は、次のキャンセルの受付時に破棄されている
+    assert stats["cancellations_tracked"] == 1
+
+def test_cancel_is_kept_while_the_request_has_queued_jobs():
+    started = []
+    release = None
+
+    async def host_runner(job):
+        started.append((job.request_id, job.computer_info.computer_name))
+        await release.wait()
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        executor = make_executor(host_runner, max_concurrent_hosts=1, min_concurrent_hosts=1)
+        await executor.start()
+        try:
+            await executor.submit("req-busy", [computer("PC-A")], None)
+            await wait_until(lambda: executor.active_hosts == 1)
+            await executor.submit("req-queued", [computer("PC-B"), computer("PC-C")], None)
+            executor.cancel("req-queued", "PC-B")
+            # 他のリクエストのキャンセルで記録の整理が走っても、待機中のジョブのキャンセルは残る
+            executor.cancel("req-other")
+            assert executor.is_cancelled("req-queued", "PC-B")
+            release.set()
+            await wait_until(lambda: executor.completed_hosts == 2)
+            return executor.get_stats()
+        finally:
+            await executor.stop()
+
+    stats = asyncio.run(scenario())
+    assert ("req-queued", "PC-B") not in started
+    assert ("req-queued", "PC-C") in started
+    assert stats["cancelled_hosts"] == 1
@@ -0,0 +1,80 @@
+import asyncio
+
+from backend.host_lock import HostLockManager
+
+def test_same_host_is_served_in_arrival_order():
+    order = []
+
+    async def scenario():
+        locks = HostLockManager(lease_seconds=10)
+
+        async def work(owner: str):
+            async with locks.hold("PC-001", owner):
+                order.append(f"start {owner}")
+                await asyncio.sleep(0.01)
+                order.append(f"end {owner}")
+
+        tasks = []
+        for owner in ("a", "b", "c"):
+            tasks.append(asyncio.create_task(work(owner)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return locks.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert order == ["start a", "end a", "start b", "end b", "start c", "end c"]
+    assert stats["contended_acquisitions"] == 2
+    assert stats["locked_hosts"] == 0
+
+def test_computer_names_are_case_insensitive_and_hosts_are_independent():
+    async def scenario():
+        locks = HostLockManager(lease_seconds=10)
+        lease = await locks.acquire("PC-001", "a")
+        # 別のホストは待たない
+        other = await asyncio.wait_for(locks.acquire("PC-002", "b"), 0.1)
+        waiter = asyncio.create_task(locks.acquire("pc-001", "c"))
+        await asyncio.sleep(0.01)
+        blocked = not waiter.done()
+        locks.release(lease)
+        locks.release(other)
+        locks.release(await asyncio.wait_for(waiter, 1))
+        return blocked
+
+    assert asyncio.run(scenario())
+
+def test_expired_lease_is_handed_to_the_next_waiter():
+    async def scenario():
+        locks = HostLockManager()
+        stale = await locks.acquire("PC-001", "stuck", lease_seconds=0.05)
+        lease = await asyncio.wait_for(locks.acquire("PC-001", "next"), 1)
+        # 期限切れの保持者は延長も解放もできない
+        renewed = locks.renew(stale)
+        locks.release(stale)
+        still_held = locks.is_locked("PC-001")
+        locks.release(lease)
+        return stale, renewed, still_held, locks.get_stats()
+
+    stale, renewed, still_held, stats = asyncio.run(scenario())
+    assert stale.expired
+    assert not renewed
+    assert still_held
+    assert stats["expired_leases"] == 1
+
+def test_cancelled_waiter_does_not_receive_the_lock():
+    async def scenario():
+        locks = HostLockManager(lease_seconds=10)
+        lease = await locks.acquire("PC-001", "a")
+        cancelled = asyncio.create_task(locks.acquire("PC-001", "b"))
+        waiting = asyncio.create_task(locks.acquire("PC-001", "c"))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        locks.release(lease)
+        next_lease = await asyncio.wait_for(waiting, 1)
+        locks.release(next_lease)
+        return next_lease.owner, locks.get_stats()
+
+    owner, stats = asyncio.run(scenario())
+    assert owner == "c"
+    assert stats["waiting"] == 0
+    assert stats["locked_hosts"] == 0
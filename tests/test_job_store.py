@@ -0,0 +1,74 @@
+from typing import List, Optional
+
+import pytest
+
+from backend.job_store import claim_jobs, finish_host_job, insert_host_jobs
+from backend.models import ComputerInfo, LoginType, SetupRequestDB, TaskStatus
+
+@pytest.fixture
+def add_request(session_factory):
+    """リクエストとジョブを登録し、ジョブの id を返す"""
+    def add(request_id: str, requester: str, names: List[str], priority: int = 0,
+            estimated_seconds: Optional[List[float]] = None) -> List[int]:
+        computers = [
+            ComputerInfo(computer_name=name, ip_address="10.0.0.1", login_type=LoginType.AD, full_name="")
+            for name in names
+        ]
+        with session_factory() as db:
+            db.add(SetupRequestDB(request_id=request_id, requester=requester, status="Approved", priority=priority))
+            job_ids = insert_host_jobs(
+                db, request_id, computers, list(range(len(names))),
+                requester=requester, priority=priority, estimated_seconds=estimated_seconds
+            )
+            db.commit()
+        return job_ids
+
+    return add
+
+def claim(session_factory, worker_id: str, limit: int, **kwargs) -> List[int]:
+    with session_factory() as db:
+        return claim_jobs(db, worker_id, limit, weights={}, **kwargs)
+
+def test_requesters_share_each_claim(session_factory, add_request):
+    alice = add_request("REQ-A", "alice", [f"A-{index}" for index in range(6)])
+    bob = add_request("REQ-B", "bob", ["B-0", "B-1"])
+    claimed = claim(session_factory, "worker-1", 4)
+    # 先に投入された大きなリクエストがあっても、同じ取得回で他の申請者のジョブも選ばれる
+    assert sorted(claimed) == sorted(alice[:2] + bob)
+
+def test_higher_priority_jobs_are_claimed_first(session_factory, add_request):
+    add_request("REQ-LOW", "alice", ["L-0", "L-1"])
+    high = add_request("REQ-HIGH", "bob", ["H-0", "H-1"], priority=5)
+    assert sorted(claim(session_factory, "worker-1", 2)) == sorted(high)
+
+def test_longest_jobs_of_a_request_are_claimed_first(session_factory, add_request):
+    jobs = add_request("REQ-1", "alice", ["PC-0", "PC-1", "PC-2"], estimated_seconds=[60, 3600, 600])
+    assert claim(session_factory, "worker-1", 2) == [jobs[1], jobs[2]]
+
+def test_workers_never_claim_the_same_job(session_factory, add_request):
+    jobs = add_request("REQ-1", "alice", [f"PC-{index}" for index in range(10)])
+    first = claim(session_factory, "worker-1", 4)
+    second = claim(session_factory, "worker-2", 10)
+    assert len(first) == 4
+    assert not set(first) & set(second)
+    assert sorted(first + second) == sorted(jobs)
+    assert claim(session_factory, "worker-3", 10) == []
+
+def test_jobs_of_a_busy_host_are_not_claimed(session_factory, add_request):
+    first = add_request("REQ-1", "alice", ["PC-001"])
+    second = add_request("REQ-2", "bob", ["pc-001", "PC-002"])
+    claimed = claim(session_factory, "worker-1", 10)
+    # 同じPC(大文字小文字を区別しない)のジョブは1件だけ占有する
+    assert sorted(claimed) == sorted(first + second[1:])
+    # 先のジョブが終わって占有を解除すると、残りのジョブを取れる
+    with session_factory() as db:
+        finish_host_job(db, first[0], TaskStatus.COMPLETED.value)
+    assert claim(session_factory, "worker-1", 0, release=first) == []
+    assert claim(session_factory, "worker-2", 10) == second[:1]
+
+def test_expired_lease_is_taken_over(session_factory, add_request):
+    jobs = add_request("REQ-1", "alice", ["PC-001"])
+    assert claim(session_factory, "worker-1", 1, lease_seconds=-1) == jobs
+    # worker-1 が停止して期限が切れた
+    assert claim(session_factory, "worker-2", 1) == jobs
+    assert claim(session_factory, "worker-3", 1) == []
@@ -0,0 +1,144 @@
+import asyncio
+import socket
+from types import SimpleNamespace
+
+import backend.preflight as preflight_module
+from backend.preflight import Preflight
+
+def computer(name: str, address: str = "127.0.0.1"):
+    return SimpleNamespace(computer_name=name, ip_address=address)
+
+def closed_port() -> int:
+    """誰も待ち受けていないポート"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def listener():
+    """WinRM のポートの代わりに接続を受け付けるだけのサーバー"""
+    accepted = []
+
+    async def accept(reader, writer):
+        accepted.append(writer.get_extra_info("peername"))
+        writer.close()
+
+    server = await asyncio.start_server(accept, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1], accepted
+
+def test_reachable_and_unreachable_hosts():
+    async def scenario():
+        server, https_port, _ = await listener()
+        try:
+            # 5985 の代わりは閉じたポート、5986 の代わりは待ち受けているポート
+            reachable = await Preflight(ports=(closed_port(), https_port), timeout=1, enabled=True).check(
+                [computer("PC-UP")]
+            )
+            unreachable = await Preflight(ports=(closed_port(), closed_port()), timeout=1, enabled=True).check(
+                [computer("PC-DOWN")]
+            )
+            return https_port, reachable, unreachable
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    https_port, reachable, unreachable = asyncio.run(scenario())
+    assert reachable["PC-UP"].reachable
+    assert reachable["PC-UP"].port == https_port
+    assert not unreachable["PC-DOWN"].reachable
+    assert unreachable["PC-DOWN"].port is None
+    assert "接続できません" in unreachable["PC-DOWN"].error
+
+def test_results_are_cached_until_the_ttl_expires():
+    async def scenario():
+        server, port, accepted = await listener()
+        checker = Preflight(ports=(port,), timeout=1, cache_ttl=0.2, enabled=True)
+        try:
+            await checker.check([computer("PC-001")])
+            await checker.check([computer("PC-001")])
+            cached = (checker.get_stats(), len(accepted))
+            await asyncio.sleep(0.25)
+            await checker.check([computer("PC-001")])
+            return cached, checker.get_stats()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    (cached, connections), expired = asyncio.run(scenario())
+    assert cached["probes"] == 1
+    assert cached["cache_hits"] == 1
+    assert connections == 1
+    # 期限切れ後は確認し直す
+    assert expired["probes"] == 2
+    assert expired["cache_hits"] == 1
+
+def test_unreachable_results_use_the_shorter_ttl():
+    async def scenario():
+        checker = Preflight(ports=(closed_port(),), timeout=1, cache_ttl=60, negative_ttl=0.1, enabled=True)
+        await checker.check([computer("PC-001")])
+        await asyncio.sleep(0.15)
+        await checker.check([computer("PC-001")])
+        return checker.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["probes"] == 2
+    assert stats["unreachable"] == 2
+
+def test_same_address_is_probed_once(monkeypatch):
+    in_flight = 0
+    peak = 0
+    probe_ports = preflight_module.probe_ports
+
+    async def counting_probe_ports(address, ports, timeout):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            await asyncio.sleep(0.02)
+            return await probe_ports(address, ports, timeout)
+        finally:
+            in_flight -= 1
+
+    monkeypatch.setattr(preflight_module, "probe_ports", counting_probe_ports)
+
+    async def scenario():
+        server, port, accepted = await listener()
+        checker = Preflight(ports=(port,), timeout=1, concurrency=3, enabled=True)
+        try:
+            # 全台が同じアドレスのため、同時に行われる確認は1回にまとめられる
+            results = await checker.check([computer(f"PC-{index}") for index in range(12)] + [computer("PC-SAME")])
+            return results, len(accepted)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    results, connections = asyncio.run(scenario())
+    assert peak == 1
+    assert connections == 1
+    assert all(result.reachable for result in results.values())
+
+def test_probes_are_bounded_by_concurrency(monkeypatch):
+    # 到達できないホストの接続確認が期限まで続く状況を、待ってから失敗する確認で代用する
+    in_flight = 0
+    peak = 0
+
+    async def slow_probe_ports(address, ports, timeout):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            await asyncio.sleep(0.02)
+            return None
+        finally:
+            in_flight -= 1
+
+    monkeypatch.setattr(preflight_module, "probe_ports", slow_probe_ports)
+
+    async def scenario():
+        checker = Preflight(ports=(5985, 5986), timeout=1, concurrency=3, enabled=True)
+        results = await checker.check([computer(f"PC-{index}", f"10.0.0.{index}") for index in range(12)])
+        return results, checker.get_stats()
+
+    results, stats = asyncio.run(scenario())
+    assert peak == 3
+    assert stats["probes"] == 12
+    assert not any(result.reachable for result in results.values())
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from backend.models import SetupRequestDB, SetupProgressDB, HostStatusDB, TaskStatus
+from backend.progress_writer import ProgressWriter, ProgressEvent
+
+@pytest.fixture
+def session_factory(session_factory):
+    with session_factory() as db:
+        db.add(SetupRequestDB(request_id="REQ-1", requester="test", status="In Progress"))
+        db.commit()
+    return session_factory
+
+def progress(computer_name: str, task_name: str, value: float, **kwargs) -> ProgressEvent:
+    return ProgressEvent(
+        request_id="REQ-1",
+        computer_name=computer_name,
+        task_name=task_name,
+        status=kwargs.pop("status", "In Progress"),
+        progress=value,
+        message=task_name,
+        **kwargs
+    )
+
+def test_host_updates_are_coalesced_into_one_row_per_flush(session_factory):
+    writer = ProgressWriter(session_factory=session_factory, broker=None)
+    writer.write(progress("PC-001", "setup_initialization", 0.0))
+    writer.write(progress("PC-001", "install_office", 30.0))
+    writer.write(progress("PC-002", "setup_initialization", 0.0))
+    writer.write(progress("PC-001", "install_office", 60.0, status="Completed", duration=120))
+    writer.write(progress("PC-001", "setup_completion", 100.0, status="Completed"))
+    asyncio.run(writer.flush())
+
+    with session_factory() as db:
+        progress_rows = db.scalars(select(SetupProgressDB)).all()
+        hosts = {row.computer_name: row for row in db.scalars(select(HostStatusDB))}
+        request = db.get(SetupRequestDB, "REQ-1")
+
+    # 進捗ログは全件残り、ホストの状態は最後のイベントだけが反映される
+    assert len(progress_rows) == 5
+    assert len(hosts) == 2
+    assert hosts["PC-001"].state == TaskStatus.COMPLETED.value
+    assert hosts["PC-001"].progress == 100.0
+    assert hosts["PC-001"].current_task == "install_office"
+    assert hosts["PC-001"].started_at is not None
+    assert hosts["PC-002"].state == TaskStatus.IN_PROGRESS.value
+    # 1回のフラッシュでリクエストの版数は1つだけ上がる
+    assert request.progress_version == 1
+    assert request.actual_time == 120
+
+    stats = writer.get_stats()
+    assert stats["flushes"] == 1
+    assert stats["events_written"] == 5
+    assert stats["coalesced_updates"] == 3
+
+def test_stop_flushes_events_buffered_before_the_interval(session_factory):
+    async def scenario():
+        # 定期フラッシュの間隔より前に停止する
+        writer = ProgressWriter(session_factory=session_factory, flush_interval_ms=60_000, broker=None)
+        await writer.start()
+        for value in range(10):
+            writer.write(progress("PC-001", "install_office", float(value)))
+        await asyncio.sleep(0.05)
+        before_stop = writer.get_stats()
+        await writer.stop()
+        return before_stop, writer.get_stats()
+
+    before_stop, after_stop = asyncio.run(scenario())
+    assert before_stop["events_written"] == 0
+    assert before_stop["buffered_events"] == 10
+    assert after_stop["events_written"] == 10
+    assert after_stop["buffered_events"] == 0
+    with session_factory() as db:
+        assert len(db.scalars(select(SetupProgressDB)).all()) == 10
+        assert db.get(HostStatusDB, ("REQ-1", "PC-001")).progress == 9.0
+
+def test_full_batch_is_flushed_without_waiting_for_the_interval(session_factory):
+    async def scenario():
+        writer = ProgressWriter(session_factory=session_factory, flush_interval_ms=60_000, batch_size=4, broker=None)
+        await writer.start()
+        for value in range(4):
+            writer.write(progress("PC-001", "install_office", float(value)))
+        for _ in range(100):
+            if writer.get_stats()["events_written"] == 4:
+                break
+            await asyncio.sleep(0.01)
+        stats = writer.get_stats()
+        await writer.stop()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["events_written"] == 4
+    assert stats["flushes"] == 1
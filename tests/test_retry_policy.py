@@ -0,0 +1,19 @@
+from backend.errors import ErrorCategory
+from backend.retry_policy import classify_task_failure, retry_policy
+
+def test_authentication_failure_is_not_retried():
+    # WinRM の接続エラーとして報告されても、認証エラーはリトライしない
+    messages = [
+        "スクリプト実行エラー: Connecting to remote server PC-001 failed with the following error message : "
+        "Access is denied. For more information, see the about_Remote_Troubleshooting Help topic. (WinRM)",
+        "スクリプト実行中に例外が発生: WinRM の認証に失敗しました(https://PC-001:5986/wsman)"
+    ]
+    for message in messages:
+        error = classify_task_failure(message, "PC-001", "install_office")
+        assert error.category == ErrorCategory.AUTHENTICATION
+        assert not retry_policy.should_retry(error)
+
+def test_winrm_connection_failure_is_retried():
+    error = classify_task_failure("スクリプト実行エラー: WinRM cannot complete the operation", "PC-001", "install_office")
+    assert error.category == ErrorCategory.NETWORK
+    assert retry_policy.should_retry(error)
@@ -0,0 +1,92 @@
+import pytest
+from sqlalchemy import select
+
+from backend.job_store import HELD_JOB_STATE, insert_host_jobs
+from backend.models import ComputerInfo, HostJobDB, LoginType, RolloutDB, RolloutSettings, SetupRequestDB, TaskStatus
+from backend.rollout import (
+    ROLLOUT_COMPLETED, ROLLOUT_PAUSED, ROLLOUT_RUNNING,
+    create_rollout, plan_waves, record_wave_result, resume_rollout
+)
+
+FAILED = TaskStatus.FAILED.value
+COMPLETED = TaskStatus.COMPLETED.value
+
+@pytest.fixture
+def rollout(session_factory):
+    """カナリア2台・以降2倍(2, 4, 2台)・失敗率の閾値 40% の段階展開"""
+    computers = [
+        ComputerInfo(computer_name=f"PC-{index}", ip_address=f"10.0.0.{index}", login_type=LoginType.AD, full_name="")
+        for index in range(8)
+    ]
+    waves = plan_waves(len(computers), canary_size=2, growth_factor=2.0)
+    with session_factory() as db:
+        db.add(SetupRequestDB(request_id="REQ-1", requester="test", status="In Progress"))
+        job_ids = insert_host_jobs(db, "REQ-1", computers, list(range(1, 9)), waves=waves)
+        create_rollout(db, "REQ-1", RolloutSettings(canary_size=2, growth_factor=2.0, failure_threshold=0.4), waves)
+        db.commit()
+    return session_factory, dict(zip(job_ids, waves))
+
+def states(db):
+    return {job.id: (job.wave, job.state) for job in db.scalars(select(HostJobDB))}
+
+def test_waves_grow_by_the_factor():
+    assert plan_waves(8, canary_size=2, growth_factor=2.0) == [0, 0, 1, 1, 1, 1, 2, 2]
+    assert plan_waves(4, canary_size=1, growth_factor=1.0) == [0, 1, 1, 2]
+
+def test_next_wave_starts_when_the_canary_succeeds(rollout):
+    session_factory, waves = rollout
+    with session_factory() as db:
+        assert all(state == HELD_JOB_STATE for wave, state in states(db).values() if wave > 0)
+        assert record_wave_result(db, "REQ-1", 0, COMPLETED) == []
+        started = record_wave_result(db, "REQ-1", 0, COMPLETED)
+        db.commit()
+        row = db.get(RolloutDB, "REQ-1")
+        assert started == [job_id for job_id, wave in waves.items() if wave == 1]
+        assert (row.current_wave, row.wave_total, row.state) == (1, 4, ROLLOUT_RUNNING)
+
+def test_rollout_pauses_as_soon_as_the_failure_rate_exceeds_the_threshold(rollout):
+    session_factory, _ = rollout
+    with session_factory() as db:
+        record_wave_result(db, "REQ-1", 0, COMPLETED)
+        record_wave_result(db, "REQ-1", 0, COMPLETED)
+        # ウェーブ 1(4台)の1台目の失敗は 25% で閾値以下
+        record_wave_result(db, "REQ-1", 1, FAILED)
+        assert db.get(RolloutDB, "REQ-1").state == ROLLOUT_RUNNING
+        # 2台目の失敗で 50% となり、残りの2台を待たずに停止する
+        assert record_wave_result(db, "REQ-1", 1, FAILED) == []
+        db.commit()
+        row = db.get(RolloutDB, "REQ-1")
+        assert row.state == ROLLOUT_PAUSED
+        assert "50%" in row.paused_reason
+        # 未着手のジョブは全て保留に戻る
+        assert {state for _, state in states(db).values()} == {HELD_JOB_STATE}
+
+        # 停止後に終わったジョブで次のウェーブに進まない
+        assert record_wave_result(db, "REQ-1", 1, COMPLETED) == []
+        assert db.get(RolloutDB, "REQ-1").current_wave == 1
+
+def test_resume_recounts_the_current_wave(rollout):
+    session_factory, waves = rollout
+    with session_factory() as db:
+        record_wave_result(db, "REQ-1", 0, COMPLETED)
+        record_wave_result(db, "REQ-1", 0, FAILED)
+        db.commit()
+        assert db.get(RolloutDB, "REQ-1").state == ROLLOUT_PAUSED
+
+        # カナリアの2台は停止までに終わっていた(テストでは実行せずに状態だけを終了にする)
+        db.execute(HostJobDB.__table__.update().where(HostJobDB.wave == 0).values(state=COMPLETED))
+        resumed = resume_rollout(db, "REQ-1")
+        db.commit()
+        row = db.get(RolloutDB, "REQ-1")
+        # 現在のウェーブが終わっていたため、次のウェーブから再開する
+        assert resumed == [job_id for job_id, wave in waves.items() if wave == 1]
+        assert (row.state, row.current_wave, row.wave_failed) == (ROLLOUT_RUNNING, 1, 0)
+
+def test_last_wave_completes_the_rollout(rollout):
+    session_factory, _ = rollout
+    with session_factory() as db:
+        for wave, hosts in ((0, 2), (1, 4), (2, 2)):
+            for _ in range(hosts):
+                record_wave_result(db, "REQ-1", wave, COMPLETED)
+        db.commit()
+        assert db.get(RolloutDB, "REQ-1").state == ROLLOUT_COMPLETED
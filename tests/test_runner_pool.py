@@ -0,0 +1,75 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+from backend.runner_pool import RunnerPool
+from backend.script_output import parse_result_json
+
+STUB_RUNNER = Path(__file__).resolve().parent.parent / "scripts" / "stub_runner.py"
+
+def make_pool(**kwargs) -> RunnerPool:
+    return RunnerPool(command=[sys.executable, "-u", str(STUB_RUNNER)], **kwargs)
+
+def test_run_script_streams_output_and_result():
+    async def scenario():
+        pool = make_pool(max_workers=1)
+        lines = []
+        try:
+            result = await pool.run_script(
+                "/scripts/install_office.ps1", "PC-001", "admin", "pw",
+                args={"Edition": "365"},
+                on_output=lambda stream, line: lines.append((stream, line))
+            )
+        finally:
+            await pool.stop()
+        return result, lines
+
+    result, lines = asyncio.run(scenario())
+    assert result["exit_code"] == 0
+    progress = [json.loads(line)["percent"] for _, line in lines if '"progress"' in line]
+    assert progress == [0, 50, 100]
+    parsed = parse_result_json("\n".join(line for stream, line in lines if stream == "stdout"))
+    assert parsed["success"] is True
+    assert parsed["details"]["computer"] == "PC-001"
+    assert parsed["details"]["args"] == {"Edition": "365"}
+
+def test_worker_is_reused_for_the_same_host():
+    async def scenario():
+        pool = make_pool(max_workers=2)
+        pids = []
+        try:
+            for _ in range(3):
+                lines = []
+                await pool.run_script(
+                    "/scripts/setup_desktop.ps1", "PC-002", "admin", "pw",
+                    on_output=lambda stream, line: lines.append(line)
+                )
+                pids.append(parse_result_json("\n".join(lines))["details"]["pid"])
+            return pids, pool.get_stats()
+        finally:
+            await pool.stop()
+
+    pids, stats = asyncio.run(scenario())
+    assert len(set(pids)) == 1
+    assert stats["spawned"] == 1
+    assert stats["sessions"] == 1
+
+def test_failed_host_returns_nonzero_exit_code(monkeypatch):
+    monkeypatch.setenv("STUB_RUNNER_FAIL_HOSTS", "PC-BAD")
+
+    async def scenario():
+        pool = make_pool(max_workers=1)
+        streams = []
+        try:
+            result = await pool.run_script(
+                "/scripts/setup_desktop.ps1", "PC-BAD", "admin", "pw",
+                on_output=lambda stream, line: streams.append(stream)
+            )
+        finally:
+            await pool.stop()
+        return result, streams
+
+    result, streams = asyncio.run(scenario())
+    assert result["exit_code"] == 1
+    assert "stderr" in streams
@@ -0,0 +1,57 @@
+import time
+import tracemalloc
+
+from backend.script_output import ScriptOutputCollector, parse_result_json
+from backend.utils import script_log_path
+
+PROGRESS_LINE = '{"type": "progress", "percent": 50, "message": "ダウンロード中"}'
+
+def measure(text: str):
+    """parse_result_json の結果と、最大メモリ使用量(バイト)・所要時間(秒)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = parse_result_json(text)
+        return result, tracemalloc.get_traced_memory()[1], time.perf_counter() - started
+    finally:
+        tracemalloc.stop()
+
+def test_last_json_line_is_the_result():
+    text = "\n".join(["ログ", '{"success": false}', "続きのログ", '{"success": true, "details": {"a": 1}}', ""])
+    assert parse_result_json(text) == {"success": True, "details": {"a": 1}}
+
+def test_multiline_json_is_parsed_from_its_first_line():
+    # ConvertTo-Json の既定の出力は複数行になる
+    text = 'ログ\n{\n    "success":  true,\n    "items":  [\n{"name": "a"}\n]\n}\n'
+    assert parse_result_json(text) == {"success": True, "items": [{"name": "a"}]}
+
+def test_trailing_text_after_json_is_not_a_result():
+    assert parse_result_json('{"success": true}\n完了しました') is None
+    assert parse_result_json("") is None
+
+def test_large_tail_is_parsed_in_bounded_memory():
+    progress = "\n".join([PROGRESS_LINE] * 5000)
+    result, peak, _ = measure(progress + '\n{"success": true, "message": "完了"}')
+    assert result == {"success": True, "message": "完了"}
+    assert peak < 1024 * 1024
+
+    # 結果JSONが無い場合も、全ての候補を部分文字列として作らない
+    result, peak, elapsed = measure(progress + "\n終了")
+    assert result is None
+    assert peak < 1024 * 1024
+    assert elapsed < 0.5
+
+def test_tail_limit_counts_utf8_bytes():
+    # 日本語の1文字は UTF-8 で3バイト
+    collector = ScriptOutputCollector(tail_bytes=100)
+    for index in range(10):
+        collector.feed("stdout", f"{index}" + "あ" * 9)
+    assert collector.summary()["total_bytes"] == 10 * 29
+    # 上限100バイトに収まるのは末尾の3行だけ(文字数で数えると10行とも収まってしまう)
+    assert collector.stdout_text().splitlines() == [f"{index}" + "あ" * 9 for index in range(7, 10)]
+    assert collector.summary()["dropped_stdout_lines"] == 7
+
+def test_script_log_names_do_not_collide_within_a_second():
+    paths = {script_log_path("PC-001", "install_office.ps1") for _ in range(100)}
+    assert len(paths) == 100
+    assert all(path.name.startswith("script_") and "_PC-001_install_office_" in path.name for path in paths)
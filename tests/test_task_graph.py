@@ -0,0 +1,85 @@
+import asyncio
+
+from backend.task_graph import ExclusiveGate, TaskGraph, TaskNode
+
+def graph(*task_ids: str, **depends_on) -> TaskGraph:
+    return TaskGraph({
+        task_id: TaskNode(task_id=task_id, name=task_id, depends_on=set(depends_on.get(task_id, ())))
+        for task_id in task_ids
+    })
+
+def test_exclusive_waits_for_running_siblings_and_blocks_new_tasks():
+    events = []
+
+    async def scenario():
+        gate = ExclusiveGate()
+
+        async def runner(node):
+            events.append(f"start {node.task_id}")
+            if node.task_id == "update_windows":
+                # 再起動を検知したタスク
+                async def wait():
+                    events.append("parked")
+                    await asyncio.sleep(0.05)
+                    events.append("back")
+                await gate.run_exclusive(wait)
+            else:
+                await asyncio.sleep(0.1 if node.task_id == "sibling" else 0)
+            events.append(f"end {node.task_id}")
+
+        # update_windows と sibling が並列に実行され、sibling が終わって空きができても later は再起動の完了まで開始しない
+        task_graph = graph("update_windows", "sibling", "later")
+        task_graph.nodes["update_windows"].priority = 3
+        task_graph.nodes["sibling"].priority = 2
+        task_graph.nodes["later"].priority = 1
+        await task_graph.run(runner, max_parallel=2, gate=gate)
+
+    asyncio.run(scenario())
+    assert events.index("parked") > events.index("end sibling")
+    assert events.index("start later") > events.index("back")
+
+def test_concurrent_exclusive_requests_share_one_wait():
+    waits = []
+
+    async def scenario():
+        gate = ExclusiveGate()
+
+        async def runner(node):
+            async def wait():
+                waits.append(node.task_id)
+                await asyncio.sleep(0.05)
+                return 1.0
+            return await gate.run_exclusive(wait)
+
+        await graph("a", "b").run(runner, max_parallel=2, gate=gate)
+        return gate
+
+    gate = asyncio.run(scenario())
+    # 同じ再起動を2度待たない
+    assert len(waits) == 1
+    assert gate.entering == 0
+
+def test_graph_without_gate_runs_independent_tasks_in_parallel():
+    running = []
+    peak = 0
+
+    async def scenario():
+        async def runner(node):
+            nonlocal peak
+            running.append(node.task_id)
+            peak = max(peak, len(running))
+            await asyncio.sleep(0.01)
+            running.remove(node.task_id)
+
+        await graph("a", "b", "c", c=["a"]).run(runner, max_parallel=2)
+
+    asyncio.run(scenario())
+    assert peak == 2
+
+def test_estimated_length_serializes_installer_tasks():
+    weights = {"install_office": 1800, "install_carbon_black": 600, "update_windows": 1200, "setup_desktop_icons": 30}
+    task_graph = TaskGraph.from_options({task_id: True for task_id in weights}, weights)
+    assert task_graph.critical_path_length() == 1800
+    # インストーラーは1つずつしか実行できないため、クリティカルパス長では足りない
+    assert task_graph.estimated_length(max_parallel=2) == 3600
+    assert task_graph.estimated_length(max_parallel=1) == 3630
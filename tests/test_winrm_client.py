@@ -0,0 +1,168 @@
+import asyncio
+import json
+
+import pytest
+
+from backend.errors import AuthenticationError
+from backend.winrm_client import WinRMPool
+from fake_winrm import FakeWinRMServer
+
+RESULT_LINE = '{"success": true, "message": "完了"}'
+
+@pytest.fixture
+def script(tmp_path):
+    path = tmp_path / "setup_desktop.ps1"
+    path.write_text("param($ComputerName)\nWrite-Output 'ok'\n", encoding="utf-8")
+    return str(path)
+
+def run(server: FakeWinRMServer, scenario, **pool_options):
+    """模倣サーバーに接続するプールで scenario(pool) を実行し、(結果, プールの状態) を返す"""
+    async def main():
+        await server.start()
+        pool = WinRMPool(client_factory=server.client, **pool_options)
+        try:
+            return await scenario(pool), pool.get_stats()
+        finally:
+            await pool.stop()
+            await server.stop()
+
+    return asyncio.run(main())
+
+def collect(lines):
+    return lambda stream, line: lines.append((stream, line))
+
+def test_connection_and_shell_are_reused(script):
+    server = FakeWinRMServer()
+
+    async def scenario(pool):
+        results = []
+        for _ in range(3):
+            results.append(await pool.run_script(script, "PC-001", "admin", "pw", args={"Edition": "365"}))
+        return results, server.connections
+
+    (results, connections), stats = run(server, scenario)
+    assert results == [{"exit_code": 0}] * 3
+    # TLS・認証・シェルの作成は最初の1回だけ(停止時のシェルの削除は新しい接続で送る)
+    assert connections == 1
+    assert server.actions.count("Create") == 1
+    assert stats["shells_opened"] == 1
+    assert stats["shells_reused"] == 2
+    # スクリプトと引数(パスワードを含む)は標準入力で渡し、コマンドラインには載せない
+    command_id = next(iter(server.stdin))
+    payload = json.loads(server.stdin[command_id].decode("utf-8"))
+    assert payload["params"] == {"ComputerName": "localhost", "Username": "admin", "Password": "pw", "Edition": "365"}
+    assert "Write-Output 'ok'" in payload["script"]
+    assert not any("pw" == argument for argument in server.arguments[command_id])
+
+def test_chunked_responses_are_reassembled(script):
+    server = FakeWinRMServer(receives=[[("stdout", f"{RESULT_LINE}\r\n".encode("utf-8"))]], chunked=True)
+
+    async def scenario(pool):
+        lines = []
+        result = await pool.run_script(script, "PC-001", "admin", "pw", on_output=collect(lines))
+        return result, lines, server.connections
+
+    (result, lines, connections), _ = run(server, scenario)
+    assert result == {"exit_code": 0}
+    assert lines == [("stdout", RESULT_LINE)]
+    assert connections == 1
+
+def test_operation_timeout_keeps_receiving(script):
+    server = FakeWinRMServer(receives=[None, None, [("stdout", f"{RESULT_LINE}\n".encode("utf-8"))]])
+
+    async def scenario(pool):
+        lines = []
+        result = await pool.run_script(script, "PC-001", "admin", "pw", on_output=collect(lines))
+        return result, lines
+
+    (result, lines), _ = run(server, scenario)
+    assert result == {"exit_code": 0}
+    assert lines == [("stdout", RESULT_LINE)]
+    assert server.actions.count("Receive") == 3
+    assert not server.signals
+
+def test_output_split_across_receives_is_joined_into_lines(script):
+    progress = '{"type": "progress", "percent": 50, "message": "インストール中"}\n'.encode("utf-8")
+    # 行の途中・UTF-8 の文字の途中で分割し、標準エラーを間に挟む
+    cut = progress.index("ン".encode("utf-8")) + 1
+    server = FakeWinRMServer(
+        receives=[
+            [("stdout", progress[:cut])],
+            [("stderr", "警告: 再起動が必要です\r\n".encode("utf-8")), ("stdout", progress[cut:] + b'{"success"')],
+            [("stdout", b': true}')]
+        ],
+        exit_code=3
+    )
+
+    async def scenario(pool):
+        lines = []
+        result = await pool.run_script(script, "PC-001", "admin", "pw", on_output=collect(lines))
+        return result, lines
+
+    (result, lines), _ = run(server, scenario)
+    assert result == {"exit_code": 3}
+    assert lines == [
+        ("stderr", "警告: 再起動が必要です"),
+        ("stdout", progress.decode("utf-8").rstrip("\n")),
+        # 改行で終わらない最後の行もコマンドの終了時に渡す
+        ("stdout", '{"success": true}')
+    ]
+
+def test_unauthorized_raises_authentication_error_without_retry(script):
+    server = FakeWinRMServer()
+
+    async def scenario(pool):
+        with pytest.raises(AuthenticationError) as raised:
+            await pool.run_script(script, "PC-001", "admin", "wrong", on_output=collect([]))
+        return raised.value
+
+    error, stats = run(server, scenario)
+    assert error.max_retries == 0
+    assert error.details["status"] == 401
+    # 認証の失敗は1回の要求で終わり、シェルの枠も戻る
+    assert server.actions == []
+    assert server.connections == 1
+    assert stats["open_shells"] == 0
+
+def test_access_denied_fault_raises_authentication_error(script):
+    server = FakeWinRMServer(deny=True)
+
+    async def scenario(pool):
+        with pytest.raises(AuthenticationError) as raised:
+            await pool.run_script(script, "PC-001", "admin", "pw")
+        return raised.value
+
+    error, stats = run(server, scenario)
+    assert error.details["fault_code"] == "5"
+    assert server.actions == ["Create"]
+    assert stats["open_shells"] == 0
+
+def test_timeout_signals_the_command_and_deletes_the_shell(script):
+    server = FakeWinRMServer(hang=True)
+
+    async def scenario(pool):
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(pool.run_script(script, "PC-001", "admin", "pw"), 0.3)
+
+    _, stats = run(server, scenario)
+    command_id = next(iter(server.stdin))
+    assert server.signals == [command_id]
+    assert len(server.deleted) == 1
+    assert server.shells == {}
+    assert stats["open_shells"] == 0
+    assert stats["shells_closed"] == 1
+
+def test_lost_shell_is_recreated(script):
+    server = FakeWinRMServer()
+
+    async def scenario(pool):
+        await pool.run_script(script, "PC-001", "admin", "pw")
+        # 対象PCの再起動でシェルが無くなった
+        server.forget_shells()
+        return await pool.run_script(script, "PC-001", "admin", "pw")
+
+    result, stats = run(server, scenario)
+    assert result == {"exit_code": 0}
+    assert server.actions.count("Create") == 2
+    assert stats["shells_opened"] == 2
+    assert stats["open_shells"] == 1